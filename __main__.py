@@ -14,10 +14,39 @@ if __name__ == '__main__':
     if project_root not in sys.path:
         sys.path.insert(0, project_root)
 
+from trimvision.utils import startup_timing # First: reads the process start time, cheaply
+startup_timing.mark("entry point reached")
 from trimvision.utils import admin_checker
-from trimvision.core.logger import logger # Initialize logger early
+from trimvision.core.logger import logger # Initialize logger early (the log file opens on first write)
+from trimvision import config
+startup_timing.mark("core modules imported")
+
+HEADLESS_COMMANDS = ("trim", "drives", "daemon", "history") # Command selecting the command line instead of the GUI
+HEADLESS_OPTIONS = ("-v", "--verbose") # Command-line options that may precede the command
+
+def parse_profile_flag(argv):
+    """Strips --profile-startup[=PATH] from argv; returns the profile path or None."""
+    for i, arg in enumerate(argv):
+        if arg == "--profile-startup" or arg.startswith("--profile-startup="):
+            del argv[i]
+            path = arg.partition("=")[2]
+            if not path:
+                from trimvision.utils.app_paths import app_dir
+                path = os.path.join(app_dir(), config.STARTUP_PROFILE_FILE)
+            return path
+    return None
 
 def main():
+    first = next((arg for arg in sys.argv[1:] if arg not in HEADLESS_OPTIONS), None)
+    if first in HEADLESS_COMMANDS or first in ("-h", "--help"):
+        # Headless mode: no Qt, no UAC re-launch (see cli.py)
+        from trimvision import cli
+        sys.exit(cli.main(sys.argv[1:]))
+
+    profile_path = parse_profile_flag(sys.argv)
+    if profile_path:
+        startup_timing.enable_profile(profile_path)
+
     # Ensure running with admin privileges first.
     # This needs to happen before most imports that might fail without admin (like WMI sometimes)
     # or before QApplication starts, as re-launching will exit current process.
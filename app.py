@@ -1,10 +1,12 @@
 # trimvision/app.py
 
 import sys
-from PyQt6.QtWidgets import QApplication
-from trimvision.ui.main_window import MainWindow
+from PyQt6.QtWidgets import QApplication, QSplashScreen
+from PyQt6.QtGui import QPixmap, QColor
+from PyQt6.QtCore import Qt
 from trimvision.core.logger import logger
 from trimvision import config
+from trimvision.utils import startup_timing
 
 class Application(QApplication):
     def __init__(self, argv):
@@ -12,11 +14,29 @@ class Application(QApplication):
         self.setApplicationName(config.APP_NAME)
         self.setApplicationVersion(config.APP_VERSION)
         # self.setWindowIcon(QIcon("path/to/icon.png")) # Add icon later
+        startup_timing.mark("Qt initialised")
 
         self.main_window = None
 
+    def _show_splash(self) -> QSplashScreen:
+        """Plain splash, on screen while the UI modules are imported and the window is built."""
+        pixmap = QPixmap(420, 160)
+        pixmap.fill(QColor("#2b2b2b"))
+        splash = QSplashScreen(pixmap)
+        splash.showMessage(f"{config.APP_NAME} v{config.APP_VERSION}\n\nStarting...",
+                           Qt.AlignmentFlag.AlignCenter, QColor("#e0e0e0"))
+        splash.show()
+        self.processEvents() # Paint it before the imports below block the event loop
+        startup_timing.mark("splash shown")
+        return splash
+
     def run(self):
         logger.info(f"Starting {config.APP_NAME} v{config.APP_VERSION}")
+        splash = self._show_splash()
+        from trimvision.ui.main_window import MainWindow # Imported late: the bulk of start-up import time
+        startup_timing.mark("main window imported")
         self.main_window = MainWindow()
+        startup_timing.mark("main window created")
         self.main_window.show()
-        return self.exec()
\ No newline at end of file
+        splash.finish(self.main_window)
+        return self.exec()
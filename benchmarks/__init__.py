@@ -0,0 +1,3 @@
+# trimvision/benchmarks/__init__.py
+# Stand-alone performance benchmarks. Run a module with:
+#   python -m trimvision.benchmarks.<module>
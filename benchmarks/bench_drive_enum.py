@@ -0,0 +1,88 @@
+# trimvision/benchmarks/bench_drive_enum.py
+# Drive enumeration time.
+#
+# Builds a synthetic /sys/block + /proc tree of --disks NVMe/SATA disks with
+# partitions and mounts, and times LinuxDriveProvider over it, so enumeration
+# can be measured on any machine. On Windows it also times the WMI provider with
+# a cold and a warm probe cache (real disks; the cold run starts one PowerShell).
+#
+#   python -m trimvision.benchmarks.bench_drive_enum [--disks 24] [--repeat 20]
+
+import os
+import sys
+import argparse
+import tempfile
+import time
+from trimvision.core.drive_manager import (LinuxDriveProvider, WindowsDriveProvider, DriveProbeCache,
+                                           get_detailed_drive_info)
+
+
+def write(path: str, text: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text + "\n")
+
+
+def build_tree(root: str, disks: int, partitions_per_disk: int = 3):
+    """Synthetic sysfs/procfs: even disks NVMe, odd disks SATA SSDs behind an ata host."""
+    partitions = ["major minor  #blocks  name", ""]
+    mounts = []
+    for i in range(disks):
+        if i % 2 == 0:
+            name, device = f"nvme{i // 2}n1", f"pci0000:00/0000:00:{i:02x}.0/nvme/nvme{i // 2}"
+            part = lambda p: f"{name}p{p}"
+            write(os.path.join(root, "sys", "devices", device, name, "device", "firmware_rev"), "1B2QEXM7")
+        else:
+            name, device = f"sd{chr(ord('a') + i // 2)}", f"pci0000:00/0000:00:17.0/ata{i}/host{i}/target{i}:0:0"
+            part = lambda p: f"{name}{p}"
+            write(os.path.join(root, "sys", "devices", device, name, "device", "rev"), "3B6Q")
+        disk_dir = os.path.join(root, "sys", "devices", device, name)
+        write(os.path.join(disk_dir, "device", "model"), f"Synthetic SSD {i}")
+        write(os.path.join(disk_dir, "device", "serial"), f"SYN{i:06d}")
+        write(os.path.join(disk_dir, "size"), str(2 * 1024**4 // 512))
+        write(os.path.join(disk_dir, "queue", "rotational"), "0")
+        write(os.path.join(disk_dir, "queue", "discard_max_bytes"), str(2 * 1024**3))
+        os.makedirs(os.path.join(root, "sys", "block"), exist_ok=True)
+        os.symlink(disk_dir, os.path.join(root, "sys", "block", name))
+        partitions.append(f" 259 {i * 16} {2 * 1024**3} {name}")
+        for p in range(1, partitions_per_disk + 1):
+            os.makedirs(os.path.join(disk_dir, part(p)))
+            partitions.append(f" 259 {i * 16 + p} {1024**2} {part(p)}")
+            mounts.append(f"/dev/{part(p)} /mnt/disk{i}/part{p} ext4 rw,relatime 0 0")
+    write(os.path.join(root, "proc", "partitions"), "\n".join(partitions))
+    write(os.path.join(root, "proc", "mounts"), "\n".join(mounts))
+
+
+def time_calls(label: str, repeat: int, call):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = call()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label:<40} {elapsed * 1e3:9.2f} ms")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive enumeration benchmark")
+    parser.add_argument("--disks", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="tv-sysfs-") as root:
+        build_tree(root, args.disks)
+        provider = LinuxDriveProvider(root)
+        drives = time_calls(f"sysfs provider, {args.disks} disks", args.repeat, provider.list_drives)
+        kept = get_detailed_drive_info(provider)
+        print(f"{len(drives)} disks enumerated, {len(kept)} kept for TRIM; e.g. {drives[-1]}")
+
+    if sys.platform == "win32":
+        with tempfile.TemporaryDirectory(prefix="tv-cache-") as cache_dir:
+            cache_path = os.path.join(cache_dir, "drive_probes.json")
+            time_calls("WMI provider, cold probe cache", 1,
+                       lambda: WindowsDriveProvider(DriveProbeCache(cache_path)).list_drives())
+            time_calls("WMI provider, warm probe cache", max(1, args.repeat // 4),
+                       lambda: WindowsDriveProvider(DriveProbeCache(cache_path)).list_drives())
+
+
+if __name__ == "__main__":
+    main()
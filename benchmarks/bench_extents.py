@@ -0,0 +1,78 @@
+# trimvision/benchmarks/bench_extents.py
+# Micro-benchmarks of the extent structures in core/extents.py.
+#
+# Builds a RangeStateMap of --extents fragmented runs over a multi-TB LBA space
+# (alternating free/allocated-sized gaps, as a worn filesystem produces) and
+# reports memory per run and the time of the operations the worker relies on:
+# assign (split/merge), point lookup, iterate-by-state, and ExtentSet
+# union/difference of two such maps.
+#
+#   python -m trimvision.benchmarks.bench_extents [--extents 1000000]
+
+import sys
+import argparse
+import time
+import numpy as np
+from trimvision.core.extents import ExtentSet, RangeStateMap
+from trimvision.core.progress_channel import STATE_PROCESSING, STATE_PROCESSED, STATE_BLOCKED
+
+
+def fragmented_extents(count: int, rng) -> np.ndarray:
+    """count (start_lba, length_lba) extents separated by random gaps."""
+    lengths = rng.integers(8, 4096, count)
+    gaps = rng.integers(1, 4096, count)
+    starts = np.cumsum(gaps + np.concatenate(([0], lengths[:-1])))
+    return np.stack((starts, lengths), axis=1)
+
+
+def timed(label: str, count: int, operation):
+    start = time.perf_counter()
+    result = operation()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {elapsed * 1e3:10.1f} ms  {elapsed / max(1, count) * 1e6:8.2f} us/op")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extent structure micro-benchmarks")
+    parser.add_argument("--extents", type=int, default=1_000_000)
+    parser.add_argument("--ops", type=int, default=100_000, help="Random assigns and lookups timed")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    rng = np.random.default_rng(args.seed)
+
+    extents = fragmented_extents(args.extents, rng)
+    total_lba = int(extents[-1].sum()) + 1
+    print(f"{args.extents} extents over {total_lba} LBAs ({total_lba * 512 / 1024**4:.2f} TB at 512 B)")
+
+    state_map = RangeStateMap(total_lba)
+    timed("assign (build, in LBA order)", args.extents,
+          lambda: state_map.assign_ranges(extents.tolist(), STATE_PROCESSED))
+    held = (sum(sys.getsizeof(block) for block in state_map._starts + state_map._states)
+            + sys.getsizeof(state_map._firsts) + sum(sys.getsizeof(first) for first in state_map._firsts))
+    print(f"{len(state_map)} runs, {state_map.nbytes / len(state_map):.1f} B/run in arrays, "
+          f"{held / len(state_map):.1f} B/run including block overhead")
+
+    starts = rng.integers(0, total_lba, args.ops)
+    lengths = rng.integers(1, 8192, args.ops)
+    states = rng.choice([STATE_PROCESSING, STATE_PROCESSED, STATE_BLOCKED], args.ops)
+
+    def random_assigns():
+        for start, length, state in zip(starts.tolist(), lengths.tolist(), states.tolist()):
+            state_map.assign(start, start + length, state)
+    timed("assign (random split/merge)", args.ops, random_assigns)
+    timed("state_at (random)", args.ops, lambda: [state_map.state_at(lba) for lba in starts.tolist()])
+    blocked = timed("extents(state) iterate-by-state", 1, lambda: state_map.extents(STATE_BLOCKED))
+    timed("runs() over 1% of the LBAs", 1, lambda: sum(1 for _ in state_map.runs(0, total_lba // 100)))
+    print(f"{len(state_map)} runs after random assigns, {len(blocked)} blocked extents")
+
+    free_a = timed("ExtentSet.from_ranges", 1, lambda: ExtentSet.from_ranges(extents))
+    free_b = ExtentSet.from_ranges(fragmented_extents(args.extents, rng))
+    timed("ExtentSet union", 1, lambda: free_a | free_b)
+    diff = timed("ExtentSet difference", 1, lambda: free_b - free_a)
+    print(f"ExtentSet: {(free_a.starts.nbytes + free_a.ends.nbytes) / len(free_a):.1f} B/extent, "
+          f"difference has {len(diff)} extents")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# trimvision/benchmarks/bench_lba_grid.py
+# LbaGridWidget frame rate with a million worker chunks.
+#
+# Applies batches of chunk-state runs, the way TrimWorker publishes them, and
+# repaints after each batch; also times zoom steps (every visible cell is
+# recomputed from the state pyramid) and full-widget repaints (resize/expose).
+# All should stay well above 60 frames per second.
+#
+#   QT_QPA_PLATFORM=offscreen python -m trimvision.benchmarks.bench_lba_grid [--blocks 1048576]
+
+import argparse
+import time
+import numpy as np
+from PyQt6.QtWidgets import QApplication
+from trimvision.core.progress_channel import STATE_PROCESSING, STATE_PROCESSED, STATE_BLOCKED
+from trimvision.ui.lba_grid_widget import LbaGridWidget
+
+
+def frames_per_second(frame, frames: int) -> float:
+    start = time.perf_counter()
+    for i in range(frames):
+        frame(i)
+    return frames / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LBA grid frame rate")
+    parser.add_argument("--blocks", type=int, default=1 << 20)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--runs-per-frame", type=int, default=64, help="Delta runs applied per frame")
+    parser.add_argument("--size", default="1280x800", help="Widget size WxH")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication([])
+    width, height = (int(v) for v in args.size.split("x"))
+    grid = LbaGridWidget()
+    grid.resize(width, height)
+    grid.show()
+    grid.initialize_grid(0, args.blocks)
+    app.processEvents()
+
+    rng = np.random.default_rng(1)
+    states = np.array([STATE_PROCESSING, STATE_PROCESSED, STATE_BLOCKED])
+    cursor = [0]
+
+    def delta_frame(_):
+        # A sweep front like a real run: runs just behind a moving position
+        front = cursor[0]
+        starts = np.sort(rng.integers(front, front + 4096, args.runs_per_frame)) % args.blocks
+        counts = np.minimum(rng.integers(1, 64, args.runs_per_frame), args.blocks - starts)
+        deltas = np.column_stack((starts, counts, rng.choice(states, args.runs_per_frame))).ravel()
+        grid.apply_chunk_state_deltas(deltas)
+        app.processEvents() # Delivers the pending partial repaint
+        cursor[0] = (front + 4096) % args.blocks
+
+    def zoom_frame(i):
+        # Zoom in towards the middle and back out again
+        depth = i % 40 if i % 80 < 40 else 40 - i % 40
+        length = max(1, int(args.blocks / 1.25 ** depth))
+        grid.set_view(args.blocks // 2 - length // 2, args.blocks // 2 - length // 2 + length)
+        app.processEvents()
+
+    def full_frame(_):
+        grid.repaint()
+
+    print(f"{args.blocks} chunks in {grid.grid_rows}x{grid.grid_cols} cells, widget {width}x{height}")
+    print(f"delta frames:  {frames_per_second(delta_frame, args.frames):8.1f} fps")
+    print(f"zoom frames:   {frames_per_second(zoom_frame, args.frames):8.1f} fps")
+    grid.set_view(0, args.blocks)
+    print(f"full repaints: {frames_per_second(full_frame, args.frames):8.1f} fps")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# trimvision/benchmarks/bench_logging.py
+# Cost of logging on the discard path.
+#
+# Runs the same simulated-device TRIM (see bench_suite) with logging as configured
+# (queue handler, writer thread, rotating file) and with the logger disabled,
+# alternating, and compares the median wall times. The first part times the bare
+# calls: a DEBUG record through the queue versus formatted and written in the
+# calling thread (the previous synchronous setup), and TraceBuffer.record().
+# Exits non-zero if logging costs the engine more than --budget-pct.
+#
+#   python -m trimvision.benchmarks.bench_logging [--runs 5] [--profile nvme] [--budget-pct 2]
+
+import sys
+import logging
+import argparse
+import statistics
+import tempfile
+import time
+from trimvision import config
+from trimvision.core import logger as log_module
+from trimvision.core.logger import logger, set_console_level, TraceBuffer
+
+
+def per_call_ns(call, n: int) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        call(i)
+    return (time.perf_counter() - start) / n * 1e9
+
+
+def main(argv=None):
+    from trimvision.benchmarks.bench_suite import PROFILES, run_simulated
+    parser = argparse.ArgumentParser(description="Logging overhead on the discard path")
+    parser.add_argument("--runs", type=int, default=5, help="Engine runs per mode")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="nvme")
+    parser.add_argument("--capacity-gb", type=float, default=64)
+    parser.add_argument("--extents", type=int, default=20000)
+    parser.add_argument("--queue-depth", type=int, default=config.TRIM_QUEUE_DEPTH)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--budget-pct", type=float, default=2.0)
+    args = parser.parse_args(argv)
+    set_console_level(logging.CRITICAL) # Measure the file path, keep the terminal readable
+
+    n = 20000
+    queued = per_call_ns(lambda i: logger.debug("Discard call %d at LBA %d", i, i * 8), n)
+    start = time.perf_counter()
+    log_module.flush()
+    drain = (time.perf_counter() - start) / n * 1e9
+    with tempfile.NamedTemporaryFile("w", suffix=".log") as f:
+        sync = logging.getLogger("trimvision-bench-sync")
+        sync.propagate = False
+        sync.setLevel(logging.DEBUG)
+        handler = logging.FileHandler(f.name)
+        handler.setFormatter(log_module._listener.handlers[0].formatter)
+        sync.addHandler(handler)
+        direct = per_call_ns(lambda i: sync.debug("Discard call %d at LBA %d", i, i * 8), n)
+        handler.close()
+    trace = TraceBuffer()
+    traced = per_call_ns(lambda i: trace.record(i * 8, 256, 2048, 0.0003, True), n)
+    print(f"DEBUG record, queued:            {queued:7.0f} ns in the caller, "
+          f"{drain:7.0f} ns left for the writer thread")
+    print(f"DEBUG record, written in caller: {direct:7.0f} ns")
+    print(f"TraceBuffer.record:              {traced:7.0f} ns")
+
+    times = {"on": [], "off": []}
+    for _ in range(args.runs):
+        for mode in ("on", "off"):
+            logger.disabled = mode == "off"
+            times[mode].append(run_simulated(args.profile, args)[1])
+    logger.disabled = False
+    on, off = statistics.median(times["on"]), statistics.median(times["off"])
+    overhead = (on / off - 1) * 100
+    print(f"engine/{args.profile}: logging on {on:.3f} s, off {off:.3f} s (median of {args.runs}): "
+          f"{overhead:+.1f}%")
+    ok = overhead <= args.budget_pct
+    print("OK" if ok else f"FAILED: over the {args.budget_pct}% budget")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
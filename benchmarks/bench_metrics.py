@@ -0,0 +1,68 @@
+# trimvision/benchmarks/bench_metrics.py
+# Recording overhead and accuracy of the discard-call metrics.
+#
+# Times TrimMetrics.record_call() over --calls synthetic completions with
+# log-normal latencies (a realistic spread with a long tail, plus a sprinkling of
+# failures), subtracting the cost of the bare loop (the batched folds into the
+# histogram are included), and compares the histogram's percentiles with the exact
+# ones. Exits non-zero if a call costs more than --budget-us.
+#
+#   python -m trimvision.benchmarks.bench_metrics [--calls 1000000] [--budget-us 1.0]
+
+import sys
+import argparse
+import random
+import time
+from trimvision.core.trim_metrics import TrimMetrics
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Discard metrics recording benchmark")
+    parser.add_argument("--calls", type=int, default=1_000_000)
+    parser.add_argument("--budget-us", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    rng = random.Random(args.seed)
+
+    latencies = [rng.lognormvariate(-7, 1.2) for _ in range(args.calls)] # Median ~0.9 ms
+    sizes = [rng.choice((1 << 20, 8 << 20, 64 << 20)) for _ in range(args.calls)]
+    outcomes = [rng.random() > 0.001 for _ in range(args.calls)]
+    error = OSError("injected")
+    calls = list(zip(sizes, latencies, outcomes))
+
+    start = time.perf_counter()
+    for call_bytes, latency, ok in calls:
+        pass
+    loop_s = time.perf_counter() - start
+
+    metrics = TrimMetrics({"device": "bench"})
+    record = metrics.record_call
+    start = time.perf_counter()
+    for call_bytes, latency, ok in calls:
+        record(call_bytes, latency, ok, None if ok else error)
+    elapsed_s = time.perf_counter() - start - loop_s
+    per_call_us = elapsed_s / args.calls * 1e6
+    print(f"record_call: {per_call_us * 1000:.0f} ns/call over {args.calls} calls "
+          f"({metrics.calls_failed} failures)")
+
+    metrics.fold()
+    exact = sorted(int(latency * 1e6) for latency in latencies)
+    for p in (50, 90, 99, 99.9):
+        true_us = exact[int(max(0, -(-len(exact) * p // 100) - 1))]
+        got_us = metrics.latency.percentile(p)
+        print(f"p{p:<5} histogram {got_us / 1000:9.3f} ms  exact {true_us / 1000:9.3f} ms  "
+              f"error {(got_us - true_us) / max(1, true_us) * 100:+5.1f}%")
+
+    start = time.perf_counter()
+    text = metrics.to_prometheus()
+    document = metrics.to_dict()
+    print(f"export: {(time.perf_counter() - start) * 1e3:.1f} ms "
+          f"({len(text)} B textfile, {len(document['latency_buckets_us'])} non-empty buckets)")
+
+    ok = per_call_us <= args.budget_us
+    print("OK" if ok else f"FAILED: over the {args.budget_us} us budget")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+# trimvision/benchmarks/bench_queue_depth.py
+# Discard throughput versus queue depth.
+#
+# Drives the DiscardDispatcher against a sparse image file whose backend sleeps for
+# a fixed time per call, the way a drive with a given per-command latency would.
+# Throughput should scale with queue depth until the submitter threads saturate.
+#
+#   python -m trimvision.benchmarks.bench_queue_depth [--latency-ms 2] [--calls 400]
+
+import argparse
+import os
+import tempfile
+import time
+from trimvision import config
+from trimvision.core import trim_helpers
+from trimvision.core.discard_dispatcher import DiscardDispatcher
+
+
+class LatencyInjectingBackend(trim_helpers.SparseFileBackend):
+    """Sparse-file backend that adds a fixed delay to every discard call."""
+    name = "sparse-file+latency"
+
+    def __init__(self, device_path, latency_s: float, **kwargs):
+        super().__init__(device_path, **kwargs)
+        self.latency_s = latency_s
+
+    def discard(self, ranges):
+        time.sleep(self.latency_s)
+        super().discard(ranges)
+
+
+def run_depth(backend, batches, queue_depth: int) -> float:
+    """Discards all batches at the given queue depth; returns elapsed seconds."""
+    start = time.perf_counter()
+    with DiscardDispatcher(backend, queue_depth) as dispatcher:
+        pending = iter(batches)
+        exhausted = False
+        while True:
+            while not exhausted and dispatcher.in_flight < dispatcher.window:
+                batch = next(pending, None)
+                if batch is None:
+                    exhausted = True
+                    break
+                dispatcher.submit(batch)
+            if dispatcher.in_flight == 0:
+                break
+            completion = dispatcher.get_completion()
+            if not completion.ok:
+                raise completion.error
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Discard throughput versus queue depth")
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="Injected latency per discard call")
+    parser.add_argument("--calls", type=int, default=400, help="Discard calls per queue depth")
+    parser.add_argument("--depths", default="1,2,4,8,16,32")
+    args = parser.parse_args(argv)
+
+    ranges_per_call = config.MAX_DSM_RANGES_PER_CALL
+    range_lba = 8 # 4 KB ranges with a 4 KB gap, so nothing merges
+    total_ranges = args.calls * ranges_per_call
+    image_size = total_ranges * range_lba * 2 * config.DEFAULT_SECTOR_SIZE
+    ranges = [(i * range_lba * 2, range_lba) for i in range(total_ranges)]
+    batches = list(trim_helpers.batch_ranges(ranges, ranges_per_call))
+
+    fd, path = tempfile.mkstemp(prefix="trimvision-bench-", suffix=".img")
+    os.close(fd)
+    try:
+        os.truncate(path, image_size)
+        backend = LatencyInjectingBackend(path, args.latency_ms / 1000)
+        print(f"{args.calls} calls x {ranges_per_call} ranges, {args.latency_ms:.1f} ms injected latency per call")
+        print(f"{'depth':>6} {'seconds':>9} {'calls/s':>9} {'ranges/s':>10} {'speedup':>8}")
+        with backend:
+            baseline = None
+            for depth in (int(d) for d in args.depths.split(",")):
+                elapsed = run_depth(backend, batches, depth)
+                baseline = baseline or elapsed
+                print(f"{depth:>6} {elapsed:>9.3f} {args.calls / elapsed:>9.0f} "
+                      f"{total_ranges / elapsed:>10.0f} {baseline / elapsed:>7.1f}x")
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+# trimvision/benchmarks/bench_suite.py
+# Reproducible benchmark suite, saved as JSON for comparison between commits.
+#
+#   engine       End-to-end TrimEngine runs over a fragmented free-space plan on a
+#                SimulatedSsdBackend, per device profile (latency, ranges per call,
+#                bandwidth, fault rate): throughput, calls, and efficiency against
+#                the device model's lower bound.
+#   ui           The same run through TrimWorker with its signals driving an
+#                LbaGridWidget on an offscreen Qt GUI thread: signals delivered, time
+#                spent in the slots and in paintEvent, and the slowdown versus the
+#                headless engine.
+#   enumeration  get_detailed_drive_info over canned provider data: a synthetic
+#                sysfs tree (LinuxDriveProvider) and canned WMI disks with a warm
+#                probe cache (WindowsDriveProvider classification), on any OS.
+#
+#   python -m trimvision.benchmarks.bench_suite [--only engine,ui,enumeration]
+#          [--profile nvme --profile sata ...] [--output results.json] [--compare baseline.json]
+#
+# Without --output the results go to benchmark-<commit>.json in the current
+# directory. --compare prints the relative change of every figure against an
+# earlier results file.
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import subprocess
+import tempfile
+import types
+from trimvision import config
+from trimvision.core.logger import set_console_level
+from trimvision.benchmarks.sim_ssd import SimulatedSsdBackend
+
+# Device models: per-call latency (ms), ranges per call, shared bandwidth (MB/s, 0 = free), fault rate
+PROFILES = {
+    "nvme": {"latency_ms": 0.3, "max_ranges": 256, "bandwidth_mbps": 0, "fault_rate": 0.0},
+    "sata": {"latency_ms": 2.0, "max_ranges": 64, "bandwidth_mbps": 20000, "fault_rate": 0.0},
+    "usb-bridge": {"latency_ms": 2.0, "max_ranges": 1, "bandwidth_mbps": 4000, "fault_rate": 0.0},
+    "flaky": {"latency_ms": 0.5, "max_ranges": 256, "bandwidth_mbps": 0, "fault_rate": 0.01},
+}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              timeout=10).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def fragmented_plan(total_lba: int, extents: int, seed: int):
+    """extents free ranges of random length and spacing over the whole device, sorted."""
+    rng = random.Random(seed)
+    stride = total_lba // extents
+    plan = []
+    for i in range(extents):
+        length = rng.randrange(stride // 8, stride // 2)
+        plan.append((i * stride + rng.randrange(0, stride - length), length))
+    return plan
+
+
+def simulated_drive(capacity_gb: float):
+    from trimvision.core.drive_manager import DriveInfo
+    return DriveInfo(model="Simulated SSD", serial_number="SIM-1", firmware_version="SIM",
+                     capacity_gb=capacity_gb, device_id_wmi="sim:ssd", physical_disk_index=-1,
+                     interface_type_wmi="SIM", drive_letter=None, is_ssd=True, is_nvme=True)
+
+
+def engine_class_for(profile: dict, args):
+    """TrimEngine that discards on a fresh SimulatedSsdBackend and plans the fragmented layout."""
+    from trimvision.core.trim_engine import TrimEngine
+
+    class SimulatedEngine(TrimEngine):
+        backend = None
+
+        def _open_backend(self):
+            self.backend = SimulatedSsdBackend(
+                capacity_bytes=int(args.capacity_gb * 1024**3), latency_s=profile["latency_ms"] / 1000,
+                max_ranges_per_call=profile["max_ranges"], bandwidth_bps=profile["bandwidth_mbps"] * 1024**2,
+                fault_rate=profile["fault_rate"], seed=args.seed)
+            return self.backend
+
+        def _plan_extents(self):
+            self.extents = fragmented_plan(self.total_lba, args.extents, args.seed)
+            self.planned_bytes = sum(length for _, length in self.extents) * self.sector_size
+
+    return SimulatedEngine
+
+
+def engine_figures(engine, wall_s: float) -> dict:
+    backend = engine.backend
+    summary = engine.run_summary
+    calls = summary["request_sizing"].get("calls", backend.calls)
+    return {
+        "wall_s": wall_s,
+        "planned_bytes": engine.planned_bytes,
+        "bytes_discarded": summary["bytes_discarded"],
+        "mb_per_s": summary["bytes_discarded"] / wall_s / 1024**2,
+        "calls": calls,
+        "calls_per_s": calls / wall_s,
+        "ranges_per_s": backend.ranges / wall_s,
+        "failed_calls": backend.faults,
+        "blocked_ranges": len(summary["blocked_ranges"]),
+        "latency_p50_ms": summary["latency"]["p50_ms"],
+        "latency_p99_ms": summary["latency"]["p99_ms"],
+        # How close the run came to what the simulated device allows
+        "efficiency": backend.model_seconds(calls, engine.planned_bytes, engine.queue_depth) / wall_s,
+    }
+
+
+def run_simulated(profile: str, args):
+    """Runs a headless engine on the profile's simulated device; returns it and the wall time."""
+    from trimvision.core.trim_engine import TrimEngine
+    engine = engine_class_for(PROFILES[profile], args)(simulated_drive(args.capacity_gb), TrimEngine.PLAN_FREE_SPACE,
+                                                       queue_depth=args.queue_depth, resume=False, metrics_dir="",
+                                                       history_path="")
+    start = time.perf_counter()
+    engine.run()
+    return engine, time.perf_counter() - start
+
+
+def bench_engine(args) -> dict:
+    results = {}
+    for name in args.profile:
+        r = results[name] = engine_figures(*run_simulated(name, args))
+        print(f"engine/{name:<11} {r['wall_s']:7.2f} s {r['mb_per_s']:9.0f} MB/s {r['calls_per_s']:8.0f} calls/s "
+              f"efficiency {r['efficiency'] * 100:5.1f}%  {r['failed_calls']} faults")
+    return results
+
+
+def bench_ui(args) -> dict:
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtCore import QEventLoop
+    from PyQt6.QtWidgets import QApplication
+    from trimvision.core.trim_worker import TrimWorker
+    from trimvision.ui.lba_grid_widget import LbaGridWidget
+
+    app = QApplication.instance() or QApplication([])
+    cost = {"deltas": 0, "deltas_s": 0.0, "progress": 0, "progress_s": 0.0, "paints": 0, "paint_s": 0.0}
+
+    class TimedGrid(LbaGridWidget):
+        def apply_chunk_state_deltas(self, deltas):
+            start = time.perf_counter()
+            super().apply_chunk_state_deltas(deltas)
+            cost["deltas"] += 1
+            cost["deltas_s"] += time.perf_counter() - start
+
+        def paintEvent(self, event):
+            start = time.perf_counter()
+            super().paintEvent(event)
+            cost["paints"] += 1
+            cost["paint_s"] += time.perf_counter() - start
+
+    def on_progress(*values):
+        start = time.perf_counter()
+        str(values) # About what formatting the status labels costs
+        cost["progress"] += 1
+        cost["progress_s"] += time.perf_counter() - start
+
+    profile = args.profile[0]
+    engine_class = engine_class_for(PROFILES[profile], args)
+    class SimulatedWorker(TrimWorker):
+        pass
+    SimulatedWorker.engine_class = engine_class
+
+    grid = TimedGrid()
+    grid.resize(1280, 800)
+    grid.show()
+    worker = SimulatedWorker(simulated_drive(args.capacity_gb), TrimWorker.PLAN_FREE_SPACE,
+                             queue_depth=args.queue_depth, resume=False)
+    grid.initialize_grid(args.capacity_gb, worker.total_chunks)
+    app.processEvents()
+    worker.chunk_states_changed.connect(grid.apply_chunk_state_deltas)
+    worker.progress_updated.connect(on_progress)
+    loop = QEventLoop()
+    worker.finished.connect(loop.quit)
+
+    start = time.perf_counter()
+    worker.start()
+    loop.exec()
+    app.processEvents() # Signals still queued when the thread finished
+    wall_s = time.perf_counter() - start
+    worker.wait()
+    grid.hide()
+
+    headless_s = run_simulated(profile, args)[1]
+    gui_busy_s = cost["deltas_s"] + cost["progress_s"] + cost["paint_s"]
+    result = {
+        "profile": profile,
+        "wall_s": wall_s,
+        "headless_wall_s": headless_s,
+        "slowdown": wall_s / headless_s,
+        "delta_signals": cost["deltas"],
+        "progress_signals": cost["progress"],
+        "delta_slot_mean_us": cost["deltas_s"] / max(1, cost["deltas"]) * 1e6,
+        "paints": cost["paints"],
+        "paint_mean_ms": cost["paint_s"] / max(1, cost["paints"]) * 1e3,
+        "gui_thread_busy_fraction": gui_busy_s / wall_s,
+    }
+    print(f"ui/{profile:<15} {wall_s:7.2f} s (headless {headless_s:.2f} s)  {cost['deltas']} delta + "
+          f"{cost['progress']} progress signals, slot {result['delta_slot_mean_us']:.0f} us, "
+          f"{cost['paints']} paints at {result['paint_mean_ms']:.2f} ms, GUI thread "
+          f"{result['gui_thread_busy_fraction'] * 100:.1f}% busy")
+    return result
+
+
+def canned_wmi_disks(disks: int):
+    """Objects shaped like Win32_DiskDrive rows, with the drive letters of their partitions."""
+    rows, letters = [], {}
+    for i in range(disks):
+        nvme = i % 2 == 0
+        rows.append(types.SimpleNamespace(Model=f"Canned {'NVMe' if nvme else 'SATA'} SSD {i}",
+                                          SerialNumber=f"  CAN{i:06d}  ", FirmwareRevision="1B2QEXM7",
+                                          Size=str(2 * 1024**4), DeviceID=f"\\\\.\\PHYSICALDRIVE{i}", Index=i,
+                                          InterfaceType="SCSI" if nvme else "IDE",
+                                          MediaType="Fixed hard disk media"))
+        letters[i] = [chr(ord("D") + i % 20) + ":"]
+    return rows, letters
+
+
+def bench_enumeration(args) -> dict:
+    from trimvision.core.drive_manager import (LinuxDriveProvider, WindowsDriveProvider, DriveProbeCache,
+                                               get_detailed_drive_info)
+    from trimvision.benchmarks.bench_drive_enum import build_tree
+
+    def best_of(call):
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = call()
+            best = min(best, time.perf_counter() - start)
+        return best, result
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="tv-bench-") as root:
+        build_tree(root, args.disks)
+        provider = LinuxDriveProvider(root)
+        elapsed, drives = best_of(lambda: get_detailed_drive_info(provider))
+        results["sysfs"] = {"disks": args.disks, "kept": len(drives), "ms": elapsed * 1e3,
+                            "ms_per_disk": elapsed * 1e3 / args.disks}
+
+        rows, letters = canned_wmi_disks(args.disks)
+        cache = DriveProbeCache(os.path.join(root, "drive_probes.json"))
+        for i, row in enumerate(rows): # Warm cache: no PowerShell, as on every start after the first
+            cache.put(row.SerialNumber.strip(), row.FirmwareRevision, ps_media_type="SSD",
+                      ps_bus_type="NVMe" if i % 2 == 0 else "SATA", is_ssd=True, is_nvme=i % 2 == 0)
+        wmi_provider = WindowsDriveProvider(cache)
+        wmi_provider.iter_drives = lambda where="": wmi_provider._classify_disks(rows, letters) # Canned query results
+        elapsed, drives = best_of(lambda: get_detailed_drive_info(wmi_provider))
+        results["wmi_warm_cache"] = {"disks": args.disks, "kept": len(drives), "ms": elapsed * 1e3,
+                                     "ms_per_disk": elapsed * 1e3 / args.disks}
+    for name, r in results.items():
+        print(f"enumeration/{name:<15} {r['ms']:7.2f} ms for {r['disks']} disks ({r['kept']} kept)")
+    return results
+
+
+def flatten(tree: dict, prefix: str = ""):
+    for key, value in tree.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def compare(results: dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = dict(flatten(baseline["results"]))
+    print(f"\nChange against {baseline_path} ({baseline['meta'].get('commit', '?')}):")
+    for key, value in flatten(results):
+        if key in before and before[key]:
+            print(f"  {key:<48} {before[key]:>12.4g} -> {value:>12.4g}  {(value / before[key] - 1) * 100:+7.1f}%")
+
+
+BENCHMARKS = {"engine": bench_engine, "ui": bench_ui, "enumeration": bench_enumeration}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TrimVision benchmark suite")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="Comma-separated subset of: "
+                                                                      + ", ".join(BENCHMARKS))
+    parser.add_argument("--profile", action="append", choices=sorted(PROFILES),
+                        help="Simulated device profile, repeatable (default: all; ui uses the first)")
+    parser.add_argument("--capacity-gb", type=float, default=64)
+    parser.add_argument("--extents", type=int, default=20000, help="Free extents in the planned layout")
+    parser.add_argument("--queue-depth", type=int, default=config.TRIM_QUEUE_DEPTH)
+    parser.add_argument("--disks", type=int, default=24, help="Disks in the canned enumeration data")
+    parser.add_argument("--repeat", type=int, default=10, help="Enumeration repeats (best is kept)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Results file (default: benchmark-<commit>.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+    args.profile = args.profile or list(PROFILES)
+    selected = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    set_console_level(logging.ERROR) # Simulated faults log warnings
+    config.METRICS_ENABLED = False # TrimWorker's engine would otherwise export into the data dir
+
+    commit = git_commit()
+    results = {name: BENCHMARKS[name](args) for name in selected}
+    document = {
+        "meta": {"commit": commit, "time": time.time(), "python": platform.python_version(),
+                 "platform": platform.platform(), "cpus": os.cpu_count(),
+                 "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")}},
+        "results": results,
+    }
+    path = args.output or f"benchmark-{commit}.json"
+    with open(path, "w") as f:
+        json.dump(document, f, indent=1)
+    print(f"Results written to {path}")
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+# trimvision/benchmarks/check_import_time.py
+# Start-up import budget.
+#
+# Imports each start-up module in a fresh interpreter (best of --repeat runs) and
+# fails when one takes longer than its budget or drags in a module that start-up
+# is meant to defer (numpy, psutil, wmi, the TRIM worker; PyQt for the headless
+# command line and engine). Exits non-zero on a regression, so it can gate a build.
+#
+#   python -m trimvision.benchmarks.check_import_time [--repeat 5] [--scale 1.0]
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# module -> (budget in ms, modules it must not import)
+BUDGETS = {
+    "trimvision.core": (30, ("numpy", "psutil", "wmi", "PyQt6")),
+    "trimvision.core.logger": (60, ("numpy", "psutil", "wmi", "PyQt6")),
+    "trimvision.utils.startup_timing": (60, ("numpy", "psutil", "wmi", "PyQt6")),
+    "trimvision.app": (100, ("numpy", "psutil", "wmi", "trimvision.ui.main_window")),
+    "trimvision.ui.main_window": (250, ("psutil", "wmi", "trimvision.core.trim_worker")),
+    "trimvision.cli": (60, ("PyQt6", "numpy", "psutil", "wmi")),
+    "trimvision.core.trim_engine": (400, ("PyQt6", "wmi")), # Headless trims must never load Qt
+}
+
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+__import__({module!r})
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed * 1000, [m for m in {forbidden!r} if m in sys.modules]]))
+"""
+
+
+def measure(module: str, forbidden, repeat: int):
+    """(best import time in ms, forbidden modules found loaded) of module in fresh interpreters."""
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+    best, loaded = float("inf"), []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", _PROBE.format(module=module, forbidden=tuple(forbidden))],
+                                capture_output=True, text=True, env=env, check=True).stdout
+        elapsed_ms, loaded = json.loads(output.strip().splitlines()[-1])
+        best = min(best, elapsed_ms)
+    return best, loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Start-up import budget check")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier for every budget (slow machines)")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for module, (budget_ms, forbidden) in BUDGETS.items():
+        elapsed_ms, loaded = measure(module, forbidden, args.repeat)
+        budget_ms *= args.scale
+        ok = elapsed_ms <= budget_ms and not loaded
+        failures += not ok
+        note = f"  imports {', '.join(loaded)}" if loaded else ""
+        print(f"{'ok  ' if ok else 'FAIL'} {module:<34} {elapsed_ms:7.1f} ms (budget {budget_ms:.0f} ms){note}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+# trimvision/benchmarks/control_latency.py
+# Distribution of pause, resume and cancel response times under load.
+#
+# Runs the real TrimEngine on a SimulatedSsdBackend whose shared bandwidth keeps
+# every discard call at the adaptive sizer's latency target, with --load-threads
+# CPU-bound Python threads competing for the interpreter as a busy GUI would.
+# Each trial applies a request at a random point of the run and times it:
+#   pause     request until the engine reports it has parked (nothing in flight);
+#   resume    request until it reports it has resumed;
+#   cancel    request until run() has returned (backend closed, run recorded),
+#             while dispatching, while throttled by a rate limit, and while paused.
+# A request has to wait for the discard calls already on the device; the rest of
+# its response time (the overhead) is the engine's. Exits non-zero if an overhead
+# exceeds --slack-ms, a response exceeds --max-ms, or a parked engine thread uses
+# CPU (it must block, not poll). The calls in flight are sized to the sizer's
+# target latency together, so that is about all a request waits for on the device;
+# --max-ms defaults to twice the target, room for a slow-start overshoot and the
+# overhead. Without load threads the overhead is a few ms; with them it is mostly
+# waits for the interpreter lock, which the load threads only give up every
+# sys.getswitchinterval().
+#
+#   python -m trimvision.benchmarks.control_latency [--trials 20] [--load-threads 2]
+
+import sys
+import time
+import logging
+import random
+import argparse
+import threading
+import psutil
+import numpy as np
+from trimvision import config
+from trimvision.core.logger import set_console_level
+from trimvision.core.trim_engine import TrimEngine, TrimListener
+from trimvision.benchmarks.bench_suite import engine_class_for, simulated_drive
+
+# Bandwidth-bound device: the sizer grows calls until queued calls take its target latency
+PROFILE = {"latency_ms": 2.0, "max_ranges": 64, "bandwidth_mbps": 2000, "fault_rate": 0.0}
+
+
+class ControlListener(TrimListener):
+    """Timestamps the engine's pause and resume reports."""
+    def __init__(self):
+        self.paused = threading.Event()
+        self.resumed = threading.Event()
+        self.paused_at = self.resumed_at = None
+
+    def status_message(self, message):
+        if message.startswith("TRIM paused"):
+            self.paused_at = time.perf_counter()
+            self.paused.set()
+        elif message.startswith("TRIM resumed"):
+            self.resumed_at = time.perf_counter()
+            self.resumed.set()
+
+
+def burn(stop: threading.Event):
+    while not stop.is_set():
+        sum(i * i for i in range(10000))
+
+
+def timed_engine_class(args):
+    """Simulated engine that records when every discard call started and ended."""
+    class TimedEngine(engine_class_for(PROFILE, args)):
+        def _open_backend(self):
+            backend = super()._open_backend()
+            calls = self.call_times = []
+            discard = backend.discard
+
+            def timed_discard(ranges):
+                start = time.perf_counter()
+                try:
+                    discard(ranges)
+                finally:
+                    calls.append((start, time.perf_counter()))
+            backend.discard = timed_discard
+            return backend
+
+    return TimedEngine
+
+
+def start_engine(args):
+    listener = ControlListener()
+    engine = timed_engine_class(args)(simulated_drive(args.capacity_gb), TrimEngine.PLAN_FREE_SPACE,
+                                      resume=False, listener=listener, metrics_dir="", history_path="")
+    thread = threading.Thread(target=engine.run, name="control-engine", daemon=True)
+    thread.start()
+    while engine.bytes_discarded == 0 and thread.is_alive():
+        time.sleep(0.005)
+    return engine, listener, thread
+
+
+def thread_cpu_s(thread: threading.Thread) -> float:
+    """CPU time used so far by another thread of this process."""
+    for t in psutil.Process().threads():
+        if t.id == thread.native_id:
+            return t.user_time + t.system_time
+    return 0.0
+
+
+def on_device_ms(engine, at: float, handoff_s: float) -> float:
+    """
+    How long the calls on the device at perf_counter time `at` still ran: what a
+    request made then must wait for. A call a submitter thread had already taken
+    may reach the backend a little later, under GIL contention; calls starting
+    within handoff_s count as on the device too.
+    """
+    return max([(end - at) * 1000 for start, end in list(engine.call_times) if start <= at + handoff_s and end > at],
+               default=0.0)
+
+
+def trial(args, rng, scenario: str) -> dict:
+    engine, listener, thread = start_engine(args)
+    time.sleep(rng.uniform(0, args.max_offset_s)) # Anywhere in a call's lifetime
+    if scenario == "throttled":
+        engine.set_rate_limit(64 * 1024**2)
+        time.sleep(0.3) # Into the throttled waits
+    result = {}
+    if scenario in ("pause/resume", "paused"):
+        start = time.perf_counter()
+        engine.pause_operation()
+        if not listener.paused.wait(30):
+            raise RuntimeError("engine did not report the pause")
+        result["pause"] = ((listener.paused_at - start) * 1000, on_device_ms(engine, start, args.handoff_ms / 1000))
+        before, cpu = engine.bytes_discarded, thread_cpu_s(thread)
+        time.sleep(args.parked_s)
+        result["parked_cpu_ms"] = (thread_cpu_s(thread) - cpu) * 1000
+        result["discarded_while_parked"] = engine.bytes_discarded - before
+        if scenario == "pause/resume":
+            start = time.perf_counter()
+            engine.resume_operation()
+            if not listener.resumed.wait(30):
+                raise RuntimeError("engine did not report the resume")
+            result["resume"] = ((listener.resumed_at - start) * 1000, 0.0)
+            time.sleep(rng.uniform(0, args.max_offset_s))
+    start = time.perf_counter()
+    engine.cancel_operation()
+    thread.join(60)
+    if thread.is_alive():
+        raise RuntimeError("engine did not stop")
+    result["cancel"] = ((time.perf_counter() - start) * 1000, on_device_ms(engine, start, args.handoff_ms / 1000))
+    return result
+
+
+def percentiles(values) -> str:
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return f"p50 {p50:7.1f}  p95 {p95:7.1f}  p99 {p99:7.1f}  max {max(values):7.1f} ms"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pause/resume/cancel response times under load")
+    parser.add_argument("--trials", type=int, default=20, help="Trials per scenario")
+    parser.add_argument("--load-threads", type=int, default=2)
+    parser.add_argument("--capacity-gb", type=float, default=64)
+    parser.add_argument("--extents", type=int, default=2000)
+    parser.add_argument("--max-offset-s", type=float, default=3.0)
+    parser.add_argument("--parked-s", type=float, default=0.5)
+    parser.add_argument("--max-ms", type=float, default=2 * config.ADAPTIVE_TARGET_LATENCY_MS,
+                        help="Longest acceptable response (0 = no limit)")
+    parser.add_argument("--slack-ms", type=float, default=400, help="Longest acceptable overhead")
+    parser.add_argument("--handoff-ms", type=float, default=50,
+                        help="Calls starting this soon after a request were already issued")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    set_console_level(logging.WARNING) # One line per control request otherwise
+    rng = random.Random(args.seed)
+
+    stop = threading.Event()
+    load = [threading.Thread(target=burn, args=(stop,), daemon=True) for _ in range(args.load_threads)]
+    for thread in load:
+        thread.start()
+    failures = []
+    samples = {}
+    try:
+        for scenario in ("dispatching", "throttled", "pause/resume", "paused"):
+            for _ in range(args.trials):
+                result = trial(args, rng, scenario)
+                for kind in ("pause", "resume", "cancel"):
+                    if kind not in result:
+                        continue
+                    name = f"cancel ({scenario})" if kind == "cancel" else kind
+                    response, waited = result[kind]
+                    samples.setdefault(name, []).append(response)
+                    samples.setdefault(f"{name} overhead", []).append(response - waited)
+                    if response - waited > args.slack_ms or (args.max_ms and response > args.max_ms):
+                        failures.append(f"{name}: {response:.0f} ms, of which {waited:.0f} ms for calls on the device")
+                if result.get("discarded_while_parked"):
+                    failures.append(f"{result['discarded_while_parked']} bytes discarded while parked")
+                if "parked_cpu_ms" in result:
+                    samples.setdefault("engine CPU while parked", []).append(result["parked_cpu_ms"])
+                    if result["parked_cpu_ms"] > args.parked_s * 1000 * 0.02:
+                        failures.append(f"engine thread used {result['parked_cpu_ms']:.0f} ms CPU while parked")
+    finally:
+        stop.set()
+
+    print(f"{args.trials} trials per scenario, {args.load_threads} CPU load threads, "
+          f"sizer target {config.ADAPTIVE_TARGET_LATENCY_MS} ms")
+    for name, values in samples.items():
+        print(f"{name:<28} {percentiles(values)}")
+    for failure in failures:
+        print(f"FAIL  {failure}")
+    print("OK" if not failures else "FAILED")
+    return 0 if not failures else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
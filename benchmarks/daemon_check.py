@@ -0,0 +1,191 @@
+# trimvision/benchmarks/daemon_check.py
+# Checks the TRIM daemon's scheduling against a simulated SSD and scripted disk load.
+#
+#   1. maintenance window parsing: day ranges (also wrapping), windows crossing
+#      midnight, next start;
+#   2. idle trigger: a drive whose disk is idle gets a job; foreground I/O pauses
+#      it (no discards while paused), quiet resumes it, it completes and is not
+#      started again within the minimum interval;
+#   3. window trigger: a job starts inside a window even though the disk is not
+#      idle, and is cancelled when the window closes;
+#   4. mounted volumes: a drive with a mount point is watched and its job trims
+#      the volume through the filesystem without opening the raw device; a
+#      full-device daemon does not watch it, and one left with no drive is refused;
+#   5. overhead: CPU time of one sampling round over --drives real disk monitors,
+#      and the share of a CPU that costs at the configured sampling interval.
+#
+#   python -m trimvision.benchmarks.daemon_check [--drives 8]
+
+import sys
+import copy
+import time
+import argparse
+import datetime
+import threading
+import psutil
+from trimvision import config
+from trimvision.core.trim_daemon import MaintenanceWindow, TrimDaemon
+from trimvision.core.io_throttle import ForegroundIoMonitor
+from trimvision.benchmarks.bench_suite import engine_class_for, simulated_drive
+
+# Slow enough (about 4 s for the plan) to pause and resume it mid-run
+PROFILE = {"latency_ms": 1.0, "max_ranges": 64, "bandwidth_mbps": 500, "fault_rate": 0.0}
+
+
+class ScriptedMonitor:
+    """Stands in for ForegroundIoMonitor: reports whatever IOPS the check sets."""
+    def __init__(self):
+        self.iops = 0.0
+
+    def sample(self):
+        return self.iops, 0.0
+
+
+def check(results, name: str, ok: bool, detail: str = ""):
+    results.append(ok)
+    print(f"{'PASS' if ok else 'FAIL'}  {name}{f': {detail}' if detail else ''}")
+
+
+def wait_for(condition, timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def daemon_for(monitor, args, drive=None, **kwargs):
+    simulated = engine_class_for(PROFILE, args)
+
+    class DaemonEngine(simulated):
+        def __init__(self, drive_info, plan_mode, listener=None):
+            super().__init__(drive_info, plan_mode, resume=False, listener=listener, metrics_dir="",
+                             history_path="")
+
+        def _trim_volume(self, volume):
+            return 1024**3 # Filesystem-level TRIM, simulated
+
+    settings = dict(idle_minutes=0.3 / 60, min_interval_h=1, idle_iops=10, busy_iops=100, resume_quiet_s=0.2,
+                    sample_interval_s=0.05, active_sample_interval_s=0.05)
+    settings.update(kwargs)
+    daemon = TrimDaemon([drive or simulated_drive(args.capacity_gb)], "free", engine_class=DaemonEngine,
+                        monitor_factory=lambda drive: monitor, **settings)
+    daemon.slots[0].last_success = None # Ignore the real run history
+    thread = threading.Thread(target=daemon.run, name="daemon-check", daemon=True)
+    thread.start()
+    return daemon, thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TRIM daemon checks")
+    parser.add_argument("--drives", type=int, default=8, help="Disk monitors sampled in the overhead check")
+    parser.add_argument("--capacity-gb", type=float, default=4)
+    parser.add_argument("--extents", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    results = []
+
+    # 1. Windows
+    wednesday_3am = datetime.datetime(2024, 5, 8, 3, 0)
+    weekdays = MaintenanceWindow.parse("Mon-Fri 01:00-05:00")
+    check(results, "weekday window", weekdays.contains(wednesday_3am)
+          and not weekdays.contains(wednesday_3am + datetime.timedelta(days=3)))
+    overnight = MaintenanceWindow.parse("Sat 22:00-06:00")
+    saturday = datetime.datetime(2024, 5, 11)
+    check(results, "window across midnight", overnight.contains(saturday + datetime.timedelta(hours=29))
+          and not overnight.contains(saturday + datetime.timedelta(hours=21))
+          and not overnight.contains(saturday + datetime.timedelta(hours=6)))
+    check(results, "wrapping day range", MaintenanceWindow.parse("Fri-Mon 00:00-24:00").days == {4, 5, 6, 0})
+    check(results, "next start", weekdays.next_start(datetime.datetime(2024, 5, 10, 6, 0))
+          == datetime.datetime(2024, 5, 13, 1, 0))
+    try:
+        MaintenanceWindow.parse("Someday 25:00-26:00")
+        check(results, "bad window rejected", False)
+    except ValueError:
+        check(results, "bad window rejected", True)
+
+    # 2. Idle trigger, pause and resume
+    monitor = ScriptedMonitor()
+    daemon, thread = daemon_for(monitor, args)
+    slot = daemon.slots[0]
+    check(results, "idle disk starts a job", wait_for(lambda: slot.running and slot.started_by == "idle"))
+    wait_for(lambda: slot.engine is not None and slot.engine.bytes_discarded > 0)
+    monitor.iops = 500
+    paused = wait_for(lambda: slot.engine is not None and slot.engine.is_paused())
+    before = -1
+    while paused and slot.engine is not None and slot.engine.bytes_discarded != before: # In-flight calls drain
+        before = slot.engine.bytes_discarded
+        time.sleep(0.3)
+    time.sleep(0.5)
+    after = slot.engine.bytes_discarded if slot.engine else 0
+    check(results, "foreground I/O pauses the job", paused and before == after and slot.running,
+          f"{(after - before) / 1024**2:.0f} MB discarded while paused")
+    monitor.iops = 0
+    check(results, "quiet disk resumes it", wait_for(lambda: slot.engine is not None and not slot.engine.is_paused()))
+    check(results, "job completes", wait_for(lambda: not slot.running and slot.last_success is not None, 30))
+    time.sleep(0.5)
+    check(results, "not started again within the interval", not slot.running)
+    daemon.stop()
+    thread.join()
+
+    # 3. Window trigger and window close
+    monitor = ScriptedMonitor()
+    monitor.iops = 50 # Neither idle nor busy
+    now = datetime.datetime.now()
+    window = f"daily {now.hour:02d}:00-{(now.hour + 1) % 24:02d}:00"
+    daemon, thread = daemon_for(monitor, args, windows=[window], idle_minutes=0)
+    slot = daemon.slots[0]
+    check(results, "window starts a job on a busy disk", wait_for(lambda: slot.running and slot.started_by == "window"))
+    wait_for(lambda: slot.engine is not None and slot.engine.bytes_discarded > 0)
+    engine = slot.engine
+    daemon.in_window = lambda now=None: False # The window closes
+    check(results, "window close cancels the job", wait_for(lambda: not slot.running)
+          and engine is not None and engine.is_cancelled() and slot.last_success is None)
+    daemon.stop()
+    thread.join()
+
+    # 4. Mounted volumes
+    mounted = copy.copy(simulated_drive(args.capacity_gb))
+    mounted.drive_letter = "/mnt/sim"
+    daemon, thread = daemon_for(ScriptedMonitor(), args, drive=mounted)
+    slot = daemon.slots[0]
+    check(results, "drive with a mounted volume watched", wait_for(lambda: slot.engine is not None))
+    engine = slot.engine
+    check(results, "its job trims the volume through the filesystem",
+          wait_for(lambda: not slot.running and slot.last_success is not None)
+          and [r["volume"] for r in engine.volume_results] == ["/mnt/sim"] and engine.backend is None)
+    daemon.stop()
+    thread.join()
+    daemon = TrimDaemon([mounted, simulated_drive(args.capacity_gb)], "full",
+                        monitor_factory=lambda drive: ScriptedMonitor())
+    check(results, "full-device daemon does not watch a drive with a mounted volume",
+          [slot.drive_info.drive_letter for slot in daemon.slots] == [None])
+    try:
+        TrimDaemon([mounted], "full", monitor_factory=lambda drive: ScriptedMonitor())
+        check(results, "full-device daemon with only mounted drives refused", False)
+    except ValueError:
+        check(results, "full-device daemon with only mounted drives refused", True)
+
+    # 5. Overhead
+    disks = list((psutil.disk_io_counters(perdisk=True) or {}).keys()) or ["none"]
+    idle = TrimDaemon([simulated_drive(1)] * args.drives, "free", idle_minutes=60,
+                      monitor_factory=lambda drive, keys=iter(disks * args.drives): ForegroundIoMonitor(next(keys)))
+    for s in idle.slots:
+        s.last_success = time.time() # Not due: the round only samples
+    rounds = 200
+    start = time.process_time()
+    for _ in range(rounds):
+        idle.tick()
+    per_round = (time.process_time() - start) / rounds
+    share = per_round / config.DAEMON_SAMPLE_INTERVAL_S
+    print(f"sampling round over {args.drives} disks: {per_round * 1e3:.2f} ms CPU; "
+          f"{share * 100:.4f}% of a CPU at one round per {config.DAEMON_SAMPLE_INTERVAL_S:g}s")
+    check(results, "negligible idle overhead", share < 0.001)
+
+    print("OK" if all(results) else "FAILED")
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+# trimvision/benchmarks/emu_check.py
+# Runs the real TrimEngine against emulated devices and checks the results.
+#
+#   1. full device, with a failing and a slow LBA region: no call breaks the
+#      device's limits, the failing region ends up blocked and keeps its data,
+#      everything else is deallocated and reads back as zeroes;
+#   2. a fragmented free-space plan cut into calls whose size is not a multiple
+#      of the discard granularity: every granule inside the plan is deallocated
+#      (none is lost by being split between two calls) and nothing outside it;
+#   3. a call over the range limit is rejected with EINVAL and counted;
+#   4. post-TRIM verification of the full-device run reads every discarded
+#      granule back as zeroes, and is skipped on a device that does not read
+#      zeroes after TRIM;
+#   5. a free-space or incremental TRIM of a drive with mounted volumes trims
+#      each volume through its filesystem and sends no raw discard to the
+#      device, a failing volume fails the run after the others were tried, and
+#      the planner itself still refuses to plan a mounted drive.
+#
+#   python -m trimvision.benchmarks.emu_check [--size-mb 1024]
+
+import os
+import sys
+import errno
+import random
+import argparse
+import tempfile
+import time
+from trimvision import config
+from trimvision.core.device_emulator import EmulatedDevice, EmulatedDeviceBackend, EMULATOR_PREFIX
+from trimvision.core.extents import ExtentSet
+
+SECTOR_SIZE = 512
+GRANULE_LBA = 8 # 4 KB
+
+
+def fill_pattern(image: str, size_bytes: int, every: int = 1024**2, length: int = 64 * 1024):
+    """Non-zero data at the start of every MB, so discarded areas have something to lose."""
+    with open(image, "r+b") as f:
+        for offset in range(0, size_bytes, every):
+            f.seek(offset)
+            f.write(b"\xa5" * length)
+
+
+def emulated_drive(device: EmulatedDevice, drive_letter=None):
+    from trimvision.core.drive_manager import DriveInfo
+    return DriveInfo(model=device.settings["model"], serial_number=device.settings["serial_number"],
+                     firmware_version="EMU", capacity_gb=device.size_bytes / 1024**3,
+                     device_id_wmi=EMULATOR_PREFIX + device.image, physical_disk_index=-1,
+                     interface_type_wmi="Emulated", drive_letter=drive_letter, is_ssd=True, is_nvme=False)
+
+
+def run_engine(device: EmulatedDevice, plan_mode: str, extents=None, verify_fraction: float = 0.0):
+    from trimvision.core.trim_engine import TrimEngine
+
+    class PlannedEngine(TrimEngine):
+        def _plan_extents(self):
+            if extents is None:
+                return super()._plan_extents()
+            self.extents = extents
+            self.planned_bytes = sum(length for _, length in extents) * self.sector_size
+
+    engine = PlannedEngine(emulated_drive(device), plan_mode, queue_depth=4, resume=False, metrics_dir="",
+                           history_path="", verify_fraction=verify_fraction)
+    start = time.perf_counter()
+    engine.run()
+    return engine, time.perf_counter() - start
+
+
+def run_mounted(device: EmulatedDevice, plan_mode: str, volumes: str, failing=()):
+    """
+    Runs the engine on the device as if it had the given mounted volumes, with the
+    filesystem-level TRIM simulated; returns it, the volumes it trimmed and its errors.
+    """
+    from trimvision.core.trim_engine import TrimEngine, TrimListener
+
+    class ErrorListener(TrimListener):
+        def __init__(self):
+            self.errors = []
+
+        def error_occurred(self, error_message):
+            self.errors.append(error_message)
+
+    trimmed = []
+
+    class VolumeEngine(TrimEngine):
+        def _trim_volume(self, volume):
+            trimmed.append(volume)
+            if volume in failing:
+                raise OSError("FITRIM not supported")
+            return 64 * 1024**2
+
+    listener = ErrorListener()
+    engine = VolumeEngine(emulated_drive(device, drive_letter=volumes), plan_mode, resume=False,
+                          listener=listener, metrics_dir="", history_path="")
+    engine.run()
+    return engine, trimmed, listener.errors
+
+
+def check(results, name: str, ok: bool, detail: str = ""):
+    results.append(ok)
+    print(f"{'PASS' if ok else 'FAIL'}  {name}{f': {detail}' if detail else ''}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TRIM engine checks against emulated devices")
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    size = args.size_mb * 1024**2
+    total_lba = size // SECTOR_SIZE
+    # Calls that are not a whole number of granules, so the cursor has to cut ranges on granule edges
+    config.ADAPTIVE_INITIAL_CALL_BYTES = config.ADAPTIVE_MAX_CALL_BYTES = 3 * 1024**2 + SECTOR_SIZE
+    from trimvision.core.trim_engine import TrimEngine
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix="tv-emu-") as directory:
+        # 1. Full device with injected faults
+        image = os.path.join(directory, "full.img")
+        bad = (total_lba // 3, 4096) # 2 MB that fail with EIO
+        slow = (total_lba // 2, 4096)
+        device = EmulatedDevice.create(image, size, max_ranges_per_call=64, max_range_bytes=32 * 1024**2,
+                                       granularity_bytes=GRANULE_LBA * SECTOR_SIZE,
+                                       regions=[{"start_lba": bad[0], "length_lba": bad[1], "error": "EIO"},
+                                                {"start_lba": slow[0], "length_lba": slow[1], "latency_ms": 20}])
+        fill_pattern(image, size)
+        engine, elapsed = run_engine(device, TrimEngine.PLAN_FULL_DEVICE, verify_fraction=1.0)
+        device = EmulatedDevice.load(image)
+        full_verification = engine.run_summary["verification"]
+        blocked = ExtentSet.from_ranges(engine.run_summary.get("blocked_ranges", []))
+        print(f"full device: {size / 1024**2:.0f} MB in {elapsed:.2f}s, {device.calls} calls, "
+              f"{device.failed_calls} failed, {len(blocked)} blocked ranges")
+        check(results, "no limit violations", device.violations == 0, "; ".join(device.violation_log[-3:]))
+        bad_set = ExtentSet.from_ranges([bad])
+        check(results, "failing region blocked", (bad_set - blocked).total() == 0)
+        with open(image, "rb") as f:
+            f.seek(bad[0] * SECTOR_SIZE // 1024**2 * 1024**2 + 1024**2) # A pattern block inside the region
+            check(results, "failing region keeps its data", f.read(16) == b"\xa5" * 16)
+        whole = ExtentSet.from_ranges([(0, total_lba)])
+        check(results, "everything else deallocated", (whole - blocked - device.deallocated).total() == 0,
+              f"{(whole - blocked - device.deallocated).total()} LBAs left")
+        unzeroed = device.unzeroed()
+        check(results, "deallocated LBAs read back as zeroes", unzeroed.total() == 0, f"{unzeroed}")
+
+        # 2. Fragmented plan, cut off granule boundaries
+        image = os.path.join(directory, "fragmented.img")
+        device = EmulatedDevice.create(image, size, granularity_bytes=GRANULE_LBA * SECTOR_SIZE)
+        fill_pattern(image, size, every=64 * 1024, length=4096)
+        rng = random.Random(args.seed)
+        plan, lba = [], 0
+        while lba < total_lba:
+            lba += rng.randrange(0, 512) * GRANULE_LBA
+            length = min(rng.randrange(1, 4096) * GRANULE_LBA, total_lba - lba)
+            if length > 0:
+                plan.append((lba, length))
+            lba += length
+        engine, elapsed = run_engine(device, TrimEngine.PLAN_FREE_SPACE, plan)
+        device = EmulatedDevice.load(image)
+        planned = ExtentSet.from_ranges(plan)
+        print(f"fragmented: {len(plan)} extents, {planned.total() * SECTOR_SIZE / 1024**2:.0f} MB in {elapsed:.2f}s, "
+              f"{device.calls} calls")
+        check(results, "no limit violations", device.violations == 0, "; ".join(device.violation_log[-3:]))
+        lost = planned - device.deallocated
+        check(results, "every planned granule deallocated", lost.total() == 0, f"{lost.total()} LBAs not deallocated")
+        check(results, "nothing outside the plan deallocated", (device.deallocated - planned).total() == 0)
+        check(results, "deallocated LBAs read back as zeroes", device.unzeroed().total() == 0)
+
+        # 3. Limit enforcement
+        backend = EmulatedDeviceBackend(EMULATOR_PREFIX + image)
+        with backend:
+            try:
+                backend.discard([(i * 16, 8) for i in range(backend.max_ranges_per_call + 1)])
+                rejected = False
+            except OSError as e:
+                rejected = e.errno == errno.EINVAL
+        check(results, "over-limit call rejected with EINVAL", rejected and EmulatedDevice.load(image).violations == 1)
+        check(results, "planning reads the image behind the device", engine.data_path == image, engine.data_path)
+
+        # 4. Verification
+        v = full_verification
+        print(f"verification: {v['samples']} samples, {v['bytes_read'] / 1024**2:.0f} MB at {v['read_mbps']:.0f} MB/s")
+        check(results, "verification reads discarded space as zeroes", v["ok"], f"{v['nonzero_bytes']} bytes not zero")
+        check(results, "verification covers every discarded granule",
+              v["bytes_read"] == (whole - blocked).total() * SECTOR_SIZE, f"{v['bytes_read']} bytes read")
+        image = os.path.join(directory, "no-rzat.img")
+        device = EmulatedDevice.create(image, 64 * 1024**2, read_zero_after_trim=False)
+        engine, _ = run_engine(device, TrimEngine.PLAN_FULL_DEVICE, verify_fraction=1.0)
+        check(results, "verification skipped without read-zero-after-TRIM",
+              "skipped" in engine.run_summary["verification"])
+
+        # 5. Mounted volumes
+        from trimvision.core import trim_planner
+        for plan_mode in (TrimEngine.PLAN_FREE_SPACE, TrimEngine.PLAN_INCREMENTAL):
+            calls = EmulatedDevice.load(image).calls
+            engine, trimmed, errors = run_mounted(device, plan_mode, "/mnt/emu, /mnt/emu2")
+            check(results, f"{plan_mode} plan of a mounted drive trims each volume through its filesystem",
+                  trimmed == ["/mnt/emu", "/mnt/emu2"] and not errors
+                  and engine.bytes_discarded == 2 * 64 * 1024**2 and len(engine.run_summary["volumes"]) == 2,
+                  f"trimmed {trimmed}; " + "; ".join(errors))
+            check(results, f"{plan_mode} plan of a mounted drive sends no raw discards",
+                  EmulatedDevice.load(image).calls == calls)
+        engine, trimmed, errors = run_mounted(device, TrimEngine.PLAN_FREE_SPACE, "/mnt/emu, /mnt/emu2",
+                                              failing=("/mnt/emu",))
+        check(results, "a failing volume fails the run after the others were trimmed",
+              trimmed == ["/mnt/emu", "/mnt/emu2"] and any("/mnt/emu:" in e for e in errors)
+              and not engine.run_summary, "; ".join(errors))
+        try:
+            trim_planner.plan_drive_extents(emulated_drive(device, drive_letter="/mnt/emu"), image, SECTOR_SIZE)
+            refused = False
+        except ValueError:
+            refused = True
+        check(results, "bitmap plan of a mounted drive refused by the planner", refused)
+
+    print("OK" if all(results) else "FAILED")
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# trimvision/benchmarks/hotplug_replay.py
+# Hot-plug refresh cost.
+#
+# Replays device events through a DriveWatcher fed by a QueueEventSource over a
+# synthetic sysfs tree (see bench_drive_enum.build_tree): a burst of change events
+# for one disk, a disk whose sysfs entry disappears, and an explicit removal. It
+# checks that each burst yields a single diff and compares the per-event refresh
+# (one probe) with a full re-enumeration of all disks.
+#
+#   python -m trimvision.benchmarks.hotplug_replay [--disks 24] [--burst 20]
+
+import os
+import sys
+import argparse
+import tempfile
+import time
+from PyQt6.QtCore import QCoreApplication
+from trimvision.core.drive_manager import LinuxDriveProvider
+from trimvision.core.drive_watcher import DriveWatcher, QueueEventSource, DeviceEvent, parse_uevent
+from trimvision.benchmarks.bench_drive_enum import build_tree, time_calls
+
+
+def wait_for(condition, timeout_s: float = 5.0):
+    """Delivers the watcher's queued signals until condition() holds or timeout_s passes."""
+    deadline = time.monotonic() + timeout_s
+    while not condition() and time.monotonic() < deadline:
+        QCoreApplication.processEvents()
+        time.sleep(0.005)
+    return condition()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hot-plug refresh replay")
+    parser.add_argument("--disks", type=int, default=24)
+    parser.add_argument("--burst", type=int, default=20, help="Change events sent for one disk at once")
+    parser.add_argument("--debounce", type=float, default=0.2)
+    args = parser.parse_args(argv)
+    app = QCoreApplication(sys.argv[:1]) # QThread needs an application object
+
+    with tempfile.TemporaryDirectory(prefix="tv-sysfs-") as root:
+        build_tree(root, args.disks)
+        provider = LinuxDriveProvider(root)
+        drives = provider.list_drives()
+        time_calls(f"full re-enumeration, {args.disks} disks", 20, provider.list_drives)
+        time_calls("single-disk probe", 20, lambda: provider.probe(drives[-1].device_id_wmi))
+
+        source = QueueEventSource()
+        watcher = DriveWatcher(provider, source, debounce_s=args.debounce)
+        changed, removed = [], []
+        watcher.drive_changed.connect(lambda drive: changed.append((time.monotonic(), drive)))
+        watcher.drive_removed.connect(lambda path: removed.append((time.monotonic(), path)))
+        watcher.start()
+        try:
+            target = drives[0].device_id_wmi
+            sent = time.monotonic()
+            for _ in range(args.burst):
+                source.push(DeviceEvent.CHANGE, target)
+            ok = bool(wait_for(lambda: changed)) and not wait_for(lambda: len(changed) > 1, args.debounce * 3)
+            print(f"{args.burst} change events -> {len(changed)} refresh(es) of {target} "
+                  f"after {(changed[0][0] - sent) * 1e3:.0f} ms (debounce {args.debounce * 1e3:.0f} ms)"
+                  if changed else "no refresh received")
+
+            gone = drives[1].device_id_wmi
+            os.unlink(os.path.join(root, "sys", "block", os.path.basename(gone)))
+            source.push(DeviceEvent.CHANGE, gone) # Re-probe finds nothing: reported as removed
+            source.push(DeviceEvent.REMOVE, drives[2].device_id_wmi)
+            ok &= wait_for(lambda: len(removed) == 2)
+            print(f"removed: {sorted(path for _, path in removed)}")
+        finally:
+            watcher.requestInterruption()
+            watcher.wait()
+
+    partition_uevent = (b"add@/devices/pci0000:00/nvme/nvme0/nvme0n1/nvme0n1p4\0ACTION=add\0"
+                        b"DEVPATH=/devices/pci0000:00/nvme/nvme0/nvme0n1/nvme0n1p4\0SUBSYSTEM=block\0"
+                        b"DEVNAME=nvme0n1p4\0DEVTYPE=partition\0")
+    event = parse_uevent(partition_uevent)
+    ok &= event is not None and (event.action, event.device) == (DeviceEvent.CHANGE, "/dev/nvme0n1")
+    print(f"partition uevent -> {event}")
+    print("OK" if ok else "FAILED")
+    del app
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# trimvision/benchmarks/sim_ssd.py
+# Simulated SSD discard backend for benchmarks.
+#
+# No file or device behind it: each discard call costs a fixed command latency
+# (overlapping across the queue, as on a drive with several commands in flight)
+# plus its bytes over a bandwidth shared by all calls, and fails with EIO at a
+# configurable rate. Batches over the per-call range limit or past the end of the
+# device are rejected the way a real DSM/BLKDISCARD call would reject them.
+# Seeded, so runs are reproducible.
+
+import errno
+import random
+import threading
+import time
+from trimvision import config
+from trimvision.core import trim_helpers
+
+
+class SimulatedSsdBackend(trim_helpers.DiscardBackend):
+    """Discard backend with a latency, range limit, bandwidth and fault model instead of a device."""
+    name = "simulated-ssd"
+
+    def __init__(self, device_path: str = "sim:ssd", capacity_bytes: int = 64 * 1024**3,
+                 latency_s: float = 0.0005, max_ranges_per_call: int = config.MAX_DSM_RANGES_PER_CALL,
+                 bandwidth_bps: float = 0, fault_rate: float = 0.0, seed: int = 1,
+                 sector_size: int = config.DEFAULT_SECTOR_SIZE):
+        super().__init__(device_path, sector_size=sector_size, max_ranges_per_call=max_ranges_per_call)
+        self.capacity_bytes = capacity_bytes
+        self.latency_s = latency_s
+        self.bandwidth_bps = bandwidth_bps # 0 = discards cost no transfer time
+        self.fault_rate = fault_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._busy_until = 0.0 # perf_counter time the shared bandwidth is free again
+        # Totals, for checking a run against the model
+        self.calls = 0
+        self.ranges = 0
+        self.lba_discarded = 0
+        self.faults = 0
+
+    def size_bytes(self) -> int:
+        return self.capacity_bytes
+
+    def discard(self, ranges):
+        ranges = list(ranges)
+        if len(ranges) > self.max_ranges_per_call:
+            raise OSError(errno.EINVAL, f"{len(ranges)} ranges in one call, device limit is {self.max_ranges_per_call}")
+        total_lba = self.capacity_bytes // self.sector_size
+        lba_count = 0
+        for start, length in ranges:
+            if start < 0 or length <= 0 or start + length > total_lba:
+                raise OSError(errno.EINVAL, f"Range ({start}, {length}) outside the device ({total_lba} LBAs)")
+            lba_count += length
+
+        now = time.perf_counter()
+        with self._lock:
+            self.calls += 1
+            failed = self.fault_rate > 0 and self._rng.random() < self.fault_rate
+            finish = now + self.latency_s
+            if self.bandwidth_bps and not failed:
+                self._busy_until = max(now, self._busy_until) + lba_count * self.sector_size / self.bandwidth_bps
+                finish = max(finish, self._busy_until)
+        delay = finish - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        with self._lock:
+            if failed:
+                self.faults += 1
+            else:
+                self.ranges += len(ranges)
+                self.lba_discarded += lba_count
+        if failed:
+            raise OSError(errno.EIO, "Simulated discard failure")
+
+    def model_seconds(self, calls: int, total_bytes: int, queue_depth: int) -> float:
+        """Lower bound on the time to discard total_bytes in calls at queue_depth under this model."""
+        latency_bound = calls * self.latency_s / max(1, queue_depth)
+        bandwidth_bound = total_bytes / self.bandwidth_bps if self.bandwidth_bps else 0.0
+        return max(latency_bound, bandwidth_bound)
+
+    def __repr__(self):
+        return (f"<{type(self).__name__} {self.capacity_bytes / 1024**3:.0f} GB latency={self.latency_s * 1e3:g}ms "
+                f"ranges/call={self.max_ranges_per_call} bandwidth={self.bandwidth_bps / 1024**2:g}MB/s "
+                f"faults={self.fault_rate:g}>")
@@ -0,0 +1,182 @@
+# trimvision/benchmarks/torture_journal.py
+# Kill-and-resume torture test of the checkpoint journal.
+#
+# Repeatedly starts a TrimEngine in a child process against a sparse image file
+# and SIGKILLs it at a random moment, until a run completes. Every discard the
+# child issues is appended to a log. Afterwards it checks that:
+#   - the union of all discards equals the plan (no range lost, nothing extra),
+#   - no run discarded anything inside a chunk that the journal already held as
+#     finished when the previous run was killed (finished work is never redone),
+#   - the journal is removed once the run completes.
+# Ranges that were in flight, or in chunks not yet finished, at a kill are
+# legitimately discarded again; their volume is reported.
+#
+#   python -m trimvision.benchmarks.torture_journal [--kills 30] [--size-mb 4096]
+
+import argparse
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import numpy as np
+
+_RANGE = struct.Struct("<QQ")
+SECTOR_SIZE = 512
+TOTAL_CHUNKS = 4096
+
+
+def plan_extents(total_lba: int, seed: int):
+    """Deterministic fragmented plan: random free extents over the whole image."""
+    rng = random.Random(seed)
+    extents, lba = [], 0
+    while lba < total_lba:
+        lba += rng.randrange(0, 4096)
+        length = min(rng.randrange(8, 65536), total_lba - lba)
+        if length > 0:
+            extents.append((lba, length))
+        lba += length
+    return extents
+
+
+def run_child(args):
+    # Config must be adjusted before the worker modules bind their defaults
+    from trimvision import config
+    config.JOURNAL_DIR = args.journal_dir
+    config.JOURNAL_FLUSH_INTERVAL_S = args.flush_interval
+    config.PROGRESS_CHUNKS = TOTAL_CHUNKS
+    config.ADAPTIVE_INITIAL_CALL_BYTES = config.ADAPTIVE_MAX_CALL_BYTES = 2 * 1024**2
+    from trimvision.core import trim_helpers
+    from trimvision.core.trim_engine import TrimEngine, TrimListener
+
+    log_fd = os.open(args.log, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+
+    class RecordingBackend(trim_helpers.SparseFileBackend):
+        """Logs every range once the discard returned, in one write() per call."""
+        def discard(self, ranges):
+            time.sleep(args.latency_ms / 1000)
+            super().discard(ranges)
+            os.write(log_fd, b"".join(_RANGE.pack(start, length) for start, length in ranges))
+
+    trim_helpers.open_backend = lambda path, **kwargs: RecordingBackend(path, **kwargs)
+
+    class PlannedEngine(TrimEngine):
+        def _plan_extents(self):
+            self.extents = plan_extents(self.total_lba, args.seed)
+            self.planned_bytes = sum(length for _, length in self.extents) * self.sector_size
+
+    drive = types.SimpleNamespace(model="torture", serial_number="TORTURE-1", device_id_wmi=args.image,
+                                  capacity_gb=os.path.getsize(args.image) / 1024**3, drive_letter=None,
+                                  physical_disk_index=0, ps_bus_type="N/A")
+    result = {}
+
+    class ResultListener(TrimListener):
+        def trim_finished(self, success, message):
+            result.update(ok=success, message=message)
+
+    PlannedEngine(drive, TrimEngine.PLAN_FREE_SPACE, queue_depth=4, listener=ResultListener(), metrics_dir="",
+                  history_path="").run()
+    sys.exit(0 if result.get("ok") else 3)
+
+
+def read_log(path: str, start: int = 0, end: int = None):
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read() if end is None else f.read(end - start)
+    return [_RANGE.unpack_from(data, i) for i in range(0, len(data) - len(data) % _RANGE.size, _RANGE.size)]
+
+
+def coverage(ranges, total_lba: int) -> np.ndarray:
+    """Number of times each LBA was discarded."""
+    delta = np.zeros(total_lba + 1, dtype=np.int32)
+    for start, length in ranges:
+        delta[start] += 1
+        delta[start + length] -= 1
+    return np.cumsum(delta[:-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Checkpoint journal kill-and-resume torture test")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--image"), parser.add_argument("--log"), parser.add_argument("--journal-dir")
+    parser.add_argument("--kills", type=int, default=30, help="Kills before a run may complete")
+    parser.add_argument("--size-mb", type=int, default=4096)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Injected latency per discard call")
+    parser.add_argument("--flush-interval", type=float, default=0.05, help="Journal flush interval (s)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    if args.child:
+        run_child(args)
+        return
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="tv-torture-")
+    args.image = os.path.join(workdir, "disk.img")
+    args.log = os.path.join(workdir, "discards.log")
+    args.journal_dir = os.path.join(workdir, "journals")
+    with open(args.image, "wb") as f:
+        f.truncate(args.size_mb * 1024**2)
+    open(args.log, "wb").close()
+    total_lba = args.size_mb * 1024**2 // SECTOR_SIZE
+    chunk_starts = np.arange(TOTAL_CHUNKS + 1, dtype=np.int64) * total_lba // TOTAL_CHUNKS
+    journal_file = os.path.join(args.journal_dir, "TORTURE-1.tvj")
+
+    child_cmd = [sys.executable, "-m", "trimvision.benchmarks.torture_journal", "--child",
+                 "--image", args.image, "--log", args.log, "--journal-dir", args.journal_dir,
+                 "--latency-ms", str(args.latency_ms), "--flush-interval", str(args.flush_interval),
+                 "--seed", str(args.seed)]
+    from trimvision.core.trim_journal import read_completed_chunks
+
+    violations = 0
+    kills = 0
+    runs = 0
+    while True:
+        runs += 1
+        log_start = os.path.getsize(args.log)
+        finished_before = read_completed_chunks(journal_file)
+        child = subprocess.Popen(child_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if kills < args.kills:
+            time.sleep(rng.uniform(0.3, 1.5)) # Includes interpreter start-up
+        try:
+            code = child.wait(timeout=0 if kills < args.kills else 600)
+        except subprocess.TimeoutExpired:
+            child.kill()
+            child.wait()
+            kills += 1
+            code = None
+
+        # Nothing this run discarded may lie in a chunk the journal held as finished when it started
+        run_ranges = read_log(args.log, log_start)
+        if finished_before.size and run_ranges:
+            done = np.zeros(total_lba, dtype=bool)
+            for chunk in finished_before:
+                done[chunk_starts[chunk]:chunk_starts[chunk + 1]] = True
+            redone = sum(int(done[start:start + length].sum()) for start, length in run_ranges)
+            if redone:
+                violations += 1
+                print(f"run {runs}: {redone} LBAs of finished chunks discarded again")
+        print(f"run {runs}: {'killed' if code is None else f'exit {code}'}, "
+              f"{len(finished_before)} chunks finished at start, {len(run_ranges)} ranges discarded")
+        if code is not None:
+            break
+
+    plan = plan_extents(total_lba, args.seed)
+    counts = coverage(read_log(args.log), total_lba)
+    planned = coverage(plan, total_lba) > 0
+    lost = int((planned & (counts == 0)).sum())
+    extra = int((~planned & (counts > 0)).sum())
+    repeated = int(np.maximum(counts - 1, 0).sum())
+    print(f"{kills} kills, {runs} runs; final exit code {code}")
+    print(f"planned {planned.sum() * SECTOR_SIZE / 1024**2:.1f} MB, lost {lost} LBAs, outside plan {extra} LBAs, "
+          f"re-discarded after kills {repeated * SECTOR_SIZE / 1024**2:.1f} MB")
+    print(f"journal removed after completion: {not os.path.exists(journal_file)}")
+    ok = code == 0 and lost == 0 and extra == 0 and violations == 0 and not os.path.exists(journal_file)
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
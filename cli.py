@@ -0,0 +1,348 @@
+# trimvision/cli.py
+# Headless command line: `python -m trimvision <command> ...`.
+#
+#   trim  --device PATH [--device PATH ...] [--mode free|incremental|full] [--verify [FRACTION]] [--json]
+#         Runs TRIM on each device in turn with the same engine as the GUI (planning,
+#         adaptive sizing, throttling, checkpoint journal). With --json, stdout carries
+#         one JSON object per line: "status", "progress" and "finished" events per
+#         device and a final "summary"; logs go to stderr and the log file.
+#         With free or incremental, the free space of a drive with mounted volumes is
+#         trimmed through each volume's filesystem (FITRIM, Optimize-Volume -ReTrim)
+#         rather than planned from the on-disk bitmaps; this is said before the run.
+#   drives [--json]
+#         Lists the drives suitable for TRIM.
+#   daemon [--device PATH ...] [--mode free|incremental] [--window SPEC ...] [--idle-minutes N]
+#          [--interval-hours H]
+#         Runs until SIGINT/SIGTERM, trimming each device (default: every suitable drive;
+#         mounted volumes through their filesystems) inside the maintenance windows or
+#         once its disk has been idle, pausing a job while foreground I/O is back (see
+#         core/trim_daemon.py).
+#   history [--serial SERIAL] [--outcome OUTCOME] [--limit N] [--trend month|week|day] [--json]
+#         Past runs from the run history database, newest first; with --trend, a
+#         drive's throughput per calendar period (needs --serial).
+#
+# Nothing here imports PyQt; the GUI is only started by __main__ without a command.
+#
+# Exit codes: 0 every run succeeded, 1 a run failed, 2 usage error, 3 cancelled
+# (SIGINT/SIGTERM; an interrupted run resumes from its journal next time),
+# 4 completed but some ranges could not be discarded, 5 completed but --verify
+# found discarded LBAs that do not read back as zeroes.
+
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+from trimvision import config
+from trimvision.core.logger import logger, set_console_level
+from trimvision.utils import startup_timing
+
+EXIT_OK, EXIT_FAILED, EXIT_USAGE, EXIT_CANCELLED, EXIT_BLOCKED, EXIT_VERIFY_FAILED = 0, 1, 2, 3, 4, 5
+
+
+def _emit_json(event: str, **fields):
+    print(json.dumps({"event": event, "time": round(time.time(), 3), **fields}, default=str), flush=True)
+
+
+def resolve_drive(device_path: str):
+    """DriveInfo of a disk, an emulated device (emu:IMAGE) or a disk image file, by path; None if none."""
+    from trimvision.core import drive_manager
+    if device_path.startswith("emu:"):
+        from trimvision.core.device_emulator import EmulatedDevice, image_path
+        try:
+            device = EmulatedDevice.load(image_path(device_path))
+        except OSError as e:
+            logger.error(str(e))
+            return None
+        return drive_manager.DriveInfo(
+            model=device.settings["model"], serial_number=device.settings["serial_number"], firmware_version="EMU",
+            capacity_gb=device.size_bytes / 1024**3, device_id_wmi=device_path, physical_disk_index=-1,
+            interface_type_wmi="Emulated", drive_letter=None, is_ssd=True, is_nvme=False)
+    try:
+        drive = drive_manager.default_provider().probe(device_path)
+    except Exception as e: # No WMI, unreadable sysfs: fall back to what the path itself tells
+        logger.warning(f"Could not probe {device_path}: {e}")
+        drive = None
+    if drive is None and os.path.isfile(device_path):
+        drive = drive_manager.DriveInfo(
+            model=f"Image {os.path.basename(device_path)}", serial_number="N/A", firmware_version="N/A",
+            capacity_gb=os.path.getsize(device_path) / 1024**3, device_id_wmi=device_path,
+            physical_disk_index=-1, interface_type_wmi="File", drive_letter=None, is_ssd=True, is_nvme=False)
+    return drive
+
+
+class ProgressReporter:
+    """
+    Prints an engine's reports; implements the TrimListener methods (duck-typed, so
+    that importing this module does not load the engine). At most one progress line
+    per interval_s.
+    """
+    def __init__(self, device_path: str, as_json: bool, interval_s: float):
+        self.device_path = device_path
+        self.as_json = as_json
+        self.interval_s = interval_s
+        self.finished_message = ""
+        self._last_progress = 0.0
+
+    def progress_updated(self, processed_chunks, total_chunks, speed_mbps, eta_seconds, throttle_state):
+        now = time.monotonic()
+        if now - self._last_progress < self.interval_s and processed_chunks < total_chunks:
+            return
+        self._last_progress = now
+        fraction = processed_chunks / total_chunks if total_chunks else 0.0
+        eta = None if eta_seconds == float('inf') else round(eta_seconds, 1)
+        if self.as_json:
+            _emit_json("progress", device=self.device_path, fraction_done=round(fraction, 4),
+                       processed_chunks=processed_chunks, total_chunks=total_chunks,
+                       speed_mbps=round(speed_mbps, 2), eta_s=eta, throttle=throttle_state)
+        else:
+            print(f"{self.device_path}: {fraction * 100:5.1f}%  {speed_mbps:8.1f} MB/s  "
+                  f"ETA {'--' if eta is None else f'{eta:.0f}s'}  [{throttle_state.get('limited_by', '')}]",
+                  flush=True)
+
+    def chunk_states_changed(self, deltas):
+        pass # No grid to draw
+
+    def status_message(self, message: str):
+        if self.as_json:
+            _emit_json("status", device=self.device_path, message=message)
+        else:
+            print(f"{self.device_path}: {message}", flush=True)
+
+    def error_occurred(self, error_message: str):
+        if self.as_json:
+            _emit_json("error", device=self.device_path, message=error_message)
+        else:
+            print(f"{self.device_path}: error: {error_message}", file=sys.stderr, flush=True)
+
+    def trim_finished(self, success: bool, message: str):
+        self.finished_message = message
+
+
+def run_trim(args) -> int:
+    from trimvision.core.trim_engine import TrimEngine # numpy, psutil: only once there is work to do
+    from trimvision.core.volume_trim import mounted_volumes
+    if args.mode == TrimEngine.PLAN_FULL_DEVICE and not args.yes:
+        print("--mode full discards every LBA and destroys all data on the device; add --yes to confirm.",
+              file=sys.stderr)
+        return EXIT_USAGE
+
+    current = {}
+    def request_cancel(signum, frame):
+        logger.warning(f"Signal {signum} received; cancelling (the run can resume from its journal)")
+        current["cancelled"] = True
+        if current.get("engine"):
+            current["engine"].cancel_operation()
+    signal.signal(signal.SIGINT, request_cancel)
+    signal.signal(signal.SIGTERM, request_cancel)
+
+    results = []
+    for device_path in args.device:
+        if current.get("cancelled"):
+            break
+        drive = resolve_drive(device_path)
+        if drive is None:
+            message = f"{device_path} is not a known disk or an image file"
+            logger.error(message)
+            result = {"device": device_path, "exit_code": EXIT_FAILED, "message": message}
+        else:
+            reporter = ProgressReporter(device_path, args.json, args.progress_interval)
+            engine = TrimEngine(drive, args.mode, queue_depth=args.queue_depth, resume=not args.no_resume,
+                                listener=reporter, metrics_dir=args.metrics_dir, verify_fraction=args.verify)
+            if args.rate_limit:
+                engine.set_rate_limit(args.rate_limit * 1024**2)
+            volumes = mounted_volumes(drive) if args.mode != TrimEngine.PLAN_FULL_DEVICE else []
+            if volumes:
+                reporter.status_message(f"mounted volumes ({', '.join(volumes)}) are trimmed through their "
+                                        f"filesystems; the {args.mode} plan from the on-disk bitmaps does not apply")
+            current["engine"] = engine
+            engine.run()
+            current["engine"] = None
+            summary = dict(engine.run_summary)
+            if current.get("cancelled"):
+                exit_code = EXIT_CANCELLED
+            elif not summary:
+                exit_code = EXIT_FAILED # run() records no summary when it fails
+            elif summary["blocked_ranges"]:
+                exit_code = EXIT_BLOCKED
+            elif summary["verification"].get("ok") is False:
+                exit_code = EXIT_VERIFY_FAILED
+            else:
+                exit_code = EXIT_OK
+            result = {"device": device_path, "exit_code": exit_code, "message": reporter.finished_message,
+                      "summary": summary}
+        results.append(result)
+        if args.json:
+            _emit_json("finished", **result)
+        else:
+            print(f"{device_path}: {result['message']}", flush=True)
+            if result.get("summary"):
+                s = result["summary"]
+                if s.get("volumes"):
+                    for r in s["volumes"]:
+                        trimmed = "done" if r["bytes_trimmed"] is None else f"{r['bytes_trimmed'] / 1024**3:.2f} GB"
+                        print(f"{device_path}: {r['volume']}: {trimmed} in {r['duration_s']:.1f}s "
+                              f"(filesystem TRIM)", flush=True)
+                else:
+                    print(f"{device_path}: {s['bytes_discarded'] / 1024**3:.2f} GB discarded of "
+                          f"{s['planned_bytes'] / 1024**3:.2f} GB planned in {s['duration_s']:.1f}s, "
+                          f"{len(s['blocked_ranges'])} blocked ranges", flush=True)
+                v = s["verification"]
+                if "ok" in v:
+                    outcome = ("all zeroes" if v["ok"] else f"{v['nonzero_bytes'] / 1024**2:.2f} MB not zeroes, "
+                                                            f"{len(v['unreadable_ranges'])} unreadable samples")
+                    print(f"{device_path}: verified {v['samples']} samples ({v['bytes_read'] / 1024**2:.0f} MB, "
+                          f"{v['read_mbps']:.0f} MB/s {v['method']} reads): {outcome}", flush=True)
+                elif v:
+                    print(f"{device_path}: verification skipped: {v['skipped']}", flush=True)
+
+    severity = (EXIT_OK, EXIT_VERIFY_FAILED, EXIT_BLOCKED, EXIT_CANCELLED, EXIT_FAILED) # Worst result of the batch wins
+    exit_code = max((r["exit_code"] for r in results), key=severity.index, default=EXIT_OK)
+    if current.get("cancelled"):
+        exit_code = EXIT_CANCELLED
+    if args.json:
+        _emit_json("summary", exit_code=exit_code, devices=len(args.device), completed=len(results),
+                   succeeded=sum(r["exit_code"] == EXIT_OK for r in results))
+    return exit_code
+
+
+def run_drives(args) -> int:
+    from trimvision.core.drive_manager import get_detailed_drive_info
+    drives = get_detailed_drive_info()
+    if args.json:
+        print(json.dumps([vars(drive) for drive in drives], default=str), flush=True)
+    else:
+        for drive in drives:
+            print(drive)
+    return EXIT_OK
+
+
+def run_daemon(args) -> int:
+    from trimvision.core.trim_daemon import TrimDaemon
+    if not args.window and not args.idle_minutes:
+        print("Nothing would ever start a TRIM: give a --window or a non-zero --idle-minutes.", file=sys.stderr)
+        return EXIT_USAGE
+    if args.device:
+        drives = [resolve_drive(path) for path in args.device]
+        if None in drives:
+            print(f"Unknown device: {args.device[drives.index(None)]}", file=sys.stderr)
+            return EXIT_USAGE
+    else:
+        from trimvision.core.drive_manager import get_detailed_drive_info
+        drives = get_detailed_drive_info()
+    if not drives:
+        print("No drives to watch.", file=sys.stderr)
+        return EXIT_USAGE
+    try:
+        daemon = TrimDaemon(drives, args.mode, args.window, args.idle_minutes, args.interval_hours)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return EXIT_USAGE
+    if not args.verbose:
+        set_console_level(logging.INFO) # A daemon's console is its activity log
+    signal.signal(signal.SIGINT, lambda signum, frame: daemon.stop())
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    daemon.run()
+    return EXIT_OK
+
+
+def run_history_command(args) -> int:
+    from trimvision.core.run_history import RunHistory
+    history = RunHistory(args.database)
+    if args.trend:
+        if not args.serial:
+            print("--trend needs --serial (see `history` for the drives' serials).", file=sys.stderr)
+            return EXIT_USAGE
+        rows = history.throughput_trend(args.serial, args.trend)
+        if args.json:
+            print(json.dumps(rows), flush=True)
+        else:
+            print(f"{'period':<10} {'runs':>5} {'p50 MB/s':>10} {'best p50':>10} {'mean MB/s':>10} {'p99 ms':>8}")
+            for row in rows:
+                print(f"{row['period']:<10} {row['runs']:>5} {row['mean_p50_mbps'] or 0:>10.1f} "
+                      f"{row['best_p50_mbps'] or 0:>10.1f} {row['mean_mbps'] or 0:>10.1f} {row['mean_p99_ms'] or 0:>8.2f}")
+        return EXIT_OK
+
+    runs = history.query(serial=args.serial, outcome=args.outcome, limit=args.limit)
+    if args.json:
+        print(json.dumps(runs), flush=True)
+    else:
+        for run in runs:
+            print(f"{run['id']:>6}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(run['started']))}  "
+                  f"{run['serial']:<20.20} {run['model']:<24.24} {run['plan_mode']:<11} {run['outcome']:<9} "
+                  f"{run['bytes_discarded'] / 1024**3:8.2f} GB {run['duration_s']:7.1f}s "
+                  f"{run['throughput_mbps']:8.1f} MB/s  {run['blocked_ranges']} blocked")
+    return EXIT_OK
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m trimvision",
+                                     description=f"{config.APP_NAME} v{config.APP_VERSION} headless mode "
+                                                 f"(run without a command for the GUI)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log everything to stderr, not just warnings")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    trim = commands.add_parser("trim", help="TRIM one or more devices")
+    trim.add_argument("--device", action="append", required=True,
+                      help="Device path (\\\\.\\PHYSICALDRIVE1, /dev/sdb), disk image or emu:IMAGE; repeat for a batch")
+    trim.add_argument("--mode", choices=("free", "incremental", "full"), default="free",
+                      help="free: free filesystem space; incremental: space freed since the last run; "
+                           "full: the whole device (destroys all data, needs --yes)")
+    trim.add_argument("--yes", action="store_true", help="Confirm a full-device TRIM")
+    trim.add_argument("--json", action="store_true", help="JSON lines on stdout")
+    trim.add_argument("--queue-depth", type=int, default=config.TRIM_QUEUE_DEPTH)
+    trim.add_argument("--rate-limit", type=float, default=0, metavar="MBPS", help="Cap the discard rate (MB/s)")
+    trim.add_argument("--no-resume", action="store_true", help="Ignore and do not keep a checkpoint journal")
+    trim.add_argument("--metrics-dir", metavar="DIR",
+                      help="Write <drive>.json and <drive>.prom discard metrics here (default: the data dir)")
+    trim.add_argument("--verify", type=float, nargs="?", const=config.VERIFY_SAMPLE_FRACTION, metavar="FRACTION",
+                      help=f"Afterwards read back this share of the discarded space (default "
+                           f"{config.VERIFY_SAMPLE_FRACTION:g}) and check it reads as zeroes")
+    trim.add_argument("--progress-interval", type=float, default=1.0, metavar="S",
+                      help="Seconds between progress reports")
+    trim.set_defaults(handler=run_trim)
+
+    drives = commands.add_parser("drives", help="List the drives suitable for TRIM")
+    drives.add_argument("--json", action="store_true")
+    drives.set_defaults(handler=run_drives)
+
+    daemon = commands.add_parser("daemon", help="TRIM drives unattended, in maintenance windows or when idle")
+    daemon.add_argument("--device", action="append", help="Device to watch (repeatable; default: every suitable drive)")
+    daemon.add_argument("--mode", choices=("free", "incremental"), default=config.DAEMON_PLAN_MODE)
+    daemon.add_argument("--window", action="append", default=list(config.DAEMON_WINDOWS), metavar="SPEC",
+                        help="Maintenance window in local time, e.g. 'Mon-Fri 01:00-05:00' (repeatable)")
+    daemon.add_argument("--idle-minutes", type=float, default=config.DAEMON_IDLE_MINUTES,
+                        help="Also trim a drive whose disk has been idle this long (0 = windows only)")
+    daemon.add_argument("--interval-hours", type=float, default=config.DAEMON_MIN_INTERVAL_H,
+                        help="Do not trim a drive again within this many hours of a successful run")
+    daemon.set_defaults(handler=run_daemon)
+
+    history = commands.add_parser("history", help="Show past TRIM runs")
+    history.add_argument("--serial", help="Only this drive (serial number, or device path for drives without one)")
+    history.add_argument("--outcome", choices=("ok", "blocked", "cancelled", "failed"))
+    history.add_argument("--limit", type=int, default=config.HISTORY_PAGE_SIZE)
+    history.add_argument("--trend", choices=("month", "week", "day"),
+                         help="Throughput of the --serial drive per calendar period instead of single runs")
+    history.add_argument("--database", metavar="PATH", help="History database (default: the one in the data dir)")
+    history.add_argument("--json", action="store_true")
+    history.set_defaults(handler=run_history_command)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    set_console_level(logging.DEBUG if args.verbose else logging.WARNING)
+    if args.verbose:
+        startup_timing.enable_logging()
+    if os.name == 'nt' and args.command != "history": # Reading the history needs no device access
+        from trimvision.utils import admin_checker
+        if not admin_checker.is_admin(): # No UAC prompt here: headless callers cannot answer it
+            print("Administrative privileges are required.", file=sys.stderr)
+            return EXIT_FAILED
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
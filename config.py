@@ -4,16 +4,138 @@ APP_NAME = "TrimVision"
 APP_VERSION = "0.1.0"
 APP_AUTHOR = "AI Generated (Enhanced by User)"
 LOG_FILE = "trim_operations.log"
+LOG_MAX_BYTES = 5 * 1024**2 # Rotated at this size
+LOG_BACKUP_COUNT = 3 # Rotated files kept (trim_operations.log.1 ...)
+LOG_TRACE_ENTRIES = 4096 # Discard calls kept in memory and written to the log when one fails
+STARTUP_PROFILE_FILE = "startup_profile.txt" # Written by --profile-startup without a path
 
 # LBA Grid Colors (can be refined later or moved to QSS)
 COLOR_LBA_PROCESSED = (0, 180, 0)      # Green
 COLOR_LBA_BLOCKED = (220, 0, 0)        # Red
 COLOR_LBA_NON_PROCEEDED = (128, 128, 128) # Gray
 COLOR_LBA_PROCESSING = (50, 150, 255) # Blue (for active cell)
+COLOR_LBA_VERIFY_FAILED = (255, 140, 0) # Orange: discarded, but did not read back as zeroes
 
 # Default chunk size for LBA visualization (e.g., 1GB)
 # This will be refined, drive size dependent.
 DEFAULT_LBA_CHUNK_SIZE_MB = 1024 # 1 GB
 
 # Max ranges for a single DeviceIoControl TRIM call (Windows limit is often 256, be conservative)
-MAX_DSM_RANGES_PER_CALL = 64
\ No newline at end of file
+MAX_DSM_RANGES_PER_CALL = 64
+
+# Logical sector size assumed when the backend cannot query the device
+DEFAULT_SECTOR_SIZE = 512
+
+# Free-space planner: smallest free run worth discarding, and bitmap bytes scanned per step
+MIN_FREE_EXTENT_BYTES = 1024 * 1024 # 1 MB
+PLANNER_CHUNK_BYTES = 4 * 1024 * 1024
+# Mounted volumes are trimmed by their filesystem instead (FITRIM, Optimize-Volume -ReTrim);
+# longest a Windows re-trim of one volume may take
+VOLUME_RETRIM_TIMEOUT_S = 6 * 3600
+
+# Discard calls kept in flight by the TRIM worker (one submitter thread each)
+TRIM_QUEUE_DEPTH = 8
+
+# Multi-drive scheduler: concurrently trimmed drives, overall and per controller/bus,
+# and a global discard bandwidth budget shared by running jobs (0 = unlimited)
+SCHEDULER_MAX_CONCURRENT_DRIVES = 4
+SCHEDULER_MAX_PER_CONTROLLER = 2
+SCHEDULER_BANDWIDTH_MBPS = 0
+# On quit, how long the window waits for cancelled jobs to stop (a cancel takes effect
+# within the discard calls already on the device, about ADAPTIVE_TARGET_LATENCY_MS)
+SCHEDULER_SHUTDOWN_WAIT_S = 10
+
+# Adaptive discard sizing: bytes per call are steered toward a target call latency
+ADAPTIVE_TARGET_LATENCY_MS = 250
+ADAPTIVE_MIN_CALL_BYTES = 1024**2 # 1 MB
+ADAPTIVE_INITIAL_CALL_BYTES = 256 * 1024**2 # 256 MB
+ADAPTIVE_MAX_CALL_BYTES = 64 * 1024**3 # 64 GB
+
+# Resolution of progress reporting and of the worker->grid chunk mapping
+# (clamped to the drive's LBA count), and the most blocks the LBA grid draws
+PROGRESS_CHUNKS = 1 << 20
+LBA_GRID_MAX_BLOCKS = 1 << 20
+LBA_GRID_MIN_CELL_PX = 2 # Zoomed out, cells aggregate chunks rather than shrink below this
+
+# Foreground-I/O-aware throttling of discards (0 = unlimited). The rate is cut while
+# application I/O on the target disk exceeds the latency or IOPS thresholds.
+THROTTLE_MAX_MBPS = 0
+THROTTLE_MAX_CALLS_PER_S = 0
+THROTTLE_MIN_MBPS = 16 # Floor so a busy disk still makes progress
+THROTTLE_BURST_S = 0.5 # Token bucket depth, in seconds of the current rate
+THROTTLE_SAMPLE_INTERVAL_S = 1.0
+THROTTLE_FG_LATENCY_MS = 20
+THROTTLE_FG_IOPS = 2000
+
+# Upper bound on worker -> UI progress/grid updates per second
+UI_UPDATE_MAX_HZ = 20
+
+# Checkpoint journal: finished chunks of an interrupted run are skipped when the same
+# drive is trimmed again. Directory is relative to the app directory unless absolute.
+JOURNAL_ENABLED = True
+JOURNAL_DIR = "journals"
+JOURNAL_FLUSH_INTERVAL_S = 2.0
+
+# Incremental TRIM: after a successful free-space run the trimmed free extents are kept,
+# and an incremental run discards only space freed since. A full free-space run is forced
+# after INCREMENTAL_MAX_RUNS incremental runs or once the snapshot is older than
+# INCREMENTAL_MAX_AGE_DAYS (0 = no limit).
+INCREMENTAL_SNAPSHOT_DIR = "snapshots"
+INCREMENTAL_MAX_RUNS = 8
+INCREMENTAL_MAX_AGE_DAYS = 30
+
+# Drive enumeration: slow per-disk probe results (PowerShell MediaType/BusType) are cached
+# by serial number and firmware revision. Directory is relative to the app directory.
+DRIVE_CACHE_ENABLED = True
+DRIVE_CACHE_DIR = "cache"
+DRIVE_CACHE_TTL_S = 7 * 24 * 3600
+DRIVE_PROBE_TIMEOUT_S = 15 # Per slow probe (PowerShell); on timeout classification falls back to WMI/model
+
+# Hot-plug: device events are coalesced per disk for DRIVE_WATCH_DEBOUNCE_S before the
+# disk is re-probed; Windows polls WMI for disk creation/deletion every DRIVE_WATCH_WMI_POLL_S.
+DRIVE_WATCH_ENABLED = True
+DRIVE_WATCH_DEBOUNCE_S = 1.0
+DRIVE_WATCH_WMI_POLL_S = 2
+
+# Discard-call metrics: latency histogram, per-second throughput and error counters,
+# exported as <drive>.json and <drive>.prom (Prometheus textfile collector) into
+# METRICS_DIR every METRICS_EXPORT_INTERVAL_S during a run and once at its end.
+METRICS_ENABLED = True
+METRICS_DIR = "metrics"
+METRICS_EXPORT_INTERVAL_S = 10.0
+METRICS_THROUGHPUT_WINDOW_S = 3600
+
+# Run history: every finished run is recorded in an SQLite database (HISTORY_DB in
+# HISTORY_DIR, relative to the app directory unless absolute); the history panel and
+# `python -m trimvision history` read it HISTORY_PAGE_SIZE runs at a time.
+HISTORY_ENABLED = True
+HISTORY_DIR = "history"
+HISTORY_DB = "runs.sqlite3"
+HISTORY_PAGE_SIZE = 100
+
+# Post-TRIM verification (opt-in per run): VERIFY_SAMPLE_FRACTION of the discarded space,
+# in blocks of VERIFY_SAMPLE_BYTES, is read back by VERIFY_THREADS parallel readers and
+# must be all zeroes. Only meaningful on drives with deterministic read-zero-after-TRIM;
+# others may legitimately return old data for discarded LBAs.
+VERIFY_AFTER_TRIM = False
+VERIFY_SAMPLE_FRACTION = 0.01
+VERIFY_SAMPLE_BYTES = 1024**2
+VERIFY_THREADS = 4
+
+# Daemon mode (`python -m trimvision daemon`): a drive is trimmed inside one of
+# DAEMON_WINDOWS (local time, e.g. "Mon-Fri 01:00-05:00", "Sat,Sun 22:00-06:00",
+# "daily 03:00-04:00") or once its foreground I/O has stayed at or below DAEMON_IDLE_IOPS
+# for DAEMON_IDLE_MINUTES (0 = windows only), at most once per DAEMON_MIN_INTERVAL_H.
+# A running job pauses while foreground I/O exceeds DAEMON_BUSY_IOPS and resumes after
+# DAEMON_RESUME_QUIET_S at idle level. Disk counters are sampled every
+# DAEMON_SAMPLE_INTERVAL_S, and every DAEMON_ACTIVE_SAMPLE_INTERVAL_S while a job runs.
+DAEMON_WINDOWS = []
+DAEMON_PLAN_MODE = "incremental"
+DAEMON_IDLE_MINUTES = 30
+DAEMON_IDLE_IOPS = 20
+DAEMON_BUSY_IOPS = 100
+DAEMON_RESUME_QUIET_S = 60
+DAEMON_MIN_INTERVAL_H = 24
+DAEMON_RETRY_MINUTES = 60 # After a failed run
+DAEMON_SAMPLE_INTERVAL_S = 30
+DAEMON_ACTIVE_SAMPLE_INTERVAL_S = 2
@@ -0,0 +1,89 @@
+# trimvision/core/adaptive_sizer.py
+# Latency-targeted sizing of discard calls.
+#
+# The byte count of each discard call is steered toward a target latency, AIMD
+# style: it doubles while calls are fast (slow start), then grows additively,
+# and is cut multiplicatively as soon as a call overshoots the target. Short
+# calls keep cancel/pause responsive; large ones keep the drive busy. The engine
+# spends the budget on all the calls it has in flight together, since concurrent
+# calls share the device and a pause or cancel waits for every one of them.
+
+import time
+from trimvision import config
+
+
+class AdaptiveRangeSizer:
+    """Chooses the number of bytes per discard call from measured call latencies."""
+
+    def __init__(self, target_latency_s: float = config.ADAPTIVE_TARGET_LATENCY_MS / 1000,
+                 min_bytes: int = config.ADAPTIVE_MIN_CALL_BYTES,
+                 max_bytes: int = config.ADAPTIVE_MAX_CALL_BYTES,
+                 initial_bytes: int = config.ADAPTIVE_INITIAL_CALL_BYTES,
+                 decrease_factor: float = 0.5):
+        self.target_latency_s = target_latency_s
+        self.min_bytes = max(1, min_bytes)
+        self.max_bytes = max(self.min_bytes, max_bytes)
+        self.initial_bytes = min(max(initial_bytes, self.min_bytes), self.max_bytes)
+        self.decrease_factor = decrease_factor
+        self.increase_bytes = self.initial_bytes # Additive step once slow start ends
+        self.current_bytes = self.initial_bytes
+        self._slow_start = True
+        self._last_decrease = 0.0
+
+        # Run summary bookkeeping
+        self.calls = 0
+        self.decreases = 0
+        self.bytes_total = 0
+        self.min_used = None
+        self.max_used = 0
+        self.size_histogram = {} # power-of-two size bucket (bytes) -> calls
+
+    @classmethod
+    def for_backend(cls, backend, **kwargs):
+        """Sizer bounded by what the backend accepts in one call."""
+        max_bytes = kwargs.pop('max_bytes', config.ADAPTIVE_MAX_CALL_BYTES)
+        if backend.max_range_lba:
+            max_bytes = min(max_bytes, backend.max_ranges_per_call * backend.max_range_lba * backend.sector_size)
+        return cls(max_bytes=max_bytes, **kwargs)
+
+    def next_call_lba(self, sector_size: int) -> int:
+        """LBA budget for the next discard call, or for all calls in flight together."""
+        return max(1, self.current_bytes // sector_size)
+
+    def record(self, call_bytes: int, latency_s: float):
+        """Feeds back the latency of a completed call of call_bytes bytes."""
+        self.calls += 1
+        self.bytes_total += call_bytes
+        self.min_used = call_bytes if self.min_used is None else min(self.min_used, call_bytes)
+        self.max_used = max(self.max_used, call_bytes)
+        bucket = 1 << max(0, call_bytes.bit_length() - 1)
+        self.size_histogram[bucket] = self.size_histogram.get(bucket, 0) + 1
+
+        now = time.monotonic()
+        if latency_s > self.target_latency_s:
+            # Calls issued before the last cut were sized for the old value; don't cut twice for them
+            if now - latency_s >= self._last_decrease:
+                self.current_bytes = max(self.min_bytes, int(self.current_bytes * self.decrease_factor))
+                self.increase_bytes = max(self.min_bytes, self.current_bytes // 8)
+                self._slow_start = False
+                self._last_decrease = now
+                self.decreases += 1
+        elif call_bytes >= self.current_bytes * self.decrease_factor:
+            # Only calls that actually used the current budget say something about it
+            if self._slow_start:
+                self.current_bytes = min(self.max_bytes, self.current_bytes * 2)
+            else:
+                self.current_bytes = min(self.max_bytes, self.current_bytes + self.increase_bytes)
+
+    def summary(self) -> dict:
+        return {
+            "target_latency_ms": self.target_latency_s * 1000,
+            "calls": self.calls,
+            "initial_call_bytes": self.initial_bytes,
+            "final_call_bytes": self.current_bytes,
+            "min_call_bytes": self.min_used or 0,
+            "max_call_bytes": self.max_used,
+            "mean_call_bytes": self.bytes_total // self.calls if self.calls else 0,
+            "decreases": self.decreases,
+            "size_histogram": dict(sorted(self.size_histogram.items())),
+        }
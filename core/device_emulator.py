@@ -0,0 +1,282 @@
+# trimvision/core/device_emulator.py
+# Emulated block device for exercising the whole TRIM path without hardware.
+#
+# An emulated device is a sparse image file plus a metadata file next to it
+# (<image>.emu.json) holding the device's discard limits, injected faults and its
+# state. Device paths of the form "emu:<image>" are opened by
+# trim_helpers.open_backend() as an EmulatedDeviceBackend, which:
+#   - rejects calls that break the limits with EINVAL, as a real DSM/BLKDISCARD
+#     call would, and counts them as violations: more ranges than
+#     max_ranges_per_call, a range longer than max_range_bytes, a start or length
+#     that is not a multiple of alignment_bytes, a range past the end;
+#   - deallocates only the whole granularity_bytes granules inside each range
+#     (partial granules keep their data, like on a real drive);
+#   - adds latency to, or fails with a chosen errno, every call that touches a
+#     configured LBA region (plus an optional latency for every call);
+#   - punches the deallocated granules out of the image, so they read back as
+#     zeroes (unless read_zero_after_trim is off), which unzeroed() verifies.
+# Without injected latency it discards at the speed of fallocate().
+
+import os
+import sys
+import json
+import time
+import errno
+import threading
+import numpy as np
+from trimvision import config
+from trimvision.core import trim_helpers
+from trimvision.core.extents import ExtentSet
+from trimvision.core.logger import logger
+
+EMULATOR_PREFIX = "emu:"
+
+# Device description written by create(); any key may be overridden
+DEFAULT_SETTINGS = {
+    "model": "Emulated SSD",
+    "serial_number": "EMU-0001",
+    "sector_size": config.DEFAULT_SECTOR_SIZE,
+    "max_ranges_per_call": config.MAX_DSM_RANGES_PER_CALL,
+    "max_range_bytes": 0, # 0 = no per-range limit
+    "granularity_bytes": 4096,
+    "alignment_bytes": config.DEFAULT_SECTOR_SIZE,
+    "read_zero_after_trim": True, # Deallocated LBAs read as zeroes (DRAT/RZAT)
+    "latency_ms": 0.0, # Added to every call
+    # {"start_lba", "length_lba", "latency_ms" (optional), "error" (errno name, optional)}
+    "regions": [],
+}
+
+
+def is_emulated(device_path: str) -> bool:
+    return str(device_path).startswith(EMULATOR_PREFIX)
+
+
+def image_path(device_path: str) -> str:
+    """File holding the data of a device path: the image of an emulated device, else the path itself."""
+    return device_path[len(EMULATOR_PREFIX):] if is_emulated(device_path) else device_path
+
+
+def metadata_path(image: str) -> str:
+    return image + ".emu.json"
+
+
+class EmulatedDevice:
+    """Settings and state of an emulated device; thread-safe recording of discard calls."""
+    def __init__(self, image: str, settings: dict = None, state: dict = None):
+        self.image = image
+        self.size_bytes = os.path.getsize(image)
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        state = state or {}
+        self.calls = state.get("calls", 0)
+        self.failed_calls = state.get("failed_calls", 0)
+        self.violations = state.get("violations", 0)
+        self.violation_log = state.get("violation_log", []) # Most recent violations, for diagnosis
+        self._deallocated = [tuple(r) for r in state.get("deallocated", [])] # Granule-aligned LBA ranges
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, image: str, size_bytes: int, **settings) -> "EmulatedDevice":
+        """Creates (or resets) a sparse image of size_bytes and its metadata."""
+        with open(image, "wb") as f:
+            f.truncate(size_bytes)
+        device = cls(image, settings)
+        device.save()
+        return device
+
+    @classmethod
+    def load(cls, image: str) -> "EmulatedDevice":
+        try:
+            with open(metadata_path(image), "r", encoding="utf-8") as f:
+                document = json.load(f)
+        except FileNotFoundError:
+            raise OSError(errno.ENODEV, f"{image} is not an emulated device (no {metadata_path(image)})")
+        except ValueError as e:
+            raise OSError(errno.EIO, f"Unreadable emulated device metadata {metadata_path(image)}: {e}")
+        return cls(image, document.get("settings"), document.get("state"))
+
+    def save(self):
+        document = {"settings": self.settings,
+                    "state": {"calls": self.calls, "failed_calls": self.failed_calls,
+                              "violations": self.violations, "violation_log": self.violation_log[-100:],
+                              "deallocated": self.deallocated.to_ranges()}}
+        path = metadata_path(self.image)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=1)
+        os.replace(path + ".tmp", path)
+
+    @property
+    def sector_size(self) -> int:
+        return self.settings["sector_size"]
+
+    @property
+    def total_lba(self) -> int:
+        return self.size_bytes // self.sector_size
+
+    @property
+    def granularity_lba(self) -> int:
+        return max(1, self.settings["granularity_bytes"] // self.sector_size)
+
+    @property
+    def deallocated(self) -> ExtentSet:
+        """LBAs deallocated by discards so far."""
+        with self._lock:
+            merged = ExtentSet.from_ranges(self._deallocated)
+            self._deallocated = merged.to_ranges()
+        return merged
+
+    def check_call(self, ranges):
+        """Raises OSError(EINVAL) if the call breaks one of the device's limits."""
+        s = self.settings
+        problem = None
+        align_lba = max(1, s["alignment_bytes"] // self.sector_size)
+        max_range_lba = s["max_range_bytes"] // self.sector_size if s["max_range_bytes"] else None
+        total_lba = self.total_lba
+        if len(ranges) > s["max_ranges_per_call"]:
+            problem = f"{len(ranges)} ranges in one call (limit {s['max_ranges_per_call']})"
+        else:
+            for start, length in ranges:
+                if length <= 0 or start < 0 or start + length > total_lba:
+                    problem = f"range ({start}, {length}) outside the device ({total_lba} LBAs)"
+                elif max_range_lba and length > max_range_lba:
+                    problem = f"range ({start}, {length}) longer than {s['max_range_bytes']} bytes"
+                elif start % align_lba or length % align_lba:
+                    problem = f"range ({start}, {length}) not aligned to {s['alignment_bytes']} bytes"
+                if problem:
+                    break
+        if problem:
+            with self._lock:
+                self.calls += 1
+                self.failed_calls += 1
+                self.violations += 1
+                self.violation_log.append(problem)
+            logger.warning(f"Discard limit violation on {self.image}: {problem}")
+            raise OSError(errno.EINVAL, f"Emulated device rejected the discard: {problem}")
+
+    def region_effects(self, ranges):
+        """(latency in seconds, errno or None) of a call touching these ranges."""
+        latency_s = self.settings["latency_ms"] / 1000
+        error = None
+        for region in self.settings["regions"]:
+            region_start, region_end = region["start_lba"], region["start_lba"] + region["length_lba"]
+            if any(start < region_end and region_start < start + length for start, length in ranges):
+                latency_s += region.get("latency_ms", 0) / 1000
+                if region.get("error"):
+                    error = getattr(errno, region["error"], errno.EIO)
+        return latency_s, error
+
+    def granules(self, ranges):
+        """The whole granules inside each range: what the device actually deallocates."""
+        g = self.granularity_lba
+        aligned = []
+        for start, length in ranges:
+            first, end = -(-start // g) * g, (start + length) // g * g
+            if end > first:
+                aligned.append((first, end - first))
+        return aligned
+
+    def record(self, deallocated, ok: bool):
+        with self._lock:
+            self.calls += 1
+            if ok:
+                self._deallocated.extend(deallocated)
+            else:
+                self.failed_calls += 1
+
+    def unzeroed(self, ranges=None) -> ExtentSet:
+        """LBAs inside ranges (default: everything deallocated) that do not read back as zeroes."""
+        ranges = self.deallocated.to_ranges() if ranges is None else ranges
+        ss = self.sector_size
+        bad = []
+        with open(self.image, "rb") as f:
+            for start, length in ranges:
+                for offset, size in _data_segments(f.fileno(), start * ss, length * ss):
+                    for piece in range(offset, offset + size, 1 << 20):
+                        f.seek(piece)
+                        data = f.read(min(1 << 20, offset + size - piece))
+                        sectors = np.frombuffer(data, dtype=np.uint8)[:len(data) // ss * ss].reshape(-1, ss)
+                        nonzero = np.flatnonzero(sectors.any(axis=1))
+                        bad.extend((piece // ss + int(i), 1) for i in nonzero)
+        return ExtentSet.from_ranges(bad)
+
+
+def _data_segments(fd: int, offset: int, length: int):
+    """(offset, size) pieces of [offset, offset + length) that hold data; holes are skipped when the OS can tell."""
+    end = offset + length
+    if not hasattr(os, "SEEK_DATA"):
+        yield offset, length
+        return
+    position = offset
+    while position < end:
+        try:
+            data = os.lseek(fd, position, os.SEEK_DATA)
+        except OSError: # ENXIO: only a hole remains
+            return
+        if data >= end:
+            return
+        hole = min(os.lseek(fd, data, os.SEEK_HOLE), end)
+        yield data, hole - data
+        position = hole
+
+
+class EmulatedDeviceBackend(trim_helpers.DiscardBackend):
+    """Discard backend of an "emu:<image>" device path, enforcing the emulated device's limits."""
+    name = "emulated"
+
+    def __init__(self, device_path, **kwargs):
+        super().__init__(device_path, **kwargs)
+        self.data_path = image_path(device_path)
+        self.device = None
+        self._image = None
+
+    def open(self):
+        self.device = EmulatedDevice.load(image_path(self.device_path))
+        s = self.device.settings
+        self.sector_size = self.device.sector_size
+        self.max_ranges_per_call = s["max_ranges_per_call"]
+        self.max_range_lba = s["max_range_bytes"] // self.sector_size if s["max_range_bytes"] else None
+        self.granularity_lba = self.device.granularity_lba
+        self.read_zero_after_trim = bool(s["read_zero_after_trim"])
+        if sys.platform.startswith("linux"):
+            self._image = trim_helpers.SparseFileBackend(self.device.image, sector_size=self.sector_size)
+            self._image.open()
+        else:
+            self._image = open(self.device.image, "r+b")
+
+    def close(self):
+        if self._image is not None:
+            self._image.close()
+            self._image = None
+        if self.device is not None:
+            self.device.save()
+
+    def size_bytes(self):
+        return self.device.size_bytes
+
+    def discard(self, ranges):
+        ranges = list(ranges)
+        self.device.check_call(ranges)
+        latency_s, error = self.device.region_effects(ranges)
+        if latency_s:
+            time.sleep(latency_s)
+        if error is not None:
+            self.device.record((), ok=False)
+            raise OSError(error, f"Emulated {errno.errorcode.get(error, error)} in a faulty region")
+        deallocated = self.device.granules(ranges)
+        if self.device.settings["read_zero_after_trim"] and deallocated:
+            self._zero(deallocated)
+        self.device.record(deallocated, ok=True)
+
+    def _zero(self, ranges):
+        if isinstance(self._image, trim_helpers.SparseFileBackend):
+            self._image.discard(ranges) # Punched holes read as zeroes
+            return
+        zeroes = bytes(1 << 20)
+        with self.device._lock: # One shared file object
+            for start, length in ranges:
+                self._image.seek(start * self.sector_size)
+                remaining = length * self.sector_size
+                while remaining > 0:
+                    remaining -= self._image.write(zeroes[:min(remaining, len(zeroes))])
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.device_path} sector={self.sector_size}>"
@@ -0,0 +1,159 @@
+# trimvision/core/discard_dispatcher.py
+# Multi-queue discard submission.
+#
+# A pool of submitter threads pulls range batches from a shared work queue and
+# issues them to the backend concurrently, so NVMe drives see several discards
+# in flight. Completions are handed back, in completion order, to the single
+# consumer thread (the TrimWorker) which owns all signalling. Batches not yet
+# issued can be withdrawn, so a pause or cancel only waits for the calls already
+# on the device.
+
+import queue
+import threading
+import time
+from trimvision import config
+from trimvision.core.logger import logger
+
+
+def _lba_count(batch) -> int:
+    return sum(length for _, length in batch)
+
+
+class DiscardCompletion:
+    """Result of one discard call."""
+    __slots__ = ("tag", "batch", "ok", "error", "latency")
+
+    def __init__(self, tag, batch, ok, error, latency):
+        self.tag = tag
+        self.batch = batch
+        self.ok = ok
+        self.error = error
+        self.latency = latency # seconds spent in backend.discard()
+
+    @property
+    def lba_count(self) -> int:
+        return _lba_count(self.batch)
+
+
+class DiscardDispatcher:
+    """
+    Runs queue_depth submitter threads against one backend.
+    submit() and get_completion() must be called from the same (consumer) thread;
+    in_flight counts batches submitted but not yet collected, lba_in_flight their LBAs.
+    """
+    def __init__(self, backend, queue_depth: int = config.TRIM_QUEUE_DEPTH):
+        self.backend = backend
+        self.queue_depth = max(1, int(queue_depth))
+        self.in_flight = 0
+        self.lba_in_flight = 0
+        self._work = queue.Queue()
+        self._done = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._holding = False # Between withdraw() and release(): batches are taken back rather than issued
+        self._returned = [] # Taken back by submitter threads while holding
+
+    def start(self):
+        for i in range(self.queue_depth):
+            thread = threading.Thread(target=self._submitter_loop, name=f"discard-q{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.debug(f"Discard dispatcher started with queue depth {self.queue_depth} on {self.backend}")
+
+    def close(self):
+        """Stops the submitter threads after the queued work has been issued."""
+        for _ in self._threads:
+            self._work.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    @property
+    def window(self) -> int:
+        """Batches to keep queued so no submitter thread waits for work."""
+        return self.queue_depth * 2
+
+    def submit(self, batch, tag=None):
+        self.in_flight += 1
+        self.lba_in_flight += _lba_count(batch)
+        self._work.put((batch, tag))
+
+    def get_completion(self, timeout: float = None):
+        """Returns the next DiscardCompletion, or None if none arrived within timeout (or on wake())."""
+        try:
+            completion = self._done.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if completion is not None:
+            self.in_flight -= 1
+            self.lba_in_flight -= completion.lba_count
+        return completion
+
+    def wake(self):
+        """Makes a pending or the next get_completion() return None; may be called from any thread."""
+        self._done.put(None)
+
+    def withdraw(self):
+        """
+        Takes back the (batch, tag) items not issued yet and holds back any submitted
+        until release(). A submitter thread that already took an item returns it and
+        wakes the consumer, so call again on every wake-up while holding.
+        """
+        with self._lock:
+            self._holding = True
+            withdrawn, self._returned = self._returned, []
+        while True:
+            try:
+                withdrawn.append(self._work.get_nowait())
+            except queue.Empty:
+                break
+        self._forget(withdrawn)
+        return withdrawn
+
+    def release(self):
+        """Issues batches again after withdraw(); returns the items taken back since, to submit again."""
+        with self._lock:
+            self._holding = False
+            returned, self._returned = self._returned, []
+        self._forget(returned)
+        return returned
+
+    def _forget(self, items):
+        self.in_flight -= len(items)
+        self.lba_in_flight -= sum(_lba_count(batch) for batch, _ in items)
+
+    def drain(self):
+        """Yields the completions of everything still in flight."""
+        while self.in_flight > 0:
+            completion = self.get_completion()
+            if completion is not None:
+                yield completion
+
+    def _submitter_loop(self):
+        while True:
+            item = self._work.get()
+            if item is None:
+                return
+            with self._lock:
+                if self._holding:
+                    self._returned.append(item)
+                    item = None
+            if item is None:
+                self._done.put(None) # Wake the consumer to collect it
+                continue
+            batch, tag = item
+            start = time.perf_counter()
+            try:
+                self.backend.discard(batch)
+                ok, error = True, None
+            except Exception as e: # Any failure must still produce a completion
+                ok, error = False, e
+            self._done.put(DiscardCompletion(tag, batch, ok, error, time.perf_counter() - start))
@@ -0,0 +1,36 @@
+# trimvision/core/drive_discovery.py
+
+import time
+import contextlib
+from PyQt6.QtCore import QThread, pyqtSignal
+from trimvision.core.logger import logger
+from trimvision.core.drive_manager import iter_detailed_drive_info, com_apartment, DriveProvider
+
+class DriveDiscoveryWorker(QThread):
+    """
+    Enumerates drives off the UI thread and streams each drive suitable for TRIM
+    as soon as the provider has classified it.
+    """
+    # drive_found(DriveInfo drive)
+    drive_found = pyqtSignal(object)
+    # discovery_finished(int drives_found, float seconds)
+    discovery_finished = pyqtSignal(int, float)
+
+    def __init__(self, provider: DriveProvider = None, parent=None):
+        super().__init__(parent)
+        self.provider = provider
+
+    def run(self):
+        start = time.perf_counter()
+        found = 0
+        try:
+            # WMI is COM; every thread using it needs its own apartment, released after the scan
+            with com_apartment(), contextlib.closing(iter_detailed_drive_info(self.provider)) as drives:
+                for drive in drives:
+                    if self.isInterruptionRequested():
+                        logger.info("Drive discovery interrupted.")
+                        break
+                    found += 1
+                    self.drive_found.emit(drive)
+        finally:
+            self.discovery_finished.emit(found, time.perf_counter() - start)
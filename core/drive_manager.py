@@ -1,10 +1,22 @@
 # trimvision/core/drive_manager.py
+# Drive enumeration.
+#
+# A DriveProvider lists every disk of the machine in a few bulk queries: on Windows
+# one WMI connection (Win32_DiskDrive plus one partition -> drive letter query) and
+# at most one PowerShell process for all disks, skipped entirely while the persistent
+# probe cache holds every disk; on Linux /sys/block, /proc/partitions and /proc/mounts.
+# get_detailed_drive_info() keeps the disks suitable for TRIM.
 
-import wmi
-import psutil
+import os
+import re
+import sys
+import contextlib
+import json       # For PowerShell output and the probe cache
+import time
 import subprocess # For PowerShell
-import json       # For PowerShell output
+from trimvision import config
 from trimvision.core.logger import logger # Assuming logger is in trimvision.core
+from trimvision.utils.app_paths import data_dir
 
 class DriveInfo:
     def __init__(self, model, serial_number, firmware_version, capacity_gb,
@@ -55,117 +67,378 @@ class DriveInfo:
 
         return f"{self.model} ({type_str}, {self.capacity_gb:.2f} GB) - {self.drive_letter or self.device_id_wmi}"
 
-def get_powershell_disk_info(physical_disk_index):
+def classify_drive(model, interface_type_wmi, media_type_wmi, ps_media_type, ps_bus_type):
+    """Returns (is_ssd, is_nvme), trusting PowerShell's MediaType/BusType and falling back to WMI/model."""
+    is_ssd = is_nvme = False
+    if ps_media_type and ps_media_type != "N/A":
+        if ps_media_type.upper() in ["SSD", "SCM"]: is_ssd = True
+        if ps_bus_type and ps_bus_type.upper() == "NVME":
+            is_nvme = True
+            is_ssd = True # NVMe is always SSD
+        logger.debug(f"Drive {model}: PS_MediaType='{ps_media_type}', PS_BusType='{ps_bus_type}'. Deduced: is_ssd={is_ssd}, is_nvme={is_nvme}")
+    else: # Fallback if PowerShell fails
+        logger.debug(f"Drive {model}: PowerShell check failed/NA. Falling back to WMI/model.")
+        if "nvme" in model.lower() or (interface_type_wmi or "").upper() == "NVME":
+            is_nvme = True
+            is_ssd = True
+        if not is_ssd and media_type_wmi in [4, 5]: is_ssd = True # WMI MediaType 4:SSD, 5:SCM
+        if not is_ssd and "ssd" in model.lower(): is_ssd = True
+    return is_ssd, is_nvme
+
+
+class DriveProbeCache:
+    """
+    Persistent cache of slow per-disk probe results (PowerShell MediaType/BusType and the
+    SSD/NVMe classification), keyed by serial number and firmware revision. Entries expire
+    after ttl_s so a re-provisioned drive is eventually probed again.
+    """
+    def __init__(self, path: str = None, ttl_s: float = config.DRIVE_CACHE_TTL_S):
+        self.path = path or os.path.join(data_dir(config.DRIVE_CACHE_DIR), "drive_probes.json")
+        self.ttl_s = ttl_s
+        self._entries = {}
+        self._dirty = False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable drive probe cache {self.path}: {e}")
+
+    @staticmethod
+    def key(serial_number, firmware_version):
+        if serial_number in (None, "", "N/A"):
+            return None # Nothing stable to key on; always probe
+        return f"{serial_number}|{firmware_version or 'N/A'}"
+
+    def get(self, serial_number, firmware_version):
+        entry = self._entries.get(self.key(serial_number, firmware_version))
+        if entry is None or time.time() - entry.get("cached_at", 0) > self.ttl_s:
+            return None
+        return entry
+
+    def put(self, serial_number, firmware_version, **fields):
+        key = self.key(serial_number, firmware_version)
+        if key is not None:
+            self._entries[key] = dict(fields, cached_at=time.time())
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, indent=1)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError as e:
+            logger.warning(f"Could not save drive probe cache {self.path}: {e}")
+
+
+class DriveProvider:
+    """Lists all disks of the machine as DriveInfo objects, SSD or not."""
+    name = "none"
+
+    def iter_drives(self):
+        """Yields each disk as soon as it is classified."""
+        raise NotImplementedError
+
+    def list_drives(self):
+        return list(self.iter_drives())
+
+    def probe(self, device_path: str):
+        """Re-reads a single disk by its device path; None if it is gone."""
+        raise NotImplementedError
+
+
+# Get-PhysicalDisk reports these as enum names; older PowerShell versions may emit the raw codes
+_PS_MEDIA_TYPES = {0: "Unspecified", 3: "HDD", 4: "SSD", 5: "SCM"}
+_PS_BUS_TYPES = {1: "SCSI", 3: "ATA", 7: "USB", 8: "RAID", 10: "SAS", 11: "SATA", 12: "SD", 17: "NVMe"}
+
+
+def get_powershell_disks_info(timeout_s: float = config.DRIVE_PROBE_TIMEOUT_S):
+    """(MediaType, BusType) of every physical disk, by disk number, from a single PowerShell process."""
     try:
         command = [
             "powershell", "-NoProfile", "-ExecutionPolicy", "Bypass", "-Command",
-            f"Get-PhysicalDisk -DeviceNumber {physical_disk_index} | Select-Object MediaType, BusType | ConvertTo-Json -Compress"
+            "Get-PhysicalDisk | Select-Object DeviceId, MediaType, BusType | ConvertTo-Json -Compress"
         ]
-        result = subprocess.run(command, capture_output=True, text=True, check=False, creationflags=subprocess.CREATE_NO_WINDOW)
-
-        if result.returncode == 0 and result.stdout:
+        result = subprocess.run(command, capture_output=True, text=True, check=False, timeout=timeout_s,
+                                creationflags=subprocess.CREATE_NO_WINDOW)
+        if result.returncode != 0 or not result.stdout:
+            logger.warning(f"PS Get-PhysicalDisk failed. RC: {result.returncode}. Stderr: {result.stderr}")
+            return {}
+        try:
+            disks_data = json.loads(result.stdout)
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON decode error for PS output: {e}\nOutput: {result.stdout}")
+            return {}
+        if isinstance(disks_data, dict): disks_data = [disks_data] # A single disk is not wrapped in a list
+        info = {}
+        for disk_data in disks_data:
             try:
-                disk_data = json.loads(result.stdout)
-                if isinstance(disk_data, list) and len(disk_data) > 0: disk_data = disk_data[0]
-                elif not isinstance(disk_data, dict): return None, None
-                
-                ps_media_type = disk_data.get("MediaType")
-                ps_bus_type = disk_data.get("BusType")
-                logger.debug(f"PS info for disk idx {physical_disk_index}: MediaType={ps_media_type}, BusType={ps_bus_type}")
-                return ps_media_type, ps_bus_type
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error for PS output (disk {physical_disk_index}): {e}\nOutput: {result.stdout}")
-                return None, None
-        else:
-            logger.warning(f"PS command failed for disk {physical_disk_index}. RC: {result.returncode}. Stderr: {result.stderr}")
-            return None, None
+                index = int(disk_data.get("DeviceId"))
+            except (TypeError, ValueError):
+                continue
+            media_type = disk_data.get("MediaType")
+            bus_type = disk_data.get("BusType")
+            info[index] = (_PS_MEDIA_TYPES.get(media_type, media_type) if media_type is not None else None,
+                           _PS_BUS_TYPES.get(bus_type, bus_type) if bus_type is not None else None)
+            logger.debug(f"PS info for disk idx {index}: MediaType={info[index][0]}, BusType={info[index][1]}")
+        return info
     except FileNotFoundError:
         logger.error("PowerShell not found.")
-        return None, None
+        return {}
+    except subprocess.TimeoutExpired:
+        logger.warning(f"PS Get-PhysicalDisk did not answer within {timeout_s:.0f}s; falling back to WMI/model.")
+        return {}
     except Exception as e:
-        logger.error(f"Error running PS Get-PhysicalDisk for idx {physical_disk_index}: {e}")
-        return None, None
+        logger.error(f"Error running PS Get-PhysicalDisk: {e}")
+        return {}
 
-def get_physical_drive_letters(device_id_wmi_param):
-    c = wmi.WMI()
-    drive_letters = []
+
+def get_drive_letters_by_disk(wmi_instance):
+    """Drive letters of every disk, by disk index, from one Win32_LogicalDiskToPartition query."""
+    letters = {}
     try:
-        query = f"ASSOCIATORS OF {{Win32_DiskDrive.DeviceID='{device_id_wmi_param.replace('\\', '\\\\')}'}} WHERE AssocClass = Win32_DiskDriveToDiskPartition"
-        for partition in c.query(query):
-            query2 = f"ASSOCIATORS OF {{Win32_DiskPartition.DeviceID='{partition.DeviceID}'}} WHERE AssocClass = Win32_LogicalDiskToPartition"
-            for logical_disk in c.query(query2):
-                drive_letters.append(logical_disk.DeviceID)
+        for link in wmi_instance.query("SELECT Antecedent, Dependent FROM Win32_LogicalDiskToPartition"):
+            # Read the raw object paths; dereferencing them would cost a WMI round trip each.
+            # Antecedent: ...Win32_DiskPartition.DeviceID="Disk #0, Partition #1"
+            # Dependent:  ...Win32_LogicalDisk.DeviceID="C:"
+            partition = link.ole_object.Properties_("Antecedent").Value
+            logical_disk = link.ole_object.Properties_("Dependent").Value
+            disk = re.search(r'Disk #(\d+)', partition)
+            letter = re.search(r'DeviceID="([^"]+)"', logical_disk)
+            if disk and letter:
+                letters.setdefault(int(disk.group(1)), set()).add(letter.group(1))
     except Exception as e: # Catching WMI specific errors might be better if known
-        logger.error(f"Error getting drive letters for {device_id_wmi_param}: {e} (Code: {getattr(e, 'hresult', 'N/A')})")
-    return sorted(list(set(drive_letters)))
+        logger.error(f"Error getting drive letters: {e} (Code: {getattr(e, 'hresult', 'N/A')})")
+    return {index: sorted(disk_letters) for index, disk_letters in letters.items()}
 
 
-def get_detailed_drive_info():
-    logger.info("Scanning for drives using WMI and PowerShell...")
-    drives_list = []
-    try:
+class WindowsDriveProvider(DriveProvider):
+    """WMI + PowerShell enumeration, with the slow PowerShell probe behind a DriveProbeCache."""
+    name = "wmi"
+
+    def __init__(self, cache: DriveProbeCache = None):
+        self.cache = cache
+
+    def iter_drives(self, where: str = ""):
+        import wmi # Windows-only dependency, imported where it is needed
         wmi_instance = wmi.WMI()
-        for disk_wmi in wmi_instance.Win32_DiskDrive():
-            model = getattr(disk_wmi, 'Model', 'N/A')
+        disks = wmi_instance.query("SELECT Model, SerialNumber, FirmwareRevision, Size, DeviceID, Index, "
+                                   f"InterfaceType, MediaType FROM Win32_DiskDrive {where}")
+        letters = get_drive_letters_by_disk(wmi_instance)
+        try:
+            yield from self._classify_disks(disks, letters)
+        finally:
+            if self.cache:
+                self.cache.save()
+
+    def probe(self, device_path: str):
+        index = re.search(r'PHYSICALDRIVE(\d+)', device_path.upper())
+        if index is None:
+            return None
+        return next(iter(self.iter_drives(f"WHERE Index = {int(index.group(1))}")), None)
+
+    def _classify_disks(self, disks, letters):
+        probes = None # PowerShell results, fetched once for all disks on the first cache miss
+        for disk_wmi in disks:
+            model = getattr(disk_wmi, 'Model', None) or 'N/A'
             serial_number = getattr(disk_wmi, 'SerialNumber', 'N/A').strip() if getattr(disk_wmi, 'SerialNumber', None) else 'N/A'
-            firmware_version = getattr(disk_wmi, 'FirmwareRevision', 'N/A').strip()
-            capacity_bytes = int(getattr(disk_wmi, 'Size', 0))
+            firmware_version = (getattr(disk_wmi, 'FirmwareRevision', None) or 'N/A').strip()
+            capacity_bytes = int(getattr(disk_wmi, 'Size', 0) or 0)
             capacity_gb = capacity_bytes / (1024**3) if capacity_bytes else 0
-            
+
             # This is the WMI path like \\.\PHYSICALDRIVE0
             current_device_id_wmi = getattr(disk_wmi, 'DeviceID', 'N/A')
             # This is the index like 0, 1, ...
             physical_disk_index = getattr(disk_wmi, 'Index', None)
-            
-            interface_type_wmi_val = getattr(disk_wmi, 'InterfaceType', 'N/A')
-            media_type_wmi_raw = getattr(disk_wmi, 'MediaType', None)
-
-            is_ssd_final = False
-            is_nvme_final = False
-            ps_media_type_res = "N/A"
-            ps_bus_type_res = "N/A"
+            interface_type_wmi_val = getattr(disk_wmi, 'InterfaceType', None) or 'N/A'
 
-            if physical_disk_index is not None:
-                ps_media_type_res, ps_bus_type_res = get_powershell_disk_info(physical_disk_index)
+            cached = self.cache.get(serial_number, firmware_version) if self.cache else None
+            if cached is not None:
+                ps_media_type_res, ps_bus_type_res = cached["ps_media_type"], cached["ps_bus_type"]
+                is_ssd, is_nvme = cached["is_ssd"], cached["is_nvme"]
+                logger.debug(f"Drive {model}: using cached probe results")
             else:
-                logger.warning(f"Could not get WMI disk Index for {model} ({current_device_id_wmi}). Skipping PowerShell check.")
-
-            if ps_media_type_res and ps_media_type_res != "N/A":
-                if ps_media_type_res.upper() in ["SSD", "SCM"]: is_ssd_final = True
-                if ps_bus_type_res and ps_bus_type_res.upper() == "NVME":
-                    is_nvme_final = True
-                    is_ssd_final = True # NVMe is always SSD
-                logger.debug(f"Drive {model}: PS_MediaType='{ps_media_type_res}', PS_BusType='{ps_bus_type_res}'. Deduced: is_ssd={is_ssd_final}, is_nvme={is_nvme_final}")
-            else: # Fallback if PowerShell fails
-                logger.debug(f"Drive {model}: PowerShell check failed/NA. Falling back to WMI/model.")
-                if "nvme" in model.lower() or interface_type_wmi_val.upper() == "NVME":
-                    is_nvme_final = True
-                    is_ssd_final = True
-                if not is_ssd_final and media_type_wmi_raw in [4, 5]: is_ssd_final = True # WMI MediaType 4:SSD, 5:SCM
-                if not is_ssd_final and "ssd" in model.lower(): is_ssd_final = True
-            
-            if not is_ssd_final:
-                logger.info(f"Skipping non-SSD drive: {model} (DevID: {current_device_id_wmi}, PS_MediaType: {ps_media_type_res or 'N/A'})")
-                continue
+                ps_media_type_res = ps_bus_type_res = "N/A"
+                if physical_disk_index is not None:
+                    if probes is None:
+                        probes = get_powershell_disks_info()
+                    ps_media_type_res, ps_bus_type_res = probes.get(physical_disk_index, (None, None))
+                else:
+                    logger.warning(f"Could not get WMI disk Index for {model} ({current_device_id_wmi}). Skipping PowerShell check.")
+                is_ssd, is_nvme = classify_drive(model, interface_type_wmi_val, getattr(disk_wmi, 'MediaType', None),
+                                                 ps_media_type_res, ps_bus_type_res)
+                if ps_media_type_res and ps_media_type_res != "N/A" and self.cache:
+                    # Only a real PowerShell answer is worth keeping; fallbacks are re-probed next time
+                    self.cache.put(serial_number, firmware_version, ps_media_type=ps_media_type_res,
+                                   ps_bus_type=ps_bus_type_res, is_ssd=is_ssd, is_nvme=is_nvme)
 
-            drive_letters_str = ", ".join(get_physical_drive_letters(current_device_id_wmi))
-
-            drive_obj = DriveInfo(
+            yield DriveInfo(
                 model=model, serial_number=serial_number, firmware_version=firmware_version,
                 capacity_gb=capacity_gb, device_id_wmi=current_device_id_wmi,
                 physical_disk_index=physical_disk_index, interface_type_wmi=interface_type_wmi_val,
-                drive_letter=drive_letters_str, is_ssd=is_ssd_final, is_nvme=is_nvme_final,
-                ps_media_type=ps_media_type_res, ps_bus_type=ps_bus_type_res
+                drive_letter=", ".join(letters.get(physical_disk_index, [])), is_ssd=is_ssd, is_nvme=is_nvme,
+                ps_media_type=ps_media_type_res or "N/A", ps_bus_type=ps_bus_type_res or "N/A"
             )
-            drives_list.append(drive_obj)
-            logger.info(f"Kept SSD Drive: {drive_obj}")
 
+
+class LinuxDriveProvider(DriveProvider):
+    """
+    Reads /sys/block, /proc/partitions and /proc/mounts. root relocates those paths,
+    so a captured or synthetic tree can be enumerated without the real devices.
+    Mount points take the place of drive letters.
+    """
+    name = "sysfs"
+    # Block devices that are not physical disks
+    VIRTUAL_PREFIXES = ("loop", "ram", "zram", "dm-", "md", "sr", "fd", "nbd")
+
+    def __init__(self, root: str = "/"):
+        self.root = root
+
+    def _path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def _read(self, *parts, default="N/A"):
+        try:
+            with open(self._path(*parts), "r", encoding="utf-8", errors="replace") as f:
+                return f.read().strip() or default
+        except OSError:
+            return default
+
+    def _partitions(self):
+        """Block device names listed in /proc/partitions."""
+        names = []
+        try:
+            with open(self._path("proc", "partitions"), "r") as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) == 4 and fields[0].isdigit():
+                        names.append(fields[3])
+        except OSError as e:
+            logger.warning(f"Cannot read /proc/partitions: {e}")
+        return names
+
+    def _mounts(self):
+        """Mount points by device name."""
+        mounts = {}
+        try:
+            with open(self._path("proc", "mounts"), "r") as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) >= 2 and fields[0].startswith("/dev/"):
+                        # /proc/mounts escapes spaces in paths as \040
+                        mounts.setdefault(os.path.basename(fields[0]), []).append(fields[1].replace("\\040", " "))
+        except OSError as e:
+            logger.warning(f"Cannot read /proc/mounts: {e}")
+        return mounts
+
+    def _bus_type(self, name: str) -> str:
+        if name.startswith("nvme"):
+            return "NVMe"
+        device_path = os.path.realpath(self._path("sys", "block", name))
+        for marker, bus_type in (("/usb", "USB"), ("/ata", "SATA"), ("virtio", "Virtio"), ("/mmc", "SD")):
+            if marker in device_path:
+                return bus_type
+        return "N/A"
+
+    def _disk_names(self):
+        return sorted(n for n in os.listdir(self._path("sys", "block")) if not n.startswith(self.VIRTUAL_PREFIXES))
+
+    def iter_drives(self):
+        names = self._disk_names()
+        partitions = self._partitions()
+        mounts = self._mounts()
+        for index, name in enumerate(names):
+            yield self._read_disk(name, index, partitions, mounts)
+
+    def probe(self, device_path: str):
+        name = os.path.basename(device_path)
+        names = self._disk_names()
+        if name not in names:
+            return None
+        return self._read_disk(name, names.index(name), self._partitions(), self._mounts())
+
+    def _read_disk(self, name: str, index: int, partitions, mounts):
+        model = self._read("sys", "block", name, "device", "model")
+        serial_number = self._read("sys", "block", name, "device", "serial")
+        if serial_number == "N/A":
+            serial_number = self._read("sys", "block", name, "device", "wwid")
+        firmware_version = self._read("sys", "block", name, "device", "firmware_rev")
+        if firmware_version == "N/A":
+            firmware_version = self._read("sys", "block", name, "device", "rev")
+        try:
+            capacity_bytes = int(self._read("sys", "block", name, "size", default="0")) * 512 # Always 512 B units
+        except ValueError:
+            capacity_bytes = 0
+        rotational = self._read("sys", "block", name, "queue", "rotational", default="1") == "1"
+        discard_max = self._read("sys", "block", name, "queue", "discard_max_bytes", default="0")
+        bus_type = self._bus_type(name)
+        is_nvme = bus_type == "NVMe"
+        is_ssd = is_nvme or not rotational
+        if is_ssd and discard_max == "0":
+            logger.info(f"{name} ({model}) does not support discard; not offering it for TRIM")
+            is_ssd = False
+
+        # The disk's own mounts and those of its partitions
+        parts = [name] + [p for p in partitions if p != name and os.path.exists(self._path("sys", "block", name, p))]
+        mount_points = sorted(m for p in parts for m in mounts.get(p, []))
+        return DriveInfo(
+            model=model if model != "N/A" else name, serial_number=serial_number,
+            firmware_version=firmware_version, capacity_gb=capacity_bytes / (1024**3),
+            device_id_wmi=f"/dev/{name}", physical_disk_index=index, interface_type_wmi=bus_type,
+            drive_letter=", ".join(mount_points), is_ssd=is_ssd, is_nvme=is_nvme,
+            ps_media_type="SSD" if not rotational else "HDD", ps_bus_type=bus_type
+        )
+
+
+@contextlib.contextmanager
+def com_apartment():
+    """COM initialization for a thread that talks to WMI (no-op off Windows)."""
+    if sys.platform != "win32":
+        yield
+        return
+    import pythoncom
+    pythoncom.CoInitialize()
+    try:
+        yield
+    finally:
+        pythoncom.CoUninitialize()
+
+
+def default_provider() -> DriveProvider:
+    if sys.platform == "win32":
+        return WindowsDriveProvider(DriveProbeCache() if config.DRIVE_CACHE_ENABLED else None)
+    return LinuxDriveProvider()
+
+
+def iter_detailed_drive_info(provider: DriveProvider = None):
+    """Yields the drives suitable for TRIM one by one, as the provider classifies them."""
+    provider = provider or default_provider()
+    logger.info(f"Scanning for drives ({provider.name})...")
+    scan_start = time.perf_counter()
+    kept = 0
+    try:
+        for drive_obj in provider.iter_drives():
+            if not drive_obj.is_ssd:
+                logger.info(f"Skipping non-SSD drive: {drive_obj.model} (DevID: {drive_obj.device_id_wmi}, PS_MediaType: {drive_obj.ps_media_type or 'N/A'})")
+                continue
+            kept += 1
+            logger.info(f"Kept SSD Drive: {drive_obj}")
+            yield drive_obj
     except Exception as e:
         logger.error(f"General error enumerating drives: {e}", exc_info=True)
+    logger.info(f"Drive scan took {time.perf_counter() - scan_start:.2f}s")
 
-    if not drives_list:
+    if not kept:
         logger.warning("No SSD/NVMe drives suitable for TRIM were detected.")
-    return drives_list
+
+
+def get_detailed_drive_info(provider: DriveProvider = None):
+    return list(iter_detailed_drive_info(provider))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,200 @@
+# trimvision/core/drive_watcher.py
+# Hot-plug watching.
+#
+# A DeviceEventSource reports add/remove/change events of whole disks: kernel
+# uevents over netlink on Linux, WMI instance creation/deletion events on Windows,
+# or a QueueEventSource fed by hand (tests, replays). DriveWatcher debounces the
+# events per disk, re-probes only the disks they name and emits the resulting
+# drive list diffs.
+
+import sys
+import time
+import queue
+import select
+import socket
+from PyQt6.QtCore import QThread, pyqtSignal
+from trimvision import config
+from trimvision.core.logger import logger
+from trimvision.core.drive_manager import DriveProvider, com_apartment, default_provider
+
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+
+
+class DeviceEvent:
+    ADD = "add"
+    REMOVE = "remove"
+    CHANGE = "change"
+
+    __slots__ = ("action", "device")
+
+    def __init__(self, action: str, device: str):
+        self.action = action
+        self.device = device # Device path, as in DriveInfo.device_id_wmi
+
+    def __repr__(self):
+        return f"DeviceEvent({self.action}, {self.device})"
+
+
+class DeviceEventSource:
+    """Blocking feed of DeviceEvents; read() returns what arrived within timeout_s (possibly nothing)."""
+    def read(self, timeout_s: float):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class QueueEventSource(DeviceEventSource):
+    """Events pushed from another thread; drives tests and replays without real devices."""
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def push(self, action: str, device: str):
+        self._queue.put(DeviceEvent(action, device))
+
+    def read(self, timeout_s: float):
+        try:
+            events = [self._queue.get(timeout=timeout_s)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                return events
+
+
+def parse_uevent(message: bytes):
+    """DeviceEvent for a kernel uevent about a block disk or partition, else None."""
+    fields = message.split(b"\0")
+    env = dict(field.decode(errors="replace").split("=", 1) for field in fields[1:] if b"=" in field)
+    if env.get("SUBSYSTEM") != "block" or "DEVNAME" not in env:
+        return None
+    action = env.get("ACTION")
+    if env.get("DEVTYPE") == "partition":
+        # A partition appearing or going away changes its disk (partitions, mounts)
+        disk = env.get("DEVPATH", "").rstrip("/").split("/")[-2:-1]
+        return DeviceEvent(DeviceEvent.CHANGE, f"/dev/{disk[0]}") if disk else None
+    if env.get("DEVTYPE") != "disk":
+        return None
+    if action == "add":
+        return DeviceEvent(DeviceEvent.ADD, f"/dev/{env['DEVNAME']}")
+    if action == "remove":
+        return DeviceEvent(DeviceEvent.REMOVE, f"/dev/{env['DEVNAME']}")
+    if action in ("change", "online", "offline", "move"):
+        return DeviceEvent(DeviceEvent.CHANGE, f"/dev/{env['DEVNAME']}")
+    return None
+
+
+class UeventSource(DeviceEventSource):
+    """Kernel uevents from the NETLINK_KOBJECT_UEVENT socket (Linux)."""
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        self._sock.bind((0, UEVENT_KERNEL_GROUP))
+
+    def read(self, timeout_s: float):
+        events = []
+        ready, _, _ = select.select([self._sock], [], [], timeout_s)
+        while ready:
+            event = parse_uevent(self._sock.recv(65536))
+            if event is not None:
+                events.append(event)
+            ready, _, _ = select.select([self._sock], [], [], 0)
+        return events
+
+    def close(self):
+        self._sock.close()
+
+
+class WmiDiskEventSource(DeviceEventSource):
+    """Win32_DiskDrive creation/deletion events; must be read on the thread that created it."""
+    def __init__(self, poll_s: float = config.DRIVE_WATCH_WMI_POLL_S):
+        import wmi # Windows-only dependency
+        self._timed_out = wmi.x_wmi_timed_out
+        wmi_instance = wmi.WMI()
+        self._watchers = [
+            (DeviceEvent.ADD, wmi_instance.watch_for(notification_type="Creation", wmi_class="Win32_DiskDrive",
+                                                     delay_secs=poll_s)),
+            (DeviceEvent.REMOVE, wmi_instance.watch_for(notification_type="Deletion", wmi_class="Win32_DiskDrive",
+                                                        delay_secs=poll_s)),
+        ]
+
+    def read(self, timeout_s: float):
+        events = []
+        for action, watcher in self._watchers:
+            try:
+                disk = watcher(timeout_ms=max(1, int(timeout_s * 1000 / len(self._watchers))))
+                events.append(DeviceEvent(action, disk.DeviceID))
+            except self._timed_out:
+                pass
+        return events
+
+
+def default_event_source() -> DeviceEventSource:
+    if sys.platform == "win32":
+        return WmiDiskEventSource()
+    if sys.platform.startswith("linux"):
+        return UeventSource()
+    raise OSError(f"No device event source for {sys.platform}")
+
+
+class DriveWatcher(QThread):
+    """
+    Turns device events into drive list diffs. Events are coalesced per disk for
+    debounce_s (a hot-plug produces bursts), then only that disk is probed.
+    """
+    # drive_changed(DriveInfo drive) # Added or updated disk suitable for TRIM
+    drive_changed = pyqtSignal(object)
+    # drive_removed(str device_path) # Disk gone, or no longer suitable for TRIM
+    drive_removed = pyqtSignal(str)
+
+    def __init__(self, provider: DriveProvider = None, source: DeviceEventSource = None,
+                 debounce_s: float = config.DRIVE_WATCH_DEBOUNCE_S, parent=None):
+        super().__init__(parent)
+        self.provider = provider
+        self.source = source
+        self.debounce_s = debounce_s
+
+    def run(self):
+        with com_apartment():
+            try:
+                # Created here: WMI event sources belong to the thread that reads them
+                source = self.source or default_event_source()
+                provider = self.provider or default_provider()
+            except Exception as e:
+                logger.warning(f"Hot-plug watching unavailable: {e}")
+                return
+            logger.info(f"Watching for drive changes ({type(source).__name__})")
+            pending = {} # device path -> (latest action, time it is due)
+            try:
+                while not self.isInterruptionRequested():
+                    now = time.monotonic()
+                    due_in = min((due for _, due in pending.values()), default=now + 0.5) - now
+                    for event in source.read(max(0.0, min(0.5, due_in))):
+                        logger.debug(f"Device event: {event}")
+                        pending[event.device] = (event.action, time.monotonic() + self.debounce_s)
+                    now = time.monotonic()
+                    for device, (action, due) in list(pending.items()):
+                        if due <= now:
+                            del pending[device]
+                            self._apply(provider, device, action)
+            finally:
+                source.close()
+
+    def _apply(self, provider: DriveProvider, device: str, action: str):
+        if action == DeviceEvent.REMOVE:
+            logger.info(f"Drive removed: {device}")
+            self.drive_removed.emit(device)
+            return
+        try:
+            drive = provider.probe(device)
+        except Exception as e:
+            logger.error(f"Error probing {device} after a device event: {e}", exc_info=True)
+            return
+        if drive is None or not drive.is_ssd:
+            logger.info(f"{device} is gone or not an SSD; dropping it from the drive list")
+            self.drive_removed.emit(device)
+        else:
+            logger.info(f"Drive {'added' if action == DeviceEvent.ADD else 'changed'}: {drive}")
+            self.drive_changed.emit(drive)
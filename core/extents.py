@@ -0,0 +1,229 @@
+# trimvision/core/extents.py
+# Sets of LBA extents.
+#
+# An ExtentSet holds sorted, disjoint, coalesced half-open [start, end) extents
+# in two int64 NumPy arrays. Set operations sweep the combined boundaries of
+# both operands in one vectorized pass, O((n + m) log(n + m)), so diffing two
+# free-space maps of millions of extents stays cheap. A RangeStateMap assigns a
+# state code to every LBA of a drive, as runs that split and merge on update.
+
+import bisect
+from array import array
+import numpy as np
+from trimvision.core.progress_channel import STATE_NAMES
+
+
+class ExtentSet:
+    """Immutable set of LBAs stored as coalesced extents."""
+    __slots__ = ("starts", "ends")
+
+    def __init__(self, starts=None, ends=None):
+        # Callers pass already coalesced arrays; use from_ranges() for arbitrary input
+        self.starts = np.zeros(0, dtype=np.int64) if starts is None else np.asarray(starts, dtype=np.int64)
+        self.ends = np.zeros(0, dtype=np.int64) if ends is None else np.asarray(ends, dtype=np.int64)
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """Builds a set from (start_lba, length_lba) ranges in any order, overlapping or not."""
+        ranges = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+        ranges = ranges[ranges[:, 1] > 0]
+        if ranges.size == 0:
+            return cls()
+        order = np.argsort(ranges[:, 0], kind='stable')
+        starts = ranges[order, 0]
+        ends = np.maximum.accumulate(starts + ranges[order, 1])
+        # A new extent begins wherever a start lies beyond every end before it
+        new = np.ones(len(starts), dtype=bool)
+        new[1:] = starts[1:] > ends[:-1]
+        first = np.flatnonzero(new)
+        last = np.append(first[1:] - 1, len(starts) - 1)
+        return cls(starts[first], ends[last])
+
+    def to_ranges(self):
+        """(start_lba, length_lba) tuples, the form the TRIM engine works on."""
+        return list(zip(self.starts.tolist(), (self.ends - self.starts).tolist()))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __eq__(self, other):
+        return (isinstance(other, ExtentSet) and np.array_equal(self.starts, other.starts)
+                and np.array_equal(self.ends, other.ends))
+
+    def __repr__(self):
+        return f"<ExtentSet {len(self)} extents, {self.total()} LBAs>"
+
+    def total(self) -> int:
+        """Number of LBAs in the set."""
+        return int((self.ends - self.starts).sum())
+
+    def _covers(self, points: np.ndarray) -> np.ndarray:
+        """True for each point that lies inside one of the extents."""
+        return np.searchsorted(self.starts, points, side='right') > np.searchsorted(self.ends, points, side='right')
+
+    def _combine(self, other: "ExtentSet", keep) -> "ExtentSet":
+        points = np.sort(np.concatenate((self.starts, self.ends, other.starts, other.ends)))
+        if points.size < 2: # Both empty
+            return ExtentSet()
+        points = points[np.concatenate(([True], points[1:] != points[:-1]))] # Sort-based unique, faster than np.unique
+        # Every elementary segment [points[i], points[i+1]) is wholly in or out of each operand
+        inside = keep(self._covers(points[:-1]), other._covers(points[:-1]))
+        edges = np.diff(np.concatenate(([False], inside, [False])).astype(np.int8))
+        return ExtentSet(points[np.flatnonzero(edges == 1)], points[np.flatnonzero(edges == -1)])
+
+    def union(self, other: "ExtentSet") -> "ExtentSet":
+        return self._combine(other, np.logical_or)
+
+    def intersection(self, other: "ExtentSet") -> "ExtentSet":
+        return self._combine(other, np.logical_and)
+
+    def difference(self, other: "ExtentSet") -> "ExtentSet":
+        """LBAs in this set but not in other."""
+        return self._combine(other, lambda a, b: a & ~b)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+
+class RangeStateMap:
+    """
+    State code of every LBA in [0, size), stored as coalesced runs: run i covers
+    [start_i, start_{i+1}) and neighbouring runs always differ in state.
+
+    Run starts and states live in blocks of typed arrays (9 bytes per run) of at most
+    2 * BLOCK_SIZE runs, found by bisecting the blocks' first starts. assign() splits and
+    merges runs in O(log n + BLOCK_SIZE) (a memmove within one block), lookups are
+    O(log n), and the runs of one state are collected with one vectorized scan.
+    """
+    BLOCK_SIZE = 2048
+
+    def __init__(self, size: int, initial_state: int = 0, num_states: int = len(STATE_NAMES)):
+        self.size = max(1, size)
+        self.num_states = num_states
+        self._starts = [array('q', [0])]
+        self._states = [array('B', [initial_state])]
+        self._firsts = [0] # First run start of each block, for bisect
+        self._totals = [0] * num_states # LBAs per state
+        self._totals[initial_state] = self.size
+        self._runs = 1
+
+    def __len__(self):
+        return self._runs
+
+    def __repr__(self):
+        return f"<RangeStateMap {self._runs} runs over {self.size} LBAs>"
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the run arrays."""
+        return sum(len(a) * a.itemsize for a in self._starts) + sum(len(a) for a in self._states)
+
+    def state_at(self, lba: int) -> int:
+        if not 0 <= lba < self.size:
+            raise IndexError(f"LBA {lba} outside [0, {self.size})")
+        block = bisect.bisect_right(self._firsts, lba) - 1
+        return self._states[block][bisect.bisect_right(self._starts[block], lba) - 1]
+
+    def totals(self) -> np.ndarray:
+        """LBA count per state code."""
+        return np.array(self._totals, dtype=np.int64)
+
+    def assign(self, start: int, end: int, state: int):
+        """Sets LBAs [start, end) to state, splitting and merging the runs it touches."""
+        start, end = max(0, start), min(self.size, end)
+        if start >= end:
+            return
+        # Run starts in [start, end] are replaced: from (first_block, first) up to (last_block, last)
+        first_block = bisect.bisect_right(self._firsts, start) - 1
+        first = bisect.bisect_left(self._starts[first_block], start)
+        last_block = bisect.bisect_right(self._firsts, end) - 1
+        last = bisect.bisect_right(self._starts[last_block], end)
+        block_starts, block_states = self._starts[first_block], self._states[first_block]
+        if first < len(block_starts) and block_starts[first] == start:
+            current = block_states[first]
+            before = block_states[first - 1] if first else (self._states[first_block - 1][-1] if first_block else None)
+        else:
+            current = before = block_states[first - 1] # start lies inside a run
+        after = self._states[last_block][last - 1] if end < self.size else None
+
+        # The runs overlapping [start, end) leave the totals
+        run_start, removed = start, 0
+        for block in range(first_block, last_block + 1):
+            lo = first if block == first_block else 0
+            hi = last if block == last_block else len(self._starts[block])
+            removed += hi - lo
+            for next_start, next_state in zip(self._starts[block][lo:hi], self._states[block][lo:hi]):
+                if start < next_start < end:
+                    self._totals[current] -= next_start - run_start
+                    run_start, current = next_start, next_state
+        self._totals[current] -= end - run_start
+        self._totals[state] += end - start
+
+        new_starts, new_states = [], []
+        if before != state:
+            new_starts.append(start), new_states.append(state)
+        if after is not None and after != state:
+            new_starts.append(end), new_states.append(after)
+        self._runs += len(new_starts) - removed
+        if first_block == last_block:
+            block_starts[first:last] = array('q', new_starts)
+            block_states[first:last] = array('B', new_states)
+        else:
+            block_starts[first:] = array('q', new_starts) + self._starts[last_block][last:]
+            block_states[first:] = array('B', new_states) + self._states[last_block][last:]
+            del self._starts[first_block + 1:last_block + 1], self._states[first_block + 1:last_block + 1]
+            del self._firsts[first_block + 1:last_block + 1]
+        self._rebalance(first_block)
+
+    def assign_ranges(self, ranges, state: int):
+        """assign() for each (start_lba, length_lba) range."""
+        for start, length in ranges:
+            self.assign(start, start + length, state)
+
+    def _rebalance(self, block: int):
+        """Keeps a block between BLOCK_SIZE / 4 and 2 * BLOCK_SIZE runs where possible."""
+        starts, states = self._starts[block], self._states[block]
+        if len(starts) < self.BLOCK_SIZE // 4 and block + 1 < len(self._starts):
+            starts.extend(self._starts.pop(block + 1))
+            states.extend(self._states.pop(block + 1))
+            del self._firsts[block + 1]
+        if not starts:
+            del self._starts[block], self._states[block], self._firsts[block]
+            return
+        if len(starts) > 2 * self.BLOCK_SIZE:
+            half = len(starts) // 2
+            self._starts.insert(block + 1, starts[half:])
+            self._states.insert(block + 1, states[half:])
+            self._firsts.insert(block + 1, starts[half])
+            del starts[half:], states[half:]
+        self._firsts[block] = starts[0]
+
+    def to_arrays(self):
+        """(starts, ends, states) of all runs, as NumPy arrays."""
+        starts = np.concatenate([np.frombuffer(block, dtype=np.int64) for block in self._starts])
+        states = np.concatenate([np.frombuffer(block, dtype=np.uint8) for block in self._states])
+        return starts, np.append(starts[1:], self.size), states
+
+    def runs(self, start: int = 0, end: int = None):
+        """Yields (start, end, state) of the runs overlapping [start, end), clipped to it."""
+        start, end = max(0, start), self.size if end is None else min(end, self.size)
+        if start >= end:
+            return
+        block = bisect.bisect_right(self._firsts, start) - 1
+        index = bisect.bisect_right(self._starts[block], start) - 1
+        while block < len(self._starts):
+            starts, states = self._starts[block], self._states[block]
+            block_end = self._firsts[block + 1] if block + 1 < len(self._firsts) else self.size
+            for i in range(index, len(starts)):
+                if starts[i] >= end:
+                    return
+                run_end = starts[i + 1] if i + 1 < len(starts) else block_end
+                yield max(starts[i], start), min(run_end, end), states[i]
+            block, index = block + 1, 0
+
+    def extents(self, state: int) -> ExtentSet:
+        """All LBAs in state, as an ExtentSet."""
+        starts, ends, states = self.to_arrays()
+        mask = states == state
+        return ExtentSet(starts[mask], ends[mask])
@@ -0,0 +1,187 @@
+# trimvision/core/io_throttle.py
+# Foreground-I/O-aware throttling of discard traffic.
+#
+# Token buckets cap discard bytes/s and calls/s. The effective rate adapts on its
+# own: the target disk's counters are sampled through psutil, and the rate is cut
+# as soon as foreground (application) I/O latency or IOPS rise, then recovers
+# gradually once the disk quietens down.
+
+import os
+import time
+import psutil
+from trimvision import config
+from trimvision.core.logger import logger
+
+
+class TokenBucket:
+    """Classic token bucket; a rate of 0 means unlimited."""
+    def __init__(self, rate: float, burst_seconds: float = config.THROTTLE_BURST_S):
+        self.burst_seconds = burst_seconds
+        self.rate = 0.0
+        self.tokens = 0.0
+        self._last = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float):
+        self._refill()
+        self.rate = max(0.0, rate)
+        self.tokens = min(self.tokens, self.capacity) if self.rate else 0.0
+
+    @property
+    def capacity(self) -> float:
+        return self.rate * self.burst_seconds
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def delay_for(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they are now)."""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        # A request bigger than the bucket only has to wait for a full bucket
+        needed = min(amount, self.capacity) - self.tokens
+        return needed / self.rate if needed > 0 else 0.0
+
+    def consume(self, amount: float):
+        if self.rate:
+            self._refill()
+            self.tokens -= amount # May go negative; the debt delays the next call
+
+
+def disk_counter_key(drive_info) -> str:
+    """Name of the drive in psutil.disk_io_counters(perdisk=True)."""
+    if os.name == 'nt':
+        return f"PhysicalDrive{drive_info.physical_disk_index}"
+    return os.path.basename(drive_info.device_id_wmi)
+
+
+class ForegroundIoMonitor:
+    """Samples read/write counters of one disk; discards are not part of these counters."""
+    def __init__(self, disk_key: str):
+        self.disk_key = disk_key
+        self._last = None
+        self._last_time = None
+        self.available = True
+
+    def _read(self):
+        counters = psutil.disk_io_counters(perdisk=True) or {}
+        return counters.get(self.disk_key)
+
+    def sample(self):
+        """Returns (iops, avg_latency_ms) of foreground I/O since the last sample, or None."""
+        if not self.available:
+            return None
+        try:
+            current = self._read()
+        except Exception as e:
+            logger.warning(f"Disk counters unavailable for {self.disk_key}: {e}")
+            current = None
+        if current is None:
+            logger.info(f"No I/O counters for disk '{self.disk_key}'; foreground-aware throttling disabled.")
+            self.available = False
+            return None
+        now = time.monotonic()
+        previous, previous_time = self._last, self._last_time
+        self._last, self._last_time = current, now
+        if previous is None or now <= previous_time:
+            return None
+        ops = (current.read_count - previous.read_count) + (current.write_count - previous.write_count)
+        busy_ms = (current.read_time - previous.read_time) + (current.write_time - previous.write_time)
+        iops = ops / (now - previous_time)
+        latency_ms = busy_ms / ops if ops > 0 else 0.0
+        return iops, latency_ms
+
+
+class AdaptiveThrottle:
+    """
+    Rate limiter for discard calls combining a ceiling (user/scheduler budget) with an
+    adaptive rate driven by foreground I/O. state() describes what currently limits it.
+    """
+    def __init__(self, monitor: ForegroundIoMonitor = None,
+                 max_bytes_per_s: float = config.THROTTLE_MAX_MBPS * 1024**2,
+                 max_calls_per_s: float = config.THROTTLE_MAX_CALLS_PER_S,
+                 min_bytes_per_s: float = config.THROTTLE_MIN_MBPS * 1024**2,
+                 sample_interval_s: float = config.THROTTLE_SAMPLE_INTERVAL_S,
+                 fg_latency_ms: float = config.THROTTLE_FG_LATENCY_MS,
+                 fg_iops: float = config.THROTTLE_FG_IOPS):
+        self.monitor = monitor
+        self.ceiling_bps = max_bytes_per_s # 0 = no ceiling
+        self.min_bps = min_bytes_per_s
+        self.sample_interval_s = sample_interval_s
+        self.fg_latency_ms = fg_latency_ms
+        self.fg_iops = fg_iops
+        self.adaptive_bps = 0.0 # 0 = foreground is quiet, no adaptive cut in force
+        self.limited_by = "none"
+        self.fg_iops_seen = 0.0
+        self.fg_latency_seen = 0.0
+        self.byte_bucket = TokenBucket(max_bytes_per_s)
+        self.call_bucket = TokenBucket(max_calls_per_s)
+        self._window_bytes = 0
+        self._window_start = time.monotonic()
+        self._last_sample = 0.0
+
+    def set_ceiling(self, bytes_per_s: float):
+        self.ceiling_bps = max(0.0, bytes_per_s)
+        self._apply()
+
+    @property
+    def effective_bps(self) -> float:
+        rates = [r for r in (self.ceiling_bps, self.adaptive_bps) if r > 0]
+        return min(rates) if rates else 0.0
+
+    def _apply(self):
+        self.byte_bucket.set_rate(self.effective_bps)
+        foreground_binds = self.adaptive_bps and (not self.ceiling_bps or self.adaptive_bps < self.ceiling_bps)
+        if not foreground_binds: # Otherwise keep the foreground reason set by _maybe_adapt()
+            self.limited_by = "rate limit" if self.ceiling_bps else "none"
+
+    def delay_for(self, call_bytes: int) -> float:
+        """Seconds to wait before a call of call_bytes may be submitted."""
+        self._maybe_adapt()
+        return max(self.byte_bucket.delay_for(call_bytes), self.call_bucket.delay_for(1))
+
+    def on_submit(self, call_bytes: int):
+        self.byte_bucket.consume(call_bytes)
+        self.call_bucket.consume(1)
+        self._window_bytes += call_bytes
+
+    def _maybe_adapt(self):
+        now = time.monotonic()
+        if self.monitor is None or now - self._last_sample < self.sample_interval_s:
+            return
+        self._last_sample = now
+        observed_bps = self._window_bytes / max(1e-6, now - self._window_start)
+        self._window_bytes = 0
+        self._window_start = now
+        sample = self.monitor.sample()
+        if sample is None:
+            return
+        self.fg_iops_seen, self.fg_latency_seen = sample
+        if self.fg_latency_seen > self.fg_latency_ms or self.fg_iops_seen > self.fg_iops:
+            # Back off multiplicatively from what we are actually doing
+            base = self.adaptive_bps or observed_bps or self.ceiling_bps or self.min_bps * 2
+            self.adaptive_bps = max(self.min_bps, base * 0.5)
+            self.limited_by = ("foreground latency" if self.fg_latency_seen > self.fg_latency_ms
+                               else "foreground IOPS")
+        elif self.adaptive_bps:
+            # Recover gradually; drop the adaptive cap once it no longer binds
+            self.adaptive_bps *= 1.25
+            self.limited_by = "recovering from foreground I/O"
+            if (self.ceiling_bps and self.adaptive_bps >= self.ceiling_bps) or \
+                    (observed_bps and self.adaptive_bps > observed_bps * 4):
+                self.adaptive_bps = 0.0
+        self._apply()
+
+    def state(self) -> dict:
+        """Snapshot for the UI: effective rate and why it is limited."""
+        return {
+            "effective_mbps": self.effective_bps / 1024**2, # 0 = unlimited
+            "limited_by": self.limited_by,
+            "foreground_iops": self.fg_iops_seen,
+            "foreground_latency_ms": self.fg_latency_seen,
+            "max_calls_per_s": self.call_bucket.rate,
+        }
@@ -1,16 +1,60 @@
 # trimvision/core/logger.py
+# Application logging.
+#
+# Callers only enqueue records: a QueueHandler on the logger hands them, still
+# unformatted, to a QueueListener thread that formats and writes them to the
+# size-rotated log file and the console. Per-call discard details never go
+# through logging at all; they are kept in a TraceBuffer (a fixed-size binary
+# ring) and only written to the log when something fails.
 
 import logging
+import logging.handlers
 import os
+import sys
+import time
+import queue
+import atexit
+from array import array
 from trimvision import config
 
+_listener = None
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records as they are; the listener thread does the formatting (same process, so no pickling)."""
+    def prepare(self, record):
+        return record
+
+class _BatchingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Leaves records in the stream buffer; the listener flushes once the queue runs empty."""
+    def flush(self): # StreamHandler.emit() flushes after every record
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+    def close(self):
+        self.flush_batch()
+        super().close()
+
+class _BatchingQueueListener(logging.handlers.QueueListener):
+    """Writes bursts of records with one flush at the end of each burst."""
+    def dequeue(self, block):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            for handler in self.handlers:
+                getattr(handler, "flush_batch", handler.flush)()
+            return self.queue.get(block)
+
 def setup_logger():
     """Sets up the application logger."""
+    global _listener
     log_formatter = logging.Formatter(
         "%(asctime)s [%(levelname)-5.5s] [%(threadName)-10.10s] [%(module)-10.10s L%(lineno)d] %(message)s"
     )
     logger = logging.getLogger(config.APP_NAME)
     logger.setLevel(logging.DEBUG) # Set to INFO for production
+    logging.logProcesses = logging.logMultiprocessing = False # Not in the format; saves work per record
 
     # File Handler
     # Ensure the log file is in the same directory as the executable or script's main directory
@@ -21,23 +65,92 @@ def setup_logger():
 
     log_file_path = os.path.join(app_path, config.LOG_FILE)
 
-    file_handler = logging.FileHandler(log_file_path)
+    file_handler = _BatchingRotatingFileHandler( # Opened on the first record, not at import
+        log_file_path, maxBytes=config.LOG_MAX_BYTES, backupCount=config.LOG_BACKUP_COUNT, delay=True)
     file_handler.setFormatter(log_formatter)
-    logger.addHandler(file_handler)
 
     # Console Handler (optional, for debugging)
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(log_formatter)
-    logger.addHandler(console_handler)
+
+    # Writer thread; the logging thread only pays for creating and enqueueing the record
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(_LazyQueueHandler(log_queue))
+    _listener = _BatchingQueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_stop_listener)
 
     return logger
 
-# Initialize logger once
-import sys # Import sys here for the getattr check in setup_logger
+def _stop_listener():
+    """Drains the queue and ends the writer thread (at exit)."""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
 logger = setup_logger()
 
+def set_console_level(level):
+    """Sets what reaches the console handler; the log file still records everything."""
+    for handler in _listener.handlers:
+        if type(handler) is logging.StreamHandler: # FileHandler is a StreamHandler subclass
+            handler.setLevel(level)
+
+def flush():
+    """Waits until every record logged so far has been written."""
+    _listener.stop()
+    _listener.start()
+
+
+class TraceBuffer:
+    """
+    The last `entries` discard calls in a preallocated ring of int64 fields, for
+    post-mortem logging: recording costs a few array stores, no formatting or I/O.
+    Not thread-safe; owned by the thread that collects completions.
+    """
+    FIELDS = ("time_ns", "first_lba", "ranges", "lba_count", "latency_us", "ok")
+    WIDTH = len(FIELDS)
+
+    def __init__(self, entries: int = config.LOG_TRACE_ENTRIES):
+        self.entries = max(1, entries)
+        self._ring = array("q", bytes(8 * self.WIDTH * self.entries))
+        self._next = 0 # Total calls recorded; the ring holds the last min(_next, entries)
+
+    def record(self, first_lba: int, ranges: int, lba_count: int, latency_s: float, ok: bool):
+        i = (self._next % self.entries) * self.WIDTH
+        ring = self._ring
+        ring[i] = time.monotonic_ns()
+        ring[i + 1] = first_lba
+        ring[i + 2] = ranges
+        ring[i + 3] = lba_count
+        ring[i + 4] = int(latency_s * 1_000_000)
+        ring[i + 5] = ok
+        self._next += 1
+
+    def __len__(self):
+        return min(self._next, self.entries)
+
+    def rows(self):
+        """Recorded calls, oldest first, as tuples of FIELDS."""
+        first = self._next - len(self)
+        width = self.WIDTH
+        return [tuple(self._ring[(n % self.entries) * width:(n % self.entries) * width + width])
+                for n in range(first, self._next)]
+
+    def dump(self, reason: str, last: int = None):
+        """Writes the most recent calls (all, or the last `last`) to the log."""
+        rows = self.rows()[-last:] if last else self.rows()
+        if not rows:
+            return
+        end_ns = rows[-1][0]
+        lines = [f"{'t-ms':>10} {'first_lba':>14} {'ranges':>6} {'lba_count':>12} {'latency_us':>10} ok"]
+        lines += [f"{(t - end_ns) / 1e6:>10.1f} {lba:>14} {ranges:>6} {count:>12} {latency:>10} {ok}"
+                  for t, lba, ranges, count, latency, ok in rows]
+        logger.warning(f"{reason}; last {len(rows)} of {self._next} discard calls:\n" + "\n".join(lines),
+                       stacklevel=2) # Attributed to the caller
+
+
 if __name__ == '__main__':
     logger.info("Logger test: Info message.")
     logger.debug("Logger test: Debug message.")
     logger.warning("Logger test: Warning message.")
-    logger.error("Logger test: Error message.")
\ No newline at end of file
+    logger.error("Logger test: Error message.")
@@ -0,0 +1,99 @@
+# trimvision/core/progress_channel.py
+# Batched worker -> UI state channel.
+#
+# Instead of one queued Qt signal per chunk transition, the worker records
+# integer-coded transitions here, as runs of consecutive chunks, and publishes
+# them in one batch at a capped rate. A batch holds only the latest state of each
+# chunk changed since the last one, so its size is bounded by the dirty chunks
+# rather than by the number of transitions.
+
+import time
+import threading
+import numpy as np
+from trimvision import config
+
+# Chunk states shared by the worker and the LBA grid
+STATE_NON_PROCEEDED = 0
+STATE_PROCESSING = 1
+STATE_PROCESSED = 2
+STATE_BLOCKED = 3
+STATE_VERIFY_FAILED = 4 # Discarded, but a verification read found data
+
+STATE_NAMES = {
+    STATE_NON_PROCEEDED: "Non-proceeded",
+    STATE_PROCESSING: "Processing",
+    STATE_PROCESSED: "Processed",
+    STATE_BLOCKED: "Blocked",
+    STATE_VERIFY_FAILED: "Verify failed",
+}
+
+
+def _encode_runs(indices: np.ndarray, states: np.ndarray) -> np.ndarray:
+    """Flat (first_index, count, state) triples for sorted distinct indices: one per run of consecutive equal states."""
+    breaks = np.flatnonzero((np.diff(indices) != 1) | (np.diff(states) != 0)) + 1
+    starts = np.concatenate(([0], breaks))
+    triples = np.empty((len(starts), 3), dtype=np.int64)
+    triples[:, 0] = indices[starts]
+    triples[:, 1] = np.diff(np.concatenate((starts, [len(indices)])))
+    triples[:, 2] = states[starts]
+    return triples.ravel()
+
+
+def iter_deltas(deltas):
+    """Yields (first_index, count, state) runs from a flat delta array as published by StateDeltaBuffer."""
+    return zip(deltas[0::3].tolist(), deltas[1::3].tolist(), deltas[2::3].tolist())
+
+
+class StateDeltaBuffer:
+    """
+    Accumulates state transitions as runs of consecutive indices and hands them out in
+    bulk, rate-capped, coalesced to the latest state recorded for each index.
+    record() and take() may be called from different threads.
+    """
+    def __init__(self, max_rate_hz: float = config.UI_UPDATE_MAX_HZ):
+        self.min_interval = 1.0 / max_rate_hz if max_rate_hz > 0 else 0.0
+        self._pending = [] # int64 arrays of flat (first_index, count, state) triples
+        self._lock = threading.Lock()
+        self._last_publish = 0.0
+
+    def record(self, index: int, state: int, count: int = 1):
+        with self._lock:
+            self._pending.append(np.array([index, count, state], dtype=np.int64))
+
+    def record_indices(self, indices: np.ndarray, state: int):
+        """Records state for a sorted array of distinct indices, compressed into runs."""
+        if len(indices) == 0:
+            return
+        triples = _encode_runs(np.asarray(indices, dtype=np.int64), np.full(len(indices), state, dtype=np.int64))
+        with self._lock:
+            self._pending.append(triples)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def due_in(self) -> float:
+        """Seconds until the next publish is allowed (0 = now)."""
+        return max(0.0, self._last_publish + self.min_interval - time.monotonic())
+
+    def take(self, force: bool = False):
+        """
+        Returns the latest state of every index changed since the last take, as a flat int64
+        array of sorted runs [first0, count0, state0, ...], or None if nothing is pending or
+        the rate cap does not allow a publish yet.
+        """
+        if not force and self.due_in() > 0:
+            return None
+        with self._lock:
+            if not self._pending:
+                return None
+            pending, self._pending = self._pending, []
+        self._last_publish = time.monotonic()
+        if len(pending) == 1:
+            return pending[0] # Sorted distinct runs already
+        triples = np.concatenate(pending).reshape(-1, 3)
+        counts = triples[:, 1]
+        # One entry per index in recording order; the last state recorded for an index wins
+        indices = np.repeat(triples[:, 0] - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        states = np.repeat(triples[:, 2], counts)
+        indices, last = np.unique(indices[::-1], return_index=True)
+        return _encode_runs(indices, states[::-1][last])
@@ -0,0 +1,190 @@
+# trimvision/core/run_history.py
+# Persistent history of TRIM runs.
+#
+# Every run the engine finishes (completed, cancelled or failed) is stored as one
+# row of an SQLite database in the app's data directory: drive identity, outcome,
+# volumes, duration, per-phase timings, throughput and latency percentiles and
+# blocked ranges, plus the full run summary as JSON. Rows are indexed by drive
+# serial and start time, so a drive's history and its throughput trend over
+# months are cheap to query, and pages are read by keyset (start time, id) so
+# scrolling deep into the history costs the same as the first page.
+#
+# A connection is opened per call: the engine records from its worker thread
+# while the UI reads from the GUI thread.
+
+import os
+import json
+import time
+import sqlite3
+import contextlib
+from trimvision import config
+from trimvision.core.logger import logger
+from trimvision.utils.app_paths import data_dir
+
+SCHEMA_VERSION = 1
+
+OUTCOME_OK = "ok"
+OUTCOME_BLOCKED = "blocked" # Completed, but some ranges could not be discarded
+OUTCOME_CANCELLED = "cancelled"
+OUTCOME_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,            -- Unix time
+    duration_s REAL NOT NULL,
+    serial TEXT NOT NULL,
+    model TEXT NOT NULL,
+    firmware TEXT NOT NULL,
+    device TEXT NOT NULL,
+    plan_mode TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    message TEXT NOT NULL,
+    planned_bytes INTEGER NOT NULL,
+    bytes_discarded INTEGER NOT NULL,
+    throughput_mbps REAL NOT NULL,    -- bytes_discarded over the dispatch phase
+    throughput_p10_mbps REAL,         -- Percentiles of the per-second throughput
+    throughput_p50_mbps REAL,
+    throughput_p90_mbps REAL,
+    calls INTEGER NOT NULL,
+    failed_calls INTEGER NOT NULL,
+    latency_p50_ms REAL,
+    latency_p99_ms REAL,
+    latency_max_ms REAL,
+    blocked_ranges INTEGER NOT NULL,
+    blocked_bytes INTEGER NOT NULL,
+    phases TEXT NOT NULL,             -- JSON {phase: seconds}
+    summary TEXT NOT NULL             -- JSON run summary, including the blocked ranges
+);
+CREATE INDEX IF NOT EXISTS runs_by_serial ON runs (serial, started);
+CREATE INDEX IF NOT EXISTS runs_by_time ON runs (started);
+"""
+
+# Columns of the list views; phases and summary are only read by get()
+LIST_COLUMNS = ("id", "started", "duration_s", "serial", "model", "firmware", "device", "plan_mode", "outcome",
+                "message", "planned_bytes", "bytes_discarded", "throughput_mbps", "throughput_p10_mbps",
+                "throughput_p50_mbps", "throughput_p90_mbps", "calls", "failed_calls", "latency_p50_ms",
+                "latency_p99_ms", "latency_max_ms", "blocked_ranges", "blocked_bytes")
+
+
+def history_path() -> str:
+    return os.path.join(data_dir(config.HISTORY_DIR), config.HISTORY_DB)
+
+
+def drive_serial(drive_info) -> str:
+    """What runs of a drive are filed under: its serial number, or its device path if there is none."""
+    serial = getattr(drive_info, "serial_number", None)
+    return serial if serial not in (None, "", "N/A") else drive_info.device_id_wmi
+
+
+class RunHistory:
+    """Query and record API over the run history database."""
+    def __init__(self, path: str = None):
+        self.path = path or history_path()
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL") # Readers do not block the recording worker
+            db.executescript(_SCHEMA)
+            db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """A connection that commits on success and is always closed."""
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def record(self, run: dict) -> int:
+        """Stores a run (a dict with the columns of the runs table); returns its id."""
+        row = dict(run, phases=json.dumps(run.get("phases", {})), summary=json.dumps(run.get("summary", {}),
+                                                                                    default=str))
+        columns = [c for c in LIST_COLUMNS if c != "id" and c in row] + ["phases", "summary"]
+        with self._connect() as db:
+            cursor = db.execute(f"INSERT INTO runs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                                [row[c] for c in columns])
+        return cursor.lastrowid
+
+    @staticmethod
+    def _where(serial=None, since=None, until=None, outcome=None, before=None):
+        clauses, params = [], []
+        for clause, value in (("serial = ?", serial), ("started >= ?", since), ("started < ?", until),
+                              ("outcome = ?", outcome)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        if before is not None: # Keyset: rows strictly after (started, id) in newest-first order
+            clauses.append("(started < ? OR (started = ? AND id < ?))")
+            params += [before[0], before[0], before[1]]
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, serial: str = None, since: float = None, until: float = None, outcome: str = None,
+              limit: int = config.HISTORY_PAGE_SIZE, before=None):
+        """
+        Runs newest first, as dicts of LIST_COLUMNS. For the next page pass
+        before=(started, id) of the last row returned.
+        """
+        where, params = self._where(serial, since, until, outcome, before)
+        with self._connect() as db:
+            rows = db.execute(f"SELECT {', '.join(LIST_COLUMNS)} FROM runs{where} "
+                              f"ORDER BY started DESC, id DESC LIMIT ?", params + [limit]).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self, serial: str = None, since: float = None, until: float = None, outcome: str = None) -> int:
+        where, params = self._where(serial, since, until, outcome)
+        with self._connect() as db:
+            return db.execute(f"SELECT COUNT(*) FROM runs{where}", params).fetchone()[0]
+
+    def get(self, run_id: int):
+        """One run with its phases and summary decoded; None if there is no such run."""
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        run = dict(row)
+        run["phases"] = json.loads(run["phases"])
+        run["summary"] = json.loads(run["summary"])
+        return run
+
+    def drives(self):
+        """Every drive in the history: serial, model, number of runs and the time of the last one."""
+        with self._connect() as db:
+            rows = db.execute("SELECT serial, model, COUNT(*) AS runs, MAX(started) AS last_run FROM runs "
+                              "GROUP BY serial ORDER BY last_run DESC").fetchall()
+        return [dict(row) for row in rows]
+
+    def throughput_trend(self, serial: str, period: str = "month"):
+        """
+        Completed runs of a drive grouped by calendar month (or "week"/"day"),
+        oldest first: runs, mean and best p50 throughput, mean p99 latency.
+        """
+        fmt = {"day": "%Y-%m-%d", "week": "%Y-W%W", "month": "%Y-%m"}[period]
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT strftime(?, started, 'unixepoch', 'localtime') AS period, COUNT(*) AS runs, "
+                "AVG(throughput_p50_mbps) AS mean_p50_mbps, MAX(throughput_p50_mbps) AS best_p50_mbps, "
+                "AVG(throughput_mbps) AS mean_mbps, AVG(latency_p99_ms) AS mean_p99_ms FROM runs "
+                "WHERE serial = ? AND outcome IN (?, ?) GROUP BY period ORDER BY period",
+                (fmt, serial, OUTCOME_OK, OUTCOME_BLOCKED)).fetchall()
+        return [dict(row) for row in rows]
+
+
+def record_run(run, path: str = None):
+    """
+    Records a run, given as a dict or as a function returning it (called here, so that
+    errors building the row are caught too); failures are logged, never raised
+    (history must not break a TRIM).
+    """
+    try:
+        if callable(run):
+            run = run()
+        start = time.perf_counter()
+        run_id = RunHistory(path).record(run)
+        logger.debug(f"Run {run_id} of {run.get('model')} recorded in the history "
+                     f"({(time.perf_counter() - start) * 1e3:.1f} ms)")
+        return run_id
+    except Exception as e:
+        logger.warning(f"Could not record the run in the history database: {e}")
+        return None
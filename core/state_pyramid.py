@@ -0,0 +1,134 @@
+# trimvision/core/state_pyramid.py
+# Multi-resolution summary of per-chunk TRIM states.
+#
+# Leaves hold the state code of each chunk; every level above holds, per node,
+# the count of each state among the FANOUT nodes below it. Updates adjust the
+# counts incrementally, a whole batch of runs at once (bincounts over the leaves
+# it changes, then per-node sums level by level), and the state histogram of any
+# chunk window is answered from O(FANOUT * log n) nodes, so zoomed views never
+# rescan the leaves.
+
+import numpy as np
+from trimvision.core.progress_channel import STATE_NAMES
+
+
+class StatePyramid:
+    """Per-level state counts over n chunk states (state codes 0..len(STATE_NAMES)-1)."""
+    FANOUT_BITS = 4
+    FANOUT = 1 << FANOUT_BITS
+
+    def __init__(self, size: int, num_states: int = len(STATE_NAMES), initial_state: int = 0):
+        self.size = max(1, size)
+        self.num_states = num_states
+        self.leaves = np.full(self.size, initial_state, dtype=np.uint8)
+        # levels[k] has shape (ceil(size / FANOUT**k), num_states); level 0 is the leaves themselves
+        self.levels = [None]
+        nodes = self.size
+        while nodes > 1:
+            nodes = -(-nodes // self.FANOUT)
+            counts = np.zeros((nodes, num_states), dtype=np.int64)
+            counts[:, initial_state] = self.FANOUT ** len(self.levels)
+            # The last node of each level only covers the leaves that exist
+            counts[-1, initial_state] = self.size - (nodes - 1) * self.FANOUT ** len(self.levels)
+            self.levels.append(counts)
+
+    def set_range(self, start: int, end: int, state: int):
+        """Sets chunks [start, end) to state, updating the counts of every level above them."""
+        self.set_runs([start], [end - start], [state])
+
+    def set_runs(self, starts, counts, states):
+        """
+        Sets chunks [starts[i], starts[i] + counts[i]) to states[i] for every run, later runs
+        winning where runs overlap. The leaves are written once, the first level is updated with
+        bincounts over all the changed leaves and each level above from the changes below it.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.minimum(starts + np.asarray(counts, dtype=np.int64), self.size)
+        starts = np.maximum(starts, 0)
+        keep = ends > starts
+        starts, ends, states = starts[keep], ends[keep], np.asarray(states, dtype=self.leaves.dtype)[keep]
+        if starts.size == 0:
+            return
+        counts = ends - starts
+        indices = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        new = np.repeat(states, counts)
+        if indices.size > 1 and np.any(np.diff(indices) <= 0):
+            # Unsorted or overlapping runs: keep the last state written to each leaf
+            indices, last = np.unique(indices[::-1], return_index=True)
+            new = new[::-1][last]
+        old = self.leaves[indices]
+        changed = old != new
+        indices, old, new = indices[changed], old[changed], new[changed]
+        if indices.size == 0:
+            return
+        self.leaves[indices] = new
+        if len(self.levels) == 1:
+            return
+        # Each leaf adds its new state to the node above it and removes its old one
+        nodes, slot = self._group(indices)
+        slot *= self.num_states
+        size = nodes.size * self.num_states
+        moved = np.bincount(slot + new, minlength=size) - np.bincount(slot + old, minlength=size)
+        moved = moved.reshape(nodes.size, self.num_states)
+        self.levels[1][nodes] += moved
+        # Higher levels sum the changes of the nodes below rather than revisiting the leaves
+        for level in range(2, len(self.levels)):
+            nodes, slot = self._group(nodes)
+            moved = np.add.reduceat(moved, np.flatnonzero(np.diff(slot, prepend=-1)), axis=0)
+            self.levels[level][nodes] += moved
+
+    def _group(self, children: np.ndarray):
+        """Distinct parents of sorted child indices, and each child's position among them."""
+        parents = children >> self.FANOUT_BITS
+        first_of_parent = np.concatenate(([True], parents[1:] != parents[:-1]))
+        return parents[first_of_parent], np.cumsum(first_of_parent) - 1
+
+    def _node_counts(self, level: int, lo: int, hi: int) -> np.ndarray:
+        """(hi - lo, num_states) counts of nodes [lo, hi) of a level."""
+        if level == 0:
+            leaves = self.leaves[lo:hi]
+            return np.stack([leaves == s for s in range(self.num_states)], axis=1).astype(np.int64)
+        return self.levels[level][lo:hi]
+
+    def histogram(self, start: int, end: int) -> np.ndarray:
+        """State counts of chunks [start, end), from at most 2 * FANOUT nodes per level."""
+        hist = np.zeros(self.num_states, dtype=np.int64)
+        lo, hi = max(0, start), min(self.size, end)
+        level = 0
+        while lo < hi:
+            if level == len(self.levels) - 1:
+                hist += self._node_counts(level, lo, hi).sum(axis=0)
+                break
+            # Partial parents at both ends are summed here, whole parents one level up
+            head_end = min(hi, -(-lo // self.FANOUT) * self.FANOUT)
+            tail_start = max(head_end, hi // self.FANOUT * self.FANOUT)
+            hist += self._node_counts(level, lo, head_end).sum(axis=0)
+            hist += self._node_counts(level, tail_start, hi).sum(axis=0)
+            lo, hi = head_end // self.FANOUT, tail_start // self.FANOUT
+            level += 1
+        return hist
+
+    def window_histograms(self, edges) -> np.ndarray:
+        """
+        State counts of consecutive windows [edges[i], edges[i+1]), as a (len(edges) - 1, num_states)
+        array. Read from the coarsest level whose nodes fit in the narrowest window, with window
+        edges rounded to that level's nodes; cost is linear in the nodes covered, not the chunks.
+        """
+        edges = np.clip(np.asarray(edges, dtype=np.int64), 0, self.size)
+        min_width = max(1, int(np.diff(edges).min())) if len(edges) > 1 else 1
+        level = 0
+        while level + 1 < len(self.levels) and self.FANOUT ** (level + 1) <= min_width:
+            level += 1
+        shift = level * self.FANOUT_BITS
+        lo = int(edges[0]) >> shift
+        hi = -(-int(edges[-1]) >> shift)
+        node_edges = np.clip((edges + ((1 << shift) >> 1)) >> shift, lo, hi) - lo
+        node_edges[0], node_edges[-1] = 0, hi - lo # The outer edges cover the whole window
+        if level == 0:
+            # Leaves: count (window, state) pairs directly rather than building per-state prefix sums
+            windows = np.repeat(np.arange(len(edges) - 1), np.diff(node_edges))
+            return np.bincount(windows * self.num_states + self.leaves[lo:hi],
+                               minlength=(len(edges) - 1) * self.num_states).reshape(-1, self.num_states)
+        cumulative = np.zeros((hi - lo + 1, self.num_states), dtype=np.int64)
+        np.cumsum(self._node_counts(level, lo, hi), axis=0, out=cumulative[1:])
+        return cumulative[node_edges[1:]] - cumulative[node_edges[:-1]]
@@ -0,0 +1,317 @@
+# trimvision/core/trim_daemon.py
+# Unattended TRIM scheduling for `python -m trimvision daemon`.
+#
+# The daemon watches a set of drives and starts a TrimEngine for a drive that is
+# due (no successful run within DAEMON_MIN_INTERVAL_H) when
+#   - the current local time is inside one of its maintenance windows, or
+#   - the disk has been idle, by its foreground I/O counters, for DAEMON_IDLE_MINUTES.
+# A running job is paused (TrimEngine.pause_operation) as soon as foreground I/O
+# comes back and resumed once the disk has been quiet again for
+# DAEMON_RESUME_QUIET_S; a job started by a window is cancelled when the window
+# closes and continues from its checkpoint journal in the next one. Idle and busy
+# are judged by foreground IOPS only: discards are not part of the counters, but
+# they can raise the latency of foreground I/O, which would make a latency test
+# pause and resume a job in a loop (adapting to latency is the throttle's job).
+# The free space of drives with mounted volumes is trimmed through their filesystems
+# (the engine never plans it from the on-disk bitmaps, which a mounted filesystem
+# does not keep current); such a job pauses and cancels between volumes only. A
+# full-device daemon does not watch them at all.
+#
+# The daemon thread sleeps on an Event between samples: every
+# DAEMON_SAMPLE_INTERVAL_S while nothing runs (or earlier, when a window opens),
+# every DAEMON_ACTIVE_SAMPLE_INTERVAL_S while a job runs.
+
+import re
+import time
+import datetime
+import threading
+from trimvision import config
+from trimvision.core.logger import logger
+from trimvision.core.io_throttle import ForegroundIoMonitor, disk_counter_key
+from trimvision.core.trim_journal import drive_key
+from trimvision.core import run_history
+
+DAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+class MaintenanceWindow:
+    """
+    A weekly time window in local time: "[DAYS ]HH:MM-HH:MM", DAYS being "daily"
+    (the default) or a comma list of days and day ranges ("Mon-Fri", "Sat,Sun").
+    A window ending at or before its start crosses midnight and belongs to the day it starts on.
+    """
+    _SPEC = re.compile(r"^\s*(?:(?P<days>[A-Za-z,\-]+)\s+)?(?P<start>\d{1,2}:\d{2})\s*-\s*(?P<end>\d{1,2}:\d{2})\s*$")
+
+    def __init__(self, days, start_minute: int, end_minute: int, spec: str = ""):
+        self.days = frozenset(days) # 0 = Monday
+        self.start_minute = start_minute
+        self.end_minute = end_minute
+        self.spec = spec
+
+    @classmethod
+    def parse(cls, spec: str) -> "MaintenanceWindow":
+        match = cls._SPEC.match(spec)
+        if not match:
+            raise ValueError(f"Bad maintenance window '{spec}' (expected e.g. 'Mon-Fri 01:00-05:00')")
+        days = set()
+        for part in (match.group("days") or "daily").lower().split(","):
+            if part == "daily":
+                days.update(range(7))
+                continue
+            first, _, last = part.partition("-")
+            if first[:3] not in DAY_NAMES or (last and last[:3] not in DAY_NAMES):
+                raise ValueError(f"Bad day '{part}' in maintenance window '{spec}'")
+            start, end = DAY_NAMES.index(first[:3]), DAY_NAMES.index((last or first)[:3])
+            days.update((start + i) % 7 for i in range((end - start) % 7 + 1)) # Ranges may wrap: Sat-Mon
+        minutes = []
+        for text in (match.group("start"), match.group("end")):
+            hours, mins = map(int, text.split(":"))
+            if hours > 24 or mins > 59 or hours * 60 + mins > 24 * 60:
+                raise ValueError(f"Bad time '{text}' in maintenance window '{spec}'")
+            minutes.append(hours * 60 + mins)
+        return cls(days, minutes[0], minutes[1], spec.strip())
+
+    @property
+    def length_minutes(self) -> int:
+        return (self.end_minute - self.start_minute) % (24 * 60) or 24 * 60
+
+    def _starts_around(self, now: datetime.datetime):
+        """Start times of this window from yesterday to a week ahead."""
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        for offset in range(-1, 8):
+            day = midnight + datetime.timedelta(days=offset)
+            if day.weekday() in self.days:
+                yield day + datetime.timedelta(minutes=self.start_minute)
+
+    def contains(self, now: datetime.datetime) -> bool:
+        length = datetime.timedelta(minutes=self.length_minutes)
+        return any(start <= now < start + length for start in self._starts_around(now))
+
+    def next_start(self, now: datetime.datetime):
+        """The next time the window opens after now (None if it has no days)."""
+        return next((start for start in self._starts_around(now) if start > now), None)
+
+    def __str__(self):
+        return self.spec or f"{sorted(self.days)} {self.start_minute // 60:02d}:{self.start_minute % 60:02d}+" \
+                            f"{self.length_minutes}min"
+
+
+class _DriveSlot:
+    """The daemon's view of one drive: idle tracking and its job, if any."""
+    def __init__(self, drive_info, monitor):
+        self.drive_info = drive_info
+        self.monitor = monitor
+        self.idle_since = None # Monotonic time since which foreground I/O has stayed at idle level
+        self.last_sample = None
+        self.iops = None
+        self.engine = None
+        self.thread = None
+        self.started_by = "" # "window" or "idle"
+        self.finished = None # (success, message) reported by the engine
+        self.last_success = None # Wall time of the last successful run
+        self.next_attempt = 0.0 # Monotonic; after a failure the drive is retried no sooner than this
+
+    @property
+    def name(self) -> str:
+        return f"{self.drive_info.model} ({self.drive_info.device_id_wmi})"
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+
+class _JobListener:
+    """TrimListener of a daemon job (duck-typed): logs stages, keeps the outcome."""
+    def __init__(self, slot: _DriveSlot):
+        self.slot = slot
+
+    def progress_updated(self, processed_chunks, total_chunks, speed_mbps, eta_seconds, throttle_state):
+        pass
+
+    def chunk_states_changed(self, deltas):
+        pass
+
+    def status_message(self, message):
+        logger.debug(f"{self.slot.name}: {message}")
+
+    def error_occurred(self, error_message):
+        logger.error(f"{self.slot.name}: {error_message}")
+
+    def trim_finished(self, success, message):
+        self.slot.finished = (success, message)
+
+
+class TrimDaemon:
+    """
+    Starts, pauses, resumes and cancels TRIM jobs of drives by maintenance window and
+    disk idleness. run() blocks until stop() is called (from any thread or a signal handler).
+    With plan_mode "full", drives with mounted volumes are skipped; raises ValueError if that leaves none.
+    """
+    def __init__(self, drives, plan_mode: str = config.DAEMON_PLAN_MODE, windows=(),
+                 idle_minutes: float = config.DAEMON_IDLE_MINUTES,
+                 min_interval_h: float = config.DAEMON_MIN_INTERVAL_H,
+                 idle_iops: float = config.DAEMON_IDLE_IOPS, busy_iops: float = config.DAEMON_BUSY_IOPS,
+                 resume_quiet_s: float = config.DAEMON_RESUME_QUIET_S,
+                 sample_interval_s: float = config.DAEMON_SAMPLE_INTERVAL_S,
+                 active_sample_interval_s: float = config.DAEMON_ACTIVE_SAMPLE_INTERVAL_S,
+                 max_concurrent: int = config.SCHEDULER_MAX_CONCURRENT_DRIVES,
+                 engine_class=None, monitor_factory=None):
+        self.plan_mode = plan_mode
+        self.windows = [w if isinstance(w, MaintenanceWindow) else MaintenanceWindow.parse(w) for w in windows]
+        self.idle_s = idle_minutes * 60
+        self.min_interval_s = min_interval_h * 3600
+        self.idle_iops = idle_iops
+        self.busy_iops = busy_iops
+        self.resume_quiet_s = resume_quiet_s
+        self.sample_interval_s = sample_interval_s
+        self.active_sample_interval_s = active_sample_interval_s
+        self.max_concurrent = max(1, max_concurrent)
+        self.engine_class = engine_class # Defaults to TrimEngine, imported when the first job starts
+        monitor_factory = monitor_factory or (lambda drive: ForegroundIoMonitor(disk_counter_key(drive)))
+        watched = []
+        for drive in drives:
+            if not drive.drive_letter:
+                watched.append(drive)
+            elif plan_mode == "full": # trim_planner.PLAN_FULL_DEVICE; the planner pulls in NumPy
+                logger.warning(f"Not watching {drive.model} ({drive.device_id_wmi}): it has mounted volumes "
+                               f"({drive.drive_letter}) and a full-device TRIM would destroy them")
+            else:
+                logger.info(f"{drive.model} ({drive.device_id_wmi}) has mounted volumes ({drive.drive_letter}); "
+                            f"they are trimmed through their filesystems")
+                watched.append(drive)
+        self.slots = [_DriveSlot(drive, monitor_factory(drive)) for drive in watched]
+        if not self.slots:
+            raise ValueError("Every drive has mounted volumes; nothing to watch")
+        self._stop = threading.Event()
+        self._load_last_runs()
+
+    def _load_last_runs(self):
+        """Picks up when each drive was last trimmed successfully, so a restart does not trim again at once."""
+        if not config.HISTORY_ENABLED:
+            return
+        try:
+            history = run_history.RunHistory()
+            for slot in self.slots:
+                for outcome in (run_history.OUTCOME_OK, run_history.OUTCOME_BLOCKED):
+                    runs = history.query(serial=run_history.drive_serial(slot.drive_info), outcome=outcome, limit=1)
+                    if runs:
+                        slot.last_success = max(slot.last_success or 0.0, runs[0]["started"])
+        except Exception as e:
+            logger.warning(f"Could not read the run history; treating every drive as due: {e}")
+
+    # --- Control ---
+
+    def stop(self):
+        """Asks run() to return; running jobs are cancelled and resume from their journals next time."""
+        self._stop.set()
+
+    def run(self):
+        logger.info(f"TRIM daemon watching {len(self.slots)} drives ({self.plan_mode}); windows: "
+                    f"{', '.join(map(str, self.windows)) or 'none'}; idle trigger: "
+                    f"{f'{self.idle_s / 60:g} min' if self.idle_s else 'off'}")
+        try:
+            while not self._stop.is_set():
+                self.tick()
+                self._stop.wait(self._next_wait())
+        finally:
+            self._shutdown()
+        logger.info("TRIM daemon stopped")
+
+    def _shutdown(self):
+        for slot in self.slots:
+            if slot.running:
+                logger.info(f"Daemon stopping: cancelling TRIM of {slot.name}")
+                slot.engine.cancel_operation()
+        for slot in self.slots:
+            if slot.running:
+                slot.thread.join()
+                self._collect(slot, time.monotonic())
+
+    # --- Scheduling ---
+
+    def in_window(self, now: datetime.datetime = None) -> bool:
+        now = now or datetime.datetime.now()
+        return any(window.contains(now) for window in self.windows)
+
+    def _next_wait(self) -> float:
+        if any(slot.running for slot in self.slots):
+            return self.active_sample_interval_s
+        wait = self.sample_interval_s
+        now = datetime.datetime.now()
+        starts = [s for s in (w.next_start(now) for w in self.windows) if s is not None]
+        if starts: # Wake up when the next window opens rather than up to a sample interval late
+            wait = min(wait, max(0.0, (min(starts) - now).total_seconds()) + 0.1)
+        return wait
+
+    def tick(self):
+        """One sampling round: updates idleness and starts, pauses, resumes or cancels jobs."""
+        now = time.monotonic()
+        in_window = self.in_window()
+        for slot in self.slots:
+            self._sample(slot, now)
+            if slot.running and not slot.thread.is_alive():
+                slot.thread.join()
+                self._collect(slot, now)
+            if slot.running:
+                self._steer(slot, now, in_window)
+        for slot in self.slots:
+            if not slot.running and self._due(slot, now) and sum(s.running for s in self.slots) < self.max_concurrent:
+                if in_window:
+                    self._start(slot, "window")
+                elif self.idle_s and slot.idle_since is not None and now - slot.idle_since >= self.idle_s:
+                    self._start(slot, "idle")
+
+    def _sample(self, slot: _DriveSlot, now: float):
+        sample = slot.monitor.sample()
+        slot.iops = sample[0] if sample is not None else None
+        if slot.iops is not None and slot.iops <= self.idle_iops:
+            if slot.idle_since is None:
+                slot.idle_since = slot.last_sample or now # Quiet for the whole interval just sampled
+        else:
+            slot.idle_since = None # Busy, or unknown (first sample, no counters)
+        slot.last_sample = now
+
+    def _due(self, slot: _DriveSlot, now: float) -> bool:
+        if now < slot.next_attempt:
+            return False
+        return slot.last_success is None or time.time() - slot.last_success >= self.min_interval_s
+
+    def _start(self, slot: _DriveSlot, reason: str):
+        if self.engine_class is None:
+            from trimvision.core.trim_engine import TrimEngine # numpy and the I/O stack: only once there is work
+            self.engine_class = TrimEngine
+        logger.info(f"Starting {self.plan_mode} TRIM of {slot.name} "
+                    f"({'maintenance window' if reason == 'window' else 'disk idle'})")
+        slot.engine = self.engine_class(slot.drive_info, self.plan_mode, listener=_JobListener(slot))
+        slot.started_by = reason
+        slot.finished = None
+        slot.thread = threading.Thread(target=slot.engine.run, name=f"trim-{drive_key(slot.drive_info)}",
+                                       daemon=True)
+        slot.thread.start()
+
+    def _steer(self, slot: _DriveSlot, now: float, in_window: bool):
+        engine = slot.engine
+        if engine.is_cancelled():
+            return # Winding down
+        if slot.started_by == "window" and not in_window:
+            logger.info(f"Maintenance window closed; cancelling TRIM of {slot.name} (resumes in the next window)")
+            engine.cancel_operation()
+        elif slot.iops is not None and slot.iops > self.busy_iops and not engine.is_paused():
+            logger.info(f"Foreground I/O on {slot.name} ({slot.iops:.0f} IOPS); pausing TRIM")
+            engine.pause_operation()
+        elif engine.is_paused() and slot.idle_since is not None and now - slot.idle_since >= self.resume_quiet_s:
+            logger.info(f"{slot.name} quiet for {now - slot.idle_since:.0f}s; resuming TRIM")
+            engine.resume_operation()
+
+    def _collect(self, slot: _DriveSlot, now: float):
+        """Books the outcome of a finished job."""
+        success, message = slot.finished or (False, "no result")
+        cancelled = slot.engine.is_cancelled()
+        if success and not cancelled:
+            slot.last_success = time.time()
+            logger.info(f"TRIM of {slot.name} finished: {message}")
+        elif not cancelled:
+            slot.next_attempt = now + config.DAEMON_RETRY_MINUTES * 60
+            logger.warning(f"TRIM of {slot.name} failed ({message}); retrying in {config.DAEMON_RETRY_MINUTES} min")
+        slot.engine = slot.thread = None
+        slot.started_by = ""
@@ -0,0 +1,707 @@
+# trimvision/core/trim_engine.py
+# The TRIM engine, free of Qt.
+#
+# TrimEngine plans a run, keeps the discard dispatcher busy with adaptively sized
+# calls under the throttle, checkpoints progress and reports through a TrimListener.
+# TrimWorker runs it on a QThread and relays the listener calls as signals; the
+# command line (trimvision.cli) runs it directly, so headless use never loads PyQt.
+#
+# Pause, resume and cancel are signalled through a condition variable and wake the
+# dispatch loop wherever it waits (for a completion, the throttle or a resume).
+# Queued calls are withdrawn at once, so a request takes effect within the calls
+# already on the device, which the adaptive sizer keeps near its target latency.
+#
+# Free-space plans read the filesystems' on-disk bitmaps, which a mounted filesystem
+# keeps changing; the free space of mounted volumes is trimmed through the filesystem
+# itself instead (volume_trim), one volume after the other.
+
+import time
+import threading
+import numpy as np
+from trimvision.core.logger import logger, TraceBuffer
+from trimvision.core.drive_manager import DriveInfo # For type hinting
+from trimvision.core import trim_helpers
+from trimvision.core import trim_planner
+from trimvision.core import volume_trim
+from trimvision.core.discard_dispatcher import DiscardDispatcher
+from trimvision.core.adaptive_sizer import AdaptiveRangeSizer
+from trimvision.core.trim_journal import TrimJournal, journal_path, plan_digest, drive_key
+from trimvision.core.trim_metrics import TrimMetrics
+from trimvision.core import run_history
+from trimvision.core import trim_verify
+from trimvision.utils.app_paths import data_dir
+from trimvision.core.trim_snapshot import TrimSnapshot, snapshot_path
+from trimvision.core.extents import ExtentSet, RangeStateMap
+from trimvision.core.io_throttle import AdaptiveThrottle, ForegroundIoMonitor, disk_counter_key
+from trimvision.core.progress_channel import (StateDeltaBuffer, STATE_NON_PROCEEDED, STATE_PROCESSING,
+                                              STATE_PROCESSED, STATE_BLOCKED, STATE_VERIFY_FAILED)
+from trimvision import config
+
+class ChunkTracker:
+    """
+    Maps discard calls of any size onto the fixed set of progress/visualization chunks.
+    A chunk starts when the first call touching it is submitted and finishes once all of
+    its planned LBAs have completed; chunks with nothing planned finish as they are passed.
+    Chunk sets are NumPy index arrays so a grid of up to a million chunks stays cheap.
+    """
+    def __init__(self, extents, total_lba: int, total_chunks: int):
+        self.total_chunks = total_chunks
+        self.chunk_starts = np.arange(total_chunks, dtype=np.int64) * total_lba // total_chunks
+        # Ranges reaching past the reported capacity count towards the last chunk
+        self.chunk_ends = np.append(self.chunk_starts[1:], np.iinfo(np.int64).max)
+        self.planned = np.zeros(total_chunks, dtype=np.int64)
+        self.done = np.zeros(total_chunks, dtype=np.int64)
+        self.failed = np.zeros(total_chunks, dtype=bool)
+        self.started = np.zeros(total_chunks, dtype=bool)
+        self.finished = np.zeros(total_chunks, dtype=bool)
+        self.finished_count = 0
+        self._next_unstarted = 0 # Chunks before this one have been started or passed
+        chunks, counts = self.split(extents)
+        np.add.at(self.planned, chunks, counts)
+
+    def chunk_of(self, lba):
+        return np.maximum(0, np.searchsorted(self.chunk_starts, lba, side='right') - 1)
+
+    def split(self, ranges):
+        """Returns (chunk indices, lba counts) of the parts of each range falling in each chunk."""
+        ranges = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+        starts = ranges[:, 0]
+        ends = starts + ranges[:, 1]
+        first = self.chunk_of(starts)
+        pieces = self.chunk_of(ends - 1) - first + 1
+        owner = np.repeat(np.arange(len(ranges)), pieces)
+        offsets = np.arange(owner.size) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        chunks = first[owner] + offsets
+        counts = (np.minimum(self.chunk_ends[chunks], ends[owner])
+                  - np.maximum(self.chunk_starts[chunks], starts[owner]))
+        return chunks, counts
+
+    def on_submit(self, batch):
+        """Returns (newly started chunks, (empty chunks passed over, failed flags)) for a submitted batch."""
+        chunks, _ = self.split(batch)
+        started = np.unique(chunks[~self.started[chunks]])
+        self.started[started] = True
+        passed = np.arange(self._next_unstarted, max(self._next_unstarted, int(chunks.max(initial=0))))
+        self._next_unstarted += len(passed)
+        return started, self._finish(passed[~self.started[passed]])
+
+    def on_complete(self, batch, ok: bool):
+        """Returns the chunks finished by a completed batch as (chunks, failed flags)."""
+        chunks, counts = self.split(batch)
+        np.add.at(self.done, chunks, counts)
+        if not ok:
+            self.failed[chunks] = True
+        touched = np.unique(chunks)
+        return self._finish(touched[~self.finished[touched] & (self.done[touched] >= self.planned[touched])])
+
+    def skip(self, chunks):
+        """Marks chunks finished by an earlier run; returns their LBA spans as ranges."""
+        chunks = np.unique(chunks)
+        chunks = chunks[~self.finished[chunks]]
+        self._finish(chunks)
+        if chunks.size == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(chunks) != 1) + 1
+        firsts = chunks[np.concatenate(([0], breaks))]
+        lasts = chunks[np.concatenate((breaks - 1, [len(chunks) - 1]))]
+        starts, ends = self.chunk_starts[firsts], self.chunk_ends[lasts]
+        return [(int(start), int(end - start)) for start, end in zip(starts, ends)]
+
+    def finish_remaining(self):
+        """Finishes the chunks with nothing planned that were never passed (end of plan)."""
+        return self._finish(np.flatnonzero(~self.finished & (self.planned == 0)))
+
+    def _finish(self, chunks):
+        self.finished[chunks] = True
+        self.started[chunks] = True
+        self.finished_count += len(chunks)
+        return chunks, self.failed[chunks]
+
+
+class TrimListener:
+    """
+    Receives the engine's reports; every method is a no-op here. Calls are made on the
+    thread running the engine. The arguments match TrimWorker's signals of the same name.
+    """
+    def progress_updated(self, processed_chunks: int, total_chunks: int, speed_mbps: float, eta_seconds: float,
+                         throttle_state: dict):
+        pass
+
+    def chunk_states_changed(self, deltas):
+        """Flat [first_chunk, count, state, ...] runs of progress_channel STATE_* codes."""
+        pass
+
+    def status_message(self, message: str):
+        pass
+
+    def error_occurred(self, error_message: str):
+        pass
+
+    def trim_finished(self, success: bool, message: str):
+        pass
+
+
+class TrimEngine:
+    """
+    Runs one TRIM operation on a drive, synchronously on the calling thread.
+    cancel_operation(), pause_operation(), resume_operation() and set_rate_limit()
+    may be called from other threads while run() is in progress.
+    """
+    PLAN_FREE_SPACE = trim_planner.PLAN_FREE_SPACE
+    PLAN_FULL_DEVICE = trim_planner.PLAN_FULL_DEVICE
+    PLAN_INCREMENTAL = trim_planner.PLAN_INCREMENTAL
+
+    def __init__(self, drive_info: DriveInfo, plan_mode: str = PLAN_FREE_SPACE,
+                 queue_depth: int = config.TRIM_QUEUE_DEPTH, resume: bool = config.JOURNAL_ENABLED,
+                 listener: TrimListener = None, metrics_dir: str = None, history_path: str = None,
+                 verify_fraction: float = None):
+        self.listener = listener or TrimListener()
+        self.drive_info = drive_info
+        self.plan_mode = plan_mode
+        self.queue_depth = queue_depth
+        self.resume = resume # Keep a checkpoint journal and skip chunks an interrupted run finished
+        self._is_running = False
+        self._is_paused = False
+        self._is_cancelled = False
+        self._control = threading.Condition() # Notified on pause, resume and cancel
+        self._dispatcher: DiscardDispatcher = None # While discards are dispatched, so control can wake it
+
+        # Progress and the grid work in fixed chunks of the drive; the size of each discard
+        # call is chosen independently by the adaptive sizer.
+        self.sector_size = config.DEFAULT_SECTOR_SIZE
+        self.total_lba = int(drive_info.capacity_gb * 1024**3) // self.sector_size
+        self.total_chunks = max(1, min(config.PROGRESS_CHUNKS, self.total_lba))
+        self.bytes_discarded = 0
+        self.extents = [] # Planned (start_lba, length_lba) ranges, sorted
+        self.planned_bytes = 0
+        self.resumed_bytes = 0 # Part of planned_bytes finished by an earlier, interrupted run
+        self.free_extents: ExtentSet = None # Free space at planning time (free/incremental plans)
+        self.snapshot: TrimSnapshot = None # Trimmed extents the incremental plan was built on
+        self.skipped_bytes = 0 # Free space left out of an incremental plan as already trimmed
+        self.blocked_chunks = 0
+        # Per-LBA state of the run (progress_channel codes); LBAs outside the plan stay non-proceeded.
+        # Written by the worker thread only; read it from elsewhere once the run has finished.
+        self.lba_states = RangeStateMap(self.total_lba)
+        self.journal: TrimJournal = None
+        self.sizer: AdaptiveRangeSizer = None
+        self.run_summary = {}
+        # Discards back off on their own when the drive also serves application I/O
+        self.throttle = AdaptiveThrottle(ForegroundIoMonitor(disk_counter_key(drive_info)))
+        # Every discard call is recorded; exported periodically and at the end when enabled
+        if metrics_dir is None and config.METRICS_ENABLED:
+            metrics_dir = data_dir(config.METRICS_DIR)
+        self.metrics_dir = metrics_dir or None
+        self.metrics = self._new_metrics()
+        # Finished runs are recorded in the run history database ("" = not recorded)
+        self.history_path = history_path if history_path is not None or config.HISTORY_ENABLED else ""
+        self.phase_times = {} # Seconds spent in each stage of the last run
+        # Share of the discarded space read back after the run to check it reads as zeroes (0 = no verification)
+        if verify_fraction is None:
+            verify_fraction = config.VERIFY_SAMPLE_FRACTION if config.VERIFY_AFTER_TRIM else 0.0
+        self.verify_fraction = verify_fraction
+        self.verification = {} # VerifyResult.summary() of the last run; empty if not verified
+        self.granularity_lba = 1
+        self.tracker: ChunkTracker = None
+        self.data_path = drive_info.device_id_wmi # Where planning and verification read the drive; set by the backend
+        self.volume_results = [] # Per mounted volume of the last run, if it was trimmed through the filesystems
+
+    def _new_metrics(self) -> TrimMetrics:
+        return TrimMetrics({"device": self.drive_info.device_id_wmi, "model": self.drive_info.model,
+                            "plan_mode": self.plan_mode}, export_dir=self.metrics_dir)
+
+    def set_rate_limit(self, bytes_per_second: float):
+        """Caps the discard rate (0 = no cap); may be called from any thread while the worker runs."""
+        configured = config.THROTTLE_MAX_MBPS * 1024**2
+        caps = [r for r in (configured, bytes_per_second) if r > 0]
+        self.throttle.set_ceiling(min(caps) if caps else 0)
+
+    def _submit_delay(self) -> float:
+        """Seconds to wait before the next call may be submitted under the throttle."""
+        return self.throttle.delay_for(self.sizer.next_call_lba(self.sector_size) * self.sector_size)
+
+    def _open_backend(self):
+        """Device access for the run; subclasses may substitute a simulated device."""
+        return trim_helpers.open_backend(self.drive_info.device_id_wmi)
+
+    def _plan_extents(self):
+        """Planner stage: decides which LBA ranges are discarded."""
+        if self.plan_mode == self.PLAN_FULL_DEVICE:
+            self.extents = [(0, self.total_lba)]
+        else:
+            self.listener.status_message("Scanning free space...")
+            plan_start = time.time()
+            free = trim_planner.plan_drive_extents(self.drive_info, self.data_path, self.sector_size)
+            self.free_extents = ExtentSet.from_ranges(free)
+            logger.info(f"Free-space plan for {self.drive_info.model}: {len(self.free_extents)} extents "
+                        f"in {time.time() - plan_start:.2f}s")
+            planned = self.free_extents
+            if self.plan_mode == self.PLAN_INCREMENTAL:
+                self.snapshot = TrimSnapshot.load(snapshot_path(self.drive_info))
+                if self.snapshot is None:
+                    logger.info(f"No TRIM snapshot for {self.drive_info.model}; running a full free-space pass")
+                elif not self.snapshot.usable_for(self.total_lba, self.sector_size):
+                    self.snapshot = None
+                else:
+                    planned = self.free_extents - self.snapshot.trimmed
+                    self.skipped_bytes = (self.free_extents.total() - planned.total()) * self.sector_size
+                    logger.info(f"Incremental plan for {self.drive_info.model}: {len(planned)} extents newly "
+                                f"free, {self.skipped_bytes / 1024**3:.2f} GB already trimmed")
+            self.extents = planned.to_ranges()
+        self.planned_bytes = sum(length for _, length in self.extents) * self.sector_size
+        self.listener.status_message(f"Trimming {self.planned_bytes / 1024**3:.2f} GB on {self.drive_info.model}...")
+
+    def run(self):
+        """Plans and runs the whole TRIM operation; blocks until it has finished."""
+        self._is_running = True # Control requests made before this point (a cancel right after start) still apply
+        self.bytes_discarded = 0
+        self.metrics = self._new_metrics()
+        self.trace = TraceBuffer() # Per-call details, only written to the log when something fails
+        self._trace_dumped = False
+        self.run_summary = {}
+        self.phase_times = {}
+        self.verification = {}
+        self.volume_results = []
+        self._phase_start = time.perf_counter()
+        run_start = time.time()
+
+        logger.info(f"TRIM worker started for drive: {self.drive_info.model} ({self.drive_info.device_id_wmi})")
+
+        try:
+            volumes = volume_trim.mounted_volumes(self.drive_info) if self.plan_mode != self.PLAN_FULL_DEVICE else []
+            if volumes:
+                self._trim_volumes(volumes)
+            else:
+                read_zero_after_trim = self._run_discards()
+
+            if volumes:
+                self.verification = {"skipped": "mounted volumes are trimmed by their filesystems"}
+            elif self.verify_fraction > 0 and not self._is_cancelled:
+                self._verify(read_zero_after_trim)
+                self._end_phase("verify_s")
+
+            if not volumes and not self._is_cancelled and self.blocked_chunks == 0:
+                self._save_snapshot() # Volume trims leave no LBA record to build an incremental plan on
+            self._end_phase("snapshot_s")
+
+            self._record_summary(run_start)
+            if self._is_cancelled:
+                logger.info(f"TRIM operation cancelled for {self.drive_info.model}")
+                self._record_history(run_history.OUTCOME_CANCELLED, "Operation Cancelled.", run_start)
+                self.listener.trim_finished(False, "Operation Cancelled.")
+            else:
+                logger.info(f"TRIM operation completed successfully for {self.drive_info.model} "
+                            f"({self.bytes_discarded / 1024**3:.2f} GB discarded)")
+                outcome = run_history.OUTCOME_BLOCKED if self.run_summary["blocked_ranges"] else run_history.OUTCOME_OK
+                self._record_history(outcome, "TRIM operation completed successfully.", run_start)
+                self.listener.trim_finished(True, "TRIM operation completed successfully.")
+
+        except Exception as e:
+            logger.error(f"Error during TRIM operation for {self.drive_info.model}: {e}", exc_info=True)
+            self.trace.dump(f"TRIM of {self.drive_info.model} failed")
+            self._record_history(run_history.OUTCOME_FAILED, f"Error: {e}", run_start)
+            self.listener.error_occurred(str(e))
+            self.listener.trim_finished(False, f"Error: {e}")
+        finally:
+            self.metrics.export(drive_key(self.drive_info)) # Final figures, also after a failure
+            self._is_running = False
+
+    def _run_discards(self):
+        """
+        Plans the run and dispatches its discards; returns whether the device reads
+        zeroes after TRIM (None if it does not say).
+        """
+        with self._open_backend() as backend:
+            # Re-derive the LBA layout from what the device actually reports
+            if backend.sector_size != self.sector_size:
+                self.sector_size = backend.sector_size
+                self.total_lba = int(self.drive_info.capacity_gb * 1024**3) // self.sector_size
+            logger.info(f"Using discard backend {backend} ({backend.max_ranges_per_call} ranges/call, "
+                        f"queue depth {self.queue_depth})")
+            self.granularity_lba = backend.granularity_lba
+            self.data_path = backend.data_path
+            read_zero_after_trim = backend.read_zero_after_trim
+            self._end_phase("open_s")
+            self._plan_extents()
+            self.lba_states = RangeStateMap(self.total_lba)
+
+            self.sizer = AdaptiveRangeSizer.for_backend(backend)
+            if self.resume:
+                self.journal = TrimJournal(journal_path(self.drive_info), self.total_lba, self.sector_size,
+                                           self.total_chunks, self.plan_mode, plan_digest(self.extents))
+                self.journal.open()
+            self._end_phase("plan_s")
+            dispatched = False
+            try:
+                with DiscardDispatcher(backend, self.queue_depth) as dispatcher:
+                    self._dispatcher = dispatcher
+                    try:
+                        self._dispatch(backend, dispatcher)
+                    finally:
+                        self._dispatcher = None
+                dispatched = True
+                self._end_phase("dispatch_s")
+            finally:
+                if self.journal is not None:
+                    # A finished run needs no checkpoint; otherwise keep it for the next attempt
+                    self.journal.close(remove=dispatched and not self._is_cancelled and self.blocked_chunks == 0)
+        return read_zero_after_trim
+
+    def _trim_volumes(self, volumes: list):
+        """
+        Trims the free space of the drive's mounted volumes through their filesystems,
+        one after the other; pause and cancel apply between volumes. Every volume is
+        tried, then a failure of any of them fails the run.
+        """
+        if self.plan_mode == self.PLAN_INCREMENTAL:
+            logger.info(f"{self.drive_info.model} has mounted volumes; the incremental plan does not apply, "
+                        f"their filesystems trim what is free")
+        self.lba_states = RangeStateMap(self.total_lba)
+        self.extents = []
+        self.planned_bytes = self.resumed_bytes = self.skipped_bytes = 0
+        self.blocked_chunks = 0
+        self._end_phase("plan_s")
+        start_time = time.time()
+        failed = []
+        for done, volume in enumerate(volumes):
+            if self._is_paused and not self._is_cancelled:
+                self.listener.status_message(f"TRIM paused on {self.drive_info.model}")
+                with self._control:
+                    self._control.wait_for(lambda: not self._is_paused or self._is_cancelled)
+                if not self._is_cancelled:
+                    self.listener.status_message(f"TRIM resumed on {self.drive_info.model}")
+            if self._is_cancelled:
+                break
+            self.listener.status_message(f"Trimming free space of {volume} through its filesystem...")
+            call_start = time.perf_counter()
+            try:
+                trimmed = self._trim_volume(volume)
+                error = None
+            except OSError as e:
+                trimmed, error = None, e
+                failed.append(f"{volume}: {e}")
+                logger.warning(f"Filesystem TRIM of {volume} on {self.drive_info.model} failed: {e}")
+            latency = time.perf_counter() - call_start
+            self.metrics.record_call(trimmed or 0, latency, error is None, error)
+            self.bytes_discarded += trimmed or 0
+            self.volume_results.append({"volume": volume, "bytes_trimmed": trimmed, "duration_s": latency,
+                                        "error": str(error) if error else None})
+            elapsed = time.time() - start_time
+            self.listener.progress_updated((done + 1) * self.total_chunks // len(volumes), self.total_chunks,
+                                           self.bytes_discarded / elapsed / 1024**2 if elapsed > 0 else 0,
+                                           float('inf'), self.throttle.state())
+        self._end_phase("dispatch_s")
+        if failed:
+            raise OSError(f"Filesystem TRIM failed on {'; '.join(failed)}")
+
+    def _trim_volume(self, volume: str):
+        """One volume's filesystem-level TRIM; returns the bytes trimmed or None. Subclasses may simulate it."""
+        return volume_trim.trim_volume(volume)
+
+    def _end_phase(self, name: str):
+        now = time.perf_counter()
+        self.phase_times[name] = now - self._phase_start
+        self._phase_start = now
+
+    def _record_history(self, outcome: str, message: str, run_start: float):
+        """Stores the run in the history database; before trim_finished so listeners can show it."""
+        if self.history_path == "":
+            return
+        # The row is built inside record_run's guard: a failure there must not keep the run from finishing
+        run_history.record_run(lambda: self._history_row(outcome, message, run_start), self.history_path or None)
+
+    def _history_row(self, outcome: str, message: str, run_start: float) -> dict:
+        self.metrics.fold()
+        latency = self.metrics.latency.summary()
+        throughput = self.metrics.throughput_summary()
+        blocked = self.run_summary.get("blocked_ranges", [])
+        dispatch_s = self.phase_times.get("dispatch_s") or (time.time() - run_start)
+        return {
+            "started": run_start,
+            "duration_s": time.time() - run_start,
+            "serial": run_history.drive_serial(self.drive_info),
+            "model": getattr(self.drive_info, "model", None) or "N/A",
+            "firmware": getattr(self.drive_info, "firmware_version", None) or "N/A",
+            "device": self.drive_info.device_id_wmi,
+            "plan_mode": self.plan_mode,
+            "outcome": outcome,
+            "message": message,
+            "planned_bytes": self.planned_bytes,
+            "bytes_discarded": self.bytes_discarded,
+            "throughput_mbps": self.bytes_discarded / dispatch_s / 1024**2 if dispatch_s > 0 else 0.0,
+            "throughput_p10_mbps": throughput["p10_mbps"],
+            "throughput_p50_mbps": throughput["p50_mbps"],
+            "throughput_p90_mbps": throughput["p90_mbps"],
+            "calls": self.metrics.calls_ok + self.metrics.calls_failed,
+            "failed_calls": self.metrics.calls_failed,
+            "latency_p50_ms": latency["p50_ms"],
+            "latency_p99_ms": latency["p99_ms"],
+            "latency_max_ms": latency["max_ms"],
+            "blocked_ranges": len(blocked),
+            "blocked_bytes": sum(length for _, length in blocked) * self.sector_size,
+            "phases": dict(self.phase_times),
+            "summary": self.run_summary,
+        }
+
+    def _verify(self, read_zero_after_trim):
+        """Verification stage: a sample of the discarded ranges must read back as zeroes."""
+        if read_zero_after_trim is False:
+            logger.info(f"{self.drive_info.model} does not return zeroes for discarded LBAs; verification skipped")
+            self.verification = {"skipped": "device does not read zeroes after TRIM"}
+            return
+        self.listener.status_message(f"Verifying {self.verify_fraction * 100:g}% of the discarded space...")
+        last_status = [time.monotonic()]
+        def on_progress(done_bytes, total_bytes):
+            if time.monotonic() - last_status[0] >= 1.0 and total_bytes:
+                last_status[0] = time.monotonic()
+                self.listener.status_message(f"Verifying: {done_bytes / total_bytes * 100:.0f}% "
+                                             f"of {total_bytes / 1024**2:.0f} MB read")
+        try:
+            result = trim_verify.verify_ranges(self.data_path,
+                                               self.lba_states.extents(STATE_PROCESSED).to_ranges(), self.sector_size,
+                                               self.verify_fraction, self.granularity_lba,
+                                               should_stop=lambda: self._is_cancelled, on_progress=on_progress)
+        except OSError as e: # The device could not be opened for reading; the TRIM itself is done
+            logger.warning(f"Could not verify {self.drive_info.model}: {e}")
+            self.verification = {"skipped": f"device not readable: {e}"}
+            return
+        self.verification = dict(result.summary(self.sector_size), read_zero_after_trim=read_zero_after_trim)
+        failed = (result.nonzero | result.unreadable).to_ranges()
+        if failed:
+            self.lba_states.assign_ranges(failed, STATE_VERIFY_FAILED)
+            deltas = StateDeltaBuffer()
+            deltas.record_indices(np.unique(self.tracker.split(failed)[0]), STATE_VERIFY_FAILED)
+            self.listener.chunk_states_changed(deltas.take(force=True))
+            logger.warning(f"Verification of {self.drive_info.model}: {result.nonzero.total()} sampled LBAs did not "
+                           f"read back as zeroes and {result.unreadable.total()} could not be read, first at LBA "
+                           f"{failed[0][0]}" + ("" if read_zero_after_trim else
+                                                 " (the drive may not guarantee zeroes after TRIM)"))
+
+    def _save_snapshot(self):
+        """After a complete free-space or incremental run: all current free space is now trimmed."""
+        if self.free_extents is None:
+            return # Full-device runs do not track free space
+        runs = self.snapshot.incremental_runs + 1 if self.snapshot is not None else 0
+        try:
+            TrimSnapshot(self.free_extents, self.total_lba, self.sector_size,
+                         created=self.snapshot.created if self.snapshot is not None else None,
+                         incremental_runs=runs).save(snapshot_path(self.drive_info))
+        except OSError as e:
+            logger.warning(f"Could not save TRIM snapshot for {self.drive_info.model}: {e}")
+
+    def _dispatch(self, backend, dispatcher: DiscardDispatcher):
+        """
+        Keeps the dispatcher's queues full with calls sized by the adaptive sizer and
+        turns completions into batched chunk-state deltas and progress.
+        """
+        start_time = time.time()
+        tracker = self.tracker = ChunkTracker(self.extents, self.total_lba, self.total_chunks)
+        deltas = StateDeltaBuffer()
+        remaining = self.extents
+        self.resumed_bytes = 0
+        self.blocked_chunks = 0
+        if self.journal is not None:
+            completed = self.journal.completed_chunks()
+            if completed.size:
+                deltas.record_indices(completed, STATE_PROCESSED)
+                remaining = trim_helpers.subtract_ranges(self.extents, tracker.skip(completed))
+                self.lba_states.assign_ranges(trim_helpers.subtract_ranges(self.extents, remaining), STATE_PROCESSED)
+                self.resumed_bytes = self.planned_bytes - sum(length for _, length in remaining) * self.sector_size
+                self.listener.status_message(f"Resuming: {self.resumed_bytes / 1024**3:.2f} GB already trimmed, "
+                                         f"{(self.planned_bytes - self.resumed_bytes) / 1024**3:.2f} GB to go...")
+        cursor = trim_helpers.RangeCursor(remaining, backend.max_ranges_per_call, backend.max_range_lba,
+                                          backend.granularity_lba)
+
+        def finish_chunks(finished):
+            chunks, failed = finished
+            deltas.record_indices(chunks[~failed], STATE_PROCESSED)
+            deltas.record_indices(chunks[failed], STATE_BLOCKED)
+            self.blocked_chunks += int(failed.sum())
+            if self.journal is not None:
+                self.journal.mark(chunks[~failed])
+
+        def publish(force=False):
+            batch = deltas.take(force)
+            if batch is not None:
+                self.listener.chunk_states_changed(batch)
+                self._emit_progress(tracker.finished_count, start_time)
+                self.metrics.tick() # Throughput per second, at the UI rate rather than per call
+
+        held = [] # (batch, tag) withdrawn from the dispatcher by a pause, submitted again on resume
+        limited_by = self.throttle.limited_by
+        while True:
+            if self._is_cancelled or self._is_paused:
+                # Only the calls already on the device are waited for
+                held += dispatcher.withdraw()
+                if self._is_cancelled:
+                    for batch, _ in held:
+                        self.lba_states.assign_ranges(batch, STATE_NON_PROCEEDED)
+                    held = []
+            else:
+                held += dispatcher.release()
+                for batch, tag in held:
+                    dispatcher.submit(batch, tag)
+                held = []
+
+            # Submit until the in-flight window or the sizer's budget is full
+            while (not cursor.exhausted and not self._is_cancelled and not self._is_paused
+                   and dispatcher.in_flight < dispatcher.window and self._submit_delay() == 0):
+                call_lba = self._next_call_lba(dispatcher)
+                if not call_lba:
+                    break
+                batch = cursor.next_batch(call_lba)
+                started, passed = tracker.on_submit(batch)
+                finish_chunks(passed)
+                deltas.record_indices(started, STATE_PROCESSING) # Tell UI these chunks are active
+                self.lba_states.assign_ranges(batch, STATE_PROCESSING)
+                dispatcher.submit(batch)
+                self.throttle.on_submit(sum(length for _, length in batch) * self.sector_size)
+
+            if self.throttle.limited_by != limited_by:
+                limited_by = self.throttle.limited_by
+                logger.info(f"Discard rate on {self.drive_info.model} now limited by: {limited_by} "
+                            f"({self.throttle.effective_bps / 1024**2:.0f} MB/s)")
+                self._emit_progress(tracker.finished_count, start_time)
+
+            publish()
+            if self.journal is not None:
+                self.journal.maybe_flush()
+            self.metrics.maybe_export(drive_key(self.drive_info))
+
+            if dispatcher.in_flight == 0:
+                if cursor.exhausted and not self._is_cancelled:
+                    finish_chunks(tracker.finish_remaining())
+                publish(force=True) # Nothing in flight: show the current state before waiting or leaving
+                if (cursor.exhausted and not held) or self._is_cancelled:
+                    break
+                if self._is_paused:
+                    self.listener.status_message(f"TRIM paused on {self.drive_info.model}")
+                    with self._control:
+                        self._control.wait_for(lambda: not self._is_paused or self._is_cancelled)
+                    if not self._is_cancelled:
+                        self.listener.status_message(f"TRIM resumed on {self.drive_info.model}")
+                    continue
+                delay = self._submit_delay()
+                if delay > 0:
+                    with self._control: # Throttled; a pause or cancel ends the wait early
+                        self._control.wait_for(lambda: self._is_paused or self._is_cancelled, timeout=delay)
+                continue
+
+            timeout = self._submit_delay() or None
+            if len(deltas):
+                # Wake up in time to publish pending deltas even if no completion arrives
+                timeout = deltas.due_in() if timeout is None else min(timeout, deltas.due_in())
+            completion = dispatcher.get_completion(timeout=timeout)
+            if completion is None:
+                continue # Rate limit allows another submission, deltas are due, or a control request
+            call_bytes = completion.lba_count * self.sector_size
+            self.sizer.record(call_bytes, completion.latency)
+            self.metrics.record_call(call_bytes, completion.latency, completion.ok, completion.error)
+            self.trace.record(completion.batch[0][0], len(completion.batch), completion.lba_count,
+                              completion.latency, completion.ok)
+            if completion.ok:
+                self.bytes_discarded += call_bytes
+            else:
+                logger.warning(f"Discard of {len(completion.batch)} ranges at LBA {completion.batch[0][0]} "
+                               f"failed on {self.drive_info.model}: {completion.error}")
+                if not self._trace_dumped: # The calls leading up to the first failure of the run
+                    self._trace_dumped = True
+                    self.trace.dump(f"First failed discard on {self.drive_info.model}")
+            self.lba_states.assign_ranges(completion.batch, STATE_PROCESSED if completion.ok else STATE_BLOCKED)
+            finish_chunks(tracker.on_complete(completion.batch, completion.ok))
+
+    def _next_call_lba(self, dispatcher: DiscardDispatcher) -> int:
+        """
+        LBAs for the next call, or 0 while the calls in flight use up the sizer's budget.
+        The budget covers all of them together: calls in flight share the device, so a
+        pause or cancel, which waits for them, takes about one target latency at most.
+        """
+        budget = self.sizer.next_call_lba(self.sector_size)
+        if dispatcher.in_flight == 0:
+            return budget
+        free = budget - dispatcher.lba_in_flight
+        return free if free >= budget // dispatcher.queue_depth else 0 # No slivers: they only add calls
+
+    def _emit_progress(self, processed_chunks: int, start_time: float):
+        elapsed_time = time.time() - start_time
+        if elapsed_time > 0 and self.bytes_discarded > 0:
+            bytes_per_second = self.bytes_discarded / elapsed_time
+            speed_mbps = bytes_per_second / (1024**2)
+            eta_seconds = max(0.0, self.planned_bytes - self.resumed_bytes - self.bytes_discarded) / bytes_per_second
+        else:
+            speed_mbps = 0
+            eta_seconds = float('inf')
+        self.listener.progress_updated(processed_chunks, self.total_chunks, speed_mbps, eta_seconds,
+                                   self.throttle.state())
+
+    def _record_summary(self, run_start: float):
+        """Collects the figures of the run, including the discard sizes the sizer settled on."""
+        duration = time.time() - run_start
+        self.metrics.fold()
+        self.run_summary = {
+            "drive_model": self.drive_info.model,
+            "plan_mode": self.plan_mode,
+            "planned_bytes": self.planned_bytes,
+            "bytes_discarded": self.bytes_discarded,
+            "resumed_bytes": self.resumed_bytes,
+            "skipped_bytes": self.skipped_bytes,
+            "blocked_ranges": self.lba_states.extents(STATE_BLOCKED).to_ranges(),
+            "duration_s": duration,
+            "queue_depth": self.queue_depth,
+            "request_sizing": self.sizer.summary() if self.sizer else {},
+            "throttle": self.throttle.state(),
+            "latency": self.metrics.latency.summary(),
+            "throughput": self.metrics.throughput_summary(),
+            "errors": dict(self.metrics.errors),
+            "phases": dict(self.phase_times),
+            "verification": self.verification,
+            "volumes": list(self.volume_results),
+        }
+        sizing = self.run_summary["request_sizing"]
+        if sizing:
+            logger.info(f"Run summary for {self.drive_info.model}: {self.bytes_discarded / 1024**3:.2f} GB in "
+                        f"{duration:.1f}s, {sizing['calls']} calls, call size "
+                        f"{sizing['min_call_bytes'] / 1024**2:.1f}-{sizing['max_call_bytes'] / 1024**2:.1f} MB "
+                        f"(final {sizing['final_call_bytes'] / 1024**2:.1f} MB, "
+                        f"target {sizing['target_latency_ms']:.0f} ms)")
+            latency = self.run_summary["latency"]
+            logger.info(f"Discard latency on {self.drive_info.model}: p50 {latency['p50_ms']:.1f} ms, "
+                        f"p99 {latency['p99_ms']:.1f} ms, max {latency['max_ms']:.1f} ms; "
+                        f"{self.metrics.calls_failed} failed calls")
+        blocked = self.run_summary["blocked_ranges"]
+        if blocked:
+            logger.warning(f"{len(blocked)} LBA ranges of {self.drive_info.model} could not be discarded "
+                           f"({sum(length for _, length in blocked) * self.sector_size / 1024**2:.1f} MB, "
+                           f"first at LBA {blocked[0][0]})")
+
+    def cancel_operation(self):
+        logger.info(f"Requesting cancellation for TRIM on {self.drive_info.model}")
+        self._signal_control(cancelled=True)
+
+    def pause_operation(self):
+        logger.info(f"Requesting pause for TRIM on {self.drive_info.model}")
+        self._signal_control(paused=True)
+
+    def resume_operation(self):
+        logger.info(f"Requesting resume for TRIM on {self.drive_info.model}")
+        self._signal_control(paused=False)
+
+    def _signal_control(self, paused: bool = None, cancelled: bool = None):
+        """Applies a control request and wakes the dispatch loop wherever it waits."""
+        with self._control:
+            if paused is not None:
+                self._is_paused = paused
+            if cancelled:
+                self._is_cancelled = True
+            self._control.notify_all()
+        dispatcher = self._dispatcher
+        if dispatcher is not None:
+            dispatcher.wake()
+
+    def is_active(self):
+        return self._is_running
+
+    def is_paused(self):
+        return self._is_paused
+
+    def is_cancelled(self):
+        return self._is_cancelled
\ No newline at end of file
@@ -1,16 +1,410 @@
 # trimvision/core/trim_helpers.py
-# This file will contain the low-level ctypes calls for DeviceIoControl TRIM.
-# For now, it's a placeholder.
+# Low-level discard backends and the range-batching TRIM engine.
+#
+# The engine works on plain (start_lba, length_lba) tuples. Ranges are sorted,
+# adjacent/overlapping ones are merged, and up to MAX_DSM_RANGES_PER_CALL of them
+# are packed into every discard call handed to the device backend.
 
+import os
+import sys
+import stat
+import struct
+import ctypes
+import threading
+from trimvision import config
 from trimvision.core.logger import logger
 
-def perform_trim_on_range(device_path: str, start_lba: int, length_lba: int) -> bool:
+
+def merge_ranges(ranges):
+    """Sorts (start_lba, length_lba) ranges and coalesces adjacent or overlapping ones."""
+    merged = []
+    for start, length in sorted(r for r in ranges if r[1] > 0):
+        if merged and start <= merged[-1][0] + merged[-1][1]:
+            prev_start, prev_length = merged[-1]
+            merged[-1] = (prev_start, max(prev_length, start + length - prev_start))
+        else:
+            merged.append((start, length))
+    return merged
+
+
+def subtract_ranges(ranges, holes):
+    """Returns the merged parts of ranges not covered by any of holes."""
+    result = []
+    holes = merge_ranges(holes)
+    h = 0
+    for start, length in merge_ranges(ranges):
+        end = start + length
+        while h < len(holes) and holes[h][0] + holes[h][1] <= start:
+            h += 1 # Hole ends before this range
+        i = h
+        while start < end and i < len(holes) and holes[i][0] < end:
+            hole_start, hole_end = holes[i][0], holes[i][0] + holes[i][1]
+            if hole_start > start:
+                result.append((start, hole_start - start))
+            start = max(start, hole_end)
+            i += 1
+        if start < end:
+            result.append((start, end - start))
+    return result
+
+
+def split_range(start_lba: int, length_lba: int, max_length_lba: int = None):
+    """Yields pieces of a range no longer than max_length_lba (None = unlimited)."""
+    if not max_length_lba or length_lba <= max_length_lba:
+        yield (start_lba, length_lba)
+        return
+    end_lba = start_lba + length_lba
+    while start_lba < end_lba:
+        piece = min(max_length_lba, end_lba - start_lba)
+        yield (start_lba, piece)
+        start_lba += piece
+
+
+def batch_ranges(ranges, max_ranges_per_call: int = config.MAX_DSM_RANGES_PER_CALL,
+                 max_length_lba: int = None):
+    """
+    Yields lists of at most max_ranges_per_call ranges.
+    Ranges are expected to be merged already; long ones are split to max_length_lba.
+    """
+    batch = []
+    for start, length in ranges:
+        for piece in split_range(start, length, max_length_lba):
+            batch.append(piece)
+            if len(batch) >= max_ranges_per_call:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+class RangeCursor:
+    """
+    Walks a list of ranges and cuts discard batches of a requested size.
+    Used where the size of each call is decided on the fly (see adaptive_sizer).
+    """
+    def __init__(self, ranges, max_ranges_per_call: int = config.MAX_DSM_RANGES_PER_CALL,
+                 max_length_lba: int = None, granularity_lba: int = 1):
+        self._ranges = merge_ranges(ranges)
+        self.max_ranges_per_call = max_ranges_per_call
+        self.max_length_lba = max_length_lba
+        # Cuts inside a range land on multiples of this, so no discard granule is split between calls
+        self.granularity_lba = max(1, granularity_lba)
+        self._index = 0
+        self._offset = 0 # LBAs of the current range already handed out
+
+    @property
+    def exhausted(self) -> bool:
+        return self._index >= len(self._ranges)
+
+    def next_batch(self, max_lba: int):
+        """Returns up to max_ranges_per_call ranges totalling at most max_lba LBAs, or None when done."""
+        batch = []
+        budget = max(1, max_lba)
+        while self._index < len(self._ranges) and len(batch) < self.max_ranges_per_call and budget > 0:
+            start, length = self._ranges[self._index]
+            remaining = length - self._offset
+            piece = min(remaining, budget, self.max_length_lba or remaining)
+            if piece < remaining and self.granularity_lba > 1:
+                cut = start + self._offset + piece
+                aligned = cut - cut % self.granularity_lba
+                if aligned <= start + self._offset: # Budget smaller than a granule: finish the granule
+                    aligned = min(cut - cut % self.granularity_lba + self.granularity_lba, start + length)
+                    if batch:
+                        break # Leave it for the next call rather than exceed this one's budget
+                piece = aligned - start - self._offset
+            batch.append((start + self._offset, piece))
+            budget -= piece
+            self._offset += piece
+            if self._offset >= length:
+                self._index += 1
+                self._offset = 0
+        return batch or None
+
+
+class DiscardBackend:
     """
-    Placeholder for actual TRIM operation on an LBA range.
-    In a real implementation, this would use ctypes and DeviceIoControl.
+    Device access used by the TRIM engine.
+    A backend receives batches of LBA ranges and discards them in as few system calls
+    as the platform allows. Failures are reported by raising OSError.
     """
-    logger.debug(f"Simulating TRIM on {device_path}: LBA {start_lba} for {length_lba} blocks.")
-    # Simulate success/failure
-    # import random
-    # return random.choice([True, True, True, False]) # Simulate occasional failure
-    return True # Assume success for now
\ No newline at end of file
+    name = "base"
+
+    def __init__(self, device_path: str, sector_size: int = config.DEFAULT_SECTOR_SIZE,
+                 max_ranges_per_call: int = config.MAX_DSM_RANGES_PER_CALL):
+        self.device_path = device_path
+        self.data_path = device_path # Where the device's content is read from (planning, verification)
+        self.sector_size = sector_size
+        self.max_ranges_per_call = max_ranges_per_call
+        self.max_range_lba = None # None = no per-range length limit
+        self.granularity_lba = 1 # Smallest unit the device deallocates; partial units are ignored
+        self.read_zero_after_trim = None # Whether discarded LBAs read back as zeroes; None = unknown
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def size_bytes(self) -> int:
+        raise NotImplementedError
+
+    def discard(self, ranges):
+        """Discards a batch of (start_lba, length_lba) ranges. Raises OSError on failure."""
+        raise NotImplementedError
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.device_path} sector={self.sector_size}>"
+
+
+class LinuxBlockBackend(DiscardBackend):
+    """BLKDISCARD on block devices (disks, partitions, loop devices)."""
+    name = "linux-blkdiscard"
+
+    BLKSSZGET = 0x1268
+    BLKGETSIZE64 = 0x80081272
+    BLKDISCARD = 0x1277
+
+    def __init__(self, device_path, **kwargs):
+        super().__init__(device_path, **kwargs)
+        self._fd = None
+
+    def open(self):
+        import fcntl
+        self._fd = os.open(self.device_path, os.O_RDWR | os.O_CLOEXEC)
+        buf = fcntl.ioctl(self._fd, self.BLKSSZGET, struct.pack("I", 0))
+        self.sector_size = struct.unpack("I", buf)[0] or self.sector_size
+        name = os.path.basename(os.path.realpath(self.device_path))
+        for queue in (f"/sys/class/block/{name}/queue", f"/sys/class/block/{name}/../queue"): # Disk, partition
+            try:
+                with open(os.path.join(queue, "discard_granularity")) as f:
+                    self.granularity_lba = max(1, int(f.read()) // self.sector_size)
+                break
+            except (OSError, ValueError):
+                continue
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def size_bytes(self):
+        import fcntl
+        buf = fcntl.ioctl(self._fd, self.BLKGETSIZE64, struct.pack("Q", 0))
+        return struct.unpack("Q", buf)[0]
+
+    def discard(self, ranges):
+        import fcntl
+        # BLKDISCARD takes a single (offset, length) pair; the kernel merges
+        # back-to-back requests for the same device.
+        for start, length in ranges:
+            fcntl.ioctl(self._fd, self.BLKDISCARD,
+                        struct.pack("QQ", start * self.sector_size, length * self.sector_size))
+
+
+class SparseFileBackend(DiscardBackend):
+    """fallocate(PUNCH_HOLE) on regular (sparse) image files."""
+    name = "sparse-file"
+
+    FALLOC_FL_KEEP_SIZE = 0x01
+    FALLOC_FL_PUNCH_HOLE = 0x02
+
+    def __init__(self, device_path, **kwargs):
+        super().__init__(device_path, **kwargs)
+        self._fd = None
+        self._fallocate = None
+        self.read_zero_after_trim = True # Punched holes read as zeroes
+
+    def open(self):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._fallocate = libc.fallocate
+        self._fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+        self._fallocate.restype = ctypes.c_int
+        self._fd = os.open(self.device_path, os.O_RDWR | os.O_CLOEXEC)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def size_bytes(self):
+        return os.fstat(self._fd).st_size
+
+    def discard(self, ranges):
+        mode = self.FALLOC_FL_PUNCH_HOLE | self.FALLOC_FL_KEEP_SIZE
+        for start, length in ranges:
+            rc = self._fallocate(self._fd, mode, start * self.sector_size, length * self.sector_size)
+            if rc != 0:
+                err = ctypes.get_errno()
+                raise OSError(err, f"fallocate(PUNCH_HOLE) failed: {os.strerror(err)}")
+
+
+class WindowsDsmBackend(DiscardBackend):
+    """
+    IOCTL_STORAGE_MANAGE_DATA_SET_ATTRIBUTES (DSM TRIM) on \\\\.\\PHYSICALDRIVEn handles.
+    Synchronous I/O on one handle is serialized by Windows, so every calling thread
+    gets its own handle to allow several discards in flight.
+    """
+    name = "windows-dsm"
+
+    IOCTL_STORAGE_MANAGE_DATA_SET_ATTRIBUTES = 0x002D9404
+    DEVICE_DSM_ACTION_TRIM = 1
+    GENERIC_READ = 0x80000000
+    GENERIC_WRITE = 0x40000000
+    FILE_SHARE_READ = 0x1
+    FILE_SHARE_WRITE = 0x2
+    OPEN_EXISTING = 3
+    IOCTL_DISK_GET_LENGTH_INFO = 0x0007405C
+
+    # DEVICE_MANAGE_DATA_SET_ATTRIBUTES is 28 bytes; the range array starts 8-byte aligned.
+    _HEADER_SIZE = 28
+    _RANGES_OFFSET = 32
+
+    def __init__(self, device_path, **kwargs):
+        super().__init__(device_path, **kwargs)
+        self._handle = None
+        self._kernel32 = None
+        self._local = threading.local()
+        self._thread_handles = []
+        self._handles_lock = threading.Lock()
+
+    def open(self):
+        from ctypes import wintypes
+        self._kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        self._kernel32.CreateFileW.restype = wintypes.HANDLE
+        self._kernel32.CreateFileW.argtypes = [wintypes.LPCWSTR, wintypes.DWORD, wintypes.DWORD,
+                                               wintypes.LPVOID, wintypes.DWORD, wintypes.DWORD,
+                                               wintypes.HANDLE]
+        self._kernel32.DeviceIoControl.argtypes = [wintypes.HANDLE, wintypes.DWORD, wintypes.LPVOID,
+                                                   wintypes.DWORD, wintypes.LPVOID, wintypes.DWORD,
+                                                   ctypes.POINTER(wintypes.DWORD), wintypes.LPVOID]
+        self._handle = self._open_handle()
+        self._local.handle = self._handle
+
+    def _open_handle(self):
+        handle = self._kernel32.CreateFileW(self.device_path,
+                                            self.GENERIC_READ | self.GENERIC_WRITE,
+                                            self.FILE_SHARE_READ | self.FILE_SHARE_WRITE,
+                                            None, self.OPEN_EXISTING, 0, None)
+        if handle is None or handle == ctypes.c_void_p(-1).value:
+            raise ctypes.WinError(ctypes.get_last_error())
+        return handle
+
+    def _thread_handle(self):
+        handle = getattr(self._local, 'handle', None)
+        if handle is None:
+            handle = self._open_handle()
+            self._local.handle = handle
+            with self._handles_lock:
+                self._thread_handles.append(handle)
+        return handle
+
+    def close(self):
+        with self._handles_lock:
+            for handle in self._thread_handles:
+                self._kernel32.CloseHandle(handle)
+            self._thread_handles = []
+        if self._handle is not None:
+            self._kernel32.CloseHandle(self._handle)
+            self._handle = None
+        self._local = threading.local()
+
+    def _ioctl(self, code, in_buf, out_size=0):
+        from ctypes import wintypes
+        out_buf = ctypes.create_string_buffer(out_size) if out_size else None
+        returned = wintypes.DWORD(0)
+        in_len = len(in_buf) if in_buf is not None else 0
+        ok = self._kernel32.DeviceIoControl(self._thread_handle(), code, in_buf, in_len,
+                                            out_buf, out_size, ctypes.byref(returned), None)
+        if not ok:
+            raise ctypes.WinError(ctypes.get_last_error())
+        return out_buf.raw[:returned.value] if out_buf is not None else b""
+
+    def size_bytes(self):
+        return struct.unpack("<q", self._ioctl(self.IOCTL_DISK_GET_LENGTH_INFO, None, 8))[0]
+
+    def discard(self, ranges):
+        # One DeviceIoControl carries the whole batch of DEVICE_DATA_SET_RANGE entries.
+        ranges_blob = b"".join(struct.pack("<qQ", start * self.sector_size, length * self.sector_size)
+                               for start, length in ranges)
+        header = struct.pack("<7I", self._HEADER_SIZE, self.DEVICE_DSM_ACTION_TRIM, 0,
+                             0, 0, self._RANGES_OFFSET, len(ranges_blob))
+        payload = header.ljust(self._RANGES_OFFSET, b"\0") + ranges_blob
+        self._ioctl(self.IOCTL_STORAGE_MANAGE_DATA_SET_ATTRIBUTES, ctypes.create_string_buffer(payload, len(payload)))
+
+
+def open_backend(device_path: str, **kwargs) -> DiscardBackend:
+    """Picks the discard backend matching the platform and the kind of target path."""
+    if device_path.startswith("emu:"): # Emulated device, on any platform
+        from trimvision.core.device_emulator import EmulatedDeviceBackend
+        return EmulatedDeviceBackend(device_path, **kwargs)
+    if os.name == 'nt':
+        return WindowsDsmBackend(device_path, **kwargs)
+    if not sys.platform.startswith('linux'):
+        raise OSError(f"No discard backend available for platform {sys.platform}")
+    mode = os.stat(device_path).st_mode
+    if stat.S_ISBLK(mode):
+        return LinuxBlockBackend(device_path, **kwargs)
+    if stat.S_ISREG(mode):
+        return SparseFileBackend(device_path, **kwargs)
+    raise OSError(f"{device_path} is neither a block device nor a regular file")
+
+
+class TrimResult:
+    """Outcome of a trim_ranges() call."""
+    def __init__(self):
+        self.calls = 0
+        self.ranges_ok = 0
+        self.lba_ok = 0
+        self.failed_ranges = []
+        self.cancelled = False
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed_ranges and not self.cancelled
+
+    def bytes_discarded(self, sector_size: int) -> int:
+        return self.lba_ok * sector_size
+
+
+def trim_ranges(backend: DiscardBackend, ranges, should_stop=None, on_batch=None) -> TrimResult:
+    """
+    Discards a list of (start_lba, length_lba) ranges through an open backend.
+    Ranges are merged and packed into batches of backend.max_ranges_per_call.
+    should_stop() is checked before every call; on_batch(batch, ok) after it.
+    """
+    result = TrimResult()
+    for batch in batch_ranges(merge_ranges(ranges), backend.max_ranges_per_call, backend.max_range_lba):
+        if should_stop and should_stop():
+            result.cancelled = True
+            break
+        try:
+            backend.discard(batch)
+            ok = True
+        except OSError as e:
+            logger.warning(f"Discard of {len(batch)} ranges starting at LBA {batch[0][0]} failed on "
+                           f"{backend.device_path}: {e}")
+            ok = False
+        result.calls += 1
+        if ok:
+            result.ranges_ok += len(batch)
+            result.lba_ok += sum(length for _, length in batch)
+        else:
+            result.failed_ranges.extend(batch)
+        if on_batch:
+            on_batch(batch, ok)
+    return result
+
+
+def perform_trim_on_range(device_path: str, start_lba: int, length_lba: int) -> bool:
+    """Opens the device and discards a single LBA range through the batching engine."""
+    logger.debug("TRIM on %s: LBA %d for %d blocks.", device_path, start_lba, length_lba) # Formatted by the writer thread
+    with open_backend(device_path) as backend:
+        return trim_ranges(backend, [(start_lba, length_lba)]).ok
@@ -0,0 +1,162 @@
+# trimvision/core/trim_journal.py
+# Crash-safe checkpoint journal of a TRIM run.
+#
+# One file per drive, keyed by serial number: a fixed header with the planning
+# parameters, followed by a bitmap with one bit per progress chunk. A bit is set
+# once every planned LBA of the chunk has been discarded. The file is mmap'ed;
+# bits only ever go from 0 to 1 and are flushed at bounded intervals, so a torn
+# or stale flush can only make a resumed run redo work, never skip it.
+
+import os
+import re
+import mmap
+import time
+import struct
+import hashlib
+import numpy as np
+from trimvision import config
+from trimvision.core.logger import logger
+from trimvision.utils.app_paths import data_dir
+
+_MAGIC = b"TVJOURN1"
+# magic, header size, total_lba, sector_size, total_chunks, plan_mode, plan digest, created (unix time)
+_HEADER = struct.Struct("<8sIQIQ8s32sd")
+_HEADER_SIZE = 4096 # Bitmap starts on its own page
+
+
+def plan_digest(extents) -> bytes:
+    """SHA-256 of a plan's (start_lba, length_lba) extents."""
+    return hashlib.sha256(np.asarray(extents, dtype=np.int64).tobytes()).digest()
+
+
+def drive_key(drive_info) -> str:
+    """File-name-safe identity of a drive: its serial number, or its device path if there is none."""
+    key = drive_info.serial_number if drive_info.serial_number not in (None, "", "N/A") else drive_info.device_id_wmi
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", str(key).strip()).strip("_") or "unknown"
+
+
+def journal_path(drive_info, directory: str = None) -> str:
+    """Journal file of a drive, keyed by drive_key()."""
+    return os.path.join(data_dir(directory or config.JOURNAL_DIR), f"{drive_key(drive_info)}.tvj")
+
+
+def read_completed_chunks(path: str) -> np.ndarray:
+    """Finished chunk indices recorded in a journal file (empty if it is missing or unreadable)."""
+    try:
+        with open(path, "rb") as f:
+            magic, header_size, _, _, total_chunks, _, _, _ = _HEADER.unpack(f.read(_HEADER.size))
+            f.seek(header_size)
+            bits = np.frombuffer(f.read((total_chunks + 7) // 8), dtype=np.uint8)
+    except (OSError, struct.error):
+        return np.zeros(0, dtype=np.int64)
+    if magic != _MAGIC or bits.size * 8 < total_chunks:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.unpackbits(bits, count=total_chunks, bitorder='little'))
+
+
+class TrimJournal:
+    """
+    Bitmap of finished chunks for one drive and plan. open() returns the number of chunks
+    already finished by an earlier, interrupted run (0 for a fresh journal).
+    """
+    def __init__(self, path: str, total_lba: int, sector_size: int, total_chunks: int,
+                 plan_mode: str, digest: bytes, flush_interval_s: float = config.JOURNAL_FLUSH_INTERVAL_S):
+        self.path = path
+        self.total_lba = total_lba
+        self.sector_size = sector_size
+        self.total_chunks = total_chunks
+        self.plan_mode = plan_mode
+        self.digest = digest
+        self.flush_interval_s = flush_interval_s
+        self._file = None
+        self._mmap = None
+        self._bits = None # uint8 view of the bitmap inside the mapping
+        self._dirty = False
+        self._last_flush = 0.0
+
+    @property
+    def _file_size(self) -> int:
+        return _HEADER_SIZE + (self.total_chunks + 7) // 8
+
+    def open(self) -> int:
+        resumed = 0
+        if os.path.exists(self.path):
+            resumed = self._open_existing()
+        if self._mmap is None:
+            self._create()
+        self._last_flush = time.monotonic()
+        return resumed
+
+    def _open_existing(self) -> int:
+        with open(self.path, "rb") as f:
+            header = f.read(_HEADER.size)
+        try:
+            magic, header_size, total_lba, sector_size, total_chunks, plan_mode, digest, created = _HEADER.unpack(header)
+        except struct.error:
+            magic = None
+        if magic != _MAGIC or header_size != _HEADER_SIZE or os.path.getsize(self.path) != self._file_size:
+            logger.warning(f"Ignoring unreadable checkpoint journal {self.path}")
+            return 0
+        if (total_lba, sector_size, total_chunks, plan_mode.rstrip(b"\0")) != \
+                (self.total_lba, self.sector_size, self.total_chunks, self.plan_mode.encode()[:8]):
+            logger.info(f"Checkpoint journal {self.path} is for a different layout or plan mode; starting over")
+            return 0
+        if digest != self.digest:
+            # Free space moved since the checkpoint. Finished chunks had all of their free
+            # space discarded back then, so skipping them is still safe.
+            logger.info(f"Free-space plan changed since the checkpoint of {self.path}; keeping finished chunks")
+        self._map(open(self.path, "r+b"))
+        resumed = int(np.unpackbits(self._bits, count=self.total_chunks, bitorder='little').sum())
+        logger.info(f"Resuming from checkpoint journal {self.path}: {resumed}/{self.total_chunks} chunks "
+                    f"finished (started {time.ctime(created)})")
+        return resumed
+
+    def _create(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            header = _HEADER.pack(_MAGIC, _HEADER_SIZE, self.total_lba, self.sector_size, self.total_chunks,
+                                  self.plan_mode.encode()[:8], self.digest, time.time())
+            f.write(header.ljust(_HEADER_SIZE, b"\0"))
+            f.truncate(self._file_size)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path) # A journal is either complete or absent
+        self._map(open(self.path, "r+b"))
+
+    def _map(self, f):
+        self._file = f
+        self._mmap = mmap.mmap(f.fileno(), self._file_size)
+        self._bits = np.frombuffer(self._mmap, dtype=np.uint8, offset=_HEADER_SIZE)
+
+    def completed_chunks(self) -> np.ndarray:
+        """Indices of the chunks marked finished."""
+        return np.flatnonzero(np.unpackbits(self._bits, count=self.total_chunks, bitorder='little'))
+
+    def mark(self, chunks):
+        """Marks chunks finished; they reach disk at the next flush."""
+        chunks = np.asarray(chunks, dtype=np.int64)
+        if chunks.size:
+            np.bitwise_or.at(self._bits, chunks >> 3, (1 << (chunks & 7)).astype(np.uint8))
+            self._dirty = True
+
+    def maybe_flush(self):
+        if self._dirty and time.monotonic() - self._last_flush >= self.flush_interval_s:
+            self.flush()
+
+    def flush(self):
+        if self._mmap is not None and self._dirty:
+            self._mmap.flush()
+            self._dirty = False
+        self._last_flush = time.monotonic()
+
+    def close(self, remove: bool = False):
+        """Flushes and closes the journal; remove=True deletes it (the run finished)."""
+        if self._mmap is not None:
+            self.flush()
+            self._bits = None # Release the buffer export before closing the mapping
+            self._mmap.close()
+            self._file.close()
+            self._mmap = self._file = None
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+            logger.info(f"Removed checkpoint journal {self.path}")
@@ -0,0 +1,289 @@
+# trimvision/core/trim_metrics.py
+# Per-call instrumentation of discards.
+#
+# Every completed discard call is recorded into a log-bucketed latency histogram
+# (HDR style: 16 linear sub-buckets per power of two of microseconds, so any
+# percentile is within ~6% of the true value in constant memory), a per-second
+# throughput ring buffer and error counters.
+#
+# The per-call path only appends the latency to a flat buffer and bumps two
+# counters; the buffer is folded into the histogram in vectorized batches and the
+# byte counters are sampled into the throughput series by tick(), which the engine
+# calls at its UI publish rate. That keeps recording well under a microsecond.
+#
+# TrimMetrics exports a JSON document and a Prometheus textfile-collector file
+# (*.prom), at the end of a run and every METRICS_EXPORT_INTERVAL_S during it.
+
+import os
+import json
+import time
+from array import array
+import numpy as np
+from trimvision import config
+from trimvision.core.logger import logger
+
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS # Linear buckets per power of two
+MAX_SHIFT = 32 # Values up to 2**(MAX_SHIFT + SUB_BUCKET_BITS + 1) us (~38 h)
+BUCKETS = (MAX_SHIFT + 2) * SUB_BUCKETS
+FOLD_BATCH = 4096 # Pending latencies folded into the histogram at once
+
+
+class LatencyHistogram:
+    """Latencies in microseconds, bucketed logarithmically with linear sub-buckets."""
+    def __init__(self):
+        self.counts = np.zeros(BUCKETS, dtype=np.int64)
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    @staticmethod
+    def buckets_of(us: np.ndarray) -> np.ndarray:
+        """Bucket index of each latency (int64 microseconds)."""
+        us = np.maximum(us, 0)
+        # frexp's exponent is the bit length, exactly, for integers below 2**53
+        shift = np.maximum(np.frexp(us.astype(np.float64))[1] - SUB_BUCKET_BITS - 1, 0)
+        index = np.where(us < SUB_BUCKETS, us, (shift + 1) * SUB_BUCKETS + (us >> shift) - SUB_BUCKETS)
+        return np.minimum(index, BUCKETS - 1) # Anything longer lands in the last bucket
+
+    @staticmethod
+    def bucket_bounds(index: int):
+        """[low, high) microseconds covered by a bucket."""
+        if index < SUB_BUCKETS:
+            return index, index + 1
+        shift = index // SUB_BUCKETS - 1
+        low = (SUB_BUCKETS + index % SUB_BUCKETS) << shift
+        return low, low + (1 << shift)
+
+    def record_many(self, us: np.ndarray):
+        """Adds latencies given as int64 microseconds."""
+        if us.size == 0:
+            return
+        self.counts += np.bincount(self.buckets_of(us), minlength=BUCKETS)
+        self.count += int(us.size)
+        self.total_us += int(us.sum())
+        self.max_us = max(self.max_us, int(us.max()))
+
+    def percentile(self, p: float) -> int:
+        """Upper bound (us) of the bucket holding the p-th percentile (0-100); 0 if empty."""
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * p // 100)) # ceil
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(self.bucket_bounds(index)[1] - 1, self.max_us)
+
+    def mean_us(self) -> float:
+        return self.total_us / self.count if self.count else 0.0
+
+    def cumulative_at(self, bounds_us):
+        """Calls with latency < each bound; bounds must be bucket boundaries."""
+        cumulative = np.concatenate(([0], np.cumsum(self.counts)))
+        lows = np.array([self.bucket_bounds(i)[0] for i in range(len(self.counts))])
+        return [int(cumulative[np.searchsorted(lows, bound)]) for bound in bounds_us]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": self.mean_us() / 1000,
+            "p50_ms": self.percentile(50) / 1000,
+            "p90_ms": self.percentile(90) / 1000,
+            "p99_ms": self.percentile(99) / 1000,
+            "p999_ms": self.percentile(99.9) / 1000,
+            "max_ms": self.max_us / 1000,
+        }
+
+
+class ThroughputSeries:
+    """Bytes and calls completed per wall-clock second, for the last `seconds` seconds."""
+    __slots__ = ("seconds", "bytes", "calls", "_first", "_current")
+
+    def __init__(self, seconds: int = config.METRICS_THROUGHPUT_WINDOW_S):
+        self.seconds = max(1, seconds)
+        self.bytes = [0] * self.seconds
+        self.calls = [0] * self.seconds
+        self._first = None # First second recorded into
+        self._current = None # Latest second recorded into
+
+    def record(self, nbytes: int, now: float, calls: int = 1):
+        second = int(now)
+        if second != self._current:
+            self._advance(second)
+        slot = second % self.seconds
+        self.bytes[slot] += nbytes
+        self.calls[slot] += calls
+
+    def _advance(self, second: int):
+        """Clears the slots of the seconds after the last recorded one, up to this one."""
+        if self._current is None:
+            self._first = self._current = second
+        elif second > self._current:
+            for s in range(max(self._current + 1, second - self.seconds + 1), second + 1):
+                self.bytes[s % self.seconds] = self.calls[s % self.seconds] = 0
+            self._current = second
+
+    def samples(self, now: float = None):
+        """(unix second, bytes, calls) of every second in the window up to now, oldest first."""
+        if self._current is None:
+            return []
+        self._advance(int(time.time() if now is None else now))
+        first = max(self._current - self.seconds + 1, self._first)
+        return [(s, self.bytes[s % self.seconds], self.calls[s % self.seconds])
+                for s in range(first, self._current + 1)]
+
+
+def _escape_label(value) -> str:
+    """Prometheus text format label value escaping."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class TrimMetrics:
+    """Discard-call metrics of one TRIM run, with periodic and final export."""
+    def __init__(self, labels: dict = None, export_dir: str = None,
+                 export_interval_s: float = config.METRICS_EXPORT_INTERVAL_S):
+        self.labels = dict(labels or {}) # e.g. device, model: attached to every exported series
+        self.export_dir = export_dir
+        self.export_interval_s = export_interval_s
+        self.latency = LatencyHistogram()
+        self.throughput = ThroughputSeries()
+        self.calls_ok = 0
+        self.calls_failed = 0
+        self.bytes_ok = 0
+        self.bytes_failed = 0
+        self.errors = {} # exception type name -> count
+        self.started = time.time()
+        self._next_export = time.monotonic() + export_interval_s
+        self._pending = array("d") # Latencies (s) not yet folded into the histogram
+        self._ticked = (0, 0) # (bytes_ok, calls_ok) already credited to the throughput series
+
+    def record_call(self, call_bytes: int, latency_s: float, ok: bool, error=None):
+        """Records one completed discard call; cheap enough for every call."""
+        self._pending.append(latency_s)
+        if ok:
+            self.calls_ok += 1
+            self.bytes_ok += call_bytes
+        else:
+            self.calls_failed += 1
+            self.bytes_failed += call_bytes
+            name = type(error).__name__ if error is not None else "Unknown"
+            self.errors[name] = self.errors.get(name, 0) + 1
+        if len(self._pending) >= FOLD_BATCH:
+            self.fold()
+
+    def fold(self):
+        """Moves the pending latencies into the histogram."""
+        if self._pending:
+            self.latency.record_many((np.frombuffer(self._pending, dtype=np.float64) * 1e6).astype(np.int64))
+            self._pending = array("d")
+
+    def tick(self, now: float = None):
+        """Credits the calls completed since the last tick to the current second of the throughput series."""
+        nbytes, calls = self.bytes_ok - self._ticked[0], self.calls_ok - self._ticked[1]
+        self._ticked = (self.bytes_ok, self.calls_ok)
+        if calls:
+            self.throughput.record(nbytes, time.time() if now is None else now, calls)
+
+    def throughput_summary(self) -> dict:
+        """Mean and percentiles of the per-second discard throughput (MB/s), last partial second excluded."""
+        self.tick()
+        per_second = [nbytes for _, nbytes, _ in self.throughput.samples()]
+        if len(per_second) > 1:
+            per_second = per_second[:-1]
+        if not per_second:
+            return {"mean_mbps": 0.0, "p10_mbps": 0.0, "p50_mbps": 0.0, "p90_mbps": 0.0}
+        values = np.percentile(np.array(per_second, dtype=np.float64) / 1024**2, (10, 50, 90))
+        return {"mean_mbps": sum(per_second) / len(per_second) / 1024**2,
+                "p10_mbps": float(values[0]), "p50_mbps": float(values[1]), "p90_mbps": float(values[2])}
+
+    def to_dict(self) -> dict:
+        self.fold()
+        self.tick()
+        samples = self.throughput.samples()
+        per_second = [nbytes for _, nbytes, _ in samples]
+        return {
+            "labels": self.labels,
+            "started": self.started,
+            "updated": time.time(),
+            "calls_ok": self.calls_ok,
+            "calls_failed": self.calls_failed,
+            "bytes_ok": self.bytes_ok,
+            "bytes_failed": self.bytes_failed,
+            "errors": dict(self.errors),
+            "latency": self.latency.summary(),
+            "latency_buckets_us": {self.latency.bucket_bounds(i)[0]: int(n)
+                                   for i, n in enumerate(self.latency.counts) if n},
+            "throughput": {
+                "min_mbps": min(per_second, default=0) / 1024**2,
+                "max_mbps": max(per_second, default=0) / 1024**2,
+                "per_second": [[second, nbytes, calls] for second, nbytes, calls in samples],
+            },
+        }
+
+    def to_prometheus(self) -> str:
+        self.fold()
+        self.tick()
+        labels = ",".join(f'{key}="{_escape_label(value)}"' for key, value in sorted(self.labels.items()))
+        def series(name, value, extra=""):
+            inner = ",".join(part for part in (labels, extra) if part)
+            return f"{name}{{{inner}}} {value}" if inner else f"{name} {value}"
+
+        lines = ["# HELP trimvision_discard_calls_total Discard calls completed, by outcome.",
+                 "# TYPE trimvision_discard_calls_total counter",
+                 series("trimvision_discard_calls_total", self.calls_ok, 'outcome="ok"'),
+                 series("trimvision_discard_calls_total", self.calls_failed, 'outcome="failed"'),
+                 "# HELP trimvision_discard_bytes_total Bytes in completed discard calls, by outcome.",
+                 "# TYPE trimvision_discard_bytes_total counter",
+                 series("trimvision_discard_bytes_total", self.bytes_ok, 'outcome="ok"'),
+                 series("trimvision_discard_bytes_total", self.bytes_failed, 'outcome="failed"'),
+                 "# HELP trimvision_discard_errors_total Failed discard calls, by error type.",
+                 "# TYPE trimvision_discard_errors_total counter"]
+        lines += [series("trimvision_discard_errors_total", n, f'error="{name}"')
+                  for name, n in sorted(self.errors.items())]
+
+        # Histogram at power-of-two microsecond bounds (exact: they are bucket boundaries)
+        bounds = [1 << shift for shift in range(SUB_BUCKET_BITS, self.latency.max_us.bit_length() + 1)]
+        lines += ["# HELP trimvision_discard_latency_seconds Latency of discard calls.",
+                  "# TYPE trimvision_discard_latency_seconds histogram"]
+        for bound, cumulative in zip(bounds, self.latency.cumulative_at(bounds)):
+            lines.append(series("trimvision_discard_latency_seconds_bucket", cumulative, f'le="{bound / 1e6:g}"'))
+        lines += [series("trimvision_discard_latency_seconds_bucket", self.latency.count, 'le="+Inf"'),
+                  series("trimvision_discard_latency_seconds_sum", self.latency.total_us / 1e6),
+                  series("trimvision_discard_latency_seconds_count", self.latency.count),
+                  "# HELP trimvision_discard_latency_quantile_seconds Latency percentiles of discard calls.",
+                  "# TYPE trimvision_discard_latency_quantile_seconds gauge"]
+        for quantile in (50, 90, 99, 99.9):
+            lines.append(series("trimvision_discard_latency_quantile_seconds",
+                                self.latency.percentile(quantile) / 1e6, f'quantile="{quantile / 100:g}"'))
+        samples = self.throughput.samples()
+        last = samples[-2] if len(samples) > 1 else (samples[-1] if samples else (0, 0, 0)) # Last full second
+        lines += ["# HELP trimvision_discard_throughput_bytes_per_second Bytes discarded in the last full second.",
+                  "# TYPE trimvision_discard_throughput_bytes_per_second gauge",
+                  series("trimvision_discard_throughput_bytes_per_second", last[1]),
+                  "# HELP trimvision_run_start_time_seconds Unix time the run started.",
+                  "# TYPE trimvision_run_start_time_seconds gauge",
+                  series("trimvision_run_start_time_seconds", f"{self.started:.3f}")]
+        return "\n".join(lines) + "\n"
+
+    def maybe_export(self, name: str):
+        """export() once every export_interval_s; for the dispatch loop."""
+        now = time.monotonic()
+        if self.export_dir and now >= self._next_export:
+            self._next_export = now + self.export_interval_s
+            self.export(name)
+
+    def export(self, name: str):
+        """Writes <name>.json and <name>.prom into export_dir, each replaced atomically."""
+        if not self.export_dir:
+            return
+        try:
+            os.makedirs(self.export_dir, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"Could not create metrics directory {self.export_dir}: {e}")
+            return
+        for extension, text in (("json", json.dumps(self.to_dict())), ("prom", self.to_prometheus())):
+            path = os.path.join(self.export_dir, f"{name}.{extension}")
+            try:
+                with open(path + ".tmp", "w") as f: # The textfile collector ignores *.tmp files
+                    f.write(text)
+                os.replace(path + ".tmp", path)
+            except OSError as e:
+                logger.warning(f"Could not write metrics file {path}: {e}")
@@ -0,0 +1,495 @@
+# trimvision/core/trim_planner.py
+# Free-space planning for TRIM.
+#
+# Reads the block/cluster allocation bitmap of an ext4 or NTFS volume (raw device
+# or image file) through mmap and turns the free-cluster runs into an LBA extent
+# list for the TRIM worker, so allocated data is never discarded.
+
+import mmap
+import struct
+import numpy as np
+from trimvision import config
+from trimvision.core.logger import logger
+
+# What a TRIM run discards; kept here, away from the worker, so the UI can offer them
+# without importing the worker and its dependencies
+PLAN_FREE_SPACE = "free" # Discard only free filesystem clusters
+PLAN_FULL_DEVICE = "full" # Discard the whole LBA space
+PLAN_INCREMENTAL = "incremental" # Discard only free space freed since the last successful run
+
+
+class BitmapSource:
+    """
+    Read-only random access to a volume.
+    Uses mmap when the target supports it and falls back to aligned reads
+    (raw Windows volume handles cannot be mapped).
+    """
+    READ_ALIGNMENT = 4096
+
+    def __init__(self, path: str, offset_bytes: int = 0):
+        self.path = path
+        self.offset_bytes = offset_bytes
+        self._file = open(path, 'rb', buffering=0)
+        self._mmap = None
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            logger.debug(f"mmap unavailable for {path} ({e}), using aligned reads.")
+
+    def read(self, offset: int, length: int):
+        """Returns `length` bytes at `offset` (relative to the volume start) as a buffer."""
+        offset += self.offset_bytes
+        if self._mmap is not None:
+            if offset + length > len(self._mmap):
+                raise ValueError(f"Read past end of {self.path} at {offset}+{length}")
+            return self._mmap[offset:offset + length]
+        aligned_start = offset - offset % self.READ_ALIGNMENT
+        aligned_end = -(-(offset + length) // self.READ_ALIGNMENT) * self.READ_ALIGNMENT
+        self._file.seek(aligned_start)
+        data = self._file.read(aligned_end - aligned_start)
+        head = offset - aligned_start
+        if len(data) < head + length:
+            raise ValueError(f"Short read from {self.path} at {offset}+{length}")
+        return memoryview(data)[head:head + length]
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def find_free_runs(bitmap: np.ndarray, nbits: int):
+    """
+    Vectorized run-length detection on an allocation bitmap (LSB-first, 1 = in use).
+    Returns (starts, lengths) arrays of the zero-bit runs within the first nbits bits.
+    """
+    bits = np.unpackbits(bitmap, bitorder='little', count=nbits)
+    free = np.logical_not(bits).view(np.int8)
+    edges = np.diff(free, prepend=np.int8(0), append=np.int8(0))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return starts, ends - starts
+
+
+class _RunCollector:
+    """Accumulates free runs from consecutive bitmap chunks, joining runs across chunk edges."""
+    def __init__(self, min_run: int = 1):
+        self.min_run = max(1, min_run)
+        self.starts = []
+        self.lengths = []
+        self._open_start = None # Run touching the end of the previous chunk
+        self._open_length = 0
+
+    def _flush_open(self):
+        if self._open_start is not None and self._open_length >= self.min_run:
+            self.starts.append(np.array([self._open_start], dtype=np.int64))
+            self.lengths.append(np.array([self._open_length], dtype=np.int64))
+        self._open_start = None
+        self._open_length = 0
+
+    def add_chunk(self, base: int, bitmap: np.ndarray, nbits: int):
+        if nbits <= 0:
+            return
+        nbytes = (nbits + 7) // 8
+        bitmap = bitmap[:nbytes]
+        full_bytes = nbits // 8
+        # Fast paths: fully allocated and fully free chunks need no bit unpacking
+        if full_bytes == nbytes and not np.any(bitmap != 0xFF):
+            self._flush_open()
+            return
+        if full_bytes == nbytes and not np.any(bitmap):
+            starts = np.zeros(1, dtype=np.int64)
+            lengths = np.full(1, nbits, dtype=np.int64)
+        else:
+            starts, lengths = find_free_runs(bitmap, nbits)
+            starts = starts.astype(np.int64)
+            lengths = lengths.astype(np.int64)
+        if not len(starts):
+            self._flush_open()
+            return
+        starts += base
+        # Join with the run left open by the previous chunk
+        if self._open_start is not None:
+            if starts[0] == self._open_start + self._open_length:
+                lengths[0] += self._open_length
+                starts[0] = self._open_start
+                self._open_start = None
+                self._open_length = 0
+            else:
+                self._flush_open()
+        # Keep the last run open if it reaches the end of this chunk
+        if starts[-1] + lengths[-1] == base + nbits:
+            self._open_start = int(starts[-1])
+            self._open_length = int(lengths[-1])
+            starts = starts[:-1]
+            lengths = lengths[:-1]
+        keep = lengths >= self.min_run
+        self.starts.append(starts[keep])
+        self.lengths.append(lengths[keep])
+
+    def finish(self):
+        self._flush_open()
+        if not self.starts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(self.starts), np.concatenate(self.lengths)
+
+
+# --- ext4 ---------------------------------------------------------------------
+
+EXT4_MAGIC = 0xEF53
+EXT4_INCOMPAT_META_BG = 0x0010
+EXT4_INCOMPAT_64BIT = 0x0080
+EXT4_RO_COMPAT_SPARSE_SUPER = 0x0001
+EXT4_RO_COMPAT_BIGALLOC = 0x0200
+EXT4_COMPAT_SPARSE_SUPER2 = 0x0200
+EXT4_BG_BLOCK_UNINIT = 0x0002
+
+
+class Ext4Volume:
+    """Block-group bitmap reader for ext2/3/4."""
+    fs_name = "ext4"
+
+    def __init__(self, src: BitmapSource):
+        self.src = src
+        sb = bytes(src.read(1024, 1024))
+        if struct.unpack_from("<H", sb, 0x38)[0] != EXT4_MAGIC:
+            raise ValueError("Not an ext2/3/4 superblock")
+        (self.blocks_count_lo, self.first_data_block, log_block,
+         log_cluster, self.blocks_per_group, self.clusters_per_group,
+         self.inodes_per_group) = self._unpack_counts(sb)
+        self.block_size = 1024 << log_block
+        self.feature_compat, self.feature_incompat, self.feature_ro_compat = struct.unpack_from("<3I", sb, 0x5C)
+        self.inode_size = struct.unpack_from("<H", sb, 0x58)[0]
+        self.reserved_gdt_blocks = struct.unpack_from("<H", sb, 0xCE)[0]
+        desc_size = struct.unpack_from("<H", sb, 0xFE)[0]
+        blocks_count_hi = struct.unpack_from("<I", sb, 0x150)[0]
+        self.backup_bgs = struct.unpack_from("<2I", sb, 0x24C)
+
+        if self.feature_incompat & EXT4_INCOMPAT_META_BG:
+            raise ValueError("ext4 meta_bg layout is not supported")
+
+        is_64bit = bool(self.feature_incompat & EXT4_INCOMPAT_64BIT)
+        self.blocks_count = self.blocks_count_lo | ((blocks_count_hi << 32) if is_64bit else 0)
+        self.desc_size = desc_size if is_64bit and desc_size >= 64 else 32
+        if self.feature_ro_compat & EXT4_RO_COMPAT_BIGALLOC:
+            self.cluster_size = 1024 << log_cluster
+        else:
+            self.cluster_size = self.block_size
+            self.clusters_per_group = self.blocks_per_group
+        self.cluster_ratio = self.cluster_size // self.block_size
+        self.group_count = -(-(self.blocks_count - self.first_data_block) // self.blocks_per_group)
+        # A trailing partial cluster is left out so no extent can run past the filesystem
+        self.total_clusters = self.blocks_count // self.cluster_ratio
+        self.descriptors = self._read_descriptors()
+        self._metadata_by_group = None
+
+    @staticmethod
+    def _unpack_counts(sb):
+        blocks_count_lo = struct.unpack_from("<I", sb, 0x04)[0]
+        first_data_block, log_block, log_cluster, blocks_per_group, clusters_per_group, inodes_per_group = \
+            struct.unpack_from("<6I", sb, 0x14)
+        return (blocks_count_lo, first_data_block, log_block, log_cluster,
+                blocks_per_group, clusters_per_group, inodes_per_group)
+
+    def _read_descriptors(self):
+        # The descriptor table follows the block holding the primary superblock
+        gdt_offset = (1024 // self.block_size + 1) * self.block_size
+        raw = bytes(self.src.read(gdt_offset, self.group_count * self.desc_size))
+        descriptors = []
+        for g in range(self.group_count):
+            base = g * self.desc_size
+            block_bitmap, inode_bitmap, inode_table = struct.unpack_from("<3I", raw, base)
+            flags = struct.unpack_from("<H", raw, base + 0x12)[0]
+            if self.desc_size >= 64:
+                hi_bitmap, hi_inode_bitmap, hi_table = struct.unpack_from("<3I", raw, base + 0x20)
+                block_bitmap |= hi_bitmap << 32
+                inode_bitmap |= hi_inode_bitmap << 32
+                inode_table |= hi_table << 32
+            descriptors.append((block_bitmap, inode_bitmap, inode_table, flags))
+        return descriptors
+
+    def _group_has_super_backup(self, group: int) -> bool:
+        if group == 0:
+            return True
+        if self.feature_compat & EXT4_COMPAT_SPARSE_SUPER2:
+            return group in self.backup_bgs
+        if not self.feature_ro_compat & EXT4_RO_COMPAT_SPARSE_SUPER:
+            return True
+        if group == 1:
+            return True
+        for base in (3, 5, 7):
+            n = base
+            while n < group:
+                n *= base
+            if n == group:
+                return True
+        return False
+
+    def _group_metadata(self):
+        """Maps block group -> [(first_block, count)] of the group metadata stored inside it."""
+        if self._metadata_by_group is None:
+            table_blocks = -(-self.inodes_per_group * self.inode_size // self.block_size)
+            by_group = {}
+            for block_bitmap, inode_bitmap, inode_table, _ in self.descriptors:
+                for first, count in ((block_bitmap, 1), (inode_bitmap, 1), (inode_table, table_blocks)):
+                    first_group = (first - self.first_data_block) // self.blocks_per_group
+                    last_group = (first + count - 1 - self.first_data_block) // self.blocks_per_group
+                    for g in range(first_group, last_group + 1):
+                        by_group.setdefault(g, []).append((first, count))
+            self._metadata_by_group = by_group
+        return self._metadata_by_group
+
+    def _uninit_group_bitmap(self, group: int, nbytes: int) -> np.ndarray:
+        """
+        Reconstructs the bitmap of a BLOCK_UNINIT group: everything is free except the
+        superblock/GDT backup and any group metadata (bitmaps, inode tables) placed in it.
+        """
+        bits = np.zeros(nbytes * 8, dtype=np.uint8)
+        group_first = self.first_data_block + group * self.blocks_per_group
+        group_end = group_first + self.blocks_per_group
+
+        def mark(first_block, count):
+            lo = max(first_block, group_first)
+            hi = min(first_block + count, group_end)
+            if hi > lo:
+                bits[(lo - group_first) // self.cluster_ratio:
+                     -(-(hi - group_first) // self.cluster_ratio)] = 1
+
+        if self._group_has_super_backup(group):
+            gdt_blocks = -(-self.group_count * self.desc_size // self.block_size)
+            mark(group_first, 1 + gdt_blocks + self.reserved_gdt_blocks)
+        for first, count in self._group_metadata().get(group, ()):
+            mark(first, count)
+        return np.packbits(bits, bitorder='little')
+
+    def iter_bitmap_chunks(self, chunk_bytes: int):
+        """Yields (first_cluster, bitmap_bytes, nbits) for consecutive runs of block groups."""
+        bytes_per_group = self.clusters_per_group // 8
+        groups_per_chunk = max(1, chunk_bytes // max(1, bytes_per_group))
+        first_cluster = self.first_data_block // self.cluster_ratio
+        for g0 in range(0, self.group_count, groups_per_chunk):
+            parts = []
+            nbits = 0
+            for g in range(g0, min(g0 + groups_per_chunk, self.group_count)):
+                block_bitmap, _, _, flags = self.descriptors[g]
+                group_bits = min(self.clusters_per_group,
+                                 self.total_clusters - first_cluster - g * self.clusters_per_group)
+                if flags & EXT4_BG_BLOCK_UNINIT:
+                    parts.append(self._uninit_group_bitmap(g, bytes_per_group))
+                else:
+                    parts.append(np.frombuffer(self.src.read(block_bitmap * self.block_size, bytes_per_group),
+                                               dtype=np.uint8))
+                nbits += group_bits
+            bitmap = parts[0] if len(parts) == 1 else np.concatenate(parts)
+            yield first_cluster + g0 * self.clusters_per_group, bitmap, nbits
+
+
+# --- NTFS ---------------------------------------------------------------------
+
+NTFS_OEM_ID = b"NTFS    "
+NTFS_BITMAP_MFT_RECORD = 6
+NTFS_ATTR_DATA = 0x80
+NTFS_ATTR_END = 0xFFFFFFFF
+
+
+class NtfsVolume:
+    """$Bitmap reader for NTFS."""
+    fs_name = "ntfs"
+
+    def __init__(self, src: BitmapSource):
+        self.src = src
+        boot = bytes(src.read(0, 512))
+        if boot[3:11] != NTFS_OEM_ID:
+            raise ValueError("Not an NTFS boot sector")
+        self.bytes_per_sector = struct.unpack_from("<H", boot, 0x0B)[0]
+        spc = boot[0x0D]
+        sectors_per_cluster = spc if spc <= 0x80 else 1 << (256 - spc)
+        self.cluster_size = self.bytes_per_sector * sectors_per_cluster
+        total_sectors, mft_lcn = struct.unpack_from("<QQ", boot, 0x28)
+        self.total_clusters = -(-total_sectors // sectors_per_cluster)
+        clusters_per_record = struct.unpack_from("<b", boot, 0x40)[0]
+        self.record_size = (clusters_per_record * self.cluster_size if clusters_per_record > 0
+                            else 1 << -clusters_per_record)
+        record_offset = mft_lcn * self.cluster_size + NTFS_BITMAP_MFT_RECORD * self.record_size
+        record = self._apply_fixups(bytearray(src.read(record_offset, self.record_size)))
+        self.bitmap_runs, self.bitmap_size = self._find_data_runs(record)
+
+    def _apply_fixups(self, record: bytearray) -> bytearray:
+        if record[:4] != b"FILE":
+            raise ValueError("Corrupt $Bitmap MFT record")
+        usa_offset, usa_count = struct.unpack_from("<HH", record, 4)
+        check = record[usa_offset:usa_offset + 2]
+        for i in range(1, usa_count):
+            end = i * 512
+            if record[end - 2:end] != check:
+                raise ValueError("MFT record fixup mismatch")
+            record[end - 2:end] = record[usa_offset + 2 * i:usa_offset + 2 * i + 2]
+        return record
+
+    @staticmethod
+    def _decode_runlist(data: bytes, pos: int):
+        runs = []
+        lcn = 0
+        while pos < len(data) and data[pos]:
+            header = data[pos]
+            len_size, off_size = header & 0x0F, header >> 4
+            pos += 1
+            length = int.from_bytes(data[pos:pos + len_size], 'little')
+            pos += len_size
+            if off_size == 0:
+                raise ValueError("Sparse run in $Bitmap")
+            lcn += int.from_bytes(data[pos:pos + off_size], 'little', signed=True)
+            pos += off_size
+            runs.append((lcn, length))
+        return runs
+
+    def _find_data_runs(self, record: bytes):
+        pos = struct.unpack_from("<H", record, 0x14)[0]
+        while pos + 8 <= len(record):
+            attr_type, attr_len = struct.unpack_from("<II", record, pos)
+            if attr_type == NTFS_ATTR_END or attr_len == 0:
+                break
+            non_resident, name_length = record[pos + 8], record[pos + 9]
+            if attr_type == NTFS_ATTR_DATA and name_length == 0:
+                if not non_resident:
+                    raise ValueError("Resident $Bitmap data is not supported")
+                runlist_offset = struct.unpack_from("<H", record, pos + 0x20)[0]
+                data_size = struct.unpack_from("<Q", record, pos + 0x30)[0]
+                return self._decode_runlist(record[pos:pos + attr_len], runlist_offset), data_size
+            pos += attr_len
+        raise ValueError("$Bitmap has no $DATA attribute")
+
+    def iter_bitmap_chunks(self, chunk_bytes: int):
+        """Yields (first_cluster, bitmap_bytes, nbits) following the $Bitmap data runs."""
+        remaining_bits = self.total_clusters
+        remaining_bytes = min(self.bitmap_size, -(-remaining_bits // 8))
+        base = 0
+        for lcn, length in self.bitmap_runs:
+            run_offset = lcn * self.cluster_size
+            run_bytes = min(length * self.cluster_size, remaining_bytes)
+            pos = 0
+            while pos < run_bytes and remaining_bits > 0:
+                n = min(chunk_bytes, run_bytes - pos)
+                nbits = min(n * 8, remaining_bits)
+                yield base, np.frombuffer(self.src.read(run_offset + pos, n), dtype=np.uint8), nbits
+                base += nbits
+                remaining_bits -= nbits
+                pos += n
+            remaining_bytes -= run_bytes
+            if remaining_bits <= 0 or remaining_bytes <= 0:
+                break
+
+
+FILESYSTEMS = (Ext4Volume, NtfsVolume)
+
+
+# --- Partition tables -----------------------------------------------------------
+
+MBR_SIGNATURE = b"\x55\xAA"
+MBR_TYPE_GPT_PROTECTIVE = 0xEE
+MBR_EXTENDED_TYPES = (0x05, 0x0F, 0x85)
+GPT_SIGNATURE = b"EFI PART"
+
+
+def read_partition_offsets(src: BitmapSource, sector_size: int = config.DEFAULT_SECTOR_SIZE):
+    """
+    Returns the byte offsets of the primary MBR or GPT partitions on a whole-disk source.
+    An empty list means there is no partition table. Logical partitions inside an MBR
+    extended partition are not followed, so their free space is never planned.
+    """
+    mbr = bytes(src.read(0, 512))
+    if mbr[510:512] != MBR_SIGNATURE or mbr[3:11] == NTFS_OEM_ID:
+        return []
+    entries = [struct.unpack_from("<4xB3xII", mbr, 446 + 16 * i) for i in range(4)]
+    if any(part_type == MBR_TYPE_GPT_PROTECTIVE for part_type, _, _ in entries):
+        header = bytes(src.read(sector_size, 92))
+        if header[:8] != GPT_SIGNATURE:
+            raise ValueError("Protective MBR without a GPT header")
+        entries_lba, entry_count, entry_size = struct.unpack_from("<QII", header, 72)
+        table = bytes(src.read(entries_lba * sector_size, entry_count * entry_size))
+        offsets = []
+        for i in range(entry_count):
+            entry = table[i * entry_size:(i + 1) * entry_size]
+            if entry[:16] != bytes(16):
+                offsets.append(struct.unpack_from("<Q", entry, 32)[0] * sector_size)
+        return offsets
+    return [first_lba * sector_size for part_type, first_lba, count in entries
+            if part_type and count and part_type not in MBR_EXTENDED_TYPES]
+
+
+def open_volume(src: BitmapSource):
+    """Returns the first filesystem parser that recognizes the volume, or None."""
+    for fs_class in FILESYSTEMS:
+        try:
+            return fs_class(src)
+        except (ValueError, struct.error):
+            continue
+    return None
+
+
+def scan_free_extents(volume_path: str, volume_offset_bytes: int = 0,
+                      sector_size: int = config.DEFAULT_SECTOR_SIZE,
+                      min_extent_bytes: int = config.MIN_FREE_EXTENT_BYTES):
+    """
+    Scans the allocation bitmap of the volume at volume_path (starting volume_offset_bytes
+    into it) and returns its free space as a list of (start_lba, length_lba) device extents.
+    Raises ValueError if the filesystem is not recognized.
+    """
+    with BitmapSource(volume_path, volume_offset_bytes) as src:
+        volume = open_volume(src)
+        if volume is None:
+            raise ValueError(f"No supported filesystem (ext4/NTFS) found on {volume_path}")
+        collector = _RunCollector(min_run=-(-min_extent_bytes // volume.cluster_size))
+        for base, bitmap, nbits in volume.iter_bitmap_chunks(config.PLANNER_CHUNK_BYTES):
+            collector.add_chunk(base, bitmap, nbits)
+        starts, lengths = collector.finish()
+
+    lba_per_cluster = volume.cluster_size // sector_size
+    offset_lba = volume_offset_bytes // sector_size
+    extents = list(zip((starts * lba_per_cluster + offset_lba).tolist(),
+                       (lengths * lba_per_cluster).tolist()))
+    free_bytes = int(lengths.sum()) * volume.cluster_size
+    logger.info(f"{volume.fs_name} volume {volume_path}@{volume_offset_bytes}: "
+                f"{len(extents)} free extents, {free_bytes / 1024**3:.2f} GB free "
+                f"of {volume.total_clusters * volume.cluster_size / 1024**3:.2f} GB")
+    return extents
+
+
+def plan_drive_extents(drive_info, device_path: str, sector_size: int = config.DEFAULT_SECTOR_SIZE):
+    """
+    Builds the free-space extent list (disk LBAs) for a drive, reading its content from
+    device_path (the disk itself, or the image behind an emulated device).
+    The partition table of the device is read and every partition holding a supported
+    filesystem is scanned; a device without a partition table is treated as one volume.
+    Raises ValueError if no supported filesystem is found, or if the drive has mounted
+    volumes: the on-disk bitmap of a mounted filesystem can lag behind its allocations
+    (and keeps changing), so blocks in use could be discarded. Those are trimmed through
+    their filesystem instead (see volume_trim).
+    """
+    if drive_info.drive_letter:
+        raise ValueError(f"{drive_info.device_id_wmi} has mounted volumes ({drive_info.drive_letter}); their free "
+                         f"space cannot be planned from the on-disk bitmaps, unmount them or trim them through "
+                         f"the filesystem")
+    with BitmapSource(device_path) as src:
+        offsets = read_partition_offsets(src, sector_size) or [0]
+
+    extents = []
+    scanned = 0
+    for offset in offsets:
+        try:
+            extents.extend(scan_free_extents(device_path, offset, sector_size))
+            scanned += 1
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping partition at byte {offset} of {device_path}: {e}")
+    if not scanned:
+        raise ValueError(f"No supported filesystem found on {device_path}")
+    extents.sort()
+    return extents
@@ -0,0 +1,254 @@
+# trimvision/core/trim_scheduler.py
+# Multi-drive TRIM job scheduling.
+#
+# Jobs for many drives are queued by priority and started as TrimWorkers while
+# staying under a global cap on concurrently trimmed devices and a per-controller
+# cap (drives behind the same HBA/bus share its bandwidth). An optional global
+# bandwidth budget is split evenly between the running workers.
+
+import heapq
+import itertools
+import time
+from PyQt6.QtCore import QObject, pyqtSignal
+from trimvision import config
+from trimvision.core.logger import logger
+from trimvision.core.drive_manager import DriveInfo # For type hinting
+from trimvision.core.trim_planner import PLAN_FREE_SPACE
+
+
+class TrimJob:
+    """One queued or running TRIM of a drive."""
+    QUEUED = "Queued"
+    RUNNING = "Running"
+    COMPLETED = "Completed"
+    FAILED = "Failed"
+    CANCELLED = "Cancelled"
+
+    _ids = itertools.count(1)
+
+    def __init__(self, drive_info: DriveInfo, plan_mode: str, priority: int = 0, verify_fraction: float = None):
+        self.job_id = next(self._ids)
+        self.drive_info = drive_info
+        self.plan_mode = plan_mode
+        self.priority = priority
+        self.verify_fraction = verify_fraction # Post-TRIM read-back sample (None = config default)
+        self.state = self.QUEUED
+        self.message = ""
+        self.worker = None # TrimWorker, once the job has started
+        self.processed_chunks = 0
+        self.total_chunks = 0
+        self.speed_mbps = 0.0
+        self.throttle_state = {} # Latest AdaptiveThrottle.state() of the worker
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def controller_key(self) -> str:
+        """Drives sharing this key sit behind the same controller/bus."""
+        controller = getattr(self.drive_info, 'controller', "N/A")
+        if controller and controller != "N/A":
+            return controller
+        return self.drive_info.ps_bus_type or "N/A"
+
+    @property
+    def fraction_done(self) -> float:
+        if self.state in (self.COMPLETED, self.FAILED, self.CANCELLED):
+            return 1.0
+        return self.processed_chunks / self.total_chunks if self.total_chunks else 0.0
+
+    @property
+    def is_active(self) -> bool:
+        return self.state in (self.QUEUED, self.RUNNING)
+
+    def __repr__(self):
+        return f"<TrimJob #{self.job_id} {self.drive_info.model} {self.state} prio={self.priority}>"
+
+
+class TrimScheduler(QObject):
+    """
+    Queues TrimJobs and runs them in parallel within the configured limits.
+    All methods must be called from the GUI thread.
+    """
+    # job_started(TrimJob job) # job.worker is set and already started
+    job_started = pyqtSignal(object)
+    # job_finished(TrimJob job) # job.state / job.message hold the outcome
+    job_finished = pyqtSignal(object)
+    # aggregate_progress(float fraction_done, int running_jobs, int queued_jobs, float total_speed_mbps)
+    aggregate_progress = pyqtSignal(float, int, int, float)
+
+    def __init__(self, max_concurrent: int = config.SCHEDULER_MAX_CONCURRENT_DRIVES,
+                 max_per_controller: int = config.SCHEDULER_MAX_PER_CONTROLLER,
+                 bandwidth_mbps: float = config.SCHEDULER_BANDWIDTH_MBPS,
+                 worker_factory=None, parent=None):
+        super().__init__(parent)
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_per_controller = max(1, max_per_controller)
+        self.bandwidth_mbps = bandwidth_mbps
+        self.worker_factory = worker_factory # Defaults to TrimWorker, imported when the first job starts
+        self.jobs = [] # Every job of the current session, in submission order
+        self._queue = [] # heap of (-priority, sequence, job)
+        self._sequence = itertools.count()
+
+    # --- Queue management ---
+
+    def submit(self, drive_info: DriveInfo, plan_mode: str = PLAN_FREE_SPACE,
+               priority: int = 0, verify_fraction: float = None) -> TrimJob:
+        """Queues a TRIM job; returns the existing job if the drive already has an active one."""
+        existing = self.active_job_for(drive_info)
+        if existing:
+            logger.info(f"Drive {drive_info.model} already has active job #{existing.job_id}")
+            return existing
+        job = TrimJob(drive_info, plan_mode, priority, verify_fraction)
+        self.jobs.append(job)
+        heapq.heappush(self._queue, (-priority, next(self._sequence), job))
+        logger.info(f"Queued TRIM job #{job.job_id} for {drive_info.model} "
+                    f"(priority {priority}, controller {job.controller_key})")
+        self._schedule()
+        self._emit_aggregate()
+        return job
+
+    def cancel(self, job: TrimJob):
+        if job.state == TrimJob.QUEUED:
+            self._queue = [entry for entry in self._queue if entry[2] is not job]
+            heapq.heapify(self._queue)
+            self._finish(job, TrimJob.CANCELLED, "Cancelled before start.")
+        elif job.state == TrimJob.RUNNING and job.worker:
+            job.worker.cancel_operation()
+
+    def cancel_all(self):
+        for job in list(self.jobs):
+            if job.is_active:
+                self.cancel(job)
+
+    def wait_stopped(self, timeout_s: float) -> bool:
+        """Blocks until the running workers' threads have ended, at most timeout_s; True if they all have."""
+        deadline = time.monotonic() + timeout_s
+        for job in self.running_jobs():
+            worker = job.worker
+            if worker is not None and not worker.wait(max(0, int((deadline - time.monotonic()) * 1000))):
+                logger.warning(f"TRIM job #{job.job_id} for {job.drive_info.model} did not stop "
+                               f"within {timeout_s:g}s")
+                return False
+        return True
+
+    def active_job_for(self, drive_info: DriveInfo):
+        for job in self.jobs:
+            if job.is_active and self.same_drive(job.drive_info, drive_info):
+                return job
+        return None
+
+    def running_jobs(self):
+        return [job for job in self.jobs if job.state == TrimJob.RUNNING]
+
+    def queued_jobs(self):
+        return [entry[2] for entry in sorted(self._queue)]
+
+    def has_active_jobs(self) -> bool:
+        return any(job.is_active for job in self.jobs)
+
+    @staticmethod
+    def same_drive(a: DriveInfo, b: DriveInfo) -> bool:
+        if a is b:
+            return True
+        if a.serial_number and a.serial_number != 'N/A':
+            return a.serial_number == b.serial_number
+        return a.device_id_wmi == b.device_id_wmi
+
+    # --- Scheduling ---
+
+    def _schedule(self):
+        """Starts the highest-priority queued jobs that fit the global and controller caps."""
+        running = self.running_jobs()
+        per_controller = {}
+        for job in running:
+            per_controller[job.controller_key] = per_controller.get(job.controller_key, 0) + 1
+
+        deferred = []
+        while self._queue and len(running) < self.max_concurrent:
+            entry = heapq.heappop(self._queue)
+            job = entry[2]
+            if per_controller.get(job.controller_key, 0) >= self.max_per_controller:
+                deferred.append(entry) # Controller busy; lower-priority jobs elsewhere may still start
+                continue
+            self._start(job)
+            running.append(job)
+            per_controller[job.controller_key] = per_controller.get(job.controller_key, 0) + 1
+        for entry in deferred:
+            heapq.heappush(self._queue, entry)
+        self._rebalance_bandwidth()
+
+    def _start(self, job: TrimJob):
+        if self.worker_factory is None:
+            from trimvision.core.trim_worker import TrimWorker # Pulls in numpy, psutil and the I/O stack
+            self.worker_factory = TrimWorker
+        worker = self.worker_factory(job.drive_info, job.plan_mode, verify_fraction=job.verify_fraction)
+        job.worker = worker
+        job.total_chunks = worker.total_chunks
+        job.state = TrimJob.RUNNING
+        job.started_at = time.time()
+        worker.progress_updated.connect(
+            lambda done, total, speed, eta, throttle, job=job: self._on_progress(job, done, total, speed, throttle))
+        worker.trim_finished.connect(lambda ok, message, job=job: self._on_trim_finished(job, ok, message))
+        worker.finished.connect(lambda job=job: self._on_thread_finished(job))
+        logger.info(f"Starting TRIM job #{job.job_id} for {job.drive_info.model}")
+        worker.start()
+        self.job_started.emit(job)
+
+    def _rebalance_bandwidth(self):
+        running = self.running_jobs()
+        if not running:
+            return
+        share = self.bandwidth_mbps * 1024**2 / len(running) if self.bandwidth_mbps > 0 else 0
+        for job in running:
+            job.worker.set_rate_limit(share)
+
+    # --- Worker callbacks ---
+
+    def _on_progress(self, job: TrimJob, processed_chunks: int, total_chunks: int, speed_mbps: float,
+                     throttle_state: dict):
+        job.processed_chunks = processed_chunks
+        job.total_chunks = total_chunks
+        job.speed_mbps = speed_mbps
+        job.throttle_state = throttle_state
+        self._emit_aggregate()
+
+    def _on_trim_finished(self, job: TrimJob, success: bool, message: str):
+        if success:
+            state = TrimJob.COMPLETED
+        elif "cancel" in message.lower():
+            state = TrimJob.CANCELLED
+        else:
+            state = TrimJob.FAILED
+        job.state = state
+        job.message = message
+
+    def _on_thread_finished(self, job: TrimJob):
+        if job.state == TrimJob.RUNNING: # Thread ended without reporting a result
+            job.state = TrimJob.FAILED
+            job.message = job.message or "Worker stopped unexpectedly."
+        worker, job.worker = job.worker, None
+        self._finish(job, job.state, job.message)
+        if worker:
+            worker.deleteLater()
+        self._schedule()
+
+    def _finish(self, job: TrimJob, state: str, message: str):
+        job.state = state
+        job.message = message
+        job.finished_at = time.time()
+        logger.info(f"TRIM job #{job.job_id} for {job.drive_info.model} ended: {state} ({message})")
+        self.job_finished.emit(job)
+        self._emit_aggregate()
+
+    def _emit_aggregate(self):
+        """Aggregate progress over the jobs of the current batch (cleared once all are done)."""
+        batch = [job for job in self.jobs if job.is_active or job.finished_at]
+        if not batch:
+            return
+        fraction = sum(job.fraction_done for job in batch) / len(batch)
+        running = self.running_jobs()
+        speed = sum(job.speed_mbps for job in running)
+        self.aggregate_progress.emit(fraction, len(running), len(self._queue), speed)
+        if not self.has_active_jobs():
+            self.jobs = [] # Batch over; the next submission starts a fresh aggregate
@@ -0,0 +1,77 @@
+# trimvision/core/trim_snapshot.py
+# Snapshot of the free extents trimmed by the last successful run of a drive.
+#
+# An incremental run discards (current free space - snapshot): only what was freed
+# since. A free-map diff cannot see blocks that were written and freed again in
+# between (free then, free now, but holding stale data in the drive's mapping), so a
+# snapshot is only trusted for a bounded number of incremental runs and a bounded age,
+# after which the next run falls back to a full free-space plan.
+#
+# Stored per drive as a compressed .npz: extent starts delta-encoded against the end
+# of the previous extent, plus lengths, which both compress well on fragmented maps.
+
+import os
+import time
+import numpy as np
+from trimvision import config
+from trimvision.core.logger import logger
+from trimvision.core.extents import ExtentSet
+from trimvision.core.trim_journal import drive_key
+from trimvision.utils.app_paths import data_dir
+
+
+def snapshot_path(drive_info, directory: str = None) -> str:
+    """Snapshot file of a drive, keyed like its checkpoint journal."""
+    return os.path.join(data_dir(directory or config.INCREMENTAL_SNAPSHOT_DIR), f"{drive_key(drive_info)}.npz")
+
+
+class TrimSnapshot:
+    """Free extents trimmed on a drive, and how many incremental runs have built on them."""
+    def __init__(self, trimmed: ExtentSet, total_lba: int, sector_size: int,
+                 created: float = None, incremental_runs: int = 0):
+        self.trimmed = trimmed
+        self.total_lba = total_lba
+        self.sector_size = sector_size
+        self.created = time.time() if created is None else created
+        self.incremental_runs = incremental_runs
+
+    def save(self, path: str):
+        gaps = self.trimmed.starts - np.concatenate(([0], self.trimmed.ends[:-1]))
+        tmp_path = path + ".tmp.npz" # np.savez appends .npz to names without it
+        np.savez_compressed(tmp_path, gaps=gaps, lengths=self.trimmed.ends - self.trimmed.starts,
+                            layout=np.array([self.total_lba, self.sector_size, self.incremental_runs], dtype=np.int64),
+                            created=np.array(self.created))
+        os.replace(tmp_path, path)
+        logger.info(f"Saved TRIM snapshot {path}: {len(self.trimmed)} extents, "
+                    f"{self.trimmed.total() * self.sector_size / 1024**3:.2f} GB trimmed")
+
+    @classmethod
+    def load(cls, path: str):
+        """The snapshot stored at path, or None if there is none or it cannot be read."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                gaps, lengths = data["gaps"], data["lengths"]
+                total_lba, sector_size, runs = (int(v) for v in data["layout"])
+                created = float(data["created"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable TRIM snapshot {path}: {e}")
+            return None
+        starts = np.cumsum(gaps + np.concatenate(([0], lengths[:-1])))
+        return cls(ExtentSet(starts, starts + lengths), total_lba, sector_size, created, runs)
+
+    def usable_for(self, total_lba: int, sector_size: int) -> bool:
+        """Whether an incremental run may build on this snapshot; logs why not."""
+        if (self.total_lba, self.sector_size) != (total_lba, sector_size):
+            logger.info("TRIM snapshot is for a different drive layout; running a full free-space pass")
+            return False
+        if config.INCREMENTAL_MAX_RUNS and self.incremental_runs >= config.INCREMENTAL_MAX_RUNS:
+            logger.info(f"{self.incremental_runs} incremental runs since the last full pass; "
+                        f"running a full free-space pass")
+            return False
+        age_days = (time.time() - self.created) / 86400
+        if config.INCREMENTAL_MAX_AGE_DAYS and age_days >= config.INCREMENTAL_MAX_AGE_DAYS:
+            logger.info(f"TRIM snapshot is {age_days:.0f} days old; running a full free-space pass")
+            return False
+        return True
@@ -0,0 +1,226 @@
+# trimvision/core/trim_verify.py
+# Sampled read-back verification of discarded ranges.
+#
+# Drives with deterministic read-zero-after-TRIM (RZAT) return zeroes for every
+# deallocated LBA, so after a run a sample of the discarded ranges is read back
+# and must be all zeroes. Samples are VERIFY_SAMPLE_BYTES blocks drawn uniformly
+# from the whole granules of the discarded ranges (partial granules are not
+# deallocated), read by VERIFY_THREADS threads in parallel:
+#   - disks (block devices, \\.\PHYSICALDRIVEn) with aligned unbuffered reads into
+#     page-aligned buffers (O_DIRECT on Linux), so the page cache neither serves
+#     stale data nor gets flooded;
+#   - image files (and emulated devices) with the same positional reads, through
+#     the page cache.
+# Blocks are checked as uint64 words with a NumPy reduction (which runs without
+# the GIL); only a non-zero block is broken down into its non-zero sectors.
+
+import os
+import sys
+import mmap
+import time
+import threading
+import concurrent.futures
+import numpy as np
+from trimvision import config
+from trimvision.core.logger import logger
+from trimvision.core.extents import ExtentSet
+
+DIRECT_IO_ALIGNMENT = 4096 # Offsets, lengths and buffers of unbuffered reads are multiples of this
+
+
+def sample_ranges(ranges, fraction: float, block_lba: int, align_lba: int = 1, seed: int = None):
+    """
+    About `fraction` of the LBAs of ranges as sorted (start_lba, length_lba) blocks of
+    at most block_lba, aligned to align_lba and inside the aligned part of the ranges.
+    """
+    block_lba = max(align_lba, block_lba // align_lba * align_lba)
+    r = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+    starts = -(-r[:, 0] // align_lba) * align_lba
+    ends = (r[:, 0] + r[:, 1]) // align_lba * align_lba
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+    # Every range is cut into block-sized slots (the last one may be shorter); a sample is a slot
+    slots = -(-(ends - starts) // block_lba)
+    first_slot = np.cumsum(slots) - slots
+    total = int(slots.sum())
+    count = min(total, int(np.ceil(total * fraction))) if fraction > 0 else 0
+    if count == 0:
+        return []
+    if count == total:
+        picked = np.arange(total, dtype=np.int64)
+    else:
+        picked = np.sort(np.random.default_rng(seed).choice(total, count, replace=False))
+    owner = np.searchsorted(first_slot, picked, side='right') - 1
+    sample_starts = starts[owner] + (picked - first_slot[owner]) * block_lba
+    sample_lengths = np.minimum(block_lba, ends[owner] - sample_starts)
+    return list(zip(sample_starts.tolist(), sample_lengths.tolist()))
+
+
+class VerifyResult:
+    """Outcome of a verification pass."""
+    def __init__(self, method: str):
+        self.method = method
+        self.samples = 0
+        self.bytes_read = 0
+        self.nonzero = ExtentSet() # LBAs that did not read back as zeroes
+        self.unreadable = ExtentSet() # Samples whose read failed
+        self.errors = {}
+        self.seconds = 0.0
+        self.cancelled = False
+
+    @property
+    def ok(self) -> bool:
+        return self.nonzero.total() == 0 and self.unreadable.total() == 0
+
+    def summary(self, sector_size: int) -> dict:
+        return {
+            "method": self.method,
+            "ok": self.ok,
+            "cancelled": self.cancelled,
+            "samples": self.samples,
+            "bytes_read": self.bytes_read,
+            "seconds": self.seconds,
+            "read_mbps": self.bytes_read / self.seconds / 1024**2 if self.seconds > 0 else 0.0,
+            "nonzero_ranges": self.nonzero.to_ranges(),
+            "nonzero_bytes": self.nonzero.total() * sector_size,
+            "unreadable_ranges": self.unreadable.to_ranges(),
+            "errors": dict(self.errors),
+        }
+
+
+class _DirectReader:
+    """
+    Aligned unbuffered reads of a disk (or buffered ones, with direct=False). Every
+    thread gets its own handle and a page-aligned buffer (anonymous mmap), reused for
+    every block; on Windows a handle's file position is shared, so handles cannot be
+    shared between threads either.
+    """
+    method = "direct"
+
+    def __init__(self, path: str, buffer_bytes: int, direct: bool = True):
+        self.path = path
+        self.buffer_bytes = buffer_bytes
+        self._local = threading.local()
+        self._handles = []
+        self._lock = threading.Lock()
+        self._flags = os.O_RDONLY | getattr(os, "O_BINARY", 0) | getattr(os, "O_CLOEXEC", 0)
+        if not direct:
+            self.method = "buffered"
+        elif hasattr(os, "O_DIRECT"):
+            try:
+                os.close(os.open(path, self._flags | os.O_DIRECT))
+                self._flags |= os.O_DIRECT
+            except OSError: # Filesystem or driver without direct I/O: buffered reads still work
+                self.method = "buffered"
+        elif sys.platform != "win32":
+            self.method = "buffered"
+        # Windows: reads of \\.\PHYSICALDRIVEn handles are not cached; they only need sector alignment
+
+    def _thread_state(self):
+        state = getattr(self._local, "state", None)
+        if state is None:
+            handle = open(os.open(self.path, self._flags), "rb", buffering=0) # Raw FileIO: readinto without a copy
+            state = self._local.state = (handle, mmap.mmap(-1, self.buffer_bytes))
+            with self._lock:
+                self._handles.append(state)
+        return state
+
+    def read(self, offset: int, length: int):
+        handle, buffer = self._thread_state()
+        with memoryview(buffer) as view:
+            if hasattr(os, "preadv"):
+                done = os.preadv(handle.fileno(), [view[:length]], offset)
+            else:
+                handle.seek(offset)
+                done = handle.readinto(view[:length])
+        if done != length:
+            raise OSError(f"Short read: {done} of {length} bytes at {offset}")
+        return np.frombuffer(buffer, dtype=np.uint8, count=length)
+
+    def close(self):
+        with self._lock:
+            for handle, buffer in self._handles:
+                handle.close()
+                buffer.close()
+            self._handles = []
+
+
+def open_reader(path: str, buffer_bytes: int, method: str = None):
+    """
+    The reader of a disk or image file path (a backend's data_path): buffered reads for
+    image files, direct reads for disks (or as `method` says).
+    """
+    if method == "buffered" or (method is None and os.path.isfile(path)):
+        return _DirectReader(path, buffer_bytes, direct=False)
+    return _DirectReader(path, buffer_bytes)
+
+
+def _nonzero_sectors(block, sector_size: int):
+    """Indices of the sectors of block holding a non-zero byte."""
+    sectors = block[:len(block) // sector_size * sector_size].reshape(-1, sector_size)
+    return np.flatnonzero(sectors.view(np.uint64).max(axis=1) if sector_size % 8 == 0 else sectors.max(axis=1))
+
+
+def verify_ranges(device_path: str, ranges, sector_size: int, fraction: float = config.VERIFY_SAMPLE_FRACTION,
+                  granularity_lba: int = 1, threads: int = config.VERIFY_THREADS,
+                  sample_bytes: int = config.VERIFY_SAMPLE_BYTES, seed: int = None,
+                  should_stop=None, on_progress=None, method: str = None) -> VerifyResult:
+    """
+    Reads back a `fraction` sample of the discarded ranges and checks it is zero.
+    should_stop() is polled between samples; on_progress(done_bytes, total_bytes) is
+    called on the calling thread as groups of samples complete.
+    """
+    # Samples hold whole granules and satisfy the direct I/O alignment
+    align_lba = int(np.lcm(max(1, granularity_lba), -(-DIRECT_IO_ALIGNMENT // sector_size)))
+    block_lba = max(align_lba, sample_bytes // sector_size)
+    samples = sample_ranges(ranges, fraction, block_lba, align_lba, seed)
+    reader = open_reader(device_path, block_lba * sector_size, method)
+    result = VerifyResult(reader.method)
+    total_bytes = sum(length for _, length in samples) * sector_size
+    start = time.perf_counter()
+
+    def check_group(group):
+        nonzero, unreadable, errors, done = [], [], {}, 0
+        for lba, length in group:
+            if should_stop is not None and should_stop():
+                break
+            try:
+                block = reader.read(lba * sector_size, length * sector_size)
+            except OSError as e:
+                unreadable.append((lba, length))
+                name = type(e).__name__ if e.errno is None else os.strerror(e.errno)
+                errors[name] = errors.get(name, 0) + 1
+                continue
+            done += length * sector_size
+            words = block.view(np.uint64)
+            if words.max() != 0:
+                nonzero.extend((lba + int(i), 1) for i in _nonzero_sectors(block, sector_size))
+        return nonzero, unreadable, errors, done
+
+    try:
+        threads = max(1, threads)
+        # Several groups per thread so progress advances smoothly and slow regions even out
+        per_group = max(1, -(-len(samples) // (threads * 16)))
+        groups = [samples[i:i + per_group] for i in range(0, len(samples), per_group)]
+        nonzero, unreadable = [], []
+        with concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix="verify") as pool:
+            for future in concurrent.futures.as_completed([pool.submit(check_group, g) for g in groups]):
+                group_nonzero, group_unreadable, errors, done = future.result()
+                nonzero += group_nonzero
+                unreadable += group_unreadable
+                for name, count in errors.items():
+                    result.errors[name] = result.errors.get(name, 0) + count
+                result.bytes_read += done
+                if on_progress is not None:
+                    on_progress(result.bytes_read, total_bytes)
+    finally:
+        reader.close()
+    result.samples = len(samples)
+    result.nonzero = ExtentSet.from_ranges(nonzero)
+    result.unreadable = ExtentSet.from_ranges(unreadable)
+    result.cancelled = should_stop is not None and should_stop()
+    result.seconds = time.perf_counter() - start
+    logger.info(f"Verified {result.samples} samples ({result.bytes_read / 1024**2:.1f} MB, {result.method} reads) "
+                f"of {device_path} in {result.seconds:.2f}s: {result.nonzero.total()} non-zero LBAs, "
+                f"{len(result.unreadable)} unreadable ranges")
+    return result
@@ -1,10 +1,31 @@
 # trimvision/core/trim_worker.py
 
-import time
 from PyQt6.QtCore import QThread, pyqtSignal
-from trimvision.core.logger import logger
 from trimvision.core.drive_manager import DriveInfo # For type hinting
-# from trimvision.core import trim_helpers # Will be used later for actual TRIM
+from trimvision.core.trim_engine import TrimEngine, TrimListener
+from trimvision import config
+
+
+class _SignalRelay(TrimListener):
+    """Forwards the engine's reports as the worker's signals (queued to the receivers' threads)."""
+    def __init__(self, worker: "TrimWorker"):
+        self.worker = worker
+
+    def progress_updated(self, processed_chunks, total_chunks, speed_mbps, eta_seconds, throttle_state):
+        self.worker.progress_updated.emit(processed_chunks, total_chunks, speed_mbps, eta_seconds, throttle_state)
+
+    def chunk_states_changed(self, deltas):
+        self.worker.chunk_states_changed.emit(deltas)
+
+    def status_message(self, message):
+        self.worker.status_message.emit(message)
+
+    def error_occurred(self, error_message):
+        self.worker.error_occurred.emit(error_message)
+
+    def trim_finished(self, success, message):
+        self.worker.trim_finished.emit(success, message)
+
 
 class TrimWorker(QThread):
     """
@@ -12,108 +33,69 @@ class TrimWorker(QThread):
     Emits signals for progress, completion, and errors.
     """
     # Signals:
-    # progress_updated(int processed_chunks, int total_chunks, float current_speed_mbps, float eta_seconds)
-    progress_updated = pyqtSignal(int, int, float, float)
-    # chunk_state_changed(int chunk_index, str state) # "Processing", "Processed", "Blocked"
-    chunk_state_changed = pyqtSignal(int, str)
+    # progress_updated(int processed_chunks, int total_chunks, float current_speed_mbps, float eta_seconds,
+    #                  dict throttle_state) # see AdaptiveThrottle.state()
+    progress_updated = pyqtSignal(int, int, float, float, object)
+    # chunk_states_changed(ndarray deltas) # Flat [first_chunk, count, state, ...] runs with progress_channel
+    #                                      # STATE_* codes, published at most config.UI_UPDATE_MAX_HZ times/s
+    chunk_states_changed = pyqtSignal(object)
     # trim_finished(bool success, str message)
     trim_finished = pyqtSignal(bool, str)
     # error_occurred(str error_message)
     error_occurred = pyqtSignal(str)
+    # status_message(str message) # Stage changes such as planning, for the status bar
+    status_message = pyqtSignal(str)
     # confirmation_required(str drive_name, str drive_path) # Not used here, dialog handled in main UI
 
-    def __init__(self, drive_info: DriveInfo, parent=None):
+    PLAN_FREE_SPACE = TrimEngine.PLAN_FREE_SPACE
+    PLAN_FULL_DEVICE = TrimEngine.PLAN_FULL_DEVICE
+    PLAN_INCREMENTAL = TrimEngine.PLAN_INCREMENTAL
+
+    engine_class = TrimEngine # Subclasses may swap in an engine with a different planner
+
+    def __init__(self, drive_info: DriveInfo, plan_mode: str = PLAN_FREE_SPACE,
+                 queue_depth: int = config.TRIM_QUEUE_DEPTH, resume: bool = config.JOURNAL_ENABLED,
+                 verify_fraction: float = None, parent=None):
         super().__init__(parent)
-        self.drive_info = drive_info
-        self._is_running = False
-        self._is_paused = False # For future pause/resume
-        self._is_cancelled = False # For future cancellation
+        self.engine = self.engine_class(drive_info, plan_mode, queue_depth, resume, listener=_SignalRelay(self),
+                                        verify_fraction=verify_fraction)
+
+    # The engine's state, for the scheduler and the UI
+    @property
+    def drive_info(self) -> DriveInfo:
+        return self.engine.drive_info
+
+    @property
+    def plan_mode(self) -> str:
+        return self.engine.plan_mode
 
-        # Placeholder for LBA/chunk logic
-        self.total_chunks = 100 # Example: 100 chunks to process for visualization
-        self.chunk_size_bytes = (drive_info.capacity_gb * 1024**3) / self.total_chunks if drive_info.capacity_gb > 0 else 1024**3 # Approx
+    @property
+    def total_chunks(self) -> int:
+        return self.engine.total_chunks
+
+    @property
+    def lba_states(self):
+        return self.engine.lba_states
+
+    @property
+    def run_summary(self) -> dict:
+        return self.engine.run_summary
 
     def run(self):
         """Main work of the thread."""
-        self._is_running = True
-        self._is_cancelled = False
-        self._is_paused = False
-        processed_chunks = 0
-        start_time = time.time()
-
-        logger.info(f"TRIM worker started for drive: {self.drive_info.model} ({self.drive_info.device_id_wmi})")
-
-        try:
-            # --- Actual TRIM Logic Placeholder ---
-            # In a real scenario, you'd iterate through LBA ranges of the drive.
-            # For now, we simulate processing chunks.
-            for i in range(self.total_chunks):
-                if self._is_cancelled:
-                    logger.info(f"TRIM operation cancelled for {self.drive_info.model}")
-                    self.trim_finished.emit(False, "Operation Cancelled.")
-                    self._is_running = False
-                    return
-
-                while self._is_paused and not self._is_cancelled:
-                    time.sleep(0.5) # Sleep while paused
-
-                # Simulate processing a chunk
-                self.chunk_state_changed.emit(i, "Processing") # Tell UI this chunk is active
-                logger.debug(f"Trimming chunk {i+1}/{self.total_chunks} for {self.drive_info.model}")
-                
-                # --- Placeholder for actual trim_helpers.perform_trim_on_range() ---
-                time.sleep(0.1) # Simulate work for each chunk
-                # result_ok = trim_helpers.trim_lba_range(self.drive_info.device_id_wmi, start_lba, length_lba)
-                result_ok = True # Assume success for placeholder
-                # --- End Placeholder ---
-
-                if result_ok:
-                    self.chunk_state_changed.emit(i, "Processed")
-                else:
-                    self.chunk_state_changed.emit(i, "Blocked")
-                    # Optionally, decide if one blocked chunk means total failure or just log it
-
-                processed_chunks += 1
-                elapsed_time = time.time() - start_time
-                
-                if processed_chunks > 0 and elapsed_time > 0:
-                    chunks_per_second = processed_chunks / elapsed_time
-                    # Speed calculation (very rough for simulation)
-                    # Assume each chunk is a fixed size for this simulation
-                    bytes_processed = processed_chunks * self.chunk_size_bytes
-                    speed_mbps = (bytes_processed / (1024**2)) / elapsed_time if elapsed_time > 0 else 0
-
-                    remaining_chunks = self.total_chunks - processed_chunks
-                    eta_seconds = remaining_chunks / chunks_per_second if chunks_per_second > 0 else float('inf')
-                else:
-                    speed_mbps = 0
-                    eta_seconds = float('inf')
-
-                self.progress_updated.emit(processed_chunks, self.total_chunks, speed_mbps, eta_seconds)
-
-            # If loop completes without cancellation
-            if not self._is_cancelled:
-                logger.info(f"TRIM operation completed successfully for {self.drive_info.model}")
-                self.trim_finished.emit(True, "TRIM operation completed successfully.")
-
-        except Exception as e:
-            logger.error(f"Error during TRIM operation for {self.drive_info.model}: {e}", exc_info=True)
-            self.error_occurred.emit(str(e))
-            self.trim_finished.emit(False, f"Error: {e}")
-        finally:
-            self._is_running = False
+        self.engine.run()
+
+    def set_rate_limit(self, bytes_per_second: float):
+        self.engine.set_rate_limit(bytes_per_second)
 
     def cancel_operation(self):
-        logger.info(f"Requesting cancellation for TRIM on {self.drive_info.model}")
-        self._is_cancelled = True
+        self.engine.cancel_operation()
 
-    def pause_operation(self): # For future use
-        logger.info(f"Requesting pause for TRIM on {self.drive_info.model}")
-        self._is_paused = True
+    def pause_operation(self):
+        self.engine.pause_operation()
 
-    def resume_operation(self): # For future use
-        logger.info(f"Requesting resume for TRIM on {self.drive_info.model}")
-        self._is_paused = False
+    def resume_operation(self):
+        self.engine.resume_operation()
 
     def is_active(self):
-        return self._is_running
\ No newline at end of file
+        return self.engine.is_active()
@@ -0,0 +1,69 @@
+# trimvision/core/volume_trim.py
+# Filesystem-level TRIM of mounted volumes.
+#
+# The on-disk allocation bitmap of a mounted filesystem lags behind what the
+# filesystem has allocated in memory, so its free space must not be discarded
+# from a bitmap scan. Only the filesystem itself can trim it safely:
+#   - Linux: the FITRIM ioctl on the mount point (what fstrim does), which
+#     reports the number of bytes it trimmed;
+#   - Windows: Optimize-Volume -ReTrim on the drive letter, which does not.
+
+import os
+import re
+import sys
+import struct
+import subprocess
+from trimvision import config
+from trimvision.core.logger import logger
+
+FITRIM = 0xC0185879 # _IOWR('X', 121, struct fstrim_range)
+_FSTRIM_RANGE = struct.Struct("QQQ") # start, len, minlen (bytes)
+_DRIVE_LETTER = re.compile(r"^([A-Za-z]):?\\?$")
+
+
+def mounted_volumes(drive_info) -> list:
+    """Mount points (Linux) or drive letters (Windows) of the drive's mounted volumes."""
+    return [v.strip() for v in (drive_info.drive_letter or "").split(",") if v.strip()]
+
+
+def trim_volume(volume: str):
+    """
+    Trims the free space of a mounted volume through its filesystem; returns the bytes
+    trimmed, or None if the platform does not report them. Raises OSError on failure.
+    """
+    if sys.platform == "win32":
+        return _retrim_windows(volume)
+    if sys.platform.startswith("linux"):
+        return _fitrim_linux(volume)
+    raise OSError(f"No filesystem-level TRIM available for platform {sys.platform}")
+
+
+def _fitrim_linux(mount_point: str) -> int:
+    import fcntl
+    fd = os.open(mount_point, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+    try:
+        arg = bytearray(_FSTRIM_RANGE.pack(0, 2**64 - 1, 0)) # The whole filesystem, any extent size
+        fcntl.ioctl(fd, FITRIM, arg, True)
+    finally:
+        os.close(fd)
+    trimmed = _FSTRIM_RANGE.unpack(arg)[1] # The kernel writes back the bytes trimmed
+    logger.debug(f"FITRIM on {mount_point}: {trimmed / 1024**3:.2f} GB trimmed")
+    return trimmed
+
+
+def _retrim_windows(volume: str):
+    match = _DRIVE_LETTER.match(volume)
+    if not match:
+        raise OSError(f"{volume} is not a drive letter")
+    command = ["powershell", "-NoProfile", "-NonInteractive", "-Command",
+               f"Optimize-Volume -DriveLetter {match.group(1).upper()} -ReTrim"]
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, timeout=config.VOLUME_RETRIM_TIMEOUT_S,
+                                   creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+    except subprocess.TimeoutExpired:
+        raise OSError(f"Optimize-Volume -ReTrim on {volume} did not finish within "
+                      f"{config.VOLUME_RETRIM_TIMEOUT_S}s")
+    if completed.returncode != 0:
+        raise OSError(f"Optimize-Volume -ReTrim on {volume} failed: "
+                      f"{(completed.stderr or completed.stdout).strip() or completed.returncode}")
+    return None
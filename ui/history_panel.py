@@ -0,0 +1,210 @@
+# trimvision/ui/history_panel.py
+# Browser for the run history database (core/run_history.py).
+#
+# The table model holds only the pages read so far: Qt asks for more rows
+# (canFetchMore/fetchMore) as the view scrolls towards the end, and each page is
+# read by keyset after the last row shown, so opening the dialog costs one page
+# however many runs are recorded. Phases and the full run summary are only read
+# for the selected run.
+
+import json
+import time
+from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QWidget, QComboBox, QPushButton, QLabel,
+                             QTableView, QTextEdit, QSplitter, QAbstractItemView, QHeaderView)
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
+from trimvision import config
+from trimvision.core.logger import logger
+from trimvision.core.run_history import RunHistory
+
+
+class RunHistoryModel(QAbstractTableModel):
+    """Runs newest first, fetched a page at a time."""
+    # (header, run key, formatter)
+    COLUMNS = (
+        ("Started", "started", lambda v: time.strftime("%Y-%m-%d %H:%M", time.localtime(v))),
+        ("Drive", "model", str),
+        ("Serial", "serial", str),
+        ("Mode", "plan_mode", str),
+        ("Outcome", "outcome", str),
+        ("Discarded", "bytes_discarded", lambda v: f"{v / 1024**3:.2f} GB"),
+        ("Duration", "duration_s", lambda v: f"{v:.1f} s"),
+        ("MB/s", "throughput_mbps", lambda v: f"{v:.1f}"),
+        ("p99 latency", "latency_p99_ms", lambda v: "" if v is None else f"{v:.2f} ms"),
+        ("Blocked", "blocked_ranges", str),
+    )
+
+    def __init__(self, history: RunHistory, parent=None):
+        super().__init__(parent)
+        self.history = history
+        self.serial = None
+        self.page_size = config.HISTORY_PAGE_SIZE
+        self._runs = []
+        self._exhausted = False
+
+    def set_serial(self, serial):
+        """Shows only one drive's runs (None: all drives) and reloads from the newest."""
+        self.serial = serial
+        self.reload()
+
+    def reload(self):
+        self.beginResetModel()
+        self._runs = []
+        self._exhausted = False
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+
+    def run_at(self, row: int):
+        return self._runs[row] if 0 <= row < len(self._runs) else None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._runs)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        run = self._runs[index.row()]
+        _, key, formatter = self.COLUMNS[index.column()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return formatter(run[key])
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return run["message"]
+        if role == Qt.ItemDataRole.TextAlignmentRole and isinstance(run[key], (int, float)) and key != "started":
+            return int(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.COLUMNS[section][0]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._exhausted:
+            return
+        last = self._runs[-1] if self._runs else None
+        try:
+            page = self.history.query(serial=self.serial, limit=self.page_size,
+                                      before=(last["started"], last["id"]) if last else None)
+        except Exception as e:
+            logger.error(f"Could not read the run history: {e}")
+            page = []
+        self._exhausted = len(page) < self.page_size
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self._runs), len(self._runs) + len(page) - 1)
+            self._runs.extend(page)
+            self.endInsertRows()
+
+
+class HistoryPanel(QWidget):
+    """Run list filtered by drive, with the details of the selected run."""
+    def __init__(self, history: RunHistory = None, parent=None):
+        super().__init__(parent)
+        self.history = history or RunHistory()
+        self.model = RunHistoryModel(self.history, self)
+
+        layout = QVBoxLayout(self)
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("Drive:"))
+        self.drive_combo = QComboBox()
+        self.drive_combo.currentIndexChanged.connect(self._on_drive_filter_changed)
+        filter_layout.addWidget(self.drive_combo, 1)
+        self.refresh_button = QPushButton("Refresh")
+        self.refresh_button.clicked.connect(self.refresh)
+        filter_layout.addWidget(self.refresh_button)
+        layout.addLayout(filter_layout)
+
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        self.table.selectionModel().currentRowChanged.connect(self._on_run_selected)
+
+        self.details = QTextEdit()
+        self.details.setReadOnly(True)
+        self.details.setPlaceholderText("Select a run to see its phases, latency and blocked ranges.")
+
+        splitter = QSplitter(Qt.Orientation.Vertical)
+        splitter.addWidget(self.table)
+        splitter.addWidget(self.details)
+        splitter.setStretchFactor(0, 3)
+        splitter.setStretchFactor(1, 1)
+        layout.addWidget(splitter)
+
+        self.refresh()
+
+    def refresh(self):
+        """Re-reads the drive list and the first page of runs, keeping the drive filter."""
+        selected = self.drive_combo.currentData()
+        self.drive_combo.blockSignals(True)
+        self.drive_combo.clear()
+        self.drive_combo.addItem("All drives", userData=None)
+        try:
+            drives = self.history.drives()
+        except Exception as e:
+            logger.error(f"Could not read the run history: {e}")
+            drives = []
+        for drive in drives:
+            self.drive_combo.addItem(f"{drive['model']} ({drive['serial']}) - {drive['runs']} runs",
+                                     userData=drive["serial"])
+        index = self.drive_combo.findData(selected)
+        self.drive_combo.setCurrentIndex(max(0, index))
+        self.drive_combo.blockSignals(False)
+        self.model.set_serial(self.drive_combo.currentData())
+        self.details.clear()
+
+    def _on_drive_filter_changed(self, index):
+        self.model.set_serial(self.drive_combo.itemData(index))
+        self.details.clear()
+
+    def _on_run_selected(self, current, previous):
+        run = self.model.run_at(current.row())
+        if run is None:
+            self.details.clear()
+            return
+        run = self.history.get(run["id"]) or run
+        summary = run.get("summary", {})
+        lines = [f"Run {run['id']}: {run['model']} ({run['serial']}, firmware {run['firmware']}) on {run['device']}",
+                 f"{run['outcome']}: {run['message']}",
+                 f"Planned {run['planned_bytes'] / 1024**3:.2f} GB, discarded {run['bytes_discarded'] / 1024**3:.2f} GB "
+                 f"in {run['duration_s']:.1f} s ({run['calls']} calls, {run['failed_calls']} failed)",
+                 f"Throughput {run['throughput_mbps']:.1f} MB/s "
+                 f"(per second p10/p50/p90 {run['throughput_p10_mbps'] or 0:.1f} / "
+                 f"{run['throughput_p50_mbps'] or 0:.1f} / {run['throughput_p90_mbps'] or 0:.1f} MB/s)",
+                 f"Latency p50 {run['latency_p50_ms'] or 0:.2f} ms, p99 {run['latency_p99_ms'] or 0:.2f} ms, "
+                 f"max {run['latency_max_ms'] or 0:.2f} ms",
+                 "Phases: " + ", ".join(f"{name[:-2]} {seconds:.2f} s" for name, seconds in run.get("phases", {}).items()),
+                 f"Blocked: {run['blocked_ranges']} ranges, {run['blocked_bytes'] / 1024**2:.1f} MB"]
+        verification = summary.get("verification") or {}
+        if "ok" in verification:
+            lines.append(f"Verification: {verification['samples']} samples, {verification['bytes_read'] / 1024**2:.0f} MB "
+                         f"read at {verification['read_mbps']:.0f} MB/s, "
+                         + ("all zeroes" if verification["ok"] else
+                            f"{verification['nonzero_bytes'] / 1024**2:.2f} MB not zeroes, "
+                            f"{len(verification['unreadable_ranges'])} unreadable samples"))
+        elif verification:
+            lines.append(f"Verification skipped: {verification.get('skipped')}")
+        if summary.get("errors"):
+            lines.append(f"Errors: {json.dumps(summary['errors'])}")
+        for start, length in summary.get("blocked_ranges", [])[:50]:
+            lines.append(f"    LBA {start} + {length}")
+        self.details.setPlainText("\n".join(lines))
+
+
+class HistoryDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"{config.APP_NAME} - Run History")
+        self.resize(900, 560)
+        layout = QVBoxLayout(self)
+        self.panel = HistoryPanel(parent=self)
+        layout.addWidget(self.panel)
+
+    def refresh(self):
+        self.panel.refresh()
@@ -1,198 +1,323 @@
 # trimvision/ui/lba_grid_widget.py
 
-from PyQt6.QtWidgets import QWidget
-from PyQt6.QtGui import QPainter, QColor, QBrush, QPen
-from PyQt6.QtCore import Qt, QRectF, pyqtSignal, QTimer
+import math
+import numpy as np
+from PyQt6.QtWidgets import QWidget, QToolTip
+from PyQt6.QtGui import QPainter, QColor, QPen, QImage
+from PyQt6.QtCore import Qt, QRect, QRectF, QPointF, pyqtSignal, QTimer
 from trimvision import config
 from trimvision.core.logger import logger
-
-# Define block states (could be an Enum for more robustness)
-STATE_NON_PROCEEDED = 0
-STATE_PROCESSING = 1
-STATE_PROCESSED = 2
-STATE_BLOCKED = 3
+# Block states are the worker's chunk state codes
+from trimvision.core.progress_channel import (STATE_NON_PROCEEDED, STATE_PROCESSING, STATE_PROCESSED,
+                                              STATE_BLOCKED, STATE_VERIFY_FAILED, STATE_NAMES)
+from trimvision.core.state_pyramid import StatePyramid
 
 class LbaGridWidget(QWidget):
+    """
+    Grid of LBA blocks showing a zoomable window of the worker's chunks.
+    Chunk states live in a StatePyramid; each visual block is colored from the state
+    histogram of the chunks it covers (any blocked chunk shows red, partially processed
+    blocks blend gray to green), so nothing disappears when zoomed out. Wheel zooms around
+    the cursor, dragging pans, double-click shows the whole drive again.
+    """
+    # view_changed(int first_chunk, int end_chunk) # Visible chunk window [first, end)
+    view_changed = pyqtSignal(int, int)
+
+    ZOOM_STEP = 1.25 # View shrinks/grows by this factor per wheel notch
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setMinimumHeight(200) # Ensure it has some default size
+        self.setMouseTracking(True) # Hover tooltips
+        self.setToolTip("Wheel: zoom, drag: pan, double-click: whole drive")
 
-        self.grid_rows = 20
-        self.grid_cols = 30 # Results in 600 blocks, adjust as needed
-        self.total_visual_blocks = self.grid_rows * self.grid_cols
-
-        self.block_states = []
         self.block_colors = {
             STATE_NON_PROCEEDED: QColor(*config.COLOR_LBA_NON_PROCEEDED),
             STATE_PROCESSING: QColor(*config.COLOR_LBA_PROCESSING),
             STATE_PROCESSED: QColor(*config.COLOR_LBA_PROCESSED),
             STATE_BLOCKED: QColor(*config.COLOR_LBA_BLOCKED),
+            STATE_VERIFY_FAILED: QColor(*config.COLOR_LBA_VERIFY_FAILED),
         }
-        
+        self._background = self.palette().window().color()
+        # Processed fraction (0..255) -> 0xAARRGGBB, blending non-proceeded gray into processed green
+        fraction = np.linspace(0, 1, 256)[:, None]
+        blend = (np.array(self.block_colors[STATE_NON_PROCEEDED].getRgb()[:3]) * (1 - fraction)
+                 + np.array(self.block_colors[STATE_PROCESSED].getRgb()[:3]) * fraction).round().astype(np.uint32)
+        self._blend_palette = 0xFF000000 | (blend[:, 0] << 16) | (blend[:, 1] << 8) | blend[:, 2]
+
+        self.total_worker_chunks = 100 # Default, will be updated by initialize_grid
+        self.capacity_gb = 0.0
+        self.pyramid = StatePyramid(self.total_worker_chunks)
+        self.view_start = 0 # Visible chunk window [view_start, view_end)
+        self.view_end = self.total_worker_chunks
+
+        # Layout of the visible window: cell i covers chunks [cell_edges[i], cell_edges[i+1])
+        self.grid_rows = 1
+        self.grid_cols = 1
+        self.total_visual_blocks = 1
+        self.cell_edges = np.zeros(2, dtype=np.int64)
+        self._pixels = np.zeros((1, 1), dtype=np.uint32)
+        self._image = QImage()
+
         # For animation (simple pulse for processing block)
-        self._processing_block_index = -1
+        self._processing_chunk = -1
         self._processing_pulse_state = False
         self._pulse_timer = QTimer(self)
         self._pulse_timer.timeout.connect(self._toggle_pulse_state)
         self._pulse_interval = 300 # ms
 
-        self.block_padding = 1 # pixels between blocks
-        self.block_corner_radius = 2 # pixels for rounded corners
-
-        self.total_worker_chunks = 100 # Default, will be updated by initialize_grid
+        self.block_padding = 1 # pixels between blocks, drawn only while blocks are large enough
+        self._drag_origin = None # (mouse position, view_start) while panning
 
         self.reset_grid() # Initialize with default states
 
     def initialize_grid(self, total_drive_capacity_gb: float, total_worker_chunks: int):
-        logger.info(f"Initializing LBA grid: {self.grid_rows}x{self.grid_cols} blocks. Worker chunks: {total_worker_chunks}")
         self.total_worker_chunks = total_worker_chunks if total_worker_chunks > 0 else 100
+        self.capacity_gb = total_drive_capacity_gb
+        logger.info(f"Initializing LBA grid over {self.total_worker_chunks} worker chunks")
         self.reset_grid()
-        self.update() # Trigger repaint
 
     def reset_grid(self):
-        self.block_states = [STATE_NON_PROCEEDED] * self.total_visual_blocks
+        self.pyramid = StatePyramid(self.total_worker_chunks, initial_state=STATE_NON_PROCEEDED)
         self._stop_processing_animation()
-        self.update()
-
-    def _map_worker_chunk_to_visual_blocks(self, worker_chunk_index: int):
-        """Maps a worker chunk index to a range of visual block indices."""
-        if self.total_worker_chunks <= 0 or self.total_visual_blocks <= 0:
-            return []
-
-        # Calculate how many visual blocks this worker chunk represents
-        start_ratio = worker_chunk_index / self.total_worker_chunks
-        end_ratio = (worker_chunk_index + 1) / self.total_worker_chunks
-
-        start_visual_block = int(start_ratio * self.total_visual_blocks)
-        end_visual_block = int(end_ratio * self.total_visual_blocks) -1 # Inclusive end
+        self.set_view(0, self.total_worker_chunks)
 
-        # Ensure end_visual_block doesn't exceed total_visual_blocks due to rounding
-        end_visual_block = min(end_visual_block, self.total_visual_blocks - 1)
-        
-        if start_visual_block > end_visual_block: # Can happen if one worker chunk covers less than one visual block
-            return [start_visual_block] if start_visual_block < self.total_visual_blocks else []
-            
-        return list(range(start_visual_block, end_visual_block + 1))
+    # --- View window ---
 
+    def set_view(self, first_chunk: int, end_chunk: int):
+        """Shows chunks [first_chunk, end_chunk), clamped to the drive."""
+        length = min(max(1, end_chunk - first_chunk), self.total_worker_chunks)
+        first_chunk = min(max(0, first_chunk), self.total_worker_chunks - length)
+        self.view_start, self.view_end = first_chunk, first_chunk + length
+        self._layout_cells()
+        self._render_cells(0, self.total_visual_blocks)
+        self.update()
+        self.view_changed.emit(self.view_start, self.view_end)
+
+    def _layout_cells(self):
+        """Fits as many cells as the widget has room for (up to one per chunk) into a grid."""
+        view_length = self.view_end - self.view_start
+        width, height = max(1, self.width()), max(1, self.height())
+        min_px = config.LBA_GRID_MIN_CELL_PX
+        room = max(1, (width // min_px) * (height // min_px))
+        self.total_visual_blocks = min(view_length, room, config.LBA_GRID_MAX_BLOCKS)
+        self.grid_cols = max(1, min(self.total_visual_blocks,
+                                    math.ceil(math.sqrt(self.total_visual_blocks * width / height))))
+        self.grid_rows = math.ceil(self.total_visual_blocks / self.grid_cols)
+        self.cell_edges = self.view_start + np.arange(self.total_visual_blocks + 1, dtype=np.int64) * view_length // self.total_visual_blocks
+        # Cells past the last block of a partially filled last row keep the background color
+        self._pixels = np.full((self.grid_rows, self.grid_cols), self._background.rgba(), dtype=np.uint32)
+        # The QImage shares the pixel buffer, so refreshing pixels needs no image copy
+        self._image = QImage(self._pixels.data, self.grid_cols, self.grid_rows,
+                             self.grid_cols * 4, QImage.Format.Format_RGB32)
+
+    def _cells_for_chunks(self, first_chunk: int, end_chunk: int):
+        """Half-open range of visible cells overlapping chunks [first_chunk, end_chunk)."""
+        start = max(0, int(np.searchsorted(self.cell_edges, first_chunk, side='right')) - 1)
+        end = min(self.total_visual_blocks, int(np.searchsorted(self.cell_edges, end_chunk, side='left')))
+        return start, max(start, end)
+
+    def _cell_at(self, pos) -> int:
+        col = int(pos.x() * self.grid_cols / max(1, self.width()))
+        row = int(pos.y() * self.grid_rows / max(1, self.height()))
+        if not (0 <= col < self.grid_cols and 0 <= row < self.grid_rows):
+            return -1
+        cell = row * self.grid_cols + col
+        return cell if cell < self.total_visual_blocks else -1
+
+    # --- State updates ---
+
+    def update_worker_chunk_state(self, worker_chunk_index: int, state: int):
+        """Updates the visual blocks corresponding to a worker chunk (progress_channel state code)."""
+        if state not in STATE_NAMES:
+            logger.warning(f"Unknown chunk state code received: {state}")
+            return
+        self.apply_chunk_state_deltas(np.array([worker_chunk_index, 1, state], dtype=np.int64))
 
-    def update_worker_chunk_state(self, worker_chunk_index: int, state_str: str):
+    def apply_chunk_state_deltas(self, deltas):
         """
-        Updates the visual blocks corresponding to a worker chunk.
-        state_str: "Processing", "Processed", "Blocked"
+        Bulk counterpart of update_worker_chunk_state for TrimWorker.chunk_states_changed:
+        applies a flat [first_chunk, count, state, ...] run array, repainting only the dirty rows.
         """
-        new_state = STATE_NON_PROCEEDED
-        if state_str == "Processing":
-            new_state = STATE_PROCESSING
-        elif state_str == "Processed":
-            new_state = STATE_PROCESSED
-        elif state_str == "Blocked":
-            new_state = STATE_BLOCKED
-        else:
-            logger.warning(f"Unknown state string received: {state_str}")
-            return
-
-        visual_block_indices = self._map_worker_chunk_to_visual_blocks(worker_chunk_index)
-
-        if new_state == STATE_PROCESSING and visual_block_indices:
-            # For "Processing", typically highlight the first block in the range
-            self._start_processing_animation(visual_block_indices[0])
-        else:
-            # If not processing, or if processing covers multiple blocks, clear old animation
+        runs = np.asarray(deltas, dtype=np.int64).reshape(-1, 3)
+        valid = (runs[:, 0] >= 0) & (runs[:, 0] + runs[:, 1] <= self.total_worker_chunks)
+        if not valid.all():
+            for first_chunk, chunk_count, _ in runs[~valid].tolist():
+                logger.warning(f"Chunk run {first_chunk}+{chunk_count} out of range ({self.total_worker_chunks} chunks)")
+            runs = runs[valid]
+        firsts, counts, states = runs[:, 0], runs[:, 1], runs[:, 2]
+        # The whole batch in one pyramid update
+        self.pyramid.set_runs(firsts, counts, states)
+        dirty_start = int(firsts.min()) if len(runs) else self.total_worker_chunks
+        dirty_end = int((firsts + counts).max()) if len(runs) else 0
+        processing = np.flatnonzero(states == STATE_PROCESSING)
+        last_processing_chunk = int(firsts[processing[-1]]) if processing.size else -1
+
+        # Keep pulsing the newest chunk still being processed
+        if last_processing_chunk >= 0:
+            self._start_processing_animation(last_processing_chunk)
+        elif (self._processing_chunk >= 0
+              and self.pyramid.leaves[self._processing_chunk] != STATE_PROCESSING):
             self._stop_processing_animation()
 
-        changed = False
-        for vb_idx in visual_block_indices:
-            if 0 <= vb_idx < self.total_visual_blocks:
-                if self.block_states[vb_idx] != new_state:
-                    self.block_states[vb_idx] = new_state
-                    changed = True
-            else:
-                logger.warning(f"Visual block index {vb_idx} out of range for worker chunk {worker_chunk_index}")
-        
-        if changed:
-            self.update() # Trigger repaint
-
-    def _start_processing_animation(self, block_index: int):
-        if self._processing_block_index != block_index:
+        # Only cells of the visible window that cover changed chunks are recomputed
+        first_cell, end_cell = self._cells_for_chunks(max(dirty_start, self.view_start), min(dirty_end, self.view_end))
+        if first_cell < end_cell:
+            self._render_cells(first_cell, end_cell)
+            self.update(self._rows_rect(first_cell // self.grid_cols, (end_cell - 1) // self.grid_cols + 1))
+
+    def _render_cells(self, first_cell: int, end_cell: int):
+        """Colors cells [first_cell, end_cell) from the state histograms of their chunks."""
+        hist = self.pyramid.window_histograms(self.cell_edges[first_cell:end_cell + 1])
+        total = np.maximum(1, hist.sum(axis=1))
+        # Gray -> green by processed fraction, then processing, failed verification and blocked take precedence
+        pixels = self._blend_palette[hist[:, STATE_PROCESSED] * (len(self._blend_palette) - 1) // total]
+        pixels[hist[:, STATE_PROCESSING] > 0] = self.block_colors[STATE_PROCESSING].rgba()
+        pixels[hist[:, STATE_VERIFY_FAILED] > 0] = self.block_colors[STATE_VERIFY_FAILED].rgba()
+        pixels[hist[:, STATE_BLOCKED] > 0] = self.block_colors[STATE_BLOCKED].rgba()
+        self._pixels.reshape(-1)[first_cell:end_cell] = pixels
+
+    def _rows_rect(self, first_row: int, end_row: int) -> QRect:
+        row_h = self.height() / self.grid_rows
+        top = math.floor(first_row * row_h) - 1
+        bottom = math.ceil(end_row * row_h) + 1
+        return QRect(0, top, self.width(), bottom - top)
+
+    def _block_rect(self, block_index: int) -> QRectF:
+        row, col = divmod(block_index, self.grid_cols)
+        block_w = self.width() / self.grid_cols
+        block_h = self.height() / self.grid_rows
+        return QRectF(col * block_w, row * block_h, block_w, block_h)
+
+    def _processing_update_rect(self) -> QRect:
+        cell, _ = self._cells_for_chunks(self._processing_chunk, self._processing_chunk + 1)
+        rect = self._block_rect(cell).toAlignedRect()
+        # Covers the minimum-size marker drawn around tiny blocks as well
+        return rect.adjusted(-3, -3, 3, 3)
+
+    def _processing_visible(self) -> bool:
+        return self.view_start <= self._processing_chunk < self.view_end
+
+    def _start_processing_animation(self, chunk_index: int):
+        if self._processing_chunk != chunk_index:
             self._stop_processing_animation() # Stop previous if any
-        self._processing_block_index = block_index
+        self._processing_chunk = chunk_index
         self._processing_pulse_state = True # Start in "bright" state
         if not self._pulse_timer.isActive():
-            self._pulse_timer.start(self._pulse_interval) # <<< CORRECTED HERE
-        self.update() # Update immediately for the new processing block
+            self._pulse_timer.start(self._pulse_interval)
+        if self._processing_visible():
+            self.update(self._processing_update_rect())
 
     def _stop_processing_animation(self):
         if self._pulse_timer.isActive():
             self._pulse_timer.stop()
-        # Restore the original color of the previously processing block if it's not the new one
-        if self._processing_block_index != -1:
-            # Assuming it should revert to NON_PROCEEDED if animation stops,
-            # or better, its actual last committed state before "Processing"
-            # For now, let the main state update handle its final color.
-            pass 
-        self._processing_block_index = -1
-        self.update()
+        if self._processing_chunk != -1 and self._processing_visible():
+            # Its final color comes from the state histogram; just repaint the highlight away
+            self.update(self._processing_update_rect())
+        self._processing_chunk = -1
 
     def _toggle_pulse_state(self):
         self._processing_pulse_state = not self._processing_pulse_state
-        if self._processing_block_index != -1:
-            self.update() # Repaint only the affected block area later for optimization
-
-    def paintEvent(self, event):
-        painter = QPainter(self)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        if self._processing_chunk != -1 and self._processing_visible():
+            self.update(self._processing_update_rect())
 
-        widget_width = self.width()
-        widget_height = self.height()
+    # --- Zoom and pan ---
 
-        if widget_width <= 0 or widget_height <= 0 or self.grid_cols == 0 or self.grid_rows == 0:
+    def wheelEvent(self, event):
+        notches = event.angleDelta().y() / 120
+        if not notches:
             return
+        view_length = self.view_end - self.view_start
+        new_length = int(round(view_length / self.ZOOM_STEP ** notches))
+        new_length = min(max(1, new_length), self.total_worker_chunks)
+        # Keep the chunk under the cursor where it is
+        cell = self._cell_at(event.position())
+        anchor = int(self.cell_edges[cell]) if cell >= 0 else self.view_start + view_length // 2
+        fraction = (anchor - self.view_start) / view_length
+        self.set_view(anchor - int(fraction * new_length), anchor - int(fraction * new_length) + new_length)
+        event.accept()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            self._drag_origin = (event.position(), self.view_start)
+            self.setCursor(Qt.CursorShape.ClosedHandCursor)
+
+    def mouseMoveEvent(self, event):
+        if self._drag_origin is not None:
+            origin, origin_start = self._drag_origin
+            # Content follows the mouse: one row of drag moves the view by one row of cells
+            cells = ((origin.x() - event.position().x()) * self.grid_cols / max(1, self.width())
+                     + round((origin.y() - event.position().y()) * self.grid_rows / max(1, self.height())) * self.grid_cols)
+            chunks_per_cell = (self.view_end - self.view_start) / self.total_visual_blocks
+            length = self.view_end - self.view_start
+            start = origin_start + int(cells * chunks_per_cell)
+            if start != self.view_start:
+                self.set_view(start, start + length)
+            return
+        cell = self._cell_at(event.position())
+        if cell >= 0:
+            QToolTip.showText(event.globalPosition().toPoint(), self._describe_cell(cell), self)
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton and self._drag_origin is not None:
+            self._drag_origin = None
+            self.unsetCursor()
 
-        # Calculate block size based on available space and padding
-        total_padding_width = (self.grid_cols + 1) * self.block_padding
-        total_padding_height = (self.grid_rows + 1) * self.block_padding
+    def mouseDoubleClickEvent(self, event):
+        self.set_view(0, self.total_worker_chunks)
 
-        block_w = (widget_width - total_padding_width) / self.grid_cols
-        block_h = (widget_height - total_padding_height) / self.grid_rows
+    def _describe_cell(self, cell: int) -> str:
+        first, end = int(self.cell_edges[cell]), int(self.cell_edges[cell + 1])
+        hist = self.pyramid.histogram(first, end)
+        gb_per_chunk = self.capacity_gb / self.total_worker_chunks if self.total_worker_chunks else 0
+        return (f"{first * gb_per_chunk:.2f}-{end * gb_per_chunk:.2f} GB (chunks {first}-{end - 1})\n"
+                f"Processed: {hist[STATE_PROCESSED]}, Blocked: {hist[STATE_BLOCKED]}, "
+                f"Processing: {hist[STATE_PROCESSING]}, Pending: {hist[STATE_NON_PROCEEDED]}"
+                + (f", Verify failed: {hist[STATE_VERIFY_FAILED]}" if hist[STATE_VERIFY_FAILED] else ""))
 
-        if block_w <= 0 or block_h <= 0: # Not enough space to draw
-            # Optionally draw a "Too small" message
-            # painter.drawText(self.rect(), Qt.AlignmentFlag.AlignCenter, "Grid too small to render")
+    # --- Painting ---
+
+    def paintEvent(self, event):
+        widget_width = self.width()
+        widget_height = self.height()
+        if widget_width <= 0 or widget_height <= 0 or self._image.isNull():
             return
 
-        for r in range(self.grid_rows):
-            for c in range(self.grid_cols):
-                block_index = r * self.grid_cols + c
-                if block_index >= len(self.block_states): continue # Should not happen
-
-                state = self.block_states[block_index]
-                color = self.block_colors.get(state, QColor(Qt.GlobalColor.black)) # Default to black if state unknown
-
-                # Pulsing effect for the currently processing block
-                if block_index == self._processing_block_index:
-                    if self._processing_pulse_state:
-                        # Make it slightly brighter or use a distinct border
-                        # For simplicity, let's make it slightly brighter by reducing alpha of others or enhancing this one
-                        # color = color.lighter(120) # Simple lighter effect
-                        # Or change border:
-                        pen = QPen(color.darker(150), 1.5) # Distinct border for processing
-                    else:
-                        # color = color.darker(110) # Slightly darker for the other pulse state
-                        pen = QPen(color, 0.5) # Normal border
-                else:
-                    pen = QPen(color.darker(110), 0.5) # Default border slightly darker than fill
-
-                painter.setPen(pen)
-                painter.setBrush(QBrush(color))
-
-                x = self.block_padding + c * (block_w + self.block_padding)
-                y = self.block_padding + r * (block_h + self.block_padding)
-                
-                rect = QRectF(x, y, block_w, block_h)
-                painter.drawRoundedRect(rect, self.block_corner_radius, self.block_corner_radius)
+        painter = QPainter(self)
+        dirty = QRectF(event.rect())
+        # Source rectangle (in blocks) of the dirty area; nearest-neighbour scaling keeps blocks crisp
+        scale_x = self.grid_cols / widget_width
+        scale_y = self.grid_rows / widget_height
+        source = QRectF(dirty.x() * scale_x, dirty.y() * scale_y,
+                        dirty.width() * scale_x, dirty.height() * scale_y)
+        painter.drawImage(dirty, self._image, source)
+
+        block_w = widget_width / self.grid_cols
+        block_h = widget_height / self.grid_rows
+        if min(block_w, block_h) >= 6 * self.block_padding:
+            # Large blocks: separate them with background-colored grid lines
+            painter.setPen(QPen(self._background, self.block_padding))
+            first_col, last_col = int(dirty.left() / block_w), int(dirty.right() / block_w) + 1
+            first_row, last_row = int(dirty.top() / block_h), int(dirty.bottom() / block_h) + 1
+            for c in range(first_col, min(last_col, self.grid_cols) + 1):
+                painter.drawLine(QPointF(c * block_w, dirty.top()), QPointF(c * block_w, dirty.bottom()))
+            for r in range(first_row, min(last_row, self.grid_rows) + 1):
+                painter.drawLine(QPointF(dirty.left(), r * block_h), QPointF(dirty.right(), r * block_h))
+
+        # Pulsing effect for the currently processing block
+        if self._processing_chunk != -1 and self._processing_pulse_state and self._processing_visible():
+            color = self.block_colors[STATE_PROCESSING]
+            painter.setPen(QPen(color.darker(150), 1.5)) # Distinct border for processing
+            painter.setBrush(color.lighter(130))
+            cell, _ = self._cells_for_chunks(self._processing_chunk, self._processing_chunk + 1)
+            rect = self._block_rect(cell)
+            # Tiny blocks get a minimum-size marker so the active position stays visible
+            if rect.width() < 4 or rect.height() < 4:
+                rect = QRectF(rect.center().x() - 2, rect.center().y() - 2, 4, 4)
+            painter.drawRect(rect)
 
         painter.end()
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
-        self.update() # Redraw on resize
\ No newline at end of file
+        self.set_view(self.view_start, self.view_end) # Re-fit the cells to the new size
@@ -2,13 +2,18 @@
 
 from PyQt6.QtWidgets import (QMainWindow, QVBoxLayout, QWidget, QLabel,
                              QPushButton, QComboBox, QProgressBar, QTextEdit,
-                             QMessageBox, QHBoxLayout, QFrame)
+                             QMessageBox, QHBoxLayout, QFrame, QCheckBox, QApplication)
 from PyQt6.QtCore import Qt, QTimer
 from trimvision import config
 from trimvision.core.logger import logger
-from trimvision.core.drive_manager import get_detailed_drive_info, DriveInfo
-from trimvision.core.trim_worker import TrimWorker
+from trimvision.core.drive_manager import DriveInfo
+from trimvision.core.drive_discovery import DriveDiscoveryWorker
+from trimvision.core.drive_watcher import DriveWatcher
+from trimvision.core import trim_planner
+from trimvision.core import volume_trim
+from trimvision.core.trim_scheduler import TrimScheduler, TrimJob
 from trimvision.ui.lba_grid_widget import LbaGridWidget # <<< IMPORT NEW WIDGET
+from trimvision.utils import startup_timing
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -42,6 +47,10 @@ class MainWindow(QMainWindow):
         self.lba_grid_widget = LbaGridWidget() # <<< REPLACE PLACEHOLDER
         self.lba_grid_widget.setMinimumHeight(300) # Ensure it takes up space
         self.main_layout.addWidget(self.lba_grid_widget)
+        self.grid_view_label = QLabel("View: whole drive (wheel to zoom, drag to pan)")
+        self.grid_view_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.lba_grid_widget.view_changed.connect(self._on_grid_view_changed)
+        self.main_layout.addWidget(self.grid_view_label)
         
         # --- Bottom section: Progress and Controls ---
         self.bottom_section_layout = QVBoxLayout()
@@ -65,18 +74,54 @@ class MainWindow(QMainWindow):
         self.cancel_trim_button.clicked.connect(self.on_cancel_trim_clicked)
         self.cancel_trim_button.setEnabled(False)
 
+        self.plan_mode_combo = QComboBox()
+        self.plan_mode_combo.addItem("Free space only", userData=trim_planner.PLAN_FREE_SPACE)
+        self.plan_mode_combo.addItem("Incremental (space freed since last run)", userData=trim_planner.PLAN_INCREMENTAL)
+        self.plan_mode_combo.addItem("Full device", userData=trim_planner.PLAN_FULL_DEVICE)
+        self.plan_mode_combo.setToolTip("Free space only: discard unallocated clusters of ext4/NTFS volumes.\n"
+                                        "Incremental: discard only free space that was allocated at the last "
+                                        "successful run (periodically a full free-space pass).\n"
+                                        "Full device: discard every LBA (destroys all data on the drive).\n"
+                                        "Mounted volumes are trimmed through their filesystem instead of from "
+                                        "the on-disk bitmaps (free and incremental modes).")
+
+        self.verify_checkbox = QCheckBox("Verify")
+        self.verify_checkbox.setChecked(config.VERIFY_AFTER_TRIM)
+        self.verify_checkbox.setToolTip(f"After the TRIM, read back {config.VERIFY_SAMPLE_FRACTION * 100:g}% of the "
+                                        f"discarded space and check that it reads as zeroes.\n"
+                                        f"Only meaningful on drives with deterministic read-zero-after-TRIM.")
+
+        self.controls_layout.addWidget(self.plan_mode_combo)
+        self.controls_layout.addWidget(self.verify_checkbox)
         self.controls_layout.addWidget(self.start_trim_button)
         self.controls_layout.addWidget(self.cancel_trim_button)
+        self.history_button = QPushButton("History...")
+        self.history_button.clicked.connect(self.on_history_clicked)
+        self.history_button.setEnabled(config.HISTORY_ENABLED)
+        self.controls_layout.addWidget(self.history_button)
         self.bottom_section_layout.addLayout(self.controls_layout)
         
         self.status_label = QLabel("Status: Idle")
         self.bottom_section_layout.addWidget(self.status_label)
+
+        self.jobs_label = QLabel("Jobs: none")
+        self.bottom_section_layout.addWidget(self.jobs_label)
         self.main_layout.addLayout(self.bottom_section_layout)
 
 
         self.drives_list = []
         self.current_selected_drive: DriveInfo = None
-        self.trim_worker: TrimWorker = None
+        self.trim_worker = None # TrimWorker of the selected drive's job, shown in the grid
+        self._discovery: DriveDiscoveryWorker = None # Streams drives into the combo in the background
+        self._watcher: DriveWatcher = None # Hot-plug events, applied to the combo as diffs
+        self._removed_while_busy = set() # Device paths of unplugged drives whose job is still winding down
+        self._history_dialog = None # Created on first use
+
+        # Jobs for several drives can run side by side; the grid follows the selected drive.
+        self.scheduler = TrimScheduler(parent=self)
+        self.scheduler.job_started.connect(self._on_job_started)
+        self.scheduler.job_finished.connect(self._on_job_finished)
+        self.scheduler.aggregate_progress.connect(self._on_aggregate_progress)
 
         self._init_ui_elements_content()
         self._load_drives()
@@ -100,35 +145,132 @@ class MainWindow(QMainWindow):
         self.info_panel_v_layout.addWidget(self.info_panel_text)
         
     def _load_drives(self):
+        """Starts background discovery; drives are added to the combo as they are found."""
+        if self._discovery is not None and self._discovery.isRunning():
+            return
         logger.info("Loading available drives...")
         self.lba_grid_widget.reset_grid() # Reset grid when loading drives
-        self.drives_list = get_detailed_drive_info()
+        self.drives_list = []
         self.drive_combo.clear()
+        self.drive_combo.addItem("Scanning for drives...")
+        self.drive_combo.setEnabled(False)
+        self.info_panel_text.setText("Scanning for SSD/NVMe drives...")
+        self._discovery = DriveDiscoveryWorker(parent=self)
+        self._discovery.drive_found.connect(self._on_drive_found)
+        self._discovery.discovery_finished.connect(self._on_discovery_finished)
+        self._discovery.start()
+
+    def _on_drive_found(self, drive: DriveInfo):
+        if not self.drives_list:
+            self.drive_combo.clear() # Drop the scanning placeholder
+            self.drive_combo.setEnabled(True)
+        self._add_drive(drive)
+        if len(self.drives_list) == 1:
+            self.drive_combo.setCurrentIndex(-1) # Nothing selected until the user picks a drive
+            self.on_drive_selected(self.drive_combo.currentIndex())
+            startup_timing.mark("first drive listed")
+
+    def _on_discovery_finished(self, drives_found, seconds):
+        startup_timing.mark("drive discovery finished")
         if self.drives_list:
-            for i, drive in enumerate(self.drives_list):
-                self.drive_combo.addItem(drive.get_display_name(), userData=i)
-            self.drive_combo.setCurrentIndex(-1) 
-            self.on_drive_selected(self.drive_combo.currentIndex()) 
-            logger.info(f"Found {len(self.drives_list)} SSD drives.")
+            logger.info(f"Found {len(self.drives_list)} SSD drives in {seconds:.2f}s.")
         else:
+            self.drive_combo.clear()
             self.drive_combo.addItem("No compatible SSDs found.")
             self.drive_combo.setEnabled(False)
             self.start_trim_button.setEnabled(False)
             self.info_panel_text.setText("No SSD/NVMe drives detected or an error occurred.")
             logger.warning("No drives loaded into UI.")
+        self._start_watcher()
 
-
-    def on_drive_selected(self, index):
-        if self.is_trim_running():
-            # ... (logic to prevent changing drive during trim as before)
-            if self.current_selected_drive:
-                for i in range(self.drive_combo.count()):
-                    drive_idx_in_list = self.drive_combo.itemData(i)
-                    if drive_idx_in_list is not None and self.drives_list[drive_idx_in_list] == self.current_selected_drive:
-                        self.drive_combo.setCurrentIndex(i)
-                        break
+    # --- Hot-plug: the combo is patched in place so the selection and a running grid survive ---
+    def _start_watcher(self):
+        if not config.DRIVE_WATCH_ENABLED or (self._watcher is not None and self._watcher.isRunning()):
+            return
+        self._watcher = DriveWatcher(provider=self._discovery.provider if self._discovery else None, parent=self)
+        self._watcher.drive_changed.connect(self._on_drive_changed)
+        self._watcher.drive_removed.connect(self._on_drive_removed)
+        self._watcher.start()
+
+    def _stop_watcher(self):
+        if self._watcher is not None and self._watcher.isRunning():
+            self._watcher.requestInterruption()
+            self._watcher.wait(int((config.DRIVE_PROBE_TIMEOUT_S + 5) * 1000))
+
+    def _drive_index(self, device_path: str) -> int:
+        """Position of a drive in drives_list (and in the combo), or -1."""
+        for i, drive in enumerate(self.drives_list):
+            if drive.device_id_wmi == device_path:
+                return i
+        return -1
+
+    def _add_drive(self, drive: DriveInfo):
+        self.drives_list.append(drive)
+        self.drive_combo.addItem(drive.get_display_name(), userData=drive.device_id_wmi)
+
+    def _on_drive_changed(self, drive: DriveInfo):
+        if self._discovery is not None and self._discovery.isRunning():
+            return # A full scan is in progress and will list the drive as it is now
+        self._removed_while_busy.discard(drive.device_id_wmi)
+        index = self._drive_index(drive.device_id_wmi)
+        if index < 0:
+            if not self.drives_list:
+                self.drive_combo.clear() # Drop the "No compatible SSDs" placeholder
+                self.drive_combo.setEnabled(True)
+                self._add_drive(drive)
+                self.drive_combo.setCurrentIndex(-1)
+                self.on_drive_selected(-1)
+            else:
+                self.drive_combo.blockSignals(True)
+                self._add_drive(drive)
+                self.drive_combo.blockSignals(False)
+            self.status_label.setText(f"Status: Drive connected: {drive.get_display_name()}")
+            return
+        self.drives_list[index] = drive
+        self.drive_combo.setItemText(index, drive.get_display_name())
+        if self.current_selected_drive is not None and self.current_selected_drive.device_id_wmi == drive.device_id_wmi:
+            self.current_selected_drive = drive
+            self._show_drive_info(drive) # The grid and an attached worker stay as they are
+
+    def _on_drive_removed(self, device_path: str):
+        index = self._drive_index(device_path)
+        if index < 0:
             return
+        drive = self.drives_list[index]
+        if self.scheduler.active_job_for(drive):
+            # The job fails or gets cancelled on its own; drop the drive when it finishes
+            logger.warning(f"{device_path} went away with a TRIM job still active")
+            self._removed_while_busy.add(device_path)
+            return
+        selected = (self.current_selected_drive is not None
+                    and self.current_selected_drive.device_id_wmi == device_path)
+        del self.drives_list[index]
+        self.drive_combo.blockSignals(True)
+        self.drive_combo.removeItem(index)
+        if selected or not self.drives_list:
+            self.drive_combo.setCurrentIndex(-1)
+        self.drive_combo.blockSignals(False)
+        if not self.drives_list:
+            self.drive_combo.addItem("No compatible SSDs found.")
+            self.drive_combo.setEnabled(False)
+        if selected or not self.drives_list:
+            self.on_drive_selected(-1)
+        self.status_label.setText(f"Status: Drive disconnected: {drive.get_display_name()}")
+
+    def _stop_discovery(self):
+        if self._discovery is not None and self._discovery.isRunning():
+            self._discovery.requestInterruption()
+            # A probe in progress finishes first; slow ones are bounded by DRIVE_PROBE_TIMEOUT_S
+            self._discovery.wait(int((config.DRIVE_PROBE_TIMEOUT_S + 5) * 1000))
 
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        startup_timing.mark("first paint")
+
+
+    def on_drive_selected(self, index):
+        # Other drives may keep trimming in the background; the grid follows the selection.
+        self._detach_worker()
         self.lba_grid_widget.reset_grid() # Reset grid when a new drive is selected
 
         if index < 0 or not self.drives_list :
@@ -136,10 +278,11 @@ class MainWindow(QMainWindow):
             self.start_trim_button.setEnabled(False)
             self.current_selected_drive = None
             return
-        # ... (rest of on_drive_selected as before, ensuring selected_drive.device_id_wmi is used) ...
-        drive_idx_in_list = self.drive_combo.itemData(index)
-        if drive_idx_in_list is None or drive_idx_in_list >= len(self.drives_list):
-            logger.error(f"Invalid drive index selected: {index}, userData: {drive_idx_in_list}")
+        # Items carry the device path, so hot-plug diffs can reorder them freely
+        device_path = self.drive_combo.itemData(index)
+        drive_idx_in_list = self._drive_index(device_path) if device_path is not None else -1
+        if drive_idx_in_list < 0:
+            logger.error(f"Invalid drive index selected: {index}, userData: {device_path}")
             self.info_panel_text.setText("Error selecting drive.")
             self.start_trim_button.setEnabled(False)
             self.current_selected_drive = None
@@ -147,7 +290,14 @@ class MainWindow(QMainWindow):
 
         selected_drive: DriveInfo = self.drives_list[drive_idx_in_list]
         self.current_selected_drive = selected_drive
+        self._show_drive_info(selected_drive)
+        job = self.scheduler.active_job_for(selected_drive)
+        if job and job.worker:
+            self._attach_worker(job.worker)
+        self.set_ui_for_trim_running(job is not None)
+        logger.info(f"Drive selected: {selected_drive.model}")
 
+    def _show_drive_info(self, selected_drive: DriveInfo):
         info_str = (
             f"Model: {selected_drive.model}\n"
             f"Serial: {selected_drive.serial_number}\n"
@@ -162,8 +312,6 @@ class MainWindow(QMainWindow):
             f"Letter(s): {selected_drive.drive_letter or 'N/A'}\n"
         )
         self.info_panel_text.setText(info_str)
-        self.start_trim_button.setEnabled(True)
-        logger.info(f"Drive selected: {selected_drive.model}")
 
 
     def on_start_trim_clicked(self):
@@ -172,62 +320,135 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "No Drive Selected", "Please select a drive to TRIM.")
             return
 
-        if self.is_trim_running():
-            QMessageBox.information(self, "TRIM In Progress", "A TRIM operation is already running.")
+        if self.scheduler.active_job_for(self.current_selected_drive):
+            QMessageBox.information(self, "TRIM In Progress", "A TRIM operation is already queued or running for this drive.")
             return
 
         drive_name = self.current_selected_drive.get_display_name()
         drive_path = self.current_selected_drive.device_id_wmi
+        plan_mode = self.plan_mode_combo.currentData()
+        if plan_mode == trim_planner.PLAN_FULL_DEVICE:
+            mode_warning = "FULL DEVICE mode discards every LBA. ALL DATA ON THIS DRIVE WILL BE LOST."
+        elif plan_mode == trim_planner.PLAN_INCREMENTAL:
+            mode_warning = ("Only space freed since the last successful TRIM of this drive will be discarded. "
+                            "Ensure no critical operations are running on this drive.")
+        else:
+            mode_warning = "Only free space will be discarded. Ensure no critical operations are running on this drive."
+        volumes = volume_trim.mounted_volumes(self.current_selected_drive)
+        if volumes and plan_mode != trim_planner.PLAN_FULL_DEVICE:
+            mode_warning = (f"This drive has mounted volumes ({', '.join(volumes)}). Their free space will be "
+                            f"trimmed through the filesystem (FITRIM / Optimize-Volume -ReTrim) as a whole, "
+                            f"not planned from the on-disk bitmaps, so the LBA grid shows no per-range progress.")
 
         reply = QMessageBox.question(self, "Confirm TRIM Operation",
                                      f"Are you sure you want to perform a TRIM operation on:\n\n"
                                      f"{drive_name}\n({drive_path})\n\n"
-                                     f"This will optimize the selected SSD. Ensure no critical operations are running on this drive.",
+                                     f"{mode_warning}",
                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
                                      QMessageBox.StandardButton.No)
 
         if reply == QMessageBox.StandardButton.Yes:
             logger.info(f"User confirmed TRIM for: {drive_name}")
-            self.status_label.setText(f"Starting TRIM on {drive_name}...")
             self.progress_bar.setValue(0)
-            self.progress_bar.setFormat("Starting...")
+            self.progress_bar.setFormat("Queued...")
             self.eta_label.setText("ETA: Calculating... | Speed: N/A")
 
-            # Initialize LBA Grid for the current operation
-            # The TrimWorker default total_chunks is 100, pass this to grid for mapping
-            self.trim_worker = TrimWorker(self.current_selected_drive) # Creates worker with its default 100 chunks
-            self.lba_grid_widget.initialize_grid(
-                self.current_selected_drive.capacity_gb,
-                self.trim_worker.total_chunks # Pass worker's chunk count
-            )
-
-            self.trim_worker.progress_updated.connect(self.update_progress)
-            self.trim_worker.chunk_state_changed.connect(self.lba_grid_widget.update_worker_chunk_state) # <<< CONNECT TO GRID
-            self.trim_worker.trim_finished.connect(self.handle_trim_finished)
-            self.trim_worker.error_occurred.connect(self.handle_trim_error)
-            
-            self.trim_worker.start()
+            verify_fraction = config.VERIFY_SAMPLE_FRACTION if self.verify_checkbox.isChecked() else 0.0
+            job = self.scheduler.submit(self.current_selected_drive, plan_mode, verify_fraction=verify_fraction)
+            if job.state == TrimJob.QUEUED:
+                self.status_label.setText(f"Queued TRIM on {drive_name} (waiting for a free slot)...")
             self.set_ui_for_trim_running(True)
         else:
             logger.info(f"User cancelled TRIM for: {drive_name}")
             self.status_label.setText("TRIM operation cancelled by user.")
 
+    def _attach_worker(self, worker):
+        """Shows a running worker in the LBA grid and progress widgets."""
+        self._detach_worker()
+        self.trim_worker = worker
+        # The grid maps the worker's chunks onto its visual blocks
+        self.lba_grid_widget.initialize_grid(
+            self.current_selected_drive.capacity_gb,
+            worker.total_chunks # Pass worker's chunk count
+        )
+        worker.progress_updated.connect(self.update_progress)
+        worker.chunk_states_changed.connect(self.lba_grid_widget.apply_chunk_state_deltas) # Batched grid updates
+        worker.error_occurred.connect(self.handle_trim_error)
+        worker.status_message.connect(self._show_worker_status)
+        self.status_label.setText(f"TRIM running on {self.current_selected_drive.get_display_name()}...")
+
+    def _detach_worker(self):
+        if self.trim_worker is None:
+            return
+        worker, self.trim_worker = self.trim_worker, None
+        worker.progress_updated.disconnect(self.update_progress)
+        worker.chunk_states_changed.disconnect(self.lba_grid_widget.apply_chunk_state_deltas)
+        worker.error_occurred.disconnect(self.handle_trim_error)
+        worker.status_message.disconnect(self._show_worker_status)
+        self.lba_grid_widget._stop_processing_animation()
+
+    def _on_grid_view_changed(self, first_chunk, end_chunk):
+        grid = self.lba_grid_widget
+        if first_chunk == 0 and end_chunk == grid.total_worker_chunks:
+            self.grid_view_label.setText("View: whole drive (wheel to zoom, drag to pan)")
+            return
+        gb_per_chunk = grid.capacity_gb / grid.total_worker_chunks
+        self.grid_view_label.setText(f"View: {first_chunk * gb_per_chunk:.2f} - {end_chunk * gb_per_chunk:.2f} GB "
+                                     f"({(end_chunk - first_chunk) / grid.total_worker_chunks * 100:.2f}% of drive, "
+                                     f"double-click to reset)")
+
+    def _show_worker_status(self, message):
+        self.status_label.setText(f"Status: {message}")
+
+    def _on_job_started(self, job: TrimJob):
+        if self.current_selected_drive is not None and job is self.scheduler.active_job_for(self.current_selected_drive):
+            self._attach_worker(job.worker)
+
+    def _on_job_finished(self, job: TrimJob):
+        if (self.current_selected_drive is not None
+                and TrimScheduler.same_drive(job.drive_info, self.current_selected_drive)):
+            self.handle_trim_finished(job.state == TrimJob.COMPLETED, job.message)
+        else:
+            self.status_label.setText(f"Status: {job.drive_info.model}: {job.message}")
+        if job.drive_info.device_id_wmi in self._removed_while_busy:
+            self._removed_while_busy.discard(job.drive_info.device_id_wmi)
+            self._on_drive_removed(job.drive_info.device_id_wmi)
+        if self._history_dialog is not None and self._history_dialog.isVisible():
+            self._history_dialog.refresh() # The engine records the run before reporting it finished
+
+    def on_history_clicked(self):
+        if self._history_dialog is None:
+            from trimvision.ui.history_panel import HistoryDialog # sqlite and the table view: only when opened
+            self._history_dialog = HistoryDialog(self)
+        else:
+            self._history_dialog.refresh()
+        self._history_dialog.show()
+        self._history_dialog.raise_()
+
+    def _on_aggregate_progress(self, fraction_done, running_jobs, queued_jobs, total_speed_mbps):
+        if running_jobs == 0 and queued_jobs == 0:
+            self.jobs_label.setText(f"Jobs: all finished ({fraction_done * 100:.0f}%)")
+            return
+        self.jobs_label.setText(f"Jobs: {running_jobs} running, {queued_jobs} queued | "
+                                f"Overall: {fraction_done * 100:.0f}% | Total speed: {total_speed_mbps:.2f} MB/s")
+
     # ... (on_cancel_trim_clicked, update_progress methods as before) ...
     def on_cancel_trim_clicked(self):
-        if self.is_trim_running():
+        job = self.scheduler.active_job_for(self.current_selected_drive) if self.current_selected_drive else None
+        if job:
             logger.info("Cancel TRIM button clicked.")
             reply = QMessageBox.question(self, "Cancel TRIM",
                                          "Are you sure you want to cancel the current TRIM operation?",
                                          QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
                                          QMessageBox.StandardButton.No)
             if reply == QMessageBox.StandardButton.Yes:
-                self.trim_worker.cancel_operation()
+                self.scheduler.cancel(job)
                 self.status_label.setText("Cancelling TRIM operation...")
                 self.cancel_trim_button.setEnabled(False) 
         else:
             logger.debug("Cancel TRIM clicked but no operation running.")
 
-    def update_progress(self, processed_chunks, total_chunks, speed_mbps, eta_seconds):
+    def update_progress(self, processed_chunks, total_chunks, speed_mbps, eta_seconds, throttle_state=None):
         if total_chunks > 0:
             progress_percent = int((processed_chunks / total_chunks) * 100)
             self.progress_bar.setValue(progress_percent)
@@ -240,7 +461,11 @@ class MainWindow(QMainWindow):
                 else: eta_str = f"{int(eta_seconds // 3600)}h {int((eta_seconds % 3600) // 60)}m"
             
             speed_str = f"{speed_mbps:.2f} MB/s" if speed_mbps > 0 else "N/A"
-            self.eta_label.setText(f"ETA: {eta_str} | Speed: {speed_str}")
+            throttle_str = ""
+            if throttle_state and throttle_state.get("limited_by", "none") != "none":
+                throttle_str = (f" | Throttled to {throttle_state['effective_mbps']:.0f} MB/s "
+                                f"({throttle_state['limited_by']})")
+            self.eta_label.setText(f"ETA: {eta_str} | Speed: {speed_str}{throttle_str}")
         else:
             self.progress_bar.setFormat("Processing...")
             
@@ -262,15 +487,21 @@ class MainWindow(QMainWindow):
 
         if success:
             self.progress_bar.setValue(100)
+            verification = self.trim_worker.run_summary.get("verification") if self.trim_worker else None
+            if verification and "ok" in verification:
+                if verification["ok"]:
+                    message += f"\n\nVerification: {verification['bytes_read'] / 1024**2:.0f} MB sampled, all zeroes."
+                else:
+                    message += (f"\n\nVerification: {verification['nonzero_bytes'] / 1024**2:.2f} MB of the sampled "
+                                f"space did not read back as zeroes and {len(verification['unreadable_ranges'])} "
+                                f"samples could not be read (orange in the grid).")
             QMessageBox.information(self, "TRIM Complete", message)
         else:
             if "cancel" not in message.lower():
                  QMessageBox.warning(self, "TRIM Operation Ended", message)
 
         self.set_ui_for_trim_running(False)
-        if self.trim_worker:
-            self.trim_worker.deleteLater()
-            self.trim_worker = None
+        self._detach_worker() # The scheduler owns and deletes the worker
         # Optionally, call self.lba_grid_widget.reset_grid() here or wait for new drive selection
 
 
@@ -279,12 +510,13 @@ class MainWindow(QMainWindow):
         logger.error(f"TRIM worker explicitly emitted error: {error_message}")
 
     def set_ui_for_trim_running(self, is_running):
-        self.start_trim_button.setEnabled(not is_running)
+        """is_running refers to the selected drive; other drives can still be queued."""
+        self.start_trim_button.setEnabled(not is_running and self.current_selected_drive is not None)
         self.cancel_trim_button.setEnabled(is_running)
-        self.drive_combo.setEnabled(not is_running)
+        self.plan_mode_combo.setEnabled(not is_running)
 
     def is_trim_running(self):
-        return self.trim_worker is not None and self.trim_worker.isRunning()
+        return self.scheduler.has_active_jobs()
 
     def closeEvent(self, event):
         if self.is_trim_running():
@@ -294,17 +526,29 @@ class MainWindow(QMainWindow):
                                          QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
                                          QMessageBox.StandardButton.No)
             if reply == QMessageBox.StandardButton.Yes:
-                logger.info("Application closing with TRIM active. Cancelling worker.")
-                self.trim_worker.cancel_operation()
-                # A better way to handle this is to wait for the worker's 'finished' signal
-                # For now, let's accept the close, the worker should stop soon.
-                event.accept() 
-                # QTimer.singleShot(500, self.close) # This can lead to recursive close calls
-                # event.ignore() # Don't ignore if we're accepting
+                logger.info("Application closing with TRIM active. Cancelling all jobs.")
+                self.scheduler.cancel_all()
+                self._stop_discovery()
+                self._stop_watcher()
+                # Wait for the workers so journals are closed and runs recorded before the process exits
+                self.status_label.setText("Status: Waiting for TRIM jobs to stop...")
+                self.status_label.repaint()
+                QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+                try:
+                    stopped = self.scheduler.wait_stopped(config.SCHEDULER_SHUTDOWN_WAIT_S)
+                finally:
+                    QApplication.restoreOverrideCursor()
+                if stopped:
+                    logger.info("All TRIM jobs stopped.")
+                else:
+                    logger.warning("Closing with TRIM jobs still running; their journals resume them next time.")
+                event.accept()
                 return
             else:
                 event.ignore()
                 return
         
         logger.info("Application closing.")
+        self._stop_discovery()
+        self._stop_watcher()
         event.accept()
\ No newline at end of file
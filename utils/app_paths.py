@@ -0,0 +1,16 @@
+# trimvision/utils/app_paths.py
+
+import os
+import sys
+
+def app_dir() -> str:
+    """Directory holding the log file and app data: next to the executable, or the package root."""
+    if getattr(sys, 'frozen', False): # PyInstaller bundle
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # Up to trimvision/ root
+
+def data_dir(name: str) -> str:
+    """Returns (and creates) a subdirectory of app_dir(), or name itself if it is absolute."""
+    path = name if os.path.isabs(name) else os.path.join(app_dir(), name)
+    os.makedirs(path, exist_ok=True)
+    return path
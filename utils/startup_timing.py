@@ -0,0 +1,114 @@
+# trimvision/utils/startup_timing.py
+# Milestones of application start-up, measured from process creation.
+#
+# Imported first thing by __main__, so it stays cheap: the process start time is
+# read straight from the OS (psutil costs tens of milliseconds to import) and the
+# profile is only written when --profile-startup asks for it. Milestones are only
+# recorded until something asks for them (--profile-startup, or -v on the command
+# line): they are reached before the console's log level is set.
+
+import os
+import sys
+import time
+from trimvision.core.logger import logger
+
+
+def _process_create_time() -> float:
+    """Wall-clock creation time of this process; includes interpreter start-up and imports."""
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            from ctypes import wintypes
+            creation, exit_, kernel, user = (wintypes.FILETIME() for _ in range(4))
+            kernel32 = ctypes.windll.kernel32
+            if kernel32.GetProcessTimes(kernel32.GetCurrentProcess(), ctypes.byref(creation), ctypes.byref(exit_),
+                                        ctypes.byref(kernel), ctypes.byref(user)):
+                ticks = (creation.dwHighDateTime << 32) | creation.dwLowDateTime # 100 ns since 1601
+                return ticks / 1e7 - 11644473600
+        elif os.path.exists("/proc/self/stat"):
+            with open("/proc/self/stat") as f:
+                start_ticks = int(f.read().rsplit(")", 1)[1].split()[19]) # Field 22: start time since boot
+            with open("/proc/uptime") as f:
+                uptime = float(f.read().split()[0]) # 10 ms resolution; btime in /proc/stat only has seconds
+            return time.time() - (uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, AttributeError):
+        pass
+    return time.time() # Unknown: count from the first import of this module
+
+
+PROCESS_START = _process_create_time()
+
+# Milestones in the order they are reached on a normal start; the profile reports
+# each one's time since process start and the phase leading up to it.
+PROFILE_MILESTONES = (
+    "entry point reached",      # Interpreter start-up
+    "core modules imported",    # Logger, admin check
+    "Qt initialised",           # QApplication
+    "splash shown",
+    "main window imported",     # UI modules, numpy
+    "main window created",
+    "first paint",
+    "first drive listed",       # Enumeration, streamed by the discovery thread
+    "drive discovery finished",
+)
+
+_marks = {}
+_profile_path = None
+_logging = False
+
+def elapsed_ms() -> float:
+    return (time.time() - PROCESS_START) * 1000
+
+def mark(milestone: str) -> float:
+    """Records the first occurrence of a milestone; returns its time since process start (ms)."""
+    if milestone not in _marks:
+        _marks[milestone] = elapsed_ms()
+        if _logging:
+            _log(milestone)
+        if _profile_path and all(m in _marks for m in PROFILE_MILESTONES):
+            write_profile()
+    return _marks[milestone]
+
+def marks() -> dict:
+    return dict(_marks)
+
+def _log(milestone: str):
+    logger.debug(f"Startup: {milestone} after {_marks[milestone]:.0f} ms")
+
+def enable_logging():
+    """Logs the milestones reached so far, and from now on each one as it is reached."""
+    global _logging
+    _logging = True
+    for milestone in _marks:
+        _log(milestone)
+
+def enable_profile(path: str):
+    """Writes the phase breakdown to path once every milestone is reached (or at exit)."""
+    global _profile_path
+    _profile_path = path
+    enable_logging()
+    import atexit
+    atexit.register(write_profile)
+
+def profile_report() -> str:
+    lines = [f"{'milestone':<28}{'at (ms)':>10}{'phase (ms)':>12}"]
+    previous = 0.0
+    for milestone, at in sorted(_marks.items(), key=lambda item: item[1]):
+        lines.append(f"{milestone:<28}{at:>10.1f}{at - previous:>12.1f}")
+        previous = at
+    missing = [m for m in PROFILE_MILESTONES if m not in _marks]
+    if missing:
+        lines.append(f"not reached: {', '.join(missing)}")
+    return "\n".join(lines) + "\n"
+
+def write_profile():
+    global _profile_path
+    if not _profile_path:
+        return
+    path, _profile_path = _profile_path, None # Once: when complete or at exit, whichever is first
+    try:
+        with open(path, "w") as f:
+            f.write(profile_report())
+        logger.info(f"Startup profile written to {path}")
+    except OSError as e:
+        logger.error(f"Could not write startup profile {path}: {e}")